@@ -5,6 +5,7 @@ SS链接测试工具
 用于检测Shadowsocks链接是否可用
 """
 
+import os
 import socket
 import base64
 import urllib.parse
@@ -12,7 +13,11 @@ import json
 import time
 import sys
 import argparse
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# 与Web端共用的批量探测模块
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'web_prototype'))
+from functools import partial
+from ss_probe import run_probes, probe_tcp, probe_handshake, parse_dest, DEFAULT_DEST
 
 def parse_ss_link(ss_link):
     """解析SS链接"""
@@ -138,32 +143,51 @@ def test_ss_link(ss_link, timeout=10):
     
     return result
 
-def test_multiple_ss_links(ss_links, timeout=10, max_workers=5):
-    """批量测试SS链接"""
+def test_multiple_ss_links(ss_links, timeout=10, max_workers=5, deadline=None, handshake_dest=None):
+    """批量测试SS链接 (asyncio并发探测，见 web_prototype/ss_probe.py)
+
+    deadline 为整批测试的截止时间 (秒)，未指定时足够全部链接按超时测完。
+    指定 handshake_dest 时进行AEAD握手探测，经隧道连接该 (host, port)。
+    """
     results = []
-    
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # 提交所有任务
-        future_to_link = {
-            executor.submit(test_ss_link, link, timeout): link 
-            for link in ss_links
-        }
-        
-        # 收集结果
-        for future in as_completed(future_to_link):
-            link = future_to_link[future]
-            try:
-                result = future.result()
-                results.append(result)
-            except Exception as e:
-                results.append({
-                    'ss_link': link,
-                    'parsed': False,
-                    'connection': False,
-                    'details': {},
-                    'error': f'Test failed: {str(e)}'
-                })
-    
+    targets = []
+    for link in ss_links:
+        parsed = parse_ss_link(link)
+        if not parsed:
+            results.append({
+                'ss_link': link,
+                'parsed': False,
+                'connection': False,
+                'details': {},
+                'error': 'Invalid SS link format'
+            })
+            continue
+        targets.append(dict(parsed, ss_link=link))
+
+    if deadline is None:
+        rounds = -(-len(targets) // max(1, max_workers))
+        deadline = timeout * rounds + 1
+
+    probe_fn = partial(probe_handshake, dest=handshake_dest) if handshake_dest else probe_tcp
+    for target, probe in run_probes(targets, probe=probe_fn, concurrency=max_workers,
+                                    timeout=timeout, deadline=deadline):
+        details = {k: v for k, v in target.items() if k != 'ss_link'}
+        details.update({
+            'latency': probe['latency'],
+            'connection_message': probe['message']
+        })
+        if probe.get('mode') == 'handshake':
+            details.update({k: probe[k] for k in ('ttfb', 'throughput', 'bytes')})
+        if probe.get('degraded'):
+            details['degraded'] = True
+        results.append({
+            'ss_link': target['ss_link'],
+            'parsed': True,
+            'connection': probe['success'],
+            'details': details,
+            'error': None
+        })
+
     return results
 
 def format_test_result(result):
@@ -182,6 +206,13 @@ def format_test_result(result):
     
     if result['connection']:
         latency = details.get('latency', -1)
+        if details.get('degraded'):
+            # 握手探测退回为TCP探测，未验证密码与后端
+            return f"⚠️ {node_name} ({server_info}) - 延迟: {latency}ms, {details['connection_message']}"
+        if details.get('ttfb') is not None:
+            throughput = details.get('throughput')
+            speed = f", 吞吐: {throughput}KB/s" if throughput is not None else ''
+            return f"✅ {node_name} ({server_info}) - 延迟: {latency}ms, 首字节: {details['ttfb']}ms{speed}"
         return f"✅ {node_name} ({server_info}) - 延迟: {latency}ms"
     else:
         message = details.get('connection_message', 'Unknown error')
@@ -193,6 +224,10 @@ def main():
     parser.add_argument('--file', '-f', help='从文件读取SS链接')
     parser.add_argument('--timeout', '-t', type=int, default=10, help='连接超时时间(秒)')
     parser.add_argument('--workers', '-w', type=int, default=5, help='并发测试数量')
+    parser.add_argument('--deadline', '-d', type=float, help='整批测试的截止时间(秒)')
+    parser.add_argument('--handshake', action='store_true', help='进行AEAD握手探测 (需要cryptography)')
+    parser.add_argument('--target', default=f'{DEFAULT_DEST[0]}:{DEFAULT_DEST[1]}',
+                        help='握手探测经隧道连接的目标 host:port')
     parser.add_argument('--json', action='store_true', help='输出JSON格式结果')
     
     args = parser.parse_args()
@@ -222,7 +257,12 @@ def main():
     print("-" * 60)
     
     # 测试链接
-    results = test_multiple_ss_links(ss_links, args.timeout, args.workers)
+    try:
+        handshake_dest = parse_dest(args.target) if args.handshake else None
+    except ValueError as e:
+        print(e)
+        return 1
+    results = test_multiple_ss_links(ss_links, args.timeout, args.workers, args.deadline, handshake_dest)
     
     # 输出结果
     if args.json:
@@ -6,12 +6,18 @@ API扩展模块 - 系统监控、回收站、备份恢复等功能
 
 import os
 import json
+import time
 import shutil
 import sqlite3
 import zipfile
 from datetime import datetime, timedelta
 from flask import jsonify, request
 from system_monitor import monitor
+from service_watchdog import service_watchdog
+from xray_supervisor import xray_supervisor
+from port_allocator import port_allocator
+from backend_health import backend_health
+from probe_scheduler import probe_scheduler
 import logging
 
 logger = logging.getLogger(__name__)
@@ -32,8 +38,13 @@ def register_api_extensions(app, login_required, DB_PATH):
                 'cpu_usage': system_info['cpu'].get('usage', 0),
                 'memory_usage': system_info['memory'].get('usage_percent', 0),
                 'disk_usage': system_info['disk']['total'].get('usage_percent', 0),
-                'network_in': system_info['network'].get('total_recv', 0),
-                'network_out': system_info['network'].get('total_sent', 0),
+                # 网络速率 (字节/秒)，由后台采样的计数器差值计算
+                'network_in': system_info['network'].get('recv_rate', 0),
+                'network_out': system_info['network'].get('sent_rate', 0),
+                'network_total_in': system_info['network'].get('total_recv', 0),
+                'network_total_out': system_info['network'].get('total_sent', 0),
+                'disk_read_rate': system_info['disk'].get('io', {}).get('read_rate', 0),
+                'disk_write_rate': system_info['disk'].get('io', {}).get('write_rate', 0),
                 'uptime': system_info['processes']['uptime'].get('uptime_formatted', '未知'),
                 'xray_processes': len(system_info.get('xray_services', [])),
                 'total_processes': system_info['processes'].get('total_processes', 0),
@@ -56,6 +67,67 @@ def register_api_extensions(app, login_required, DB_PATH):
                 'error': str(e)
             }), 500
 
+    @app.route('/api/system/cache-stats')
+    @login_required
+    def api_system_cache_stats():
+        """系统信息缓存命中统计API"""
+        return jsonify({'success': True, 'data': monitor.cache.stats()})
+
+    @app.route('/api/system/watchdog')
+    @login_required
+    def api_system_watchdog():
+        """服务守护状态API：待重启、已隔离的服务与重启计数"""
+        return jsonify({'success': True, 'data': service_watchdog.get_stats()})
+
+    @app.route('/api/system/runtime')
+    @login_required
+    def api_system_runtime():
+        """Xray运行模式API：共用进程的成员数、PID与资源占用，以及平滑重启统计"""
+        data = xray_supervisor.consolidated.get_stats()
+        data['rolling'] = xray_supervisor.get_reload_stats()
+        return jsonify({'success': True, 'data': data})
+
+    @app.route('/api/system/ports')
+    @login_required
+    def api_system_ports():
+        """端口分配API：各端口池的容量、占用与当前预留"""
+        return jsonify({'success': True, 'data': port_allocator.get_stats()})
+
+    @app.route('/api/system/probes')
+    @login_required
+    def api_system_probes():
+        """定时探测API：探测方式、周期、并发上限与最近一个周期的统计"""
+        return jsonify({'success': True, 'data': probe_scheduler.get_stats()})
+
+    @app.route('/api/system/backends')
+    @login_required
+    def api_system_backends():
+        """SOCKS5后端健康API：每个后端的最新结果、近期可用率与认证失败次数"""
+        return jsonify({'success': True, 'data': backend_health.get_stats()})
+
+    @app.route('/api/system/backends/history')
+    @login_required
+    def api_system_backend_history():
+        """SOCKS5后端检查历史API：backend 为 /api/system/backends 中的 id，hours 为时间范围"""
+        backend = request.args.get('backend', '').strip()
+        if not backend:
+            return jsonify({'success': False, 'error': '缺少后端地址'}), 400
+        try:
+            hours = max(0.0, float(request.args.get('hours', 24)))
+            limit = int(request.args.get('limit', 500))
+        except ValueError:
+            return jsonify({'success': False, 'error': '参数格式错误'}), 400
+
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            history = backend_health.history(conn, backend, since=time.time() - hours * 3600, limit=limit)
+        except sqlite3.Error as e:
+            logger.error(f"读取后端检查历史失败: {e}")
+            return jsonify({'success': False, 'error': '读取后端检查历史失败'}), 500
+        finally:
+            conn.close()
+        return jsonify({'success': True, 'data': {'backend': backend, 'history': history}})
+
     @app.route('/api/recycle')
     @login_required
     def api_recycle_list():
@@ -4,8 +4,8 @@ Xray转换器Web管理系统
 生产级Flask应用，完整的前后端功能实现
 """
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, g
-from functools import wraps
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, g, Response, stream_with_context
+from functools import wraps, partial
 import os
 import subprocess
 import sqlite3
@@ -15,15 +15,37 @@ import logging
 import secrets
 import re
 import shutil
-import json
 from datetime import datetime, timedelta
 import hashlib
-from system_monitor import monitor
+from system_monitor import monitor as system_monitor
 from api_extensions import register_api_extensions
+from ip_resolver import ip_resolver
+from service_registry import service_registry
+from process_scanner import process_scanner
+from socket_table import socket_table
+from event_bus import event_bus, format_sse
+from metrics_collector import metrics_collector
+from metrics_rollup import metrics_rollup, create_tables as create_rollup_tables
+from xray_stats import traffic_poller
+from config_renderer import generate as render_service_config, write_file, DEFAULT_METHOD
+from ss_probe import (stream_probes, run_probes, probe_result, probe_tcp, probe_handshake, parse_dest,
+                      HANDSHAKE_SUPPORTED,
+                      DEFAULT_DEST as DEFAULT_PROBE_DEST, DEFAULT_TIMEOUT as DEFAULT_PROBE_TIMEOUT,
+                      DEFAULT_DEADLINE as DEFAULT_PROBE_DEADLINE,
+                      DEFAULT_CONCURRENCY as DEFAULT_PROBE_CONCURRENCY)
+from xray_supervisor import xray_supervisor
+from service_watchdog import service_watchdog
+from bulk_ops import bulk_runner, parse_max_unavailable, BULK_ACTIONS, DEFAULT_CONCURRENCY, MAX_CONCURRENCY
+from job_queue import job_queue, JobQueueFull, FINISHED as JOB_FINISHED, create_tables as create_job_tables
+from port_allocator import port_allocator, PortAllocationError, parse_ranges, parse_mapping
+from backend_health import backend_health, create_tables as create_backend_tables
+from probe_history import probe_history, create_tables as create_probe_tables
+from probe_scheduler import probe_scheduler
 import base64
 import urllib.parse
 import socket
 import subprocess
+import queue
 
 # 配置日志
 logging.basicConfig(
@@ -48,12 +70,88 @@ DB_PATH = os.path.join(SCRIPT_DIR, 'xray_web.db')
 UPLOAD_FOLDER = os.path.join(SCRIPT_DIR, 'uploads')
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
 
+# SS链接批量测试的默认值与上限 (请求中可以调整，但不能超过上限)
+PROBE_TIMEOUT = DEFAULT_PROBE_TIMEOUT
+PROBE_TIMEOUT_MAX = 10.0
+PROBE_DEADLINE = DEFAULT_PROBE_DEADLINE
+PROBE_DEADLINE_MAX = 120.0
+PROBE_CONCURRENCY = DEFAULT_PROBE_CONCURRENCY
+PROBE_CONCURRENCY_MAX = 100
+# 探测方式：tcp 只检查端口连通；handshake 完成AEAD握手并经SOCKS5后端连接 PROBE_TARGET
+PROBE_MODES = ('tcp', 'handshake')
+PROBE_DEST = parse_dest(os.environ['PROBE_TARGET']) if os.environ.get('PROBE_TARGET') else DEFAULT_PROBE_DEST
+# 后台定时探测的方式
+PROBE_MODE = os.environ.get('PROBE_MODE', 'tcp')
+
 # 确保目录存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 os.makedirs(os.path.join('data', '.recycle'), exist_ok=True)
 os.makedirs(os.path.join('data', 'backups'), exist_ok=True)
 
+# 服务注册表：监听服务目录变化
+service_registry.configure(service_dir=SERVICE_DIR)
+
+# 端口分配：跳过已有服务、回收站中的服务与系统已占用的端口
+# PORT_POOLS='default=10000-60000;vip=20000-20999'，PORT_USER_POOLS='alice=vip'
+port_allocator.configure(
+    recycle_dirs=[os.path.join(SERVICE_DIR, '.recycle'), os.path.join('data', '.recycle')],
+    pools=parse_ranges(os.environ.get('PORT_POOLS')),
+    user_pools=parse_mapping(os.environ.get('PORT_USER_POOLS'))
+)
+
+# 服务器IP解析器：与Shell脚本共享缓存文件
+ip_resolver.configure(
+    db_path=DB_PATH,
+    cache_file=os.path.join(PARENT_DIR, 'data', '.server_ip')
+)
+
+# 监控数据采集器：写入 monitor_data 的同时维护多级汇总
+metrics_collector.configure(db_path=DB_PATH, sampler=system_monitor.sampler)
+metrics_collector.listeners.append(metrics_rollup.apply)
+
+# Xray进程管理：在Web进程内直接启动/停止服务
+# XRAY_RUNTIME_MODE=consolidated 时所有服务共用一个Xray进程 (见 consolidated_runtime)
+xray_supervisor.configure(
+    service_dir=SERVICE_DIR,
+    xray_bin=os.path.join(PARENT_DIR, 'xray'),
+    mode=os.environ.get('XRAY_RUNTIME_MODE', 'process'),
+    # 平滑重启时旧进程的排空宽限时间 (秒)
+    drain_timeout=float(os.environ.get('XRAY_DRAIN_TIMEOUT', 30))
+)
+
+# Xray流量统计：轮询每个服务的StatsService
+traffic_poller.configure(
+    service_dir=SERVICE_DIR,
+    services_fn=lambda: get_service_states(),
+    xray_bin=os.path.join(PARENT_DIR, 'xray'),
+    targets_fn=xray_supervisor.consolidated.stats_targets
+)
+metrics_collector.configure(traffic_fn=traffic_poller.rates)
+
+# 服务守护：崩溃自动重启，与Shell启动的守护进程共用锁文件，只有一个实例生效
+service_watchdog.configure(lock_file=os.path.join(PARENT_DIR, 'data', 'watchdog.lock'))
+
+# SOCKS5后端健康检查：定时探测每个不同的后端 (问候、认证与CONNECT PROBE_TARGET)
+backend_health.configure(
+    db_path=DB_PATH,
+    interval=int(os.environ.get('BACKEND_CHECK_INTERVAL', 60)),
+    dest=PROBE_DEST,
+    key_file=os.path.join(PARENT_DIR, 'data', 'backend_health.key')
+)
+
+# 定时探测：按周期 (带随机抖动) 探测运行中的服务并缓存每个端口的最新结果，
+# 探测函数与目标来源在 start_background_tasks 中设置
+probe_scheduler.configure(
+    db_path=DB_PATH,
+    interval=int(os.environ.get('PROBE_INTERVAL', 60)),
+    jitter=float(os.environ.get('PROBE_JITTER', 0.1)),
+    concurrency=int(os.environ.get('PROBE_INFLIGHT', PROBE_CONCURRENCY))
+)
+
+# 后台任务队列：耗时的服务操作不占用请求线程，任务处理函数在应用上下文中执行
+job_queue.configure(db_path=DB_PATH, context=app.app_context)
+
 # API扩展将在装饰器定义后注册
 
 # Flask配置
@@ -154,6 +252,18 @@ def init_db():
         )
     ''')
 
+    # 创建监控数据汇总表 (1分钟/5分钟/1小时)
+    create_rollup_tables(cursor)
+
+    # 创建后台任务表
+    create_job_tables(cursor)
+
+    # 创建SOCKS5后端健康检查历史表
+    create_backend_tables(cursor)
+
+    # 创建探测结果表与延迟汇总表 (5分钟/1小时/1天)
+    create_probe_tables(cursor)
+
     # 创建系统设置表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS system_settings (
@@ -196,6 +306,7 @@ def init_db():
         ('enable_registration', 'false', '是否允许用户注册'),
         ('monitor_interval', '30', '监控检查间隔(秒)'),
         ('log_retention_days', '30', '日志保留天数'),
+        ('server_ip', '', '服务器公网IP(留空自动检测)'),
     ]
 
     for key, value, desc in default_settings:
@@ -238,13 +349,19 @@ def admin_required(f):
 # 注册API扩展（在装饰器定义后）
 register_api_extensions(app, login_required, DB_PATH)
 
-def log_operation(action, target=None, details=None):
-    """记录操作日志"""
+def log_operation(action, target=None, details=None, actor=None):
+    """记录操作日志
+
+    actor 为提交后台任务时保存的操作者信息 (见 current_actor)，
+    在请求之外记录日志时使用。
+    """
+    if actor is None:
+        actor = current_actor()
     try:
         db = get_db()
-        user_id = session.get('user_id')
-        ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-        user_agent = request.headers.get('User-Agent', '')
+        user_id = actor.get('user_id')
+        ip_address = actor.get('ip_address')
+        user_agent = actor.get('user_agent', '')
 
         db.execute('''
             INSERT INTO operation_logs (user_id, action, target, details, ip_address, user_agent)
@@ -254,6 +371,15 @@ def log_operation(action, target=None, details=None):
     except Exception as e:
         logger.error(f"记录操作日志失败: {e}")
 
+    # 推送操作事件
+    event_bus.publish('operation', {
+        'action': action,
+        'target': target,
+        'details': details,
+        'username': actor.get('username'),
+        'timestamp': datetime.now().isoformat()
+    })
+
 def validate_input(data, rules):
     """输入验证"""
     errors = {}
@@ -418,6 +544,9 @@ def get_services():
             ORDER BY s.port
         ''').fetchall()
 
+        # 一次扫描得到所有服务的进程状态
+        states = get_service_states()
+
         for db_service in db_services:
             service = dict(db_service)
 
@@ -425,21 +554,8 @@ def get_services():
             port_path = os.path.join(SERVICE_DIR, str(service['port']))
             if os.path.isdir(port_path):
                 # 检查服务状态
-                pid_file = os.path.join(port_path, 'xray.pid')
-                if os.path.exists(pid_file):
-                    try:
-                        with open(pid_file, 'r') as f:
-                            pid = int(f.read().strip())
-                        # 检查进程是否存在
-                        try:
-                            os.kill(pid, 0)
-                            service['status'] = 'running'
-                        except OSError:
-                            service['status'] = 'stopped'
-                    except:
-                        service['status'] = 'stopped'
-                else:
-                    service['status'] = 'stopped'
+                state = states.get(str(service['port']))
+                service['status'] = state['status'] if state else 'stopped'
 
                 # 检查是否过期
                 if service['expires_at'] and service['expires_at'] != 0:
@@ -465,188 +581,101 @@ def get_services():
 
     return services
 
+def get_service_states(force=False):
+    """批量获取所有服务的进程状态 (端口 -> 状态字典，见 process_scanner)"""
+    pidfiles = {record['port']: record.get('pid') for record in service_registry.snapshot()}
+    return process_scanner.states(pidfiles, force=force)
+
+def resolve_service_status(record, states):
+    """根据进程状态与有效期计算服务状态，返回 (status, pid)"""
+    # 检查服务状态 (新创建的服务默认为stopped状态)
+    state = states.get(record['port'])
+    if state and state['status'] == 'running':
+        status, pid = 'running', state['pid']
+    else:
+        status, pid = 'stopped', record.get('pid')
+
+    # 检查是否过期
+    expires_at = record.get('expires_at')
+    if expires_at and expires_at != '0':
+        try:
+            if datetime.now().timestamp() > int(expires_at):
+                status = 'expired'
+        except ValueError:
+            pass
+
+    return status, pid
+
 def get_services_from_filesystem():
-    """从文件系统获取服务信息（备用方法）"""
+    """从服务注册表获取服务信息 (文件解析见 service_registry)"""
     services = []
-    if not os.path.exists(SERVICE_DIR):
-        return services
-
-    for port_dir in os.listdir(SERVICE_DIR):
-        port_path = os.path.join(SERVICE_DIR, port_dir)
-        if os.path.isdir(port_path):
-            # 尝试读取info.txt文件 (新格式)
-            info_txt_file = os.path.join(port_path, 'info.txt')
-            config_env_file = os.path.join(port_path, 'config.env')
-            info_file = os.path.join(port_path, 'info')
-
-            service = {'port': port_dir}
-
-            # 优先读取info.txt文件 (新格式)
-            if os.path.exists(info_txt_file):
-                with open(info_txt_file, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        line = line.strip()
-                        if ':' in line:
-                            key, value = line.split(':', 1)
-                            key = key.strip()
-                            value = value.strip()
-                            # 转换为标准字段名
-                            if key == '节点名称':
-                                service['node_name'] = value
-                            elif key == 'Shadowsocks端口':
-                                service['ss_port'] = value
-                            elif key == 'Shadowsocks密码':
-                                service['ss_password'] = value
-                            elif key == 'SOCKS5后端':
-                                service['socks_backend'] = value
-                            elif key == '状态':
-                                service['file_status'] = value
-                            elif key == '有效期':
-                                service['expires_display'] = value
-                            elif key == '创建时间':
-                                service['created_at'] = value
-                            elif key == '协议':
-                                service['protocol'] = value
-                            elif key == '加密方式':
-                                service['encryption'] = value
-                            elif key == 'SOCKS5认证':
-                                service['socks_auth'] = value
-
-            # 读取config.env文件获取详细配置
-            elif os.path.exists(config_env_file):
-                with open(config_env_file, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        if '=' in line:
-                            key, value = line.strip().split('=', 1)
-                            service[key.lower()] = value
-
-            # 兼容旧格式info文件
-            elif os.path.exists(info_file):
-                with open(info_file, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        if '=' in line:
-                            key, value = line.strip().split('=', 1)
-                            service[key.lower()] = value
-
-            # 如果没有找到任何信息文件，跳过
-            else:
-                continue
 
-            # 设置默认值
-            if 'node_name' not in service:
-                service['node_name'] = service.get('node_name', f'服务{port_dir}')
+    # 所有服务共用同一个服务器IP，只获取一次
+    server_ip = None
 
-            # 检查服务状态
-            pid_file = os.path.join(port_path, 'xray.pid')
-            if os.path.exists(pid_file):
-                try:
-                    with open(pid_file, 'r') as f:
-                        pid = int(f.read().strip())
-                    # 检查进程是否存在
-                    try:
-                        os.kill(pid, 0)
-                        service['status'] = 'running'
-                    except OSError:
-                        service['status'] = 'stopped'
-                except:
-                    service['status'] = 'stopped'
-            else:
-                # 新创建的服务默认为stopped状态
-                service['status'] = 'stopped'
-
-            # 检查是否过期
-            if 'expires_at' in service and service['expires_at'] != '0':
-                try:
-                    expires_at = int(service['expires_at'])
-                    if datetime.now().timestamp() > expires_at:
-                        service['status'] = 'expired'
-                except:
-                    pass
+    # 一次扫描得到所有服务的进程状态与连接数
+    states = get_service_states()
+    sockets = socket_table.snapshot()
+    traffic = traffic_poller.all()
 
-            # 确保有必要的字段用于显示
-            if 'ss_port' not in service and 'port' in service:
-                service['ss_port'] = service['port']
+    for record in service_registry.snapshot():
+        service = dict(record)
 
-            # 解析SOCKS5后端地址为IP和端口
-            if 'socks_backend' in service and service['socks_backend']:
-                try:
-                    if ':' in service['socks_backend']:
-                        socks_ip, socks_port = service['socks_backend'].split(':', 1)
-                        service['socks_ip'] = socks_ip
-                        service['socks_port'] = socks_port
-                    else:
-                        service['socks_ip'] = service['socks_backend']
-                        service['socks_port'] = ''
-                except:
-                    service['socks_ip'] = service['socks_backend']
-                    service['socks_port'] = ''
-
-            # 处理有效期显示
-            if 'expires_display' in service:
-                if service['expires_display'] == '永久':
-                    service['expires_at'] = '0'
-                else:
-                    # 如果是其他格式，尝试解析为时间戳
-                    service['expires_at'] = service.get('expires_at', '0')
+        service['status'], service['pid'] = resolve_service_status(record, states)
+        service['connections'] = sockets.established(service['port'])
+        service['traffic'] = traffic.get(service['port'])
+        service['backend_health'] = backend_health.for_service(record)
+        # 定时探测的缓存结果，不在此处发起探测
+        service['health'] = probe_scheduler.get(service['port'])
 
-            # 生成SS链接
-            if service.get('ss_password') and service.get('port'):
+        # 生成SS链接
+        if service.get('ss_password') and service.get('port'):
+            if server_ip is None:
                 server_ip = get_server_ip()
-                ss_link = generate_ss_link(
-                    service['ss_password'], 
-                    server_ip, 
-                    service['port'], 
-                    service.get('node_name', '')
-                )
-                service['ss_link'] = ss_link
-                service['server_ip'] = server_ip
-            
-            services.append(service)
+            ss_link = generate_ss_link(
+                service['ss_password'], 
+                server_ip, 
+                service['port'], 
+                service.get('node_name', ''),
+                service.get('encryption')
+            )
+            service['ss_link'] = ss_link
+            service['server_ip'] = server_ip
+
+        services.append(service)
+
+    return services
 
-    return sorted(services, key=lambda x: int(x['port']))
+@app.template_filter('format_bytes')
+def format_bytes(value, suffix=''):
+    """字节数格式化为 B/KB/MB/GB"""
+    value = float(value or 0)
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if value < 1024 or unit == 'GB':
+            return f"{value:.1f} {unit}{suffix}" if unit != 'B' else f"{int(value)} B{suffix}"
+        value /= 1024
+
+@app.template_filter('time_ago')
+def time_ago(timestamp):
+    """时间戳格式化为 "N秒前" 等相对时间"""
+    if not timestamp:
+        return '-'
+    seconds = max(0, int(time.time() - timestamp))
+    if seconds < 60:
+        return f"{seconds}秒前"
+    if seconds < 3600:
+        return f"{seconds // 60}分钟前"
+    if seconds < 86400:
+        return f"{seconds // 3600}小时前"
+    return f"{seconds // 86400}天前"
 
 def get_server_ip():
-    """获取服务器IP地址"""
-    import socket
-    import requests
-    
-    # 尝试多个服务获取外网IP
-    services = [
-        "https://ifconfig.me/ip",
-        "https://ipinfo.io/ip", 
-        "https://icanhazip.com",
-        "https://ident.me",
-        "https://api.ipify.org",
-        "https://checkip.amazonaws.com"
-    ]
-    
-    for service in services:
-        try:
-            response = requests.get(service, timeout=10)
-            if response.status_code == 200:
-                ip = response.text.strip()
-                # 验证IP格式
-                socket.inet_aton(ip)
-                return ip
-        except:
-            continue
-    
-    # 如果外网服务都失败，尝试获取本机IP
-    try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        local_ip = s.getsockname()[0]
-        s.close()
-        if local_ip != "127.0.0.1":
-            return local_ip
-    except:
-        pass
-    
-    return "YOUR_SERVER_IP"
+    """获取服务器IP地址 (带缓存，见 ip_resolver)"""
+    return ip_resolver.get()
 
-def generate_ss_link(password, server_ip, port, node_name=""):
-    """生成Shadowsocks链接"""
-    method = "chacha20-ietf-poly1305"
+def generate_ss_link(password, server_ip, port, node_name="", method=None):
+    """生成Shadowsocks链接 (method 为服务配置中的加密方式)"""
+    method = method or DEFAULT_METHOD
     
     # 编码认证信息
     auth_string = f"{method}:{password}"
@@ -815,24 +844,6 @@ def test_ss_link(ss_link, timeout=10):
     
     return result
 
-def build_socks_server_config(socks_ip, socks_port, socks_user, socks_pass):
-    """构建SOCKS服务器配置"""
-    config = {
-        "address": socks_ip,
-        "port": socks_port
-    }
-    
-    # 只有在有用户名和密码时才添加认证信息
-    if socks_user and socks_pass:
-        config["users"] = [
-            {
-                "user": socks_user,
-                "pass": socks_pass
-            }
-        ]
-    
-    return config
-
 def call_xray_script(action, *args, timeout=60):
     """调用Xray脚本"""
     try:
@@ -866,7 +877,248 @@ def call_xray_script(action, *args, timeout=60):
         logger.error(f"脚本执行异常: {e}")
         return False, '', str(e)
 
-def sync_service_to_db(port, service_data):
+# ==================== 后台任务 ====================
+
+def current_actor():
+    """当前请求的操作者，随任务保存，任务完成后用于记录操作日志"""
+    return {
+        'user_id': session.get('user_id'),
+        'username': session.get('username'),
+        'ip_address': request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr),
+        'user_agent': request.headers.get('User-Agent', '')
+    }
+
+def enqueue_job(job_type, target=None, params=None):
+    """提交后台任务，返回任务信息 (队列已满时抛出 JobQueueFull)"""
+    params = dict(params or {})
+    params['actor'] = current_actor()
+    return job_queue.submit(job_type, target, params, user_id=session.get('user_id'))
+
+def job_response(job_type, target, message, params=None):
+    """API: 提交后台任务并返回202与任务地址"""
+    try:
+        job = enqueue_job(job_type, target, params)
+    except JobQueueFull as e:
+        return jsonify({
+            'success': False,
+            'error': '任务队列繁忙',
+            'message': str(e)
+        }), 503
+
+    return jsonify({
+        'success': True,
+        'message': message,
+        'job_id': job['id'],
+        'status': job['status'],
+        'status_url': url_for('api_get_job', job_id=job['id']),
+        'stream_url': url_for('api_job_stream', job_id=job['id'])
+    }), 202
+
+def public_job(job):
+    """任务信息 (去掉可能含有密码的参数)"""
+    job = dict(job)
+    job.pop('params', None)
+    return job
+
+def update_service_status(port, status):
+    """更新数据库中的服务状态 (数据库中没有记录时忽略)"""
+    try:
+        db = get_db()
+        db.execute(
+            'UPDATE services SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE port = ?',
+            (status, str(port))
+        )
+        db.commit()
+    except Exception:
+        # 数据库操作失败不影响主要功能
+        pass
+
+# 任务类型 -> (操作名称, 执行函数)
+SERVICE_ACTIONS = {
+    'start_service': ('启动', xray_supervisor.start),
+    'stop_service': ('停止', xray_supervisor.stop),
+    'restart_service': ('重启', xray_supervisor.restart),
+    'reload_service': ('平滑重启', xray_supervisor.rolling_restart)
+}
+
+def run_service_action(job, report):
+    """任务: 启动/停止/重启服务 (重复执行结果相同，进程重启后可安全重试)"""
+    port = job['target']
+    label, action = SERVICE_ACTIONS[job['type']]
+
+    report(10, f'正在{label}服务端口 {port}')
+    result = action(port)
+    service_registry.invalidate(port)
+
+    if job['type'] == 'stop_service':
+        update_service_status(port, 'stopped')
+    else:
+        update_service_status(port, 'running' if result['success'] else 'stopped')
+
+    if result['success']:
+        # 记录操作日志
+        log_operation(job['type'], f'port_{port}', f'{label}服务端口 {port}',
+                      actor=job['params'].get('actor', {}))
+    return result
+
+def run_create_service(job, report):
+    """任务: 生成服务目录与配置文件并同步到数据库
+
+    分配到的端口在创建目录前记入任务参数 (allocated_port)。进程重启后任务
+    重新执行时沿用该端口：服务信息已写入则只补做数据库同步，否则继续创建，
+    不会再分配一个端口或因端口已被自己占用而失败。
+    """
+    data = job['params']['data']
+    actor = job['params'].get('actor', {})
+
+    report(10, f"正在创建服务: {data['node_name']}")
+    port = job['params'].get('allocated_port')
+    service_dir = os.path.join(SERVICE_DIR, str(port)) if port else None
+    if port and os.path.isfile(os.path.join(service_dir, 'info')):
+        # 上次执行已完成文件部分
+        logger.info(f"任务 {job['id']} 重新执行，端口 {port} 的服务文件已存在")
+    else:
+        if not (port and os.path.isdir(service_dir)):
+            port, error = allocate_service_port(data, actor)
+            if error:
+                return {'success': False, 'message': error}
+            job_queue.checkpoint(job['id'], allocated_port=port)
+            service_dir = os.path.join(SERVICE_DIR, str(port))
+            try:
+                os.makedirs(service_dir)
+            except OSError as e:
+                port_allocator.release(port)
+                return {'success': False, 'message': f'创建服务目录失败: {e}'}
+
+        report(40, f'正在生成端口 {port} 的配置')
+        result = render_service_config(SERVICE_DIR, port, data['ss_password'], data['socks_ip'], data['socks_port'],
+                                       data.get('socks_user', ''), data.get('socks_pass', ''),
+                                       method=DEFAULT_METHOD)
+        if not result['success']:
+            shutil.rmtree(service_dir, ignore_errors=True)
+            port_allocator.release(port)
+            return {'success': False, 'message': result['message']}
+
+        # 服务信息 (与Shell脚本 add_service 的info文件格式一致)，最后写入，作为文件部分完成的标志
+        info = {
+            'NODE_NAME': data['node_name'],
+            'PASSWORD': data['ss_password'],
+            'SOCKS_IP': data['socks_ip'],
+            'SOCKS_PORT': data['socks_port'],
+            'SOCKS_USER': data.get('socks_user', ''),
+            'SOCKS_PASS': data.get('socks_pass', ''),
+            'CREATED': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'CREATED_AT': int(time.time()),
+            'EXPIRES_AT': data.get('expires_at', 0),
+            'STATUS': 'active'
+        }
+        write_file(os.path.join(service_dir, 'info'),
+                   ''.join(f'{key}={value}\n' for key, value in info.items()).encode('utf-8'))
+    port_allocator.commit(port)
+    data['port'] = port
+
+    # 同步到数据库
+    report(80, '正在同步到数据库')
+    service_data = {
+        'node_name': data['node_name'],
+        'socks_ip': data['socks_ip'],
+        'socks_port': data['socks_port'],
+        'socks_user': data.get('socks_user', ''),
+        'socks_pass': data.get('socks_pass', ''),
+        'password': data['ss_password'],
+        'expires_at': data.get('expires_at', 0),
+        'status': 'stopped'
+    }
+    sync_service_to_db(data['port'], service_data, created_by=actor.get('user_id'))
+    service_registry.invalidate(data['port'])
+
+    # 记录操作日志
+    log_operation('create_service', f"port_{data['port']}",
+                  f"创建服务: {data['node_name']}", actor=actor)
+
+    return {'success': True, 'message': '服务创建成功', 'port': data['port']}
+
+def allocate_service_port(data, actor):
+    """为新服务预留端口：使用填写的端口，未填写时从用户的端口池中分配 (见 port_allocator)
+
+    返回 (端口, 错误信息)。
+    """
+    try:
+        if data.get('port'):
+            port = validate_port(data['port'])[0]
+            if not port or not port_allocator.reserve_port(port, owner=actor.get('username')):
+                return None, f"端口 {data['port']} 不可用"
+            return port, None
+        return port_allocator.reserve(user=actor.get('username')), None
+    except PortAllocationError as e:
+        return None, str(e)
+
+def run_regenerate_config(job, report):
+    """任务: 按数据库中的服务信息重新生成配置文件，配置有变化时使其生效"""
+    port = job['target']
+    report(10, f'正在重新生成端口 {port} 的配置')
+    service = get_db().execute('SELECT * FROM services WHERE port = ?', (str(port),)).fetchone()
+    if not service:
+        return {'success': False, 'message': f'服务端口 {port} 不存在'}
+
+    # 加密方式沿用现有配置，避免已分发的链接失效
+    result = render_service_config(SERVICE_DIR, port, service['ss_password'], service['socks_ip'],
+                                   service['socks_port'], service['socks_user'] or '',
+                                   service['socks_pass'] or '')
+    service_registry.invalidate(port)
+    if not result['success']:
+        return {'success': False, 'message': result['message']}
+    if not result['changed']:
+        return {'success': True, 'message': f'端口 {port} 配置未变化，无需重新加载'}
+
+    # 运行中的服务通过Xray API在线生效，不中断同一进程中的其他连接
+    report(60, f'正在应用端口 {port} 的新配置')
+    result = xray_supervisor.reload(port)
+    service_registry.invalidate(port)
+    if not result['success']:
+        return {'success': False, 'message': f"配置已重新生成，但应用失败: {result['message']}"}
+    return {'success': True, 'message': f"端口 {port} 配置已重新生成，{result['message']}"}
+
+def run_bulk_service(job, report):
+    """任务: 批量启动/停止/重启服务 (见 bulk_ops)"""
+    params = job['params']
+    action = params['action']
+    label = BULK_ACTIONS[action]
+
+    def progress(done, total, result):
+        service_registry.invalidate(result['port'])
+        report(done * 100 // total, f"已{label} {done}/{total} 个服务")
+
+    summary = bulk_runner.run(action, params['ports'],
+                              concurrency=params.get('concurrency'),
+                              max_unavailable=params.get('max_unavailable'),
+                              max_failures=params.get('max_failures'),
+                              progress=progress)
+
+    for result in summary['results']:
+        if result.get('skipped'):
+            continue
+        if action == 'stop':
+            update_service_status(result['port'], 'stopped')
+        else:
+            update_service_status(result['port'], 'running' if result['success'] else 'stopped')
+
+    message = (f"批量{label} {summary['total']} 个服务: {summary['succeeded']} 成功, "
+               f"{summary['failed']} 失败, {summary['skipped']} 跳过, 耗时 {summary['elapsed']}秒")
+    # 记录操作日志
+    log_operation(f'bulk_{action}_service', None, message, actor=params.get('actor', {}))
+
+    summary['success'] = summary['failed'] == 0 and summary['skipped'] == 0
+    summary['message'] = message
+    return summary
+
+for _job_type in SERVICE_ACTIONS:
+    job_queue.register(_job_type, run_service_action)
+job_queue.register('bulk_service', run_bulk_service)
+job_queue.register('create_service', run_create_service)
+job_queue.register('regenerate_config', run_regenerate_config)
+
+def sync_service_to_db(port, service_data, created_by=None):
     """同步服务信息到数据库"""
     try:
         db = get_db()
@@ -911,7 +1163,7 @@ def sync_service_to_db(port, service_data):
                 service_data.get('password', ''),
                 service_data.get('expires_at', 0),
                 service_data.get('status', 'stopped'),
-                session.get('user_id')
+                created_by if created_by is not None else session.get('user_id')
             ))
 
         db.commit()
@@ -952,12 +1204,10 @@ def get_system_stats():
         except:
             pass
 
-        # 网络连接数
+        # 网络连接数 (共享套接字快照，见 socket_table)
         connections = 0
         try:
-            result = subprocess.run(['netstat', '-an'], capture_output=True, text=True)
-            if result.returncode == 0:
-                connections = len([line for line in result.stdout.split('\n') if 'ESTABLISHED' in line])
+            connections = socket_table.snapshot().total_established
         except:
             pass
 
@@ -1042,12 +1292,32 @@ def logout():
     flash('已安全登出', 'info')
     return redirect(url_for('login'))
 
+def attach_probe_stats(services, sort=None):
+    """附加近期探测统计 (service['probe'])
+
+    sort 为 latency 时按近期p50延迟升序排列，没有探测数据的服务排在最后。
+    """
+    try:
+        recent = probe_history.recent(get_db())
+    except sqlite3.Error as e:
+        logger.error(f"读取探测统计失败: {e}")
+        recent = {}
+    for service in services:
+        port = str(service.get('port', ''))
+        service['probe'] = recent.get(int(port)) if port.isdigit() else None
+    if sort == 'latency':
+        services.sort(key=lambda s: (not s['probe'] or s['probe']['p50'] is None,
+                                     (s['probe'] or {}).get('p50') or 0,
+                                     int(s['port']) if str(s['port']).isdigit() else 0))
+    return services
+
 @app.route('/')
 @login_required
 def index():
-    """主页"""
+    """主页 (?sort=latency 按近期延迟排序)"""
     try:
-        services = get_services()
+        sort = request.args.get('sort')
+        services = attach_probe_stats(get_services(), sort)
         logger.info(f"获取到 {len(services)} 个服务")
         for service in services:
             logger.info(f"服务: {service}")
@@ -1071,7 +1341,8 @@ def index():
         return render_template('index.html',
                              services=services,
                              stats=stats,
-                             system_stats=system_stats)
+                             system_stats=system_stats,
+                             sort=sort)
     except Exception as e:
         logger.error(f"主页加载失败: {e}")
         flash('加载数据失败，请刷新页面', 'error')
@@ -1083,9 +1354,9 @@ def index():
 @app.route('/api/services')
 @login_required
 def api_services():
-    """API: 获取服务列表"""
+    """API: 获取服务列表 (?sort=latency 按近期延迟排序)"""
     try:
-        services = get_services()
+        services = attach_probe_stats(get_services(), request.args.get('sort'))
         return jsonify({
             'success': True,
             'data': services,
@@ -1134,43 +1405,8 @@ def api_create_service():
                 'error': '端口已被使用'
             }), 400
 
-        # 调用Shell脚本创建服务
-        # 这里需要根据实际的Shell脚本接口进行调整
-        success, stdout, stderr = call_xray_script('add_service_api',
-                                                  data['node_name'],
-                                                  f"{data['socks_ip']}:{data['socks_port']}:{data.get('socks_user', '')}:{data.get('socks_pass', '')}",
-                                                  data.get('expiry_type', 'permanent'))
-
-        if success:
-            # 同步到数据库
-            service_data = {
-                'node_name': data['node_name'],
-                'socks_ip': data['socks_ip'],
-                'socks_port': data['socks_port'],
-                'socks_user': data.get('socks_user', ''),
-                'socks_pass': data.get('socks_pass', ''),
-                'password': data['ss_password'],
-                'expires_at': data.get('expires_at', 0),
-                'status': 'stopped'
-            }
-
-            sync_service_to_db(data['port'], service_data)
-
-            # 记录操作日志
-            log_operation('create_service', f"port_{data['port']}",
-                         f"创建服务: {data['node_name']}")
-
-            return jsonify({
-                'success': True,
-                'message': '服务创建成功',
-                'port': data['port']
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': '服务创建失败',
-                'message': stderr or stdout
-            }), 500
+        # 提交后台任务，由任务队列生成服务目录与配置 (见 run_create_service)
+        return job_response('create_service', data.get('port'), '服务创建任务已提交', {'data': data})
 
     except Exception as e:
         logger.error(f"API创建服务失败: {e}")
@@ -1232,47 +1468,8 @@ def api_start_service(port):
                     'error': '服务已过期，请先续费'
                 }), 400
 
-        # 调用Shell脚本启动服务
-        success, stdout, stderr = call_xray_script('start_single_service', str(port))
-
-        if success:
-            # 尝试更新数据库状态 (如果数据库中有记录)
-            try:
-                db = get_db()
-                db.execute(
-                    'UPDATE services SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE port = ?',
-                    ('running', str(port))
-                )
-                db.commit()
-            except Exception:
-                # 数据库操作失败不影响主要功能
-                pass
-
-            # 记录操作日志
-            log_operation('start_service', f'port_{port}', f'启动服务端口 {port}')
-
-            return jsonify({
-                'success': True,
-                'message': f'服务端口 {port} 启动成功'
-            })
-        else:
-            # 尝试更新数据库状态 (如果数据库中有记录)
-            try:
-                db = get_db()
-                db.execute(
-                    'UPDATE services SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE port = ?',
-                    ('stopped', str(port))
-                )
-                db.commit()
-            except Exception:
-                # 数据库操作失败不影响主要功能
-                pass
-
-            return jsonify({
-                'success': False,
-                'error': '服务启动失败',
-                'message': stderr or stdout
-            }), 500
+        # 提交后台任务，由任务队列启动Xray (见 run_service_action)
+        return job_response('start_service', port, f'服务端口 {port} 启动任务已提交')
 
     except Exception as e:
         logger.error(f"API启动服务失败: {e}")
@@ -1304,65 +1501,8 @@ def api_stop_service(port):
                 'error': '服务不存在'
             }), 404
 
-        # 停止服务
-        pid_file = os.path.join(SERVICE_DIR, str(port), 'xray.pid')
-        if os.path.exists(pid_file):
-            try:
-                with open(pid_file, 'r') as f:
-                    pid = int(f.read().strip())
-
-                # 尝试优雅停止
-                os.kill(pid, 15)  # SIGTERM
-                time.sleep(1)
-
-                # 检查是否还在运行
-                try:
-                    os.kill(pid, 0)
-                    # 如果还在运行，强制终止
-                    os.kill(pid, 9)  # SIGKILL
-                except OSError:
-                    pass  # 进程已经停止
-
-                # 删除PID文件
-                if os.path.exists(pid_file):
-                    os.remove(pid_file)
-
-                success = True
-                message = f'服务端口 {port} 停止成功'
-
-            except (ValueError, OSError) as e:
-                success = False
-                message = f'停止服务失败: {str(e)}'
-        else:
-            success = True
-            message = f'服务端口 {port} 已经停止'
-
-        # 尝试更新数据库状态 (如果数据库中有记录)
-        try:
-            db = get_db()
-            db.execute(
-                'UPDATE services SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE port = ?',
-                ('stopped', str(port))
-            )
-            db.commit()
-        except Exception:
-            # 数据库操作失败不影响主要功能
-            pass
-
-        if success:
-            # 记录操作日志
-            log_operation('stop_service', f'port_{port}', f'停止服务端口 {port}')
-
-            return jsonify({
-                'success': True,
-                'message': message
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': '服务停止失败',
-                'message': message
-            }), 500
+        # 提交后台任务 (SIGTERM，超时后SIGKILL，见 run_service_action)
+        return job_response('stop_service', port, f'服务端口 {port} 停止任务已提交')
 
     except Exception as e:
         logger.error(f"API停止服务失败: {e}")
@@ -1400,33 +1540,151 @@ def api_restart_service(port):
                 'error': '服务不存在'
             }), 404
 
-        # 先停止服务
-        stop_response = api_stop_service(port)
-        if not stop_response.get_json().get('success', False):
-            return stop_response
+        # 提交后台任务，停止后立即启动 (见 run_service_action)
+        return job_response('restart_service', port, f'服务端口 {port} 重启任务已提交')
 
-        # 等待一秒
-        time.sleep(2)
+    except Exception as e:
+        logger.error(f"API重启服务失败: {e}")
+        return jsonify({
+            'success': False,
+            'error': '服务重启失败',
+            'message': str(e)
+        }), 500
 
-        # 再启动服务
-        start_response = api_start_service(port)
 
-        if start_response.get_json().get('success', False):
-            # 记录操作日志
-            log_operation('restart_service', f'port_{port}', f'重启服务端口 {port}')
+@app.route('/api/services/<port>/reload', methods=['POST'])
+@app.route('/api/services/<int:port>/reload', methods=['POST'])
+@login_required
+def api_reload_service(port):
+    """API: 平滑重启服务 (新进程就绪后排空旧进程，见 XraySupervisor.rolling_restart)"""
+    try:
+        # 验证端口
+        port, error = validate_port(port)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
 
+        # 检查服务是否存在
+        db = get_db()
+        service = db.execute(
+            'SELECT * FROM services WHERE port = ?', (str(port),)
+        ).fetchone()
+
+        if not service:
             return jsonify({
-                'success': True,
-                'message': f'服务端口 {port} 重启成功'
-            })
+                'success': False,
+                'error': '服务不存在'
+            }), 404
+
+        return job_response('reload_service', port, f'服务端口 {port} 平滑重启任务已提交')
+
+    except Exception as e:
+        logger.error(f"API平滑重启服务失败: {e}")
+        return jsonify({
+            'success': False,
+            'error': '服务平滑重启失败',
+            'message': str(e)
+        }), 500
+
+
+@app.route('/api/services/bulk', methods=['POST'])
+@login_required
+def api_bulk_services():
+    """API: 批量启动/停止/重启服务
+
+    请求: {"action": "start|stop|restart",
+           "ports": [...] 或 "selector": "all|running|stopped|expired",
+           "concurrency": 8, "max_unavailable": 2 或 "25%", "max_failures": 0}
+    max_unavailable 仅对重启生效：同时处于停止状态的运行中服务不超过该数量。
+    结果 (每个端口的结果与耗时) 通过任务接口获取。
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        action = data.get('action')
+        if action not in BULK_ACTIONS:
+            return jsonify({
+                'success': False,
+                'error': f"不支持的操作: {action}，可选: {', '.join(BULK_ACTIONS)}"
+            }), 400
+
+        # 所有服务的当前状态
+        states = get_service_states(force=True)
+        services = {record['port']: resolve_service_status(record, states)[0]
+                    for record in service_registry.snapshot()}
+
+        selector = data.get('selector')
+        if data.get('ports') is not None:
+            ports = []
+            for port in data['ports']:
+                port, error = validate_port(port)
+                if error:
+                    return jsonify({
+                        'success': False,
+                        'error': error
+                    }), 400
+                ports.append(str(port))
+            missing = [port for port in ports if port not in services]
+            if missing:
+                return jsonify({
+                    'success': False,
+                    'error': f"服务不存在: {', '.join(missing)}"
+                }), 404
+        elif selector == 'all':
+            ports = list(services)
+        elif selector in ('running', 'stopped', 'expired'):
+            ports = [port for port, status in services.items() if status == selector]
         else:
-            return start_response
+            return jsonify({
+                'success': False,
+                'error': '需要提供 ports 或 selector (all/running/stopped/expired)'
+            }), 400
+
+        # 过期服务不能启动
+        if action in ('start', 'restart'):
+            ports = [port for port in ports if services.get(port) != 'expired']
+        if not ports:
+            return jsonify({
+                'success': False,
+                'error': '没有符合条件的服务'
+            }), 400
+
+        options = {}
+        if data.get('max_unavailable') is not None:
+            try:
+                parse_max_unavailable(data['max_unavailable'], len(ports))
+            except (TypeError, ValueError):
+                return jsonify({
+                    'success': False,
+                    'error': 'max_unavailable 必须是不小于1的整数或百分比 (如 "25%")'
+                }), 400
+            options['max_unavailable'] = data['max_unavailable']
+        for key, minimum in (('concurrency', 1), ('max_failures', 0)):
+            if data.get(key) is None:
+                continue
+            try:
+                value = int(data[key])
+            except (TypeError, ValueError):
+                value = minimum - 1
+            if value < minimum:
+                return jsonify({
+                    'success': False,
+                    'error': f'{key} 必须是不小于 {minimum} 的整数'
+                }), 400
+            options[key] = value
+        options['concurrency'] = min(options.get('concurrency', DEFAULT_CONCURRENCY), MAX_CONCURRENCY)
+
+        ports.sort(key=int)
+        return job_response('bulk_service', None,
+                            f'批量{BULK_ACTIONS[action]} {len(ports)} 个服务的任务已提交',
+                            dict(options, action=action, ports=ports))
 
     except Exception as e:
-        logger.error(f"API重启服务失败: {e}")
+        logger.error(f"API批量操作失败: {e}")
         return jsonify({
             'success': False,
-            'error': '服务重启失败',
+            'error': '批量操作失败',
             'message': str(e)
         }), 500
 
@@ -1434,7 +1692,11 @@ def api_restart_service(port):
 @app.route('/api/services/<int:port>/test-ss', methods=['POST'])
 @login_required
 def api_test_ss_link(port):
-    """API: 测试SS链接"""
+    """API: 测试SS链接
+
+    请求体中 mode 为 handshake 时进行AEAD握手探测 (见 api_test_ss_batch)。
+    有同一探测方式的缓存结果 (见 probe_scheduler) 时直接返回，fresh 为真时重新探测。
+    """
     try:
         # 验证端口
         port, error = validate_port(port)
@@ -1444,6 +1706,15 @@ def api_test_ss_link(port):
                 'error': error
             }), 400
 
+        data = request.get_json(silent=True) or {}
+        mode = data.get('mode', 'tcp')
+        if not data.get('fresh'):
+            cached = probe_scheduler.get(port, mode=mode)
+            if cached is not None:
+                return cached_test_response(port, cached)
+        if mode != 'tcp':
+            return test_ss_handshake(port, mode)
+
         # 获取服务信息
         services = get_services_from_filesystem()
         service = None
@@ -1468,6 +1739,11 @@ def api_test_ss_link(port):
             
         # 测试SS链接
         test_result = test_ss_link(ss_link, timeout=10)
+        if test_result['parsed']:
+            latency = test_result['details'].get('latency', -1)
+            record_probe_results([(port, latency, test_result['connection'])])
+            probe_scheduler.update(port, probe_result(
+                test_result['connection'], latency, test_result['details'].get('connection_message', '')), 'tcp')
         
         # 格式化结果
         if test_result['connection']:
@@ -1493,7 +1769,8 @@ def api_test_ss_link(port):
                 'port': test_result['details'].get('port', 0),
                 'latency': test_result['details'].get('latency', -1),
                 'parsed': test_result['parsed']
-            }
+            },
+            'cached': False
         })
         
     except Exception as e:
@@ -1504,10 +1781,167 @@ def api_test_ss_link(port):
             'message': str(e)
         }), 500
 
+def test_ss_handshake(port, mode):
+    """单个服务的握手探测"""
+    probe = select_probe(mode)
+    if probe is None:
+        return jsonify({
+            'success': False,
+            'error': f"探测方式无效，可选: {', '.join(PROBE_MODES)}"
+        }), 400
+
+    targets, results = batch_probe_targets([port])
+    if results:
+        status_code = 404 if results[0]['message'] == '服务不存在' else 400
+        return jsonify({
+            'success': False,
+            'error': results[0]['message']
+        }), status_code
+
+    target, probe_data = run_probes(targets, probe=probe, timeout=PROBE_TIMEOUT_MAX)[0]
+    probe_scheduler.update(port, probe_data, mode)
+    result = format_batch_result(target, probe_data)
+    record_probe_results([(port, result['latency'], result['success'])])
+    log_operation('test_ss_link', f'port_{port}',
+                  f'握手测试SS链接: {target["node_name"]} - {result["message"]}')
+    return single_test_response(result, cached=False)
+
+def single_test_response(result, **extra):
+    """单个测试的响应 (result 为 format_batch_result 的结果)"""
+    details = {
+        'server': result['server'],
+        'port': result['server_port'],
+        'latency': result['latency'],
+        'parsed': True
+    }
+    for key in ('ttfb', 'throughput', 'bytes'):
+        if key in result:
+            details[key] = result[key]
+    response = {
+        'success': result['success'],
+        'status': 'success' if result['success'] else 'error',
+        'message': result['message'],
+        'details': details
+    }
+    if result.get('degraded'):
+        response['degraded'] = True
+    response.update(extra)
+    return jsonify(response)
+
+def cached_test_response(port, cached):
+    """由缓存结果构造单个测试的响应"""
+    targets, results = batch_probe_targets([port])
+    if results:
+        status_code = 404 if results[0]['message'] == '服务不存在' else 400
+        return jsonify({
+            'success': False,
+            'error': results[0]['message']
+        }), status_code
+
+    return single_test_response(format_batch_result(targets[0], cached), cached=True,
+                                checked_at=cached['checked_at'], age=cached['age'])
+
+def batch_probe_targets(ports):
+    """批量测试的探测目标，返回 (目标列表, 无法测试的端口结果)
+
+    只读取请求中的服务，服务器IP只解析一次。
+    """
+    targets = []
+    results = []
+    server_ip = None
+    for port in ports:
+        record = service_registry.get(port)
+        if record is None:
+            results.append({'port': port, 'success': False, 'message': '服务不存在'})
+            continue
+        password = record.get('ss_password') or record.get('password')
+        if not password:
+            results.append({'port': port, 'success': False, 'message': 'SS链接不存在'})
+            continue
+        if server_ip is None:
+            server_ip = get_server_ip()
+        targets.append({
+            'key': port,
+            'node_name': record.get('node_name', f'服务{port}'),
+            'server': server_ip,
+            'port': int(record['port']),
+            'method': record.get('encryption') or DEFAULT_METHOD,
+            'password': password
+        })
+    return targets, results
+
+def record_probe_results(results):
+    """把探测结果 [(端口, 延迟毫秒, 是否成功)] 写入探测历史 (见 probe_history)"""
+    try:
+        db = get_db()
+        now = time.time()
+        probe_history.record(db, [(port, now, latency, success) for port, latency, success in results])
+        db.commit()
+    except Exception as e:
+        logger.error(f"记录探测结果失败: {e}")
+
+def scheduled_probe_targets():
+    """定时探测的目标：所有运行中的服务"""
+    states = get_service_states()
+    targets, _ = batch_probe_targets([port for port, state in states.items() if state['status'] == 'running'])
+    return targets
+
+def select_probe(mode):
+    """探测方式对应的探测函数，未知方式返回None"""
+    if mode == 'tcp':
+        return probe_tcp
+    if mode == 'handshake':
+        return partial(probe_handshake, dest=PROBE_DEST)
+    return None
+
+def format_batch_result(target, probe):
+    """批量测试中单个服务的结果"""
+    if probe['success'] and probe.get('mode') == 'handshake':
+        message = f"握手成功，延迟: {probe['latency']}ms，首字节: {probe['ttfb']}ms"
+    elif probe['success'] and probe.get('degraded'):
+        # 握手探测退回为TCP探测：只说明端口可连通，保留原因
+        message = f"仅TCP连接成功，未验证握手，延迟: {probe['latency']}ms ({probe['message']})"
+    elif probe['success']:
+        message = f"连接成功，延迟: {probe['latency']}ms"
+    else:
+        message = probe['message'] or '连接失败'
+    result = {
+        'port': target['key'],
+        'node_name': target['node_name'],
+        'success': probe['success'],
+        'message': message,
+        'latency': probe['latency'],
+        'server': target['server'],
+        'server_port': target['port']
+    }
+    if probe.get('mode') == 'handshake':
+        for key in ('ttfb', 'throughput', 'bytes'):
+            result[key] = probe[key]
+    if probe.get('degraded'):
+        result['degraded'] = True
+    return result
+
+def batch_summary(results):
+    success_count = sum(1 for r in results if r['success'])
+    return {
+        'total': len(results),
+        'success': success_count,
+        'failed': len(results) - success_count,
+        # 握手探测退回为TCP探测的结果数
+        'degraded': sum(1 for r in results if r.get('degraded'))
+    }
+
 @app.route('/api/test-ss-batch', methods=['POST'])
 @login_required
 def api_test_ss_batch():
-    """API: 批量测试SS链接"""
+    """API: 批量测试SS链接
+
+    并发探测 (见 ss_probe)，单个探测超时 timeout 秒，整批不超过 deadline 秒。
+    mode 为 handshake 时完成AEAD握手并经SOCKS5后端连接 PROBE_TARGET，
+    结果中另有首字节时间 ttfb 与吞吐 throughput；默认为 tcp。
+    stream 为真时以SSE逐个返回结果 (result 事件)，最后返回 summary 事件。
+    有同一探测方式缓存结果的服务直接返回缓存 (cached 为真)，fresh 为真时全部重新探测。
+    """
     try:
         data = request.get_json()
         if not data or 'ports' not in data:
@@ -1522,65 +1956,71 @@ def api_test_ss_batch():
                 'success': False,
                 'error': '端口列表格式错误'
             }), 400
-            
-        # 获取所有服务
-        services = get_services_from_filesystem()
-        service_dict = {s['port']: s for s in services}
-        
-        results = []
-        for port in ports:
-            port_str = str(port)
-            if port_str not in service_dict:
-                results.append({
-                    'port': port,
-                    'success': False,
-                    'message': '服务不存在'
-                })
-                continue
-                
-            service = service_dict[port_str]
-            ss_link = service.get('ss_link')
-            if not ss_link:
-                results.append({
-                    'port': port,
-                    'success': False,
-                    'message': 'SS链接不存在'
-                })
-                continue
-                
-            # 测试链接
-            test_result = test_ss_link(ss_link, timeout=10)
-            
-            if test_result['connection']:
-                latency = test_result['details'].get('latency', -1)
-                message = f"连接成功，延迟: {latency}ms"
-            else:
-                message = test_result['details'].get('connection_message', '连接失败')
-                if test_result['error']:
-                    message = test_result['error']
-                    
-            results.append({
-                'port': port,
-                'node_name': service.get('node_name', f'服务{port}'),
-                'success': test_result['connection'],
-                'message': message,
-                'latency': test_result['details'].get('latency', -1),
-                'server': test_result['details'].get('server', ''),
-                'server_port': test_result['details'].get('port', 0)
-            })
-        
-        # 统计结果
-        success_count = sum(1 for r in results if r['success'])
-        total_count = len(results)
-        
+
+        try:
+            options = {
+                'timeout': max(0.1, min(float(data.get('timeout', PROBE_TIMEOUT)), PROBE_TIMEOUT_MAX)),
+                'deadline': max(0.1, min(float(data.get('deadline', PROBE_DEADLINE)), PROBE_DEADLINE_MAX)),
+                'concurrency': max(1, min(int(data.get('concurrency', PROBE_CONCURRENCY)), PROBE_CONCURRENCY_MAX))
+            }
+        except (TypeError, ValueError):
+            return jsonify({
+                'success': False,
+                'error': '探测参数格式错误'
+            }), 400
+        mode = data.get('mode', 'tcp')
+        options['probe'] = select_probe(mode)
+        if options['probe'] is None:
+            return jsonify({
+                'success': False,
+                'error': f"探测方式无效，可选: {', '.join(PROBE_MODES)}"
+            }), 400
+
+        targets, results = batch_probe_targets(ports)
+        if not data.get('fresh'):
+            uncached = []
+            for target in targets:
+                cached = probe_scheduler.get(target['key'], mode=mode)
+                if cached is None:
+                    uncached.append(target)
+                else:
+                    results.append(dict(format_batch_result(target, cached), cached=True, age=cached['age']))
+            targets = uncached
+
+        if data.get('stream'):
+            def generate():
+                event_id = 0
+                for result in results:
+                    event_id += 1
+                    yield format_sse({'id': event_id, 'type': 'result', 'data': result})
+                probed = []
+                for target, probe in stream_probes(targets, **options):
+                    event_id += 1
+                    probe_scheduler.update(target['key'], probe, mode)
+                    result = dict(format_batch_result(target, probe), cached=False)
+                    results.append(result)
+                    probed.append((target['port'], probe['latency'], probe['success']))
+                    yield format_sse({'id': event_id, 'type': 'result', 'data': result})
+                record_probe_results(probed)
+                yield format_sse({'id': event_id + 1, 'type': 'summary', 'data': batch_summary(results)})
+
+            return Response(stream_with_context(generate()),
+                            mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+        probed = run_probes(targets, **options)
+        for target, probe in probed:
+            probe_scheduler.update(target['key'], probe, mode)
+            results.append(dict(format_batch_result(target, probe), cached=False))
+        record_probe_results([(target['port'], probe['latency'], probe['success']) for target, probe in probed])
+        # 与请求中的端口顺序一致
+        order = {str(port): i for i, port in enumerate(ports)}
+        results.sort(key=lambda r: order.get(str(r['port']), len(order)))
+
         return jsonify({
             'success': True,
             'results': results,
-            'summary': {
-                'total': total_count,
-                'success': success_count,
-                'failed': total_count - success_count
-            }
+            'summary': batch_summary(results)
         })
         
     except Exception as e:
@@ -1634,7 +2074,7 @@ def api_delete_service(port):
             }), 403
 
         # 先停止服务
-        call_xray_script('stop_single_service', str(port))
+        xray_supervisor.stop(port)
 
         # 移动服务文件到回收站目录而不是直接删除
         service_dir = os.path.join(SERVICE_DIR, str(port))
@@ -1648,6 +2088,7 @@ def api_delete_service(port):
             recycled_path = os.path.join(recycle_dir, recycled_name)
             
             shutil.move(service_dir, recycled_path)
+            service_registry.invalidate(port)
             logger.info(f"服务文件已移动到回收站: {recycled_path}")
 
         # 软删除：在数据库中标记为已删除
@@ -1756,6 +2197,154 @@ def api_clear_service_logs(port):
             'message': str(e)
         }), 500
 
+def collect_service_events():
+    """事件流数据源：所有服务的状态摘要 {端口: 摘要}"""
+    states = get_service_states()
+    sockets = socket_table.snapshot()
+    traffic = traffic_poller.all()
+    summary = {}
+    for record in service_registry.snapshot():
+        status, pid = resolve_service_status(record, states)
+        service_traffic = traffic.get(record['port']) or {}
+        summary[record['port']] = {
+            'status': status,
+            'pid': pid,
+            'node_name': record.get('node_name'),
+            'connections': sockets.established(record['port']),
+            'rate_in': service_traffic.get('rate_in', 0),
+            'rate_out': service_traffic.get('rate_out', 0)
+        }
+    return summary
+
+def collect_metric_events():
+    """事件流数据源：最新的系统指标采样"""
+    sample = system_monitor.sampler.latest()
+    rates = sample['rates']
+    return {
+        'timestamp': sample['timestamp'],
+        'cpu_usage': sample['cpu_percent'],
+        'memory_usage': sample['memory_percent'],
+        'load_avg': sample['load_avg'],
+        'network_in': rates.get('net_bytes_recv_rate', 0),
+        'network_out': rates.get('net_bytes_sent_rate', 0),
+        'disk_read': rates.get('disk_read_bytes_rate', 0),
+        'disk_write': rates.get('disk_write_bytes_rate', 0),
+        'connections': socket_table.snapshot().total_established
+    }
+
+event_bus.add_source('services', collect_service_events, interval=2)
+event_bus.add_source('metrics', collect_metric_events, interval=system_monitor.sampler.interval, diff=False)
+
+@app.route('/api/stream')
+@login_required
+def api_stream():
+    """API: 服务端推送事件流 (SSE)
+
+    推送服务状态变化(services)、系统指标(metrics)与操作事件(operation)，
+    所有连接共享同一个后台采集线程。
+    """
+    def generate():
+        q = event_bus.subscribe()
+        try:
+            # 先推送当前完整状态
+            for event in event_bus.snapshot():
+                yield format_sse(event)
+            while True:
+                try:
+                    event = q.get(timeout=15)
+                except queue.Empty:
+                    # 保持连接，同时检测客户端断开
+                    yield ': keepalive\n\n'
+                    continue
+                yield format_sse(event)
+        finally:
+            event_bus.unsubscribe(q)
+
+    return Response(stream_with_context(generate()),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/jobs')
+@login_required
+def api_list_jobs():
+    """API: 最近的后台任务 (普通用户只能看到自己提交的任务)"""
+    try:
+        limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+        created_by = None if session.get('role') == 'admin' else session.get('user_id')
+        jobs = job_queue.list(status=request.args.get('status'), target=request.args.get('target'),
+                              created_by=created_by, limit=limit)
+        return jsonify({
+            'success': True,
+            'jobs': [public_job(job) for job in jobs],
+            'stats': job_queue.get_stats()
+        })
+    except Exception as e:
+        logger.error(f"获取任务列表失败: {e}")
+        return jsonify({
+            'success': False,
+            'error': '获取任务列表失败',
+            'message': str(e)
+        }), 500
+
+def get_visible_job(job_id):
+    """当前用户可查看的任务，不存在或无权限时返回None"""
+    job = job_queue.get(job_id)
+    if job and session.get('role') != 'admin' and job['created_by'] != session.get('user_id'):
+        return None
+    return job
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def api_get_job(job_id):
+    """API: 查询后台任务状态"""
+    job = get_visible_job(job_id)
+    if not job:
+        return jsonify({
+            'success': False,
+            'error': '任务不存在'
+        }), 404
+
+    return jsonify({
+        'success': True,
+        'job': public_job(job)
+    })
+
+@app.route('/api/jobs/<job_id>/stream')
+@login_required
+def api_job_stream(job_id):
+    """API: 后台任务进度推送 (SSE)，任务完成后结束"""
+    if not get_visible_job(job_id):
+        return jsonify({
+            'success': False,
+            'error': '任务不存在'
+        }), 404
+
+    def generate():
+        # 先订阅再读取当前状态，避免错过两者之间完成的事件
+        q = event_bus.subscribe()
+        try:
+            job = public_job(job_queue.get(job_id))
+            yield format_sse({'id': 0, 'type': 'job', 'data': job})
+            if job['status'] in JOB_FINISHED:
+                return
+            while True:
+                try:
+                    event = q.get(timeout=15)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if event['type'] != 'job' or event['data'].get('id') != job_id:
+                    continue
+                yield format_sse(event)
+                if event['data']['status'] in JOB_FINISHED:
+                    return
+        finally:
+            event_bus.unsubscribe(q)
+
+    return Response(stream_with_context(generate()),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/monitor/stats')
 @login_required
 def api_monitor_stats():
@@ -1773,26 +2362,23 @@ def api_monitor_stats():
             'expired': len([s for s in services if s.get('status') == 'expired'])
         }
 
-        # 保存监控数据到数据库
-        try:
-            db = get_db()
-            db.execute('''
-                INSERT INTO monitor_data (cpu_usage, memory_usage, connections, timestamp)
-                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (
-                system_stats['cpu_usage'],
-                system_stats['memory_usage'],
-                system_stats['connections']
-            ))
-            db.commit()
-        except Exception as e:
-            logger.warning(f"保存监控数据失败: {e}")
+        # 监控数据由后台采集器按 monitor_interval 写入 (见 metrics_collector)，此处只读
+
+        # 每个服务的流量 (字节/秒与累计字节)，按总速率排序找出热点节点
+        traffic = traffic_poller.all()
+        hot_services = sorted(
+            traffic.items(),
+            key=lambda item: item[1]['rate_in'] + item[1]['rate_out'],
+            reverse=True
+        )[:10]
 
         return jsonify({
             'success': True,
             'data': {
                 'system': system_stats,
                 'services': service_stats,
+                'traffic': traffic,
+                'hot_services': [dict(port=port, **entry) for port, entry in hot_services],
                 'timestamp': datetime.now().isoformat()
             }
         })
@@ -1811,27 +2397,25 @@ def api_monitor_history():
     """API: 获取监控历史数据"""
     try:
         hours = request.args.get('hours', 24, type=int)
+        points = request.args.get('points', 300, type=int)
+        port = request.args.get('port', type=int)
+
+        if not hours or hours < 1 or hours > 24 * 365:
+            return jsonify({
+                'success': False,
+                'error': '时间范围必须在1小时到365天之间'
+            }), 400
 
         db = get_db()
-        history_data = db.execute('''
-            SELECT cpu_usage, memory_usage, connections, timestamp
-            FROM monitor_data
-            WHERE timestamp > datetime('now', '-{} hours')
-            ORDER BY timestamp DESC
-            LIMIT 100
-        '''.format(hours)).fetchall()
-
-        data = []
-        for row in history_data:
-            data.append({
-                'cpu_usage': row['cpu_usage'],
-                'memory_usage': row['memory_usage'],
-                'connections': row['connections'],
-                'timestamp': row['timestamp']
-            })
+        resolution, interval, data = metrics_rollup.query(
+            db, hours, port=port, max_points=points,
+            raw_interval=metrics_collector.get_interval()
+        )
 
         return jsonify({
             'success': True,
+            'resolution': resolution,
+            'interval': interval,
             'data': data
         })
 
@@ -1843,6 +2427,80 @@ def api_monitor_history():
             'message': str(e)
         }), 500
 
+@app.route('/api/probes/<int:port>/history')
+@login_required
+def api_probe_history(port):
+    """API: 端口的延迟曲线与统计 (p50/p95/p99、可用率)"""
+    try:
+        hours = request.args.get('hours', 24, type=float)
+        points = request.args.get('points', 300, type=int)
+        if not hours or hours <= 0 or hours > 24 * 1095:
+            return jsonify({
+                'success': False,
+                'error': '时间范围必须在0到1095天之间'
+            }), 400
+
+        db = get_db()
+        resolution, interval, data = probe_history.series(db, port, hours, max_points=points)
+        summary = probe_history.summary(db, hours, ports=[port]).get(port)
+
+        return jsonify({
+            'success': True,
+            'resolution': resolution,
+            'interval': interval,
+            'summary': summary,
+            'data': data
+        })
+
+    except Exception as e:
+        logger.error(f"API获取探测历史失败: {e}")
+        return jsonify({
+            'success': False,
+            'error': '获取探测历史失败',
+            'message': str(e)
+        }), 500
+
+@app.route('/api/probes/ranking')
+@login_required
+def api_probe_ranking():
+    """API: 最快 (order=fastest，按p50) 或最不可靠 (order=unreliable，按可用率) 的节点"""
+    try:
+        hours = request.args.get('hours', 24, type=float)
+        limit = request.args.get('limit', 10, type=int)
+        min_samples = request.args.get('min_samples', 1, type=int)
+        order = request.args.get('order', 'fastest')
+        if not hours or hours <= 0 or hours > 24 * 1095:
+            return jsonify({
+                'success': False,
+                'error': '时间范围必须在0到1095天之间'
+            }), 400
+        if order not in ('fastest', 'unreliable'):
+            return jsonify({
+                'success': False,
+                'error': '排序方式必须为 fastest 或 unreliable'
+            }), 400
+
+        items = probe_history.ranking(get_db(), hours, order=order,
+                                      limit=max(1, min(limit or 10, 100)), min_samples=min_samples or 1)
+        for item in items:
+            record = service_registry.get(item['port'])
+            item['node_name'] = record.get('node_name') if record else None
+
+        return jsonify({
+            'success': True,
+            'order': order,
+            'hours': hours,
+            'data': items
+        })
+
+    except Exception as e:
+        logger.error(f"API获取节点排名失败: {e}")
+        return jsonify({
+            'success': False,
+            'error': '获取节点排名失败',
+            'message': str(e)
+        }), 500
+
 @app.route('/service/<port>')
 @app.route('/service/<int:port>')
 @login_required
@@ -1872,20 +2530,8 @@ def service_detail(port):
         service_dict = dict(service)
 
         # 检查实际运行状态
-        pid_file = os.path.join(SERVICE_DIR, str(port), 'xray.pid')
-        if os.path.exists(pid_file):
-            try:
-                with open(pid_file, 'r') as f:
-                    pid = int(f.read().strip())
-                try:
-                    os.kill(pid, 0)
-                    service_dict['status'] = 'running'
-                except OSError:
-                    service_dict['status'] = 'stopped'
-            except:
-                service_dict['status'] = 'stopped'
-        else:
-            service_dict['status'] = 'stopped'
+        state = get_service_states().get(str(port))
+        service_dict['status'] = state['status'] if state else 'stopped'
 
         # 检查是否过期
         if service_dict['expires_at'] and service_dict['expires_at'] != 0:
@@ -1901,6 +2547,9 @@ def service_detail(port):
             server_ip = '127.0.0.1'
 
         service_dict['server_ip'] = server_ip
+        service_dict['traffic'] = traffic_poller.get(port)
+        # 后端以服务目录中的信息为准 (与实际生成的配置一致)
+        service_dict['backend_health'] = backend_health.for_service(service_registry.get(port) or service_dict)
 
         return render_template('service_detail.html', service=service_dict)
 
@@ -2061,9 +2710,13 @@ def update_service(port):
             with open(info_file, 'w', encoding='utf-8') as f:
                 for key, value in info_data.items():
                     f.write(f'{key}={value}\n')
+            service_registry.invalidate(port)
 
-        # 重新生成配置文件
-        success, stdout, stderr = call_xray_script('regenerate_config', port)
+        # 重新生成配置文件 (后台任务)
+        try:
+            enqueue_job('regenerate_config', port)
+        except JobQueueFull as e:
+            logger.warning(f"提交配置生成任务失败: {e}")
 
         # 记录操作日志
         log_operation('update_service', f'port_{port}',
@@ -2121,27 +2774,25 @@ def add_service():
             import random
             import string
 
-            # 生成随机端口 (避免冲突)
-            max_attempts = 50
-            for attempt in range(max_attempts):
-                ss_port = random.randint(10000, 65535)
-                if not os.path.exists(os.path.join(SERVICE_DIR, str(ss_port))):
-                    break
-            else:
-                flash('无法生成可用端口，请稍后重试', 'error')
+            # 从用户的端口池中预留端口 (见 port_allocator)
+            try:
+                ss_port = port_allocator.reserve(user=session.get('username'))
+            except PortAllocationError as e:
+                flash(f'无法分配端口: {e}', 'error')
                 return render_template('add_service.html')
 
             # 生成随机密码
             ss_password = ''.join(random.choices(string.ascii_letters + string.digits, k=16))
 
-            # 检查端口是否已存在 (双重检查)
-            if os.path.exists(os.path.join(SERVICE_DIR, str(ss_port))):
+            # 创建服务目录 (目录已存在说明端口被其他途径占用)
+            service_dir = os.path.join(SERVICE_DIR, str(ss_port))
+            try:
+                os.makedirs(service_dir)
+            except FileExistsError:
+                port_allocator.release(ss_port)
                 flash(f'端口 {ss_port} 已被使用，请重试', 'error')
                 return render_template('add_service.html')
-
-            # 创建服务目录
-            service_dir = os.path.join(SERVICE_DIR, str(ss_port))
-            os.makedirs(service_dir, exist_ok=True)
+            port_allocator.commit(ss_port)
 
             # 创建配置文件
             config_file = os.path.join(service_dir, 'config.env')
@@ -2156,36 +2807,11 @@ def add_service():
                 f.write(f'CREATED_AT={datetime.now().isoformat()}\n')
                 f.write(f'CREATED_BY={session.get("username", "admin")}\n')
 
-            # 生成Xray配置文件 (SOCKS5转SS)
-            config_file = os.path.join(service_dir, 'config.json')
-            config_data = {
-                "log": {
-                    "loglevel": "warning"
-                },
-                "inbounds": [
-                    {
-                        "port": ss_port,
-                        "protocol": "shadowsocks",
-                        "settings": {
-                            "method": "chacha20-ietf-poly1305",
-                            "password": ss_password
-                        }
-                    }
-                ],
-                "outbounds": [
-                    {
-                        "protocol": "socks",
-                        "settings": {
-                            "servers": [
-                                build_socks_server_config(socks_ip, int(socks_port), socks_user, socks_pass)
-                            ]
-                        }
-                    }
-                ]
-            }
-
-            with open(config_file, 'w') as f:
-                json.dump(config_data, f, indent=2)
+            # 生成Xray配置文件 (SOCKS5转SS，见 config_renderer)
+            result = render_service_config(SERVICE_DIR, ss_port, ss_password, socks_ip, socks_port,
+                                           socks_user, socks_pass, method=DEFAULT_METHOD)
+            if not result['success']:
+                raise ValueError(result['message'])
 
             # 保存服务信息文件
             info_file = os.path.join(service_dir, 'info.txt')
@@ -2194,7 +2820,7 @@ def add_service():
                 f.write(f'Shadowsocks端口: {ss_port}\n')
                 f.write(f'Shadowsocks密码: {ss_password}\n')
                 f.write(f'协议: Shadowsocks\n')
-                f.write(f'加密方式: chacha20-ietf-poly1305\n')
+                f.write(f'加密方式: {DEFAULT_METHOD}\n')
                 f.write(f'SOCKS5后端: {socks_ip}:{socks_port}\n')
                 if socks_user and socks_pass:
                     f.write(f'SOCKS5认证: {socks_user}:{socks_pass}\n')
@@ -2203,6 +2829,7 @@ def add_service():
                 f.write(f'创建时间: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}\n')
                 f.write(f'有效期: 永久\n')
                 f.write(f'状态: 已创建\n')
+            service_registry.invalidate(ss_port)
 
             # 保存到数据库
             try:
@@ -2216,7 +2843,7 @@ def add_service():
                     ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (
                     ss_port, ss_password, node_name, socks_ip, socks_port,
-                    'chacha20-ietf-poly1305', current_user_id, datetime.now().isoformat(), 0, 'stopped'
+                    DEFAULT_METHOD, current_user_id, datetime.now().isoformat(), 0, 'stopped'
                 ))
                 db.commit()
                 logger.info(f"服务已保存到数据库: 端口 {ss_port}")
@@ -2224,29 +2851,11 @@ def add_service():
                 logger.error(f"保存到数据库失败: {db_error}")
                 # 继续执行，不影响文件创建
 
-            # 自动启动服务
+            # 自动启动服务 (后台任务，页面通过状态推送看到结果)
             try:
                 logger.info(f"正在自动启动新添加的服务: 端口 {ss_port}")
-                success, stdout, stderr = call_xray_script('start_single_service', str(ss_port))
-                
-                if success:
-                    # 更新数据库状态为运行中
-                    try:
-                        db = get_db()
-                        db.execute(
-                            'UPDATE services SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE port = ?',
-                            ('running', str(ss_port))
-                        )
-                        db.commit()
-                        logger.info(f"服务 {ss_port} 自动启动成功")
-                        startup_message = "，服务已自动启动"
-                    except Exception as db_error:
-                        logger.error(f"更新服务状态失败: {db_error}")
-                        startup_message = "，服务启动成功但状态更新失败"
-                else:
-                    logger.warning(f"服务 {ss_port} 自动启动失败: {stderr}")
-                    startup_message = f"，但自动启动失败: {stderr}"
-                    
+                enqueue_job('start_service', ss_port)
+                startup_message = "，服务正在后台启动"
             except Exception as start_error:
                 logger.error(f"自动启动服务失败: {start_error}")
                 startup_message = f"，但自动启动失败: {str(start_error)}"
@@ -2342,11 +2951,17 @@ def cleanup_old_data():
         with app.app_context():
             db = get_db()
 
-            # 清理30天前的监控数据
-            db.execute('''
-                DELETE FROM monitor_data
-                WHERE timestamp < datetime('now', '-30 days')
-            ''')
+            # 按保留期限分批清理监控原始数据与汇总数据
+            metrics_rollup.prune(db)
+
+            # 清理已完成的后台任务
+            job_queue.prune(db)
+
+            # 清理过期的后端健康检查历史
+            backend_health.prune(db)
+
+            # 按保留期限分批清理探测结果与延迟汇总
+            probe_history.prune(db)
 
             # 清理90天前的操作日志
             db.execute('''
@@ -2378,6 +2993,28 @@ def start_background_tasks():
     # 启动后台线程
     background_thread = threading.Thread(target=background_worker, daemon=True)
     background_thread.start()
+
+    # 按 monitor_interval 定时采集监控数据
+    metrics_collector.configure(services_fn=collect_service_events)
+    traffic_poller.start()
+    metrics_collector.start()
+
+    # 恢复上次未完成的后台任务
+    job_queue.start()
+
+    # 守护Xray进程，崩溃后自动重启
+    service_watchdog.start()
+
+    # 定时检查SOCKS5后端
+    backend_health.start()
+
+    # 定时探测运行中的服务，结果缓存供服务列表与手动测试使用
+    probe_mode = PROBE_MODE if PROBE_MODE in PROBE_MODES else 'tcp'
+    if probe_mode == 'handshake' and not HANDSHAKE_SUPPORTED:
+        logger.warning("未安装cryptography，握手探测将降级为TCP连接探测 (结果标记为 degraded)，"
+                       "请执行 pip install -r requirements.txt")
+    probe_scheduler.configure(targets_fn=scheduled_probe_targets, probe=select_probe(probe_mode), mode=probe_mode)
+    probe_scheduler.start()
     logger.info("后台任务已启动")
 
 if __name__ == '__main__':
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SOCKS5后端健康检查模块 - 定时对每个不同的SOCKS5后端进行问候、用户名/密码认证与CONNECT探测
+"""
+
+import os
+import hmac
+import time
+import asyncio
+import hashlib
+import secrets
+import sqlite3
+import threading
+import logging
+from collections import deque
+from functools import partial
+
+from service_registry import service_registry
+from ss_probe import run_probes, probe_result, socks_address, DEFAULT_DEST, DEFAULT_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# 检查周期 (秒)
+DEFAULT_INTERVAL = 60
+MIN_INTERVAL = 10
+# 单个后端的探测超时 (秒)
+DEFAULT_TIMEOUT = 5.0
+# 内存中保留的每个后端最近结果数，用于可用率与认证失败次数
+RECENT_SIZE = 20
+# backend_health 表的保留天数
+HISTORY_RETENTION_DAYS = 7
+# 历史查询最多返回的行数
+MAX_HISTORY = 1000
+# 后端标识中HMAC的十六进制位数
+ID_DIGEST_LENGTH = 12
+
+# SOCKS5 (RFC 1928) 与用户名/密码认证 (RFC 1929)
+SOCKS_VERSION = 5
+METHOD_NO_AUTH = 0x00
+METHOD_USERPASS = 0x02
+METHOD_NONE_ACCEPTABLE = 0xFF
+REPLY_MESSAGES = {
+    0x01: 'general SOCKS server failure',
+    0x02: 'connection not allowed by ruleset',
+    0x03: 'network unreachable',
+    0x04: 'host unreachable',
+    0x05: 'connection refused',
+    0x06: 'TTL expired',
+    0x07: 'command not supported',
+    0x08: 'address type not supported'
+}
+
+
+def create_tables(cursor):
+    """创建后端健康检查历史表 (由 init_db 调用)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS backend_health (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            backend TEXT NOT NULL,
+            success INTEGER NOT NULL,
+            auth_failed INTEGER NOT NULL DEFAULT 0,
+            latency REAL,
+            stage TEXT,
+            message TEXT,
+            checked_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_backend_health_backend ON backend_health (backend, checked_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_backend_health_checked_at ON backend_health (checked_at)')
+
+
+def backend_of(record):
+    """服务记录中的SOCKS5后端 (地址, 端口, 用户名, 密码)，没有后端时返回None
+
+    info/config.env 格式为 socks_ip、socks_port、socks_user、socks_pass；
+    info.txt 格式的认证信息在 socks_auth 中 ('用户名:密码' 或 '无')。
+    """
+    host = (record.get('socks_ip') or '').strip()
+    try:
+        port = int(record.get('socks_port') or 0)
+    except (TypeError, ValueError):
+        return None
+    if not host or not 1 <= port <= 65535:
+        return None
+
+    user = record.get('socks_user') or ''
+    password = record.get('socks_pass') or ''
+    auth = record.get('socks_auth') or ''
+    if not user and ':' in auth:
+        user, password = auth.split(':', 1)
+    return host, port, user, password
+
+
+def backend_name(backend):
+    """后端的显示名称 (不含密码)：[用户名@]地址:端口"""
+    host, port, user, _ = backend
+    if ':' in host:
+        host = f'[{host}]'
+    return f'{user}@{host}:{port}' if user else f'{host}:{port}'
+
+
+def backend_id(backend, key):
+    """历史记录中的后端标识：显示名称，有认证时附加以服务端密钥计算的密码HMAC，
+    区分同一用户的不同密码，且无法由标识反推或离线猜测密码"""
+    if not backend[2]:
+        return backend_name(backend)
+    digest = hmac.new(key, backend[3].encode(), hashlib.sha256).hexdigest()[:ID_DIGEST_LENGTH]
+    return f'{backend_name(backend)}#{digest}'
+
+
+def load_key(key_file):
+    """读取后端标识的HMAC密钥，文件不存在时生成 (权限0600)"""
+    os.makedirs(os.path.dirname(os.path.abspath(key_file)), exist_ok=True)
+    try:
+        fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(key_file, 'r') as f:
+            return bytes.fromhex(f.read().strip())
+    with os.fdopen(fd, 'w') as f:
+        key = secrets.token_bytes(32)
+        f.write(key.hex() + '\n')
+    return key
+
+
+def _socks_result(success, message, stage, latency=-1, connect_latency=None, auth_failed=False):
+    result = probe_result(success, latency, message)
+    result.update({'stage': stage, 'connect_latency': connect_latency, 'auth_failed': auth_failed})
+    return result
+
+
+async def probe_socks5(target, timeout, dest=DEFAULT_DEST):
+    """SOCKS5探测：问候、用户名/密码认证与CONNECT dest
+
+    target 需包含 server、port，可选 user、password。latency为CONNECT成功的
+    总耗时，connect_latency为建立TCP连接的耗时 (毫秒)；stage为结束时所在的阶段
+    (tcp/greeting/auth/connect/done)，auth_failed表示后端拒绝了认证。
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    end = start + timeout
+
+    def remaining():
+        return max(0.0, end - loop.time())
+
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(target['server'], target['port']), remaining())
+    except asyncio.TimeoutError:
+        return _socks_result(False, 'Connection timeout', 'tcp')
+    except OSError as e:
+        return _socks_result(False, f'Connection failed: {e.strerror or e}', 'tcp')
+    connect_latency = round((loop.time() - start) * 1000, 2)
+
+    user = (target.get('user') or '').encode()
+    password = (target.get('password') or '').encode()
+    stage = 'greeting'
+
+    def fail(message, auth_failed=False):
+        return _socks_result(False, message, stage, connect_latency=connect_latency, auth_failed=auth_failed)
+
+    async def read(size):
+        return await asyncio.wait_for(reader.readexactly(size), remaining())
+
+    try:
+        methods = bytes([METHOD_NO_AUTH, METHOD_USERPASS]) if user else bytes([METHOD_NO_AUTH])
+        writer.write(bytes([SOCKS_VERSION, len(methods)]) + methods)
+        version, method = await read(2)
+        if version != SOCKS_VERSION:
+            return fail(f'Not a SOCKS5 server (version {version})')
+        if method == METHOD_NONE_ACCEPTABLE:
+            return fail('Authentication required' if not user else 'No acceptable authentication method',
+                        auth_failed=True)
+
+        if method == METHOD_USERPASS:
+            stage = 'auth'
+            if not user:
+                return fail('Authentication required', auth_failed=True)
+            if len(user) > 255 or len(password) > 255:
+                return fail('Username or password too long', auth_failed=True)
+            writer.write(bytes([1, len(user)]) + user + bytes([len(password)]) + password)
+            _, status = await read(2)
+            if status != 0:
+                return fail('Authentication failed', auth_failed=True)
+        elif method != METHOD_NO_AUTH:
+            return fail(f'Unsupported authentication method {method}')
+
+        stage = 'connect'
+        writer.write(bytes([SOCKS_VERSION, 1, 0]) + socks_address(*dest))
+        _, reply, _, atyp = await read(4)
+        if reply != 0:
+            return fail(f"CONNECT failed: {REPLY_MESSAGES.get(reply, f'reply {reply}')}")
+        # 跳过绑定地址
+        length = {1: 4, 4: 16}.get(atyp)
+        if length is None:
+            length = (await read(1))[0]
+        await read(length + 2)
+    except asyncio.IncompleteReadError:
+        return fail(f'Connection closed during {stage}')
+    except asyncio.TimeoutError:
+        return fail(f'Timeout during {stage}')
+    except OSError as e:
+        return fail(f'Connection error during {stage}: {e.strerror or e}')
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+    latency = round((loop.time() - start) * 1000, 2)
+    return _socks_result(True, 'CONNECT successful', 'done', latency, connect_latency)
+
+
+class BackendHealth:
+    """SOCKS5后端健康检查器
+
+    每个周期从服务注册表收集后端，按 (地址, 端口, 用户名, 密码) 去重，
+    多个服务共用的后端只探测一次；探测并发进行，整批不超过一个周期。
+    每次结果写入 backend_health 表，内存中保留每个后端的最新结果、
+    连续失败次数与最近 RECENT_SIZE 次结果，供服务列表直接读取。
+    """
+
+    def __init__(self, db_path=None, interval=DEFAULT_INTERVAL, timeout=DEFAULT_TIMEOUT,
+                 concurrency=DEFAULT_CONCURRENCY, dest=DEFAULT_DEST, key_file=None):
+        self.db_path = db_path
+        self.key_file = key_file
+        self._key = None
+        self.interval = interval
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.dest = dest
+
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        # 后端 -> {'latest', 'failures', 'recent', 'ports'}
+        self._backends = {}
+
+        # 统计
+        self.check_count = 0
+        self.last_check = None
+        self.last_duration_ms = 0
+
+    def configure(self, db_path=None, interval=None, timeout=None, concurrency=None, dest=None,
+                  key_file=None):
+        """设置数据库路径、检查周期、超时、并发数、CONNECT目标与标识密钥文件"""
+        if db_path is not None:
+            self.db_path = db_path
+        if key_file is not None:
+            self.key_file = key_file
+            self._key = None
+        if interval is not None:
+            self.interval = max(MIN_INTERVAL, interval)
+        if timeout is not None:
+            self.timeout = timeout
+        if concurrency is not None:
+            self.concurrency = concurrency
+        if dest is not None:
+            self.dest = dest
+
+    def start(self):
+        """启动检查线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='backend-health', daemon=True)
+        self._thread.start()
+        logger.info("SOCKS5后端健康检查已启动")
+
+    def stop(self):
+        """停止检查线程"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def backend_id(self, backend):
+        """后端在历史记录中的标识，见 backend_id()"""
+        if self._key is None:
+            key = None
+            if self.key_file:
+                try:
+                    key = load_key(self.key_file)
+                except (OSError, ValueError) as e:
+                    logger.error(f"读取后端标识密钥失败: {e}")
+            if key is None:
+                # 没有可用的密钥文件时使用进程内的随机密钥，重启后历史不再关联
+                logger.warning("后端标识使用临时密钥，重启后历史记录将无法关联")
+                key = secrets.token_bytes(32)
+            self._key = key
+        return backend_id(backend, self._key)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.check_once()
+            except Exception as e:
+                logger.error(f"SOCKS5后端健康检查失败: {e}")
+            self._stop_event.wait(self.interval)
+
+    def collect(self):
+        """去重后的后端 {后端: [端口]}"""
+        backends = {}
+        for record in service_registry.snapshot():
+            backend = backend_of(record)
+            if backend is not None:
+                backends.setdefault(backend, []).append(str(record['port']))
+        return backends
+
+    def check_once(self):
+        """探测所有后端一次，返回探测的后端数"""
+        start = time.time()
+        backends = self.collect()
+        targets = [{'backend': backend, 'server': backend[0], 'port': backend[1],
+                    'user': backend[2], 'password': backend[3]} for backend in backends]
+        results = run_probes(targets, probe=partial(probe_socks5, dest=self.dest),
+                             concurrency=self.concurrency, timeout=self.timeout,
+                             deadline=max(self.timeout, self.interval))
+
+        checked_at = time.time()
+        rows = []
+        with self._lock:
+            # 不再被任何服务使用的后端
+            for backend in [b for b in self._backends if b not in backends]:
+                del self._backends[backend]
+            for target, result in results:
+                backend = target['backend']
+                state = self._backends.setdefault(backend, {
+                    'latest': None, 'failures': 0, 'recent': deque(maxlen=RECENT_SIZE)})
+                state['latest'] = dict(result, checked_at=checked_at)
+                state['failures'] = 0 if result['success'] else state['failures'] + 1
+                state['recent'].append((result['success'], result['auth_failed']))
+                state['ports'] = backends[backend]
+                rows.append((self.backend_id(backend), int(result['success']), int(result['auth_failed']),
+                             result['latency'] if result['success'] else None,
+                             result['stage'], result['message'], checked_at))
+                if not result['success'] and state['failures'] == 1:
+                    logger.warning(f"SOCKS5后端 {backend_name(backend)} 不可用: {result['message']}")
+
+        self._flush(rows)
+        self.check_count += 1
+        self.last_check = checked_at
+        self.last_duration_ms = round((time.time() - start) * 1000, 2)
+        return len(targets)
+
+    def _flush(self, rows):
+        """写入检查历史"""
+        if not rows or not self.db_path:
+            return
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                conn.executemany('''
+                    INSERT INTO backend_health (
+                        backend, success, auth_failed, latency, stage, message, checked_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+        finally:
+            conn.close()
+
+    def _summary(self, backend, state):
+        latest = state['latest']
+        recent = state['recent']
+        return {
+            'id': self.backend_id(backend),
+            'backend': backend_name(backend),
+            'success': latest['success'],
+            'latency': latest['latency'],
+            'stage': latest['stage'],
+            'message': latest['message'],
+            'auth_failed': latest['auth_failed'],
+            'checked_at': latest['checked_at'],
+            'failures': state['failures'],
+            'availability': round(sum(1 for ok, _ in recent if ok) * 100 / len(recent), 1),
+            'auth_failures': sum(1 for _, auth_failed in recent if auth_failed),
+            'ports': list(state.get('ports', []))
+        }
+
+    def for_service(self, record):
+        """服务所用后端的最新检查结果，尚未检查过时返回None"""
+        backend = backend_of(record)
+        with self._lock:
+            state = self._backends.get(backend)
+            if state is None or state['latest'] is None:
+                return None
+            return self._summary(backend, state)
+
+    def get_stats(self):
+        """所有后端的最新结果与检查统计"""
+        with self._lock:
+            backends = [self._summary(backend, state) for backend, state in self._backends.items()
+                        if state['latest'] is not None]
+        backends.sort(key=lambda b: (b['success'], b['backend']))
+        return {
+            'interval': self.interval,
+            'timeout': self.timeout,
+            'check_count': self.check_count,
+            'last_check': self.last_check,
+            'last_duration_ms': self.last_duration_ms,
+            'backends': backends
+        }
+
+    def history(self, conn, backend, since=None, limit=MAX_HISTORY):
+        """后端的检查历史 (按时间倒序)，backend 为 get_stats() 中的 id"""
+        since = time.time() - HISTORY_RETENTION_DAYS * 86400 if since is None else since
+        rows = conn.execute('''
+            SELECT success, auth_failed, latency, stage, message, checked_at
+            FROM backend_health
+            WHERE backend = ? AND checked_at >= ?
+            ORDER BY checked_at DESC
+            LIMIT ?
+        ''', (backend, since, max(1, min(limit, MAX_HISTORY)))).fetchall()
+        return [{
+            'success': bool(row[0]),
+            'auth_failed': bool(row[1]),
+            'latency': row[2],
+            'stage': row[3],
+            'message': row[4],
+            'checked_at': row[5]
+        } for row in rows]
+
+    def prune(self, conn, days=HISTORY_RETENTION_DAYS):
+        """删除过期的检查历史，返回删除的行数"""
+        cursor = conn.execute('DELETE FROM backend_health WHERE checked_at < ?',
+                              (time.time() - days * 86400,))
+        return cursor.rowcount
+
+
+# 创建全局实例
+backend_health = BackendHealth()
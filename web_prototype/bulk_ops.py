@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量服务操作模块 - 限制并发数的批量启动/停止/重启，重启支持滚动方式
+"""
+
+import os
+import sys
+import math
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from process_scanner import process_scanner
+from xray_supervisor import xray_supervisor
+
+logger = logging.getLogger(__name__)
+
+BULK_ACTIONS = {
+    'start': '启动',
+    'stop': '停止',
+    'restart': '重启'
+}
+DEFAULT_CONCURRENCY = 8
+MAX_CONCURRENCY = 64
+
+
+def parse_max_unavailable(value, total):
+    """解析 max_unavailable：整数或百分比 (如 "25%"，按运行中服务数计算)，至少为1
+
+    格式无效时抛出 ValueError。
+    """
+    if isinstance(value, str) and value.strip().endswith('%'):
+        percent = float(value.strip()[:-1])
+        if not 0 < percent <= 100:
+            raise ValueError(f'百分比必须在 0~100 之间: {value}')
+        return max(1, math.floor(total * percent / 100))
+    count = int(value)
+    if count < 1:
+        raise ValueError(f'max_unavailable 必须不小于1: {value}')
+    return count
+
+
+class BulkRunner:
+    """批量服务操作
+
+    - 最多 concurrency 个端口同时执行
+    - 重启时最多 max_unavailable 个运行中的服务同时处于停止状态 (滚动重启)，
+      可以是数量或百分比；未运行的服务重启即启动，不占用该名额
+    - 失败数超过 max_failures 后不再开始新的端口，剩余端口记为 skipped
+    返回每个端口的结果与耗时，以及整体汇总。
+    """
+
+    def __init__(self, actions=None, concurrency=DEFAULT_CONCURRENCY):
+        # 动作 -> 执行函数，返回 {'success', 'message', ...}
+        self.actions = actions or {
+            'start': xray_supervisor.start,
+            'stop': xray_supervisor.stop,
+            'restart': xray_supervisor.restart
+        }
+        self.concurrency = concurrency
+
+    def run(self, action, ports, concurrency=None, max_unavailable=None, max_failures=None,
+            running=None, progress=None):
+        """执行批量操作
+
+        running: 当前运行中的端口集合，为None时扫描进程获得
+        progress: progress(已完成数, 总数, 端口结果) 回调
+        """
+        if action not in self.actions:
+            raise ValueError(f'不支持的批量操作: {action}')
+
+        ports = list(dict.fromkeys(str(port) for port in ports))
+        concurrency = max(1, min(int(concurrency or self.concurrency), MAX_CONCURRENCY))
+        if running is None:
+            states = process_scanner.states({port: None for port in ports}, force=True)
+            running = {port for port, state in states.items() if state['status'] == 'running'}
+        running = {str(port) for port in running}
+
+        rolling = action == 'restart' and max_unavailable is not None
+        if rolling:
+            max_unavailable = parse_max_unavailable(max_unavailable, len(running & set(ports)))
+        slots = threading.BoundedSemaphore(max_unavailable) if rolling else None
+
+        lock = threading.Lock()
+        counters = {'done': 0, 'failed': 0}
+        results = {}
+        begin = time.time()
+
+        def aborted():
+            with lock:
+                return max_failures is not None and counters['failed'] > max_failures
+
+        def execute(port):
+            # 只有运行中的服务重启会造成不可用
+            slot = slots if rolling and port in running else None
+            acquired = False
+            try:
+                if slot and not aborted():
+                    slot.acquire()
+                    acquired = True
+                # 等待名额期间其他端口可能已失败过多，因此取得名额后再检查一次；
+                # 失败计数在释放名额之前更新，等待中的端口能看到本次失败
+                if aborted():
+                    result = {'port': port, 'success': False, 'skipped': True,
+                              'message': '失败过多，已跳过', 'elapsed': 0}
+                else:
+                    result = self._execute(action, port)
+
+                with lock:
+                    counters['done'] += 1
+                    if not result['success'] and not result.get('skipped'):
+                        counters['failed'] += 1
+                    results[port] = result
+                    done = counters['done']
+            finally:
+                if acquired:
+                    slot.release()
+            if progress:
+                progress(done, len(ports), result)
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bulk') as executor:
+            list(executor.map(execute, ports))
+
+        ordered = [results[port] for port in ports]
+        skipped = sum(1 for r in ordered if r.get('skipped'))
+        summary = {
+            'action': action,
+            'total': len(ports),
+            'succeeded': sum(1 for r in ordered if r['success']),
+            'failed': counters['failed'],
+            'skipped': skipped,
+            'concurrency': concurrency,
+            'max_unavailable': max_unavailable if rolling else None,
+            'elapsed': round(time.time() - begin, 3),
+            'results': ordered
+        }
+        logger.info(f"批量{BULK_ACTIONS[action]}完成: {summary['succeeded']}/{summary['total']} 成功, "
+                    f"{summary['failed']} 失败, {skipped} 跳过, 耗时 {summary['elapsed']}秒")
+        return summary
+
+    def _execute(self, action, port):
+        begin = time.time()
+        try:
+            outcome = self.actions[action](port)
+        except Exception as e:
+            logger.error(f"批量{BULK_ACTIONS[action]}端口 {port} 失败: {e}")
+            outcome = {'success': False, 'message': str(e)}
+        result = {
+            'port': port,
+            'success': bool(outcome.get('success')),
+            'message': outcome.get('message', ''),
+            'elapsed': round(time.time() - begin, 3)
+        }
+        for key in ('startup_ms', 'shutdown_ms'):
+            if outcome.get(key) is not None:
+                result[key] = outcome[key]
+        return result
+
+
+# 创建全局实例
+bulk_runner = BulkRunner()
+
+if __name__ == "__main__":
+    # 命令行入口，供Shell脚本的 restart_all 等调用:
+    #   bulk_ops.py <start|stop|restart> [端口...] [--concurrency N] [--max-unavailable N|N%]
+    # 不指定端口时操作服务目录下的所有服务
+    import argparse
+
+    parser = argparse.ArgumentParser(description='批量启动/停止/重启服务')
+    parser.add_argument('action', choices=sorted(BULK_ACTIONS))
+    parser.add_argument('ports', nargs='*')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--max-unavailable', default=None, help='数量或百分比，如 2 或 25%%')
+    parser.add_argument('--max-failures', type=int, default=None)
+    parser.add_argument('--service-dir', default=os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'services'))
+    parser.add_argument('--xray-bin', default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    xray_supervisor.configure(
+        service_dir=args.service_dir,
+        xray_bin=args.xray_bin or os.path.join(os.path.dirname(os.path.dirname(args.service_dir)), 'xray'),
+        mode=os.environ.get('XRAY_RUNTIME_MODE', 'process')
+    )
+    ports = args.ports or sorted(
+        (name for name in os.listdir(args.service_dir)
+         if name.isdigit() and os.path.isdir(os.path.join(args.service_dir, name))),
+        key=int
+    )
+
+    def report(done, total, result):
+        status = '成功' if result['success'] else '跳过' if result.get('skipped') else '失败'
+        print(f"[{done}/{total}] 端口 {result['port']} {status} ({result['elapsed']}秒) {result['message']}")
+
+    summary = bulk_runner.run(args.action, ports, concurrency=args.concurrency,
+                              max_unavailable=args.max_unavailable,
+                              max_failures=args.max_failures, progress=report)
+    print(f"共 {summary['total']} 个服务: {summary['succeeded']} 成功, {summary['failed']} 失败, "
+          f"{summary['skipped']} 跳过, 耗时 {summary['elapsed']}秒")
+    sys.exit(0 if summary['failed'] == 0 else 1)
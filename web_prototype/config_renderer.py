@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+配置生成模块 - 渲染并校验Xray服务配置，原子写入；Web应用与Shell脚本共用
+
+命令行用法 (Shell脚本的 generate_config 调用):
+    python3 config_renderer.py generate <服务目录> <端口> <密码> <SOCKS5地址> <SOCKS5端口> [用户名] [密码]
+    python3 config_renderer.py validate <config.json>
+    python3 config_renderer.py bench [数量]
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+import logging
+
+from xray_stats import INBOUND_TAG, OUTBOUND_TAG, API_TAG, API_SERVICES, allocate_api_port
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILE = 'config.json'
+
+# 新服务的加密方式 (与Shell脚本一致)；重新生成时沿用现有配置中的加密方式
+DEFAULT_METHOD = 'aes-256-gcm'
+
+SS_METHODS = (
+    'aes-128-gcm', 'aes-256-gcm', 'chacha20-poly1305', 'chacha20-ietf-poly1305',
+    'xchacha20-poly1305', 'xchacha20-ietf-poly1305',
+    '2022-blake3-aes-128-gcm', '2022-blake3-aes-256-gcm', '2022-blake3-chacha20-poly1305'
+)
+
+# SO_REUSEPORT (Linux: SOL_SOCKET=1, SO_REUSEPORT=15)，平滑重启时新旧进程同时监听同一端口
+REUSEPORT_SOCKOPT = {'system': 'linux', 'type': 'int', 'level': '1', 'opt': '15', 'value': '1'}
+
+# ---- 配置结构 ----
+# 每个节点: type 类型，required 必需字段，properties 字段结构，items 列表元素结构，
+# enum 可选值，min/max 数值范围，min_items/min_length 最小长度
+
+_PORT = {'type': int, 'min': 1, 'max': 65535}
+_TAG = {'type': str, 'min_length': 1}
+
+PROTOCOL_SETTINGS = {
+    'shadowsocks': {
+        'type': dict,
+        'required': ['method', 'password'],
+        'properties': {
+            'method': {'type': str, 'enum': SS_METHODS},
+            'password': {'type': str, 'min_length': 1},
+            'network': {'type': str, 'enum': ('tcp', 'udp', 'tcp,udp')}
+        }
+    },
+    'socks': {
+        'type': dict,
+        'required': ['servers'],
+        'properties': {
+            'servers': {
+                'type': list,
+                'min_items': 1,
+                'items': {
+                    'type': dict,
+                    'required': ['address', 'port'],
+                    'properties': {
+                        'address': {'type': str, 'min_length': 1},
+                        'port': _PORT,
+                        'users': {
+                            'type': list,
+                            'items': {
+                                'type': dict,
+                                'required': ['user', 'pass'],
+                                'properties': {'user': {'type': str}, 'pass': {'type': str}}
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    },
+    'dokodemo-door': {
+        'type': dict,
+        'required': ['address'],
+        'properties': {'address': {'type': str, 'min_length': 1}}
+    }
+}
+
+CONFIG_SCHEMA = {
+    'type': dict,
+    'required': ['inbounds', 'outbounds'],
+    'properties': {
+        'log': {'type': dict},
+        'stats': {'type': dict},
+        'api': {
+            'type': dict,
+            'required': ['tag', 'services'],
+            'properties': {'tag': _TAG, 'services': {'type': list, 'items': {'type': str}}}
+        },
+        'policy': {'type': dict},
+        'inbounds': {
+            'type': list,
+            'min_items': 1,
+            'items': {
+                'type': dict,
+                'required': ['port', 'protocol'],
+                'properties': {
+                    'tag': _TAG,
+                    'listen': {'type': str},
+                    'port': _PORT,
+                    'protocol': {'type': str, 'enum': ('shadowsocks', 'dokodemo-door')},
+                    'settings': {'type': dict},
+                    'streamSettings': {'type': dict}
+                }
+            }
+        },
+        'outbounds': {
+            'type': list,
+            'min_items': 1,
+            'items': {
+                'type': dict,
+                'required': ['protocol'],
+                'properties': {
+                    'tag': _TAG,
+                    'protocol': {'type': str, 'enum': ('socks', 'freedom', 'blackhole')},
+                    'settings': {'type': dict},
+                    'streamSettings': {'type': dict}
+                }
+            }
+        },
+        'routing': {
+            'type': dict,
+            'properties': {
+                'rules': {
+                    'type': list,
+                    'items': {
+                        'type': dict,
+                        'required': ['type', 'outboundTag'],
+                        'properties': {
+                            'type': {'type': str, 'enum': ('field',)},
+                            'outboundTag': _TAG,
+                            'inboundTag': {'type': list, 'items': _TAG},
+                            'domain': {'type': list, 'items': {'type': str}}
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+
+_TYPE_NAMES = {dict: '对象', list: '数组', str: '字符串', int: '整数'}
+
+
+def check_schema(value, schema, path='config'):
+    """按结构定义检查值，返回错误列表"""
+    expected = schema['type']
+    # bool 是 int 的子类，端口等整数字段不能接受true/false
+    if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+        return [f'{path}: 应为{_TYPE_NAMES[expected]}']
+
+    errors = []
+    if 'enum' in schema and value not in schema['enum']:
+        errors.append(f"{path}: 不支持的值 {value!r}")
+    if 'min' in schema and value < schema['min'] or 'max' in schema and value > schema['max']:
+        errors.append(f"{path}: 超出范围 {schema.get('min')}-{schema.get('max')}")
+    if 'min_length' in schema and len(value) < schema['min_length']:
+        errors.append(f'{path}: 不能为空')
+    if 'min_items' in schema and len(value) < schema['min_items']:
+        errors.append(f"{path}: 至少需要 {schema['min_items']} 项")
+
+    if expected is dict:
+        for key in schema.get('required', ()):
+            if key not in value:
+                errors.append(f'{path}.{key}: 缺少字段')
+        for key, child in schema.get('properties', {}).items():
+            if key in value:
+                errors.extend(check_schema(value[key], child, f'{path}.{key}'))
+    elif expected is list and 'items' in schema:
+        for i, item in enumerate(value):
+            errors.extend(check_schema(item, schema['items'], f'{path}[{i}]'))
+    return errors
+
+
+def validate(config, port=None):
+    """校验配置结构与各协议的settings，port 指定时检查shadowsocks入站端口，返回错误信息或None"""
+    errors = check_schema(config, CONFIG_SCHEMA)
+    if errors:
+        return '; '.join(errors)
+
+    for kind in ('inbounds', 'outbounds'):
+        for i, bound in enumerate(config[kind]):
+            schema = PROTOCOL_SETTINGS.get(bound['protocol'])
+            if schema:
+                errors.extend(check_schema(bound.get('settings'), schema, f'config.{kind}[{i}].settings'))
+
+    ss_inbounds = [i for i in config['inbounds'] if i['protocol'] == 'shadowsocks']
+    if not ss_inbounds:
+        errors.append('config.inbounds: 缺少shadowsocks入站')
+    elif port is not None and ss_inbounds[0]['port'] != int(port):
+        errors.append(f"config.inbounds: 入站端口 {ss_inbounds[0]['port']} 与服务端口 {port} 不一致")
+
+    tags = [b['tag'] for kind in ('inbounds', 'outbounds') for b in config[kind] if 'tag' in b]
+    duplicated = sorted({t for t in tags if tags.count(t) > 1})
+    if duplicated:
+        errors.append(f"config: 标签重复 {', '.join(duplicated)}")
+    return '; '.join(errors) or None
+
+
+def _sockopt(reuseport=False):
+    sockopt = {'tcpKeepAlive': True, 'tcpNoDelay': True}
+    if reuseport:
+        sockopt['customSockopt'] = [dict(REUSEPORT_SOCKOPT)]
+    return {'sockopt': sockopt}
+
+
+def render(port, password, socks_ip, socks_port, socks_user='', socks_pass='', api_port=None,
+           method=DEFAULT_METHOD):
+    """渲染服务配置：shadowsocks入站 -> SOCKS5出站，api_port 不为空时启用流量统计与在线配置API"""
+    server = {'address': socks_ip, 'port': int(socks_port)}
+    # 只有在有用户名和密码时才添加认证信息
+    if socks_user and socks_pass:
+        server['users'] = [{'user': socks_user, 'pass': socks_pass}]
+
+    config = {'log': {'loglevel': 'warning', 'access': '', 'error': ''}}
+    inbounds = [{
+        'tag': INBOUND_TAG,
+        'port': int(port),
+        'protocol': 'shadowsocks',
+        'settings': {'method': method, 'password': password, 'network': 'tcp,udp'},
+        'streamSettings': _sockopt(reuseport=True)
+    }]
+    rules = [{'type': 'field', 'outboundTag': 'direct', 'domain': ['localhost', '127.0.0.1']}]
+
+    if api_port:
+        config['stats'] = {}
+        config['api'] = {'tag': API_TAG, 'services': list(API_SERVICES)}
+        config['policy'] = {
+            'levels': {'0': {'statsUserUplink': False, 'statsUserDownlink': False}},
+            'system': {
+                'statsInboundUplink': True,
+                'statsInboundDownlink': True,
+                'statsOutboundUplink': True,
+                'statsOutboundDownlink': True
+            }
+        }
+        inbounds.append({
+            'tag': API_TAG,
+            'listen': '127.0.0.1',
+            'port': int(api_port),
+            'protocol': 'dokodemo-door',
+            'settings': {'address': '127.0.0.1'}
+        })
+        rules.insert(0, {'type': 'field', 'inboundTag': [API_TAG], 'outboundTag': API_TAG})
+
+    config['inbounds'] = inbounds
+    config['outbounds'] = [
+        {
+            'tag': OUTBOUND_TAG,
+            'protocol': 'socks',
+            'settings': {'servers': [server]},
+            'streamSettings': _sockopt()
+        },
+        {'protocol': 'freedom', 'tag': 'direct'}
+    ]
+    config['routing'] = {'rules': rules}
+    return config
+
+
+def enable_reuseport(config):
+    """为已有配置的shadowsocks入站开启SO_REUSEPORT，返回是否修改了配置"""
+    changed = False
+    for inbound in config.get('inbounds', []):
+        if not isinstance(inbound, dict) or inbound.get('protocol') != 'shadowsocks':
+            continue
+        sockopt = inbound.setdefault('streamSettings', {}).setdefault('sockopt', {})
+        custom = sockopt.setdefault('customSockopt', [])
+        if not any(o.get('level') == '1' and o.get('opt') == '15' for o in custom):
+            custom.append(dict(REUSEPORT_SOCKOPT))
+            changed = True
+    return changed
+
+
+def dumps(config):
+    """序列化为写入文件的字节 (格式固定，相同配置得到相同字节)"""
+    return (json.dumps(config, indent=4, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def write_file(path, data):
+    """原子写入：临时文件 + fsync + rename，内容与现有文件相同时不写入，返回是否写入"""
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_file = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+    except BaseException:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+        raise
+
+    # rename 本身也需要落盘
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    return True
+
+
+def write_config(path, config, port=None):
+    """校验后原子写入配置，返回 (是否写入, 错误信息)"""
+    error = validate(config, port)
+    if error:
+        return False, error
+    return write_file(path, dumps(config)), None
+
+
+def current_method(config_file):
+    """现有配置中shadowsocks入站的加密方式，没有时返回None"""
+    try:
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+        for inbound in config.get('inbounds', []):
+            if inbound.get('protocol') == 'shadowsocks':
+                return inbound['settings']['method']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def generate(service_dir, port, password, socks_ip, socks_port, socks_user='', socks_pass='', method=None):
+    """生成服务的config.json
+
+    method 未指定时沿用现有配置的加密方式 (避免客户端失效)，新服务使用 DEFAULT_METHOD。
+    返回 {'success', 'message', 'changed', 'path'}；配置未变化时不写入文件。
+    """
+    port = str(port)
+    config_file = os.path.join(service_dir, port, CONFIG_FILE)
+    try:
+        socks_port = int(socks_port)
+        os.makedirs(os.path.dirname(config_file), exist_ok=True)
+        config = render(port, password, socks_ip, socks_port, socks_user, socks_pass,
+                        api_port=allocate_api_port(service_dir, port),
+                        method=method or current_method(config_file) or DEFAULT_METHOD)
+        changed, error = write_config(config_file, config, port)
+    except (OSError, ValueError, RuntimeError) as e:
+        logger.error(f"生成端口 {port} 配置失败: {e}")
+        return {'success': False, 'message': f'生成配置失败: {e}', 'changed': False, 'path': config_file}
+
+    if error:
+        return {'success': False, 'message': f'配置无效: {error}', 'changed': False, 'path': config_file}
+    message = f'配置文件已生成: {config_file}' if changed else '配置未变化，未写入'
+    return {'success': True, 'message': message, 'changed': changed, 'path': config_file}
+
+
+def _bench(count):
+    """渲染/校验/写入 count 个配置的耗时"""
+    with tempfile.TemporaryDirectory() as service_dir:
+        ports = range(20000, 20000 + count)
+
+        start = time.perf_counter()
+        configs = [render(p, 'password', '10.0.0.1', 1080, 'user', 'pass', api_port=62000 + i)
+                   for i, p in enumerate(ports)]
+        rendered = time.perf_counter()
+        errors = sum(1 for p, c in zip(ports, configs) if validate(c, p))
+        validated = time.perf_counter()
+        data = [dumps(c) for c in configs]
+        dumped = time.perf_counter()
+        for p, d in zip(ports, data):
+            os.mkdir(os.path.join(service_dir, str(p)))
+            write_file(os.path.join(service_dir, str(p), CONFIG_FILE), d)
+        written = time.perf_counter()
+        skipped = sum(1 for p, d in zip(ports, data)
+                      if not write_file(os.path.join(service_dir, str(p), CONFIG_FILE), d))
+        rewritten = time.perf_counter()
+
+    print(f'配置数量: {count}，校验错误: {errors}')
+    print(f'渲染: {(rendered - start) * 1000:.1f}ms')
+    print(f'校验: {(validated - rendered) * 1000:.1f}ms')
+    print(f'序列化: {(dumped - validated) * 1000:.1f}ms')
+    print(f'写入 (fsync): {(written - dumped) * 1000:.1f}ms')
+    print(f'相同内容跳过写入: {(rewritten - written) * 1000:.1f}ms ({skipped} 个)')
+
+
+def main(argv):
+    if len(argv) >= 6 and argv[0] == 'generate':
+        result = generate(*argv[1:8])
+        print(result['message'], file=sys.stdout if result['success'] else sys.stderr)
+        return 0 if result['success'] else 1
+
+    if len(argv) == 2 and argv[0] == 'validate':
+        try:
+            with open(argv[1], 'r') as f:
+                error = validate(json.load(f))
+        except (OSError, ValueError) as e:
+            error = f'无法读取配置: {e}'
+        print(error or '配置有效', file=sys.stderr if error else sys.stdout)
+        return 1 if error else 0
+
+    if argv and argv[0] == 'bench':
+        _bench(int(argv[1]) if len(argv) > 1 else 1000)
+        return 0
+
+    print(__doc__.strip().split('\n', 2)[2], file=sys.stderr)
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,786 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+合并运行模块 - 多个服务共用一个Xray进程，每个服务一个入站并按标签路由到自己的出站
+"""
+
+import os
+import re
+import json
+import time
+import threading
+import subprocess
+import logging
+
+from process_scanner import process_scanner
+from readiness import ProcessHandle, is_listening, wait_for_listen
+from xray_handler import HandlerError
+from xray_stats import INBOUND_TAG, API_TAG, API_PORT_BASE, enable_stats
+
+logger = logging.getLogger(__name__)
+
+# 运行模式：每个服务一个Xray进程 / 所有服务共用一个Xray进程
+PROCESS_MODE = 'process'
+CONSOLIDATED_MODE = 'consolidated'
+RUNTIME_MODES = (PROCESS_MODE, CONSOLIDATED_MODE)
+
+CONFIG_FILE = 'consolidated.json'
+MEMBERS_FILE = 'members.json'
+PID_FILE = 'xray.pid'
+LOG_FILE = 'xray.log'
+
+# 共用进程的API端口，位于各服务API端口范围之外
+DEFAULT_API_PORT = API_PORT_BASE - 1
+# 未匹配任何服务的流量丢弃
+BLOCK_TAG = 'block'
+# 等待所有入站监听的时间随服务数增加
+READY_TIMEOUT_PER_SERVICE = 0.01
+
+INBOUND_TAG_PATTERN = re.compile(rf'^{INBOUND_TAG}-(\d+)$')
+
+
+def inbound_tag(port):
+    """服务在共用进程中的入站标签"""
+    return f'{INBOUND_TAG}-{port}'
+
+
+def service_entries(port, config):
+    """服务在共用进程中的 (入站, 出站列表, 路由规则列表)
+
+    shadowsocks入站标签改为 ss-in-<端口>，出站标签加上 -<端口> 后缀；服务
+    自己的路由规则限定为该入站，最后一条规则把该入站的其余流量交给服务的
+    第一个出站 (即单独运行时的默认出站)。每条规则带ruleTag，可单独删除。
+    """
+    tag = inbound_tag(port)
+    inbound = next(i for i in config['inbounds'] if i.get('protocol') == 'shadowsocks')
+
+    outbounds = []
+    renamed = {}
+    for index, outbound in enumerate(config['outbounds']):
+        new_tag = f"{outbound.get('tag') or f'out{index}'}-{port}"
+        if outbound.get('tag'):
+            renamed[outbound['tag']] = new_tag
+        outbounds.append(dict(outbound, tag=new_tag))
+
+    rules = []
+    for rule in (config.get('routing') or {}).get('rules', []):
+        if API_TAG in (rule.get('inboundTag') or []) or rule.get('outboundTag') not in renamed:
+            continue
+        rules.append(dict(rule, inboundTag=[tag], outboundTag=renamed[rule['outboundTag']]))
+    rules.append({'type': 'field', 'inboundTag': [tag], 'outboundTag': outbounds[0]['tag']})
+    for index, rule in enumerate(rules):
+        rule['ruleTag'] = f'{tag}-r{index}'
+
+    return dict(inbound, tag=tag), outbounds, rules
+
+
+def merge_configs(configs, api_port):
+    """把多个服务的config.json合并为一个Xray配置
+
+    configs: {端口: 已校验的配置}，每个服务的条目见 service_entries()。
+    各服务的API入站不再保留，统一使用一个API入站。
+    """
+    merged = {
+        'log': {'loglevel': 'warning'},
+        'inbounds': [],
+        'outbounds': [{'tag': BLOCK_TAG, 'protocol': 'blackhole'}],
+        'routing': {'rules': []}
+    }
+    for port in sorted(configs, key=int):
+        inbound, outbounds, rules = service_entries(port, configs[port])
+        merged['inbounds'].append(inbound)
+        merged['outbounds'].extend(outbounds)
+        merged['routing']['rules'].extend(rules)
+    return enable_stats(merged, api_port)
+
+
+def port_tags(merged, port):
+    """合并配置中属于该服务的 (入站标签, 出站标签列表, 规则标签列表)"""
+    tag = inbound_tag(port)
+    suffix = f'-{port}'
+    outbounds = [o['tag'] for o in merged.get('outbounds', []) if str(o.get('tag', '')).endswith(suffix)]
+    rules = [r['ruleTag'] for r in (merged.get('routing') or {}).get('rules', [])
+             if r.get('inboundTag') == [tag] and r.get('ruleTag')]
+    return tag, outbounds, rules
+
+
+def process_usage(pid):
+    """读取进程的内存与资源占用 {'rss_kb', 'threads', 'fds'}，进程不存在时返回None"""
+    usage = {'rss_kb': 0, 'threads': 0, 'fds': 0}
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    usage['rss_kb'] = int(line.split()[1])
+                elif line.startswith('Threads:'):
+                    usage['threads'] = int(line.split()[1])
+        usage['fds'] = len(os.listdir(f'/proc/{pid}/fd'))
+    except (OSError, ValueError, IndexError):
+        return None
+    return usage
+
+
+class ConsolidatedRuntime:
+    """合并运行时：多个服务共用一个Xray进程
+
+    - 成员 (应运行的端口) 保存在 members.json，Web进程重启后恢复
+    - 共用进程运行时，启动/停止/重启单个服务通过Xray API在线增删该服务的
+      入站、出站与路由规则 (见 xray_handler)，其他服务的连接不受影响；
+      consolidated.json 只作为恢复用的副本随之更新
+    - 共用进程未运行或API调用失败时，按所有成员的config.json重新生成配置
+      并重启共用进程，期间所有成员短暂不可用；并发的启动/停止在重载锁上
+      排队，排到时已被前一次重载覆盖的直接返回
+    - 每个成员的 xray.pid 都写入共用进程的PID，并向进程扫描登记配置文件，
+      服务状态、流量统计与进程守护仍按端口工作
+    由 XraySupervisor 持有，复用其配置校验、进程终止与事件通知。
+    """
+
+    def __init__(self, supervisor, runtime_dir=None, api_port=DEFAULT_API_PORT):
+        self.supervisor = supervisor
+        self.runtime_dir = runtime_dir
+        self.api_port = api_port
+
+        # _lock 保护成员集合，_apply_lock 串行化进程重载
+        self._lock = threading.Lock()
+        self._apply_lock = threading.Lock()
+        self._members = None
+        self._applied = frozenset()
+        # 共用进程当前生效的配置
+        self._live = None
+        self._proc = None
+
+        # 统计
+        self.live_count = 0
+        self.reload_count = 0
+        self.last_reload_ms = None
+        self.last_error = None
+
+    def configure(self, runtime_dir=None, api_port=None):
+        """设置运行目录 (默认为服务目录旁的 runtime/) 与API端口"""
+        if runtime_dir is not None:
+            self.runtime_dir = runtime_dir
+        if api_port is not None:
+            self.api_port = api_port
+
+    def start(self, port):
+        """把服务加入共用进程"""
+        port = str(port)
+        begin = time.time()
+        if port == str(self.api_port):
+            return self._result(False, f'端口 {port} 与共用进程的API端口冲突', None, begin)
+        error = self.supervisor.check_config(port)
+        if error:
+            return self._result(False, error, None, begin)
+
+        with self._lock:
+            self._load()
+            added = port not in self._members
+        if added:
+            # 以独立进程运行的服务保持不变，下次重启时迁移
+            pid = self.supervisor._running_pid(port)
+            if pid:
+                return self._result(True, f'端口 {port} 已在运行', pid, begin)
+            if is_listening(port):
+                return self._result(False, f'端口 {port} 已被其他进程占用', None, begin)
+            with self._lock:
+                self._members.add(port)
+                self._save_members()
+
+        with self._apply_lock:
+            pid = self._running_pid()
+            if pid and port in self._applied:
+                message = f'服务端口 {port} 启动成功' if added else f'端口 {port} 已在运行'
+                return self._result(True, message, pid, begin)
+
+            if pid:
+                try:
+                    startup = self._live_add(port, pid)
+                    logger.info(f"端口 {port} 已在线加入共用Xray进程 (PID: {pid}, 就绪耗时 {startup * 1000:.1f}ms)")
+                    return self._result(True, f'服务端口 {port} 启动成功', pid, begin,
+                                        startup_ms=round(startup * 1000, 1))
+                except HandlerError as e:
+                    logger.warning(f"端口 {port} 在线加入失败，改为重新加载共用进程: {e}")
+
+            ok, error, startup, _ = self._reload()
+            if not ok and added:
+                # 去掉新加入的服务，恢复其余服务
+                with self._lock:
+                    self._members.discard(port)
+                    self._save_members()
+                    remaining = bool(self._members)
+                if remaining and not self._reload()[0]:
+                    logger.error(f"恢复共用Xray进程失败: {self.last_error}")
+            pid = self._running_pid()
+
+        startup_ms = round(startup * 1000, 1)
+        if not ok or port not in self._applied:
+            return self._result(False, error or f'端口 {port} 未能加入共用进程', None, begin,
+                                startup_ms=startup_ms)
+        logger.info(f"端口 {port} 已加入共用Xray进程 (PID: {pid}, 就绪耗时 {startup_ms}ms)")
+        return self._result(True, f'服务端口 {port} 启动成功', pid, begin, startup_ms=startup_ms)
+
+    def stop(self, port):
+        """把服务移出共用进程
+
+        只有在服务确实已不在共用进程中运行后才移除成员与PID文件，移除失败时
+        服务仍是成员，之后的启动/停止仍由共用进程处理。
+        """
+        port = str(port)
+        begin = time.time()
+        with self._lock:
+            self._load()
+
+        with self._apply_lock:
+            pid = self._running_pid() if port in self._applied else None
+            self.supervisor._notify('stopping', port, pid)
+            if port not in self._applied:
+                self.discard(port)
+                self.supervisor._remove_pid(port)
+                return self._result(True, f'服务端口 {port} 已经停止', None, begin)
+
+            if pid and self._applied - {port}:
+                try:
+                    shutdown = self._live_remove(port)
+                    self.discard(port)
+                    self.supervisor._remove_pid(port)
+                    logger.info(f"端口 {port} 已在线移出共用Xray进程 (耗时 {shutdown * 1000:.1f}ms)")
+                    return self._result(True, f'服务端口 {port} 停止成功', pid, begin,
+                                        shutdown_ms=round(shutdown * 1000, 1))
+                except HandlerError as e:
+                    logger.warning(f"端口 {port} 在线移除失败，改为重新加载共用进程: {e}")
+
+            # 按不含该服务的成员重新加载，失败且服务仍在运行时恢复成员
+            with self._lock:
+                self._members.discard(port)
+            ok, error, _, shutdown = self._reload()
+            stopped = port not in self._applied
+            with self._lock:
+                if not stopped:
+                    self._members.add(port)
+                self._save_members()
+            if stopped:
+                self.supervisor._remove_pid(port)
+            else:
+                self.supervisor._notify('started', port, pid)
+
+        shutdown_ms = round(shutdown * 1000, 1)
+        if not stopped:
+            return self._result(False, f'停止服务失败: {error}', pid, begin, shutdown_ms=shutdown_ms)
+        if not ok:
+            logger.error(f"端口 {port} 已移出共用进程，但其余服务重新加载失败: {error}")
+        logger.info(f"端口 {port} 已移出共用Xray进程 (退出耗时 {shutdown_ms}ms)")
+        return self._result(True, f'服务端口 {port} 停止成功', pid, begin, shutdown_ms=shutdown_ms)
+
+    def restart(self, port):
+        """按服务当前的config.json重新加载该服务 (配置有变化时使用)"""
+        port = str(port)
+        begin = time.time()
+        error = self.supervisor.check_config(port)
+        if error:
+            return self._result(False, error, None, begin)
+
+        with self._apply_lock:
+            pid = self._running_pid()
+            if pid and port in self._applied:
+                try:
+                    shutdown = self._live_remove(port)
+                    startup = self._live_add(port, pid)
+                    logger.info(f"端口 {port} 已在线重新加载 (PID: {pid})")
+                    return self._result(True, f'服务端口 {port} 重启成功', pid, begin,
+                                        startup_ms=round(startup * 1000, 1),
+                                        shutdown_ms=round(shutdown * 1000, 1))
+                except HandlerError as e:
+                    logger.warning(f"端口 {port} 在线重新加载失败，改为重新加载共用进程: {e}")
+
+            ok, error, startup, shutdown = self._reload()
+            pid = self._running_pid()
+        latency = {'startup_ms': round(startup * 1000, 1), 'shutdown_ms': round(shutdown * 1000, 1)}
+        if not ok or port not in self._applied:
+            return self._result(False, error or f'端口 {port} 未能加入共用进程', None, begin, **latency)
+        return self._result(True, f'服务端口 {port} 重启成功', pid, begin, **latency)
+
+    def is_member(self, port):
+        """服务是否由共用进程运行"""
+        with self._lock:
+            self._load()
+            return str(port) in self._members
+
+    def discard(self, port):
+        """移除成员但不重新加载 (服务改为独立运行时使用)"""
+        with self._lock:
+            self._load()
+            if str(port) in self._members:
+                self._members.discard(str(port))
+                self._save_members()
+
+    def members(self):
+        """所有成员端口"""
+        with self._lock:
+            self._load()
+            return sorted(self._members, key=int)
+
+    def stats_targets(self):
+        """共用进程中服务的流量统计目标 {端口: (API端口, 入站标签)}，供 traffic_poller 使用"""
+        with self._lock:
+            self._load()
+            return {port: (self.api_port, inbound_tag(port)) for port in self._applied}
+
+    def reap(self):
+        """回收已退出的共用进程，返回 {端口: 退出码}"""
+        if self._proc is None:
+            return {}
+        code = self._proc.poll()
+        if code is None:
+            return {}
+        self._proc = None
+        return {port: code for port in self._applied}
+
+    def get_stats(self):
+        """共用进程状态与资源占用"""
+        with self._lock:
+            self._load()
+            members = len(self._members)
+        pid = self._running_pid() if self._dir() else None
+        return {
+            'mode': self.supervisor.mode,
+            'members': members,
+            'running': len(self._applied) if pid else 0,
+            'pid': pid,
+            'usage': process_usage(pid) if pid else None,
+            'api_port': self.api_port,
+            'config_file': self._path(CONFIG_FILE) if self._dir() else None,
+            'live_count': self.live_count,
+            'reload_count': self.reload_count,
+            'last_reload_ms': self.last_reload_ms,
+            'last_error': self.last_error
+        }
+
+    def _live_add(self, port, pid):
+        """通过API把服务加入运行中的共用进程，返回就绪耗时秒 (调用方持有 _apply_lock)
+
+        先添加出站与路由规则，最后添加入站，入站开始接收连接时路由已就绪。
+        """
+        if self._live is None:
+            raise HandlerError('缺少共用进程当前的配置')
+        config, error = self.supervisor.load_config(port)
+        if error:
+            raise HandlerError(error)
+        inbound, outbounds, rules = service_entries(port, config)
+        handler = self.supervisor.handler
+        handler.add_outbounds(self.api_port, outbounds)
+        handler.add_rules(self.api_port, rules)
+        handler.add_inbounds(self.api_port, [inbound])
+
+        with ProcessHandle(pid) as handle:
+            ready, error, startup = wait_for_listen(port, handle, self.supervisor.ready_timeout,
+                                                    self.supervisor._backoff())
+        if not ready:
+            raise HandlerError(error)
+
+        live = self._live
+        live['inbounds'].append(inbound)
+        live['outbounds'].extend(outbounds)
+        live['routing']['rules'].extend(rules)
+        self._set_applied(self._applied | {port})
+        self._save_live()
+
+        self.supervisor._write_pid(port, pid)
+        self.supervisor._notify('started', port, pid)
+        self.live_count += 1
+        return startup
+
+    def _live_remove(self, port):
+        """通过API从运行中的共用进程移除服务，返回耗时秒 (调用方持有 _apply_lock)
+
+        先删除入站，不再接收新连接，再删除路由规则与出站。
+        """
+        begin = time.monotonic()
+        live = self._live
+        if live is None:
+            raise HandlerError('缺少共用进程当前的配置')
+        tag, outbound_tags, rule_tags = port_tags(live, port)
+        handler = self.supervisor.handler
+        handler.remove_inbounds(self.api_port, [tag])
+        handler.remove_rules(self.api_port, rule_tags)
+        handler.remove_outbounds(self.api_port, outbound_tags)
+
+        live['inbounds'] = [i for i in live['inbounds'] if i.get('tag') != tag]
+        live['outbounds'] = [o for o in live['outbounds'] if o.get('tag') not in outbound_tags]
+        live['routing']['rules'] = [r for r in live['routing']['rules'] if r.get('ruleTag') not in rule_tags]
+        self._set_applied(self._applied - {port})
+        self._save_live()
+
+        self.live_count += 1
+        return time.monotonic() - begin
+
+    def _set_applied(self, ports):
+        self._applied = frozenset(ports)
+        process_scanner.register_shared(self._path(CONFIG_FILE), sorted(self._applied))
+
+    def _save_live(self):
+        """写入共用进程当前配置的副本，共用进程重启时使用"""
+        config_file = self._path(CONFIG_FILE)
+        tmp_file = f'{config_file}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(self._live, f, indent=2)
+        os.replace(tmp_file, config_file)
+
+    def _reload(self):
+        """按当前成员重新生成配置并重启共用进程
+
+        返回 (是否成功, 错误信息, 就绪耗时秒, 旧进程退出耗时秒)。调用方持有 _apply_lock。
+        """
+        supervisor = self.supervisor
+        begin = time.monotonic()
+        with self._lock:
+            ports = sorted(self._members, key=int)
+
+        configs = {}
+        invalid = []
+        for port in ports:
+            config, error = supervisor.load_config(port)
+            if error:
+                logger.error(f"{error}，不加入共用进程")
+                invalid.append(port)
+            else:
+                configs[port] = config
+        if invalid:
+            with self._lock:
+                self._members.difference_update(invalid)
+                self._save_members()
+
+        shutdown = 0
+        old_pid = self._running_pid()
+        if old_pid:
+            # 先通知停止，重载不被当作崩溃
+            for port in self._applied:
+                supervisor._notify('stopping', port, old_pid)
+            proc = self._proc if self._proc and self._proc.pid == old_pid else None
+            with ProcessHandle(old_pid, proc) as handle:
+                exited, shutdown = supervisor._terminate(handle)
+            if not exited:
+                return self._failed(f'共用Xray进程 {old_pid} 未退出', 0, shutdown)
+        self.reap()
+        self._proc = None
+
+        for port in self._applied - set(configs):
+            supervisor._remove_pid(port)
+        config_file = self._path(CONFIG_FILE)
+        self._set_applied(())
+        self._live = None
+        if not configs:
+            self._remove(PID_FILE)
+            self.last_error = None
+            return True, None, 0, shutdown
+
+        os.makedirs(self._dir(), exist_ok=True)
+        self._live = merge_configs(configs, self.api_port)
+        self._save_live()
+        process_scanner.register_shared(config_file, list(configs))
+
+        log_file = self._path(LOG_FILE)
+        supervisor._rotate_log(log_file)
+        try:
+            with open(log_file, 'ab') as log:
+                proc = subprocess.Popen(
+                    [supervisor.xray_bin, 'run', '-config', config_file],
+                    stdin=subprocess.DEVNULL,
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                    cwd=self._dir(),
+                    start_new_session=True
+                )
+        except OSError as e:
+            self._clear(configs, config_file)
+            return self._failed(f'启动Xray失败: {e}', 0, shutdown)
+        self._proc = proc
+        self._write_pid(proc.pid)
+
+        timeout = supervisor.ready_timeout + READY_TIMEOUT_PER_SERVICE * len(configs)
+        deadline = time.monotonic() + timeout
+        with ProcessHandle(proc.pid, proc) as handle:
+            ready_begin = time.monotonic()
+            for port in configs:
+                ready, error, _ = wait_for_listen(port, handle, max(0, deadline - time.monotonic()),
+                                                  supervisor._backoff())
+                if not ready:
+                    break
+            startup = time.monotonic() - ready_begin
+            if not ready:
+                supervisor._terminate(handle)
+        if not ready:
+            self._proc = None
+            self._live = None
+            self._clear(configs, config_file)
+            return self._failed(f'{error}\n{supervisor._log_tail(log_file)}'.strip(), startup, shutdown)
+
+        self._set_applied(configs)
+        for port in configs:
+            supervisor._write_pid(port, proc.pid)
+        for port in configs:
+            supervisor._notify('started', port, proc.pid)
+
+        self.reload_count += 1
+        self.last_reload_ms = round((time.monotonic() - begin) * 1000, 1)
+        self.last_error = None
+        logger.info(f"共用Xray进程已加载 {len(configs)} 个服务 (PID: {proc.pid}, "
+                    f"就绪耗时 {startup * 1000:.1f}ms)")
+        return True, None, startup, shutdown
+
+    def _failed(self, error, startup, shutdown):
+        self.last_error = error
+        logger.error(f"共用Xray进程加载失败: {error}")
+        return False, error, startup, shutdown
+
+    def _clear(self, configs, config_file):
+        """启动失败：清除PID文件与进程扫描登记"""
+        self._remove(PID_FILE)
+        for port in configs:
+            self.supervisor._remove_pid(port)
+        process_scanner.register_shared(config_file, ())
+
+    def _running_pid(self):
+        """共用进程当前的PID (以进程扫描结果为准)"""
+        pid = self._read_pid()
+        if not pid or not self._applied:
+            return None
+        process = process_scanner.scan(force=True).get(next(iter(self._applied)))
+        return pid if process and process['pid'] == pid else None
+
+    def _load(self):
+        """首次使用时读取成员与上次生成的配置 (调用方持有 _lock)"""
+        if self._members is not None or not self._dir():
+            if self._members is None:
+                self._members = set()
+            return
+        try:
+            with open(self._path(MEMBERS_FILE), 'r') as f:
+                self._members = {str(port) for port in json.load(f)}
+        except (OSError, ValueError, TypeError):
+            self._members = set()
+
+        try:
+            with open(self._path(CONFIG_FILE), 'r') as f:
+                self._live = json.load(f)
+            applied = {match.group(1) for match in
+                       (INBOUND_TAG_PATTERN.match(str(i.get('tag', ''))) for i in self._live['inbounds'])
+                       if match}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            self._live = None
+            applied = set()
+        self._applied = frozenset(applied)
+        if applied:
+            process_scanner.register_shared(self._path(CONFIG_FILE), sorted(applied))
+
+    def _save_members(self):
+        if not self._dir():
+            return
+        os.makedirs(self._dir(), exist_ok=True)
+        members_file = self._path(MEMBERS_FILE)
+        tmp_file = f'{members_file}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(sorted(self._members, key=int), f)
+        os.replace(tmp_file, members_file)
+
+    def _dir(self):
+        if self.runtime_dir:
+            return self.runtime_dir
+        if self.supervisor.service_dir:
+            return os.path.join(os.path.dirname(os.path.abspath(self.supervisor.service_dir)), 'runtime')
+        return None
+
+    def _path(self, name):
+        return os.path.join(self._dir(), name)
+
+    def _read_pid(self):
+        try:
+            with open(self._path(PID_FILE), 'r') as f:
+                return int(f.read().strip())
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _write_pid(self, pid):
+        pid_file = self._path(PID_FILE)
+        tmp_file = f'{pid_file}.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(f'{pid}\n')
+        os.replace(tmp_file, pid_file)
+
+    def _remove(self, name):
+        try:
+            os.remove(self._path(name))
+        except (OSError, TypeError):
+            pass
+
+    def _result(self, success, message, pid, begin, **latency):
+        return self.supervisor._result(success, message, pid, begin, **latency)
+
+
+if __name__ == "__main__":
+    # 基准测试：对比独立进程与共用进程两种模式的内存占用与建立连接耗时
+    #   consolidated_runtime.py --xray-bin ../xray --counts 10,100,1000
+    # 服务使用 method=none 的shadowsocks入站 (无需加密即可测量完整链路)，
+    # 出站指向本进程内的SOCKS5回显服务；建立连接耗时为从connect()到
+    # 经过 入站 -> 路由 -> SOCKS5出站 -> 回显 收到第一个字节的时间。
+    import sys
+    import socket
+    import struct
+    import random
+    import argparse
+    import tempfile
+    import socketserver
+
+    class Socks5Echo(socketserver.BaseRequestHandler):
+        """最简SOCKS5服务：无认证，CONNECT后回显数据"""
+
+        def handle(self):
+            sock = self.request
+            try:
+                _, methods = sock.recv(2)
+                sock.recv(methods)
+                sock.sendall(b'\x05\x00')
+                _, _, _, atyp = sock.recv(4)
+                sock.recv({1: 4, 4: 16}.get(atyp) or sock.recv(1)[0])
+                sock.recv(2)
+                sock.sendall(b'\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00')
+                while True:
+                    data = sock.recv(4096)
+                    if not data:
+                        break
+                    sock.sendall(data)
+            except (OSError, ValueError, IndexError):
+                pass
+
+    class EchoServer(socketserver.ThreadingTCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+        request_queue_size = 1024
+
+    def service_config(port, backend_port):
+        return {
+            'log': {'loglevel': 'warning'},
+            'inbounds': [{'port': port, 'protocol': 'shadowsocks',
+                          'settings': {'method': 'none', 'password': 'benchmark', 'network': 'tcp'}}],
+            'outbounds': [{'tag': 'socks-out', 'protocol': 'socks',
+                           'settings': {'servers': [{'address': '127.0.0.1', 'port': backend_port}]}}]
+        }
+
+    def connect_latency(port, timeout=5.0):
+        """经过服务建立一次连接并收到回显的耗时 (毫秒)，失败返回None"""
+        begin = time.perf_counter()
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=timeout) as sock:
+                # method=none：地址头后直接是数据
+                sock.sendall(b'\x01' + socket.inet_aton('127.0.0.1') + struct.pack('!H', 7) + b'ping')
+                data = b''
+                while len(data) < 4:
+                    chunk = sock.recv(4 - len(data))
+                    if not chunk:
+                        return None
+                    data += chunk
+        except OSError:
+            return None
+        return (time.perf_counter() - begin) * 1000
+
+    def percentile(values, p):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] if values else None
+
+    def wait_ports(ports, procs, timeout):
+        deadline = time.monotonic() + timeout
+        pending = list(ports)
+        while pending and time.monotonic() < deadline:
+            if any(proc.poll() is not None for proc in procs):
+                return False
+            pending = [port for port in pending if not is_listening(port)]
+            if pending:
+                time.sleep(0.05)
+        return not pending
+
+    def run_mode(mode, xray_bin, configs, work_dir, samples, api_port):
+        commands = []
+        if mode == PROCESS_MODE:
+            for port, config in configs.items():
+                config_file = os.path.join(work_dir, str(port), 'config.json')
+                os.makedirs(os.path.dirname(config_file), exist_ok=True)
+                with open(config_file, 'w') as f:
+                    json.dump(config, f)
+                commands.append(config_file)
+        else:
+            config_file = os.path.join(work_dir, CONFIG_FILE)
+            with open(config_file, 'w') as f:
+                json.dump(merge_configs({str(p): c for p, c in configs.items()}, api_port), f)
+            commands.append(config_file)
+
+        begin = time.monotonic()
+        procs = [subprocess.Popen([xray_bin, 'run', '-config', config_file],
+                                  stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL, start_new_session=True)
+                 for config_file in commands]
+        try:
+            if not wait_ports(configs, procs, 30 + READY_TIMEOUT_PER_SERVICE * len(configs)):
+                raise RuntimeError(f'{mode} 模式的Xray未能在规定时间内全部就绪')
+            startup = time.monotonic() - begin
+            # 等待运行时初始化完成后再读取内存
+            time.sleep(2)
+            usage = [process_usage(proc.pid) or {'rss_kb': 0, 'threads': 0, 'fds': 0} for proc in procs]
+
+            ports = list(configs)
+            sampled = [random.choice(ports) for _ in range(samples)]
+            latencies = [connect_latency(port) for port in sampled]
+            succeeded = [value for value in latencies if value is not None]
+            return {
+                'processes': len(procs),
+                'rss_mb': round(sum(u['rss_kb'] for u in usage) / 1024, 1),
+                'threads': sum(u['threads'] for u in usage),
+                'fds': sum(u['fds'] for u in usage),
+                'startup_s': round(startup, 2),
+                'connect_p50_ms': round(percentile(succeeded, 50) or 0, 2),
+                'connect_p95_ms': round(percentile(succeeded, 95) or 0, 2),
+                'connect_max_ms': round(max(succeeded) if succeeded else 0, 2),
+                'errors': len(latencies) - len(succeeded)
+            }
+        finally:
+            for proc in procs:
+                try:
+                    os.killpg(proc.pid, 15)
+                except OSError:
+                    pass
+            for proc in procs:
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
+
+    parser = argparse.ArgumentParser(description='对比独立进程与共用进程运行Xray服务的资源占用')
+    parser.add_argument('--xray-bin', default=os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'xray'))
+    parser.add_argument('--counts', default='10,100,1000', help='服务数量，逗号分隔')
+    parser.add_argument('--base-port', type=int, default=40000, help='服务端口从该端口开始')
+    parser.add_argument('--samples', type=int, default=200, help='每种情况测量的连接数')
+    parser.add_argument('--modes', default=','.join(RUNTIME_MODES))
+    args = parser.parse_args()
+
+    if not os.access(args.xray_bin, os.X_OK):
+        print(f'找不到可执行的xray: {args.xray_bin}')
+        sys.exit(1)
+
+    backend = EchoServer(('127.0.0.1', 0), Socks5Echo)
+    threading.Thread(target=backend.serve_forever, daemon=True).start()
+    backend_port = backend.server_address[1]
+
+    columns = ('processes', 'rss_mb', 'threads', 'fds', 'startup_s',
+               'connect_p50_ms', 'connect_p95_ms', 'connect_max_ms', 'errors')
+    print(f"{'services':>8} {'mode':>12} " + ' '.join(f'{c:>14}' for c in columns))
+    for count in (int(c) for c in args.counts.split(',')):
+        configs = {args.base_port + i: service_config(args.base_port + i, backend_port) for i in range(count)}
+        for mode in args.modes.split(','):
+            with tempfile.TemporaryDirectory(prefix='xray-bench-') as work_dir:
+                try:
+                    row = run_mode(mode, args.xray_bin, configs, work_dir, args.samples, DEFAULT_API_PORT)
+                except RuntimeError as e:
+                    print(f'{count:>8} {mode:>12} {e}')
+                    continue
+            print(f'{count:>8} {mode:>12} ' + ' '.join(f'{row[c]:>14}' for c in columns))
+    backend.shutdown()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+事件总线模块 - 服务端推送(SSE)的内部事件分发
+"""
+
+import json
+import queue
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def format_sse(event):
+    """将事件格式化为SSE文本"""
+    data = json.dumps(event['data'], ensure_ascii=False, default=str)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+
+class EventBus:
+    """进程内事件总线
+
+    - publish() 把事件分发给所有订阅队列，慢订阅者只丢弃自己最旧的事件
+    - add_source() 注册定时数据源，由单个后台线程统一采集：
+      diff=True 的数据源按键比较，只推送变化的部分；
+      diff=False 的数据源在值变化时推送完整值
+    - 没有订阅者时后台线程空闲，不产生任何采集开销
+    """
+
+    def __init__(self, queue_size=256, tick=0.5):
+        self.queue_size = queue_size
+        self.tick = tick
+
+        self._subscribers = set()
+        self._sources = {}
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._thread = None
+        self._wakeup = threading.Event()
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def subscribe(self):
+        """订阅事件，返回事件队列"""
+        q = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.add(q)
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return q
+
+    def unsubscribe(self, q):
+        """取消订阅"""
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event_type, data):
+        """发布事件"""
+        with self._lock:
+            self._sequence += 1
+            event = {
+                'id': self._sequence,
+                'type': event_type,
+                'data': data,
+                'timestamp': time.time()
+            }
+            subscribers = list(self._subscribers)
+
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # 订阅者处理不过来时丢弃最旧的事件
+                try:
+                    q.get_nowait()
+                    q.put_nowait(event)
+                except (queue.Empty, queue.Full):
+                    pass
+        return event
+
+    def add_source(self, name, fn, interval, diff=True):
+        """注册定时数据源
+
+        diff=True 时 fn 返回 {键: 值}，推送 {'changed': {...}, 'removed': [...]}
+        """
+        with self._lock:
+            self._sources[name] = {
+                'fn': fn,
+                'interval': interval,
+                'diff': diff,
+                'state': None,
+                'next_run': 0
+            }
+
+    def snapshot(self):
+        """各数据源的当前完整状态，供新订阅者初始化"""
+        events = []
+        with self._lock:
+            sources = list(self._sources.items())
+        for name, source in sources:
+            state = source['state']
+            if state is None:
+                continue
+            if source['diff']:
+                events.append({'id': 0, 'type': name, 'data': {'changed': state, 'removed': []}})
+            else:
+                events.append({'id': 0, 'type': name, 'data': state})
+        return events
+
+    def _run(self):
+        while True:
+            if not self._subscribers:
+                # 没有订阅者：清空状态，下次有订阅者时重新推送完整数据
+                with self._lock:
+                    for source in self._sources.values():
+                        source['state'] = None
+                        source['next_run'] = 0
+                self._wakeup.clear()
+                self._wakeup.wait(5)
+                continue
+
+            now = time.monotonic()
+            with self._lock:
+                due = [(name, source) for name, source in self._sources.items()
+                       if now >= source['next_run']]
+
+            for name, source in due:
+                source['next_run'] = now + source['interval']
+                try:
+                    self._collect(name, source)
+                except Exception as e:
+                    logger.error(f"事件数据源 {name} 采集失败: {e}")
+
+            time.sleep(self.tick)
+
+    def _collect(self, name, source):
+        value = source['fn']()
+        previous = source['state']
+
+        if not source['diff']:
+            if value != previous:
+                source['state'] = value
+                self.publish(name, value)
+            return
+
+        previous = previous or {}
+        changed = {key: item for key, item in value.items() if previous.get(key) != item}
+        removed = [key for key in previous if key not in value]
+        source['state'] = value
+        if changed or removed:
+            self.publish(name, {'changed': changed, 'removed': removed})
+
+
+# 创建全局实例
+event_bus = EventBus()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务器IP解析模块 - 进程内缓存 + 并发探测外网IP
+"""
+
+import os
+import socket
+import sqlite3
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# 外网IP查询服务
+DEFAULT_PROVIDERS = [
+    "https://ifconfig.me/ip",
+    "https://ipinfo.io/ip",
+    "https://icanhazip.com",
+    "https://ident.me",
+    "https://api.ipify.org",
+    "https://checkip.amazonaws.com"
+]
+
+# 无法获取IP时的占位符 (与Shell脚本保持一致)
+FALLBACK_IP = "YOUR_SERVER_IP"
+
+# system_settings 中的手动指定IP键名
+OVERRIDE_SETTING_KEY = 'server_ip'
+
+
+def _is_valid_ipv4(ip):
+    """验证IPv4地址格式"""
+    if not ip or ip.count('.') != 3:
+        return False
+    try:
+        socket.inet_aton(ip)
+        return True
+    except OSError:
+        return False
+
+
+class ServerIPResolver:
+    """服务器公网IP解析器
+
+    - 结果按TTL缓存，过期后先返回旧值再在后台刷新
+    - 所有查询服务同时探测，取第一个有效结果
+    - 支持通过 system_settings 手动指定IP
+    - 通过缓存文件与Shell脚本的 get_server_ip 共享结果
+    """
+
+    def __init__(self, providers=None, ttl=3600, failure_ttl=60, timeout=5,
+                 override_ttl=30, cache_file=None, db_path=None):
+        self.providers = list(providers or DEFAULT_PROVIDERS)
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.timeout = timeout
+        self.override_ttl = override_ttl
+        self.cache_file = cache_file
+        self.db_path = db_path
+
+        self._ip = None
+        self._expires_at = 0
+        self._override = None
+        self._override_expires_at = 0
+        self._lock = threading.Lock()
+        self._resolve_lock = threading.Lock()
+        self._refreshing = False
+
+        # 实际执行探测的次数
+        self.resolve_count = 0
+
+    def configure(self, db_path=None, cache_file=None, providers=None, ttl=None):
+        """设置数据库路径、缓存文件等运行参数"""
+        with self._lock:
+            if db_path is not None:
+                self.db_path = db_path
+            if cache_file is not None:
+                self.cache_file = cache_file
+            if providers is not None:
+                self.providers = list(providers)
+            if ttl is not None:
+                self.ttl = ttl
+            self._override_expires_at = 0
+
+    def invalidate(self):
+        """清空缓存，下次获取时重新解析"""
+        with self._lock:
+            self._ip = None
+            self._expires_at = 0
+            self._override_expires_at = 0
+
+    def get(self):
+        """获取服务器IP (优先使用手动设置，其次缓存)"""
+        override = self._get_override()
+        if override:
+            return override
+
+        now = time.time()
+        with self._lock:
+            ip, expires_at = self._ip, self._expires_at
+
+        if ip is None:
+            ip, expires_at = self._load_cache_file()
+            if ip is not None:
+                with self._lock:
+                    if self._ip is None:
+                        self._ip, self._expires_at = ip, expires_at
+
+        if ip is not None:
+            if now >= expires_at:
+                self._refresh_async()
+            return ip
+
+        # 首次获取：同步解析，并发请求只解析一次
+        with self._resolve_lock:
+            with self._lock:
+                if self._ip is not None:
+                    return self._ip
+            return self._resolve_and_store()
+
+    def _refresh_async(self):
+        """后台刷新缓存 (同一时间只有一个刷新线程)"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def worker():
+            try:
+                with self._resolve_lock:
+                    self._resolve_and_store()
+            except Exception as e:
+                logger.error(f"后台刷新服务器IP失败: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _resolve_and_store(self):
+        """执行探测并写入缓存"""
+        ip = self.resolve()
+        now = time.time()
+
+        with self._lock:
+            if ip == FALLBACK_IP and self._ip not in (None, FALLBACK_IP):
+                # 探测失败时保留上一次成功的结果
+                self._expires_at = now + self.failure_ttl
+                return self._ip
+            self._ip = ip
+            self._expires_at = now + (self.ttl if ip != FALLBACK_IP else self.failure_ttl)
+
+        if ip != FALLBACK_IP:
+            self._write_cache_file(ip)
+        return ip
+
+    def resolve(self):
+        """并发探测所有查询服务，返回第一个有效IP"""
+        self.resolve_count += 1
+        start_time = time.time()
+
+        ip = self._probe_providers()
+        if ip:
+            logger.info(f"获取服务器IP成功: {ip} ({round((time.time() - start_time) * 1000)}ms)")
+            return ip
+
+        # 如果外网服务都失败，尝试获取本机IP
+        try:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            s.connect(("8.8.8.8", 80))
+            local_ip = s.getsockname()[0]
+            s.close()
+            if local_ip != "127.0.0.1":
+                return local_ip
+        except Exception:
+            pass
+
+        logger.warning("无法获取服务器IP")
+        return FALLBACK_IP
+
+    def _probe_providers(self):
+        """同时请求所有查询服务，取最先返回的有效结果"""
+        if not self.providers:
+            return None
+
+        def fetch(url):
+            response = requests.get(url, timeout=self.timeout)
+            if response.status_code == 200:
+                ip = response.text.strip()
+                if _is_valid_ipv4(ip):
+                    return ip
+            return None
+
+        executor = ThreadPoolExecutor(max_workers=len(self.providers))
+        try:
+            futures = [executor.submit(fetch, url) for url in self.providers]
+            for future in as_completed(futures, timeout=self.timeout + 1):
+                try:
+                    ip = future.result()
+                except Exception:
+                    continue
+                if ip:
+                    return ip
+        except Exception:
+            # as_completed 超时
+            pass
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return None
+
+    def _get_override(self):
+        """读取 system_settings 中手动指定的IP (带短时缓存)"""
+        if not self.db_path:
+            return None
+
+        now = time.time()
+        with self._lock:
+            if now < self._override_expires_at:
+                return self._override
+
+        override = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                row = conn.execute(
+                    'SELECT value FROM system_settings WHERE key = ?',
+                    (OVERRIDE_SETTING_KEY,)
+                ).fetchone()
+            finally:
+                conn.close()
+            if row and row[0] and row[0].strip():
+                override = row[0].strip()
+        except sqlite3.Error:
+            pass
+
+        with self._lock:
+            changed = override != self._override
+            self._override = override
+            self._override_expires_at = now + self.override_ttl
+
+        if override and changed:
+            self._write_cache_file(override)
+        return override
+
+    def _load_cache_file(self):
+        """读取缓存文件，返回 (ip, 过期时间)"""
+        if not self.cache_file:
+            return None, 0
+        try:
+            mtime = os.path.getmtime(self.cache_file)
+            with open(self.cache_file, 'r') as f:
+                ip = f.read().strip()
+        except OSError:
+            return None, 0
+
+        if not _is_valid_ipv4(ip):
+            return None, 0
+        return ip, mtime + self.ttl
+
+    def _write_cache_file(self, ip):
+        """原子写入缓存文件，供Shell脚本读取"""
+        if not self.cache_file:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w') as f:
+                f.write(f"{ip}\n")
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            logger.warning(f"写入服务器IP缓存文件失败: {e}")
+
+
+# 创建全局实例
+ip_resolver = ServerIPResolver()
+
+if __name__ == "__main__":
+    # 测试输出
+    print(ip_resolver.get())
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台任务队列模块 - 耗时的服务操作在固定大小的工作线程池中执行，任务持久化到SQLite
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+from collections import deque
+from contextlib import nullcontext
+from datetime import datetime
+
+from event_bus import event_bus
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+FINISHED = (SUCCEEDED, FAILED)
+
+# 已完成任务的保留天数
+JOB_RETENTION_DAYS = 7
+# Web进程重启时仍在执行的任务会重新排队，超过该次数后放弃
+MAX_ATTEMPTS = 3
+
+
+def create_tables(cursor):
+    """创建任务表"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            target TEXT,
+            params TEXT,
+            status TEXT NOT NULL DEFAULT 'queued',
+            progress INTEGER DEFAULT 0,
+            message TEXT,
+            result TEXT,
+            attempts INTEGER DEFAULT 0,
+            created_by INTEGER,
+            created_at TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)')
+
+
+class JobQueueFull(Exception):
+    """排队任务数已达上限"""
+
+
+class JobQueue:
+    """后台任务队列
+
+    - submit() 写入jobs表后立即返回，由 workers 个工作线程依次执行
+    - 同一个目标 (如服务端口) 的任务按提交顺序串行执行，不同目标并行
+    - 同一目标上尚未执行的同类任务会被合并，重复点击不会排出多个任务
+    - 进度与结果写回jobs表，并以 'job' 事件推送到事件总线
+    - start() 时把上次未完成的任务重新排队，处理函数需要是幂等的，
+      可用 checkpoint() 记录已完成的步骤 (如已分配的端口)，重试时据此继续
+    处理函数签名为 handler(job, report)，report(progress, message) 上报进度，
+    返回 {'success', 'message', ...}；抛出异常视为失败。
+    """
+
+    def __init__(self, db_path=None, workers=4, max_pending=256, context=None):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_pending = max_pending
+        # 执行处理函数时进入的上下文，如 app.app_context
+        self.context = context
+
+        self._handlers = {}
+        self._ready = deque()
+        # 目标 -> 等待该目标上当前任务完成的任务ID
+        self._waiting = {}
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self._started = False
+        self._stopping = False
+
+        # 统计
+        self.completed = 0
+        self.failed = 0
+
+    def configure(self, db_path=None, workers=None, max_pending=None, context=None):
+        """设置数据库路径、工作线程数与执行上下文"""
+        if db_path is not None:
+            self.db_path = db_path
+        if workers is not None:
+            self.workers = workers
+        if max_pending is not None:
+            self.max_pending = max_pending
+        if context is not None:
+            self.context = context
+
+    def register(self, job_type, handler):
+        """注册任务类型的处理函数"""
+        self._handlers[job_type] = handler
+
+    def start(self):
+        """恢复未完成的任务并启动工作线程"""
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+            self._stopping = False
+
+        self._recover()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"后台任务队列已启动 ({self.workers} 个工作线程)")
+
+    def stop(self, timeout=5):
+        """停止工作线程，正在执行的任务会执行完"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+        self._started = False
+
+    def submit(self, job_type, target=None, params=None, user_id=None):
+        """提交任务，返回任务信息"""
+        if job_type not in self._handlers:
+            raise ValueError(f'未知的任务类型: {job_type}')
+        target = str(target) if target is not None else None
+        if not self._started:
+            self.start()
+
+        with self._cond:
+            # 合并同一目标上尚未开始的同类任务
+            for job_id in self._waiting.get(target, ()) if target else ():
+                job = self.get(job_id)
+                if job and job['type'] == job_type and job['status'] == QUEUED:
+                    return job
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f'排队任务过多 ({self._pending})，请稍后重试')
+
+            job_id = uuid.uuid4().hex
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('''
+                        INSERT INTO jobs (id, type, target, params, status, created_by, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', (job_id, job_type, target, json.dumps(params or {}, ensure_ascii=False),
+                          QUEUED, user_id, self._now()))
+            finally:
+                conn.close()
+            self._enqueue(job_id, target)
+
+        job = self.get(job_id)
+        self._publish(job)
+        return job
+
+    def checkpoint(self, job_id, **values):
+        """把执行中得到的值合并进任务参数并立即持久化，返回合并后的参数"""
+        conn = self._connect()
+        try:
+            with conn:
+                row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+                if row is None:
+                    return None
+                params = self._to_dict(row)['params']
+                params.update(values)
+                conn.execute('UPDATE jobs SET params = ? WHERE id = ?',
+                             (json.dumps(params, ensure_ascii=False), job_id))
+        finally:
+            conn.close()
+        return params
+
+    def get(self, job_id):
+        """获取任务信息，不存在时返回None"""
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return self._to_dict(row) if row else None
+
+    def list(self, status=None, target=None, created_by=None, limit=50):
+        """最近的任务列表"""
+        conditions, params = [], []
+        if status:
+            conditions.append('status = ?')
+            params.append(status)
+        if target is not None:
+            conditions.append('target = ?')
+            params.append(str(target))
+        if created_by is not None:
+            conditions.append('created_by = ?')
+            params.append(created_by)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f'SELECT * FROM jobs {where} ORDER BY created_at DESC LIMIT ?', (*params, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [self._to_dict(row) for row in rows]
+
+    def prune(self, conn, days=JOB_RETENTION_DAYS):
+        """删除过期的已完成任务，返回删除的行数"""
+        cutoff = datetime.fromtimestamp(time.time() - days * 86400).isoformat()
+        cursor = conn.execute(
+            f"DELETE FROM jobs WHERE status IN ({','.join('?' * len(FINISHED))}) AND finished_at < ?",
+            (*FINISHED, cutoff)
+        )
+        return cursor.rowcount
+
+    def get_stats(self):
+        """队列统计"""
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'pending': self._pending,
+                'ready': len(self._ready),
+                'completed': self.completed,
+                'failed': self.failed
+            }
+
+    def _recover(self):
+        """把上次进程退出时未完成的任务重新排队"""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('''
+                    UPDATE jobs SET status = ?, finished_at = ?,
+                        message = '执行中断次数过多，已放弃'
+                    WHERE status = ? AND attempts >= ?
+                ''', (FAILED, self._now(), RUNNING, MAX_ATTEMPTS))
+                conn.execute('UPDATE jobs SET status = ? WHERE status = ?', (QUEUED, RUNNING))
+                rows = conn.execute(
+                    'SELECT id, target FROM jobs WHERE status = ? ORDER BY created_at', (QUEUED,)
+                ).fetchall()
+        finally:
+            conn.close()
+
+        with self._cond:
+            for row in rows:
+                self._enqueue(row['id'], row['target'])
+        if rows:
+            logger.info(f"已恢复 {len(rows)} 个未完成的后台任务")
+
+    def _enqueue(self, job_id, target):
+        """加入就绪队列；目标上已有任务时排在其后 (调用方持有锁)"""
+        self._pending += 1
+        if target is not None:
+            if target in self._waiting:
+                self._waiting[target].append(job_id)
+                return
+            self._waiting[target] = deque()
+        self._ready.append((job_id, target))
+        self._cond.notify()
+
+    def _release(self, target):
+        """目标上的任务完成，放行下一个 (调用方持有锁)"""
+        self._pending -= 1
+        if target is None:
+            return
+        waiting = self._waiting.get(target)
+        if waiting:
+            self._ready.append((waiting.popleft(), target))
+            self._cond.notify()
+        else:
+            self._waiting.pop(target, None)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._ready and not self._stopping:
+                    self._cond.wait()
+                if self._stopping:
+                    return
+                job_id, target = self._ready.popleft()
+            try:
+                self._execute(job_id)
+            except Exception as e:
+                logger.error(f"执行后台任务 {job_id} 失败: {e}")
+            finally:
+                with self._cond:
+                    self._release(target)
+
+    def _execute(self, job_id):
+        job = self._update(job_id, status=RUNNING, started_at=self._now(), attempts_inc=True)
+        if job is None:
+            return
+        handler = self._handlers.get(job['type'])
+
+        def report(progress, message=None):
+            self._update(job_id, progress=max(0, min(100, int(progress))), message=message)
+
+        try:
+            if handler is None:
+                raise ValueError(f"未知的任务类型: {job['type']}")
+            with self.context() if self.context else nullcontext():
+                result = handler(job, report) or {}
+            success = bool(result.get('success'))
+            message = result.get('message', '')
+        except Exception as e:
+            logger.error(f"后台任务 {job['type']} ({job['target']}) 失败: {e}")
+            result, success, message = {}, False, str(e)
+
+        with self._cond:
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+        self._update(job_id, status=SUCCEEDED if success else FAILED, progress=100,
+                     message=message, result=result, finished_at=self._now())
+
+    def _update(self, job_id, attempts_inc=False, **fields):
+        """更新任务字段并推送事件，返回更新后的任务"""
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'], ensure_ascii=False, default=str)
+        fields = {k: v for k, v in fields.items() if v is not None}
+        assignments = [f'{k} = ?' for k in fields]
+        if attempts_inc:
+            assignments.append('attempts = attempts + 1')
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(f"UPDATE jobs SET {', '.join(assignments)} WHERE id = ?",
+                             (*fields.values(), job_id))
+                row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = self._to_dict(row)
+        self._publish(job)
+        return job
+
+    def _publish(self, job):
+        data = dict(job)
+        # 参数中可能有密码等信息，不推送
+        data.pop('params', None)
+        event_bus.publish('job', data)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    @staticmethod
+    def _now():
+        return datetime.now().isoformat()
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(row)
+        for key in ('params', 'result'):
+            try:
+                job[key] = json.loads(job[key]) if job[key] else {}
+            except ValueError:
+                job[key] = {}
+        return job
+
+
+# 创建全局实例
+job_queue = JobQueue()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监控数据采集模块 - 按 monitor_interval 定时写入 monitor_data
+"""
+
+import sqlite3
+import threading
+import time
+import logging
+from datetime import datetime
+
+import psutil
+
+from socket_table import socket_table
+
+logger = logging.getLogger(__name__)
+
+# monitor_interval 的取值范围(秒)
+MIN_INTERVAL = 5
+DEFAULT_INTERVAL = 30
+
+
+class MetricsCollector:
+    """监控数据采集器
+
+    每个周期采集一行系统数据 (service_port 为空) 和每个运行中服务的一行数据，
+    在同一个事务中批量写入 monitor_data。采集周期取自 system_settings
+    中的 monitor_interval，每个周期重新读取，修改设置后无需重启。
+    """
+
+    def __init__(self, db_path=None, sampler=None, services_fn=None, traffic_fn=None):
+        self.db_path = db_path
+        self.sampler = sampler
+        # 返回 {端口: {'status', 'pid', 'connections', ...}}
+        self.services_fn = services_fn
+        # 返回 {端口: (traffic_in, traffic_out)}，单位为字节/秒
+        self.traffic_fn = traffic_fn
+
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._processes = {}
+
+        # 统计
+        self.samples_written = 0
+        self.flush_count = 0
+        self.last_flush_ms = 0
+
+        # 在写入事务内调用 listener(conn, rows)，如多级汇总
+        self.listeners = []
+
+    def configure(self, db_path=None, sampler=None, services_fn=None, traffic_fn=None):
+        """设置数据库路径与数据来源"""
+        if db_path is not None:
+            self.db_path = db_path
+        if sampler is not None:
+            self.sampler = sampler
+        if services_fn is not None:
+            self.services_fn = services_fn
+        if traffic_fn is not None:
+            self.traffic_fn = traffic_fn
+
+    def start(self):
+        """启动采集线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logger.info("监控数据采集已启动")
+
+    def stop(self):
+        """停止采集线程"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def get_interval(self):
+        """读取 system_settings 中的 monitor_interval"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                row = conn.execute(
+                    'SELECT value FROM system_settings WHERE key = ?', ('monitor_interval',)
+                ).fetchone()
+            finally:
+                conn.close()
+            if row and row[0]:
+                return max(MIN_INTERVAL, int(row[0]))
+        except (sqlite3.Error, ValueError):
+            pass
+        return DEFAULT_INTERVAL
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            interval = self.get_interval()
+            try:
+                self.collect_once()
+            except Exception as e:
+                logger.error(f"采集监控数据失败: {e}")
+            self._stop_event.wait(interval)
+
+    def collect_once(self):
+        """采集一个周期的数据并写入数据库，返回写入的行数"""
+        timestamp = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+        rows = [self._system_row(timestamp)]
+        rows.extend(self._service_rows(timestamp))
+        self._flush(rows)
+        return len(rows)
+
+    def _system_row(self, timestamp):
+        """系统整体数据：流量为网卡收发速率 (字节/秒)"""
+        sample = self.sampler.latest()
+        rates = sample['rates']
+        connections = socket_table.snapshot().total_established
+
+        return (None, sample['cpu_percent'], sample['memory_percent'], connections,
+                rates.get('net_bytes_recv_rate', 0), rates.get('net_bytes_sent_rate', 0), timestamp)
+
+    def _service_rows(self, timestamp):
+        """每个运行中服务的数据：进程CPU/内存、连接数与流量"""
+        if self.services_fn is None:
+            return []
+
+        services = self.services_fn()
+        traffic = self.traffic_fn() if self.traffic_fn else {}
+
+        rows = []
+        seen = set()
+        for port, service in services.items():
+            if service.get('status') != 'running' or not service.get('pid'):
+                continue
+            pid = service['pid']
+            seen.add(pid)
+            cpu_usage, memory_usage = self._process_usage(pid)
+            traffic_in, traffic_out = traffic.get(str(port), (0, 0))
+            rows.append((int(port), cpu_usage, memory_usage, service.get('connections', 0),
+                         traffic_in, traffic_out, timestamp))
+
+        # 清理已退出进程的缓存
+        for pid in list(self._processes):
+            if pid not in seen:
+                del self._processes[pid]
+        return rows
+
+    def _process_usage(self, pid):
+        """进程的CPU与内存使用率 (复用Process对象以计算两次采集间的CPU)"""
+        try:
+            proc = self._processes.get(pid)
+            if proc is None or not proc.is_running():
+                proc = self._processes[pid] = psutil.Process(pid)
+                proc.cpu_percent(None)
+                return 0.0, round(proc.memory_percent(), 2)
+            return round(proc.cpu_percent(None), 1), round(proc.memory_percent(), 2)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            self._processes.pop(pid, None)
+            return 0.0, 0.0
+
+    def _flush(self, rows):
+        """批量写入"""
+        if not rows:
+            return
+        start = time.time()
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                conn.executemany('''
+                    INSERT INTO monitor_data (
+                        service_port, cpu_usage, memory_usage, connections,
+                        traffic_in, traffic_out, timestamp
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+                for listener in self.listeners:
+                    listener(conn, rows)
+        finally:
+            conn.close()
+        self.samples_written += len(rows)
+        self.flush_count += 1
+        self.last_flush_ms = round((time.time() - start) * 1000, 2)
+
+
+# 创建全局实例
+metrics_collector = MetricsCollector()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监控数据汇总模块 - monitor_data 的多级时间桶汇总 (1分钟/5分钟/1小时)
+"""
+
+import calendar
+import math
+import time
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 汇总的指标，顺序与 monitor_data 的列一致
+METRICS = ('cpu_usage', 'memory_usage', 'connections', 'traffic_in', 'traffic_out')
+
+# 汇总表中系统整体数据的 service_port (monitor_data 中为 NULL)
+SYSTEM_PORT = 0
+
+# 原始数据保留天数，更长的时间范围由汇总表提供
+RAW_RETENTION_DAYS = 2
+
+# 历史查询默认/最大返回点数
+DEFAULT_POINTS = 300
+MAX_POINTS = 1000
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+class RollupTier:
+    """汇总层级
+
+    source 为 None 时由原始数据计算，否则由 source 层级的桶合并得到。
+    """
+
+    def __init__(self, name, width, retention_days, source=None):
+        self.name = name
+        self.width = width
+        self.retention_days = retention_days
+        self.source = source
+        self.table = f'monitor_rollup_{name}'
+
+
+ROLLUP_TIERS = (
+    RollupTier('1m', 60, 7),
+    RollupTier('5m', 300, 30),
+    RollupTier('1h', 3600, 365, source='5m'),
+)
+
+
+def create_tables(cursor):
+    """创建汇总表 (由 init_db 调用)"""
+    for tier in ROLLUP_TIERS:
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {tier.table} (
+                bucket INTEGER NOT NULL,
+                service_port INTEGER NOT NULL,
+                metric TEXT NOT NULL,
+                samples INTEGER NOT NULL,
+                sum REAL NOT NULL,
+                min REAL NOT NULL,
+                max REAL NOT NULL,
+                p95 REAL NOT NULL,
+                PRIMARY KEY (service_port, metric, bucket)
+            )
+        ''')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{tier.table}_bucket ON {tier.table} (bucket)')
+
+
+def to_epoch(timestamp):
+    """'YYYY-MM-DD HH:MM:SS' (UTC) -> 时间戳"""
+    return calendar.timegm(time.strptime(timestamp, TIMESTAMP_FORMAT))
+
+
+def format_epoch(epoch):
+    return datetime.utcfromtimestamp(epoch).strftime(TIMESTAMP_FORMAT)
+
+
+def summarize(values):
+    """计算一组样本的 (samples, sum, min, max, p95)，p95取最近秩"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(len(ordered) * 0.95))
+    return (len(ordered), sum(ordered), ordered[0], ordered[-1], ordered[rank - 1])
+
+
+def merge(stats):
+    """合并多个桶的统计；p95无法精确合并，取各桶p95的最大值(偏保守)"""
+    stats = list(stats)
+    return (
+        sum(s[0] for s in stats),
+        sum(s[1] for s in stats),
+        min(s[2] for s in stats),
+        max(s[3] for s in stats),
+        max(s[4] for s in stats)
+    )
+
+
+class _OpenBucket:
+    """一个层级当前尚未结束的时间桶"""
+
+    def __init__(self, start=None):
+        self.start = start
+        # (端口, 指标) -> 原始样本列表，或 {子桶起点: 统计}
+        self.series = {}
+        self.dirty = set()
+
+
+class MetricsRollup:
+    """多级汇总维护器
+
+    作为 MetricsCollector 的监听器，在写入原始样本的同一事务中增量更新
+    各层级当前桶的 min/avg/max/p95。1分钟与5分钟层级由原始样本计算，
+    1小时层级由5分钟桶合并，内存中只保留当前桶的数据。
+    """
+
+    def __init__(self, tiers=ROLLUP_TIERS):
+        self.tiers = tiers
+        self._open = {tier.name: _OpenBucket() for tier in tiers}
+        self._pending = []
+        self._restored = False
+
+        # 统计
+        self.rows_written = 0
+
+    def apply(self, conn, rows):
+        """处理一批 monitor_data 行 (service_port, cpu, mem, conn, in, out, timestamp)"""
+        if not self._restored:
+            # 本批数据已在同一事务中写入 monitor_data，恢复时排除
+            self.restore(conn, until=min(row[-1] for row in rows) if rows else None)
+        for row in rows:
+            self._feed(row)
+        self._write(conn, self._collect())
+
+    def restore(self, conn, until=None):
+        """启动时从数据库恢复当前桶，首次运行时为已有原始数据补建汇总
+
+        until: 只读取该时间之前的原始数据
+        """
+        self._restored = True
+        last_tier = self.tiers[-1]
+        has_rollups = conn.execute(f'SELECT 1 FROM {last_tier.table} LIMIT 1').fetchone()
+        if not has_rollups:
+            self.rebuild(conn, until=until)
+            return
+
+        # 重新读取当前桶内的原始数据 (最长的原始数据层级覆盖其余层级)
+        raw_width = max(tier.width for tier in self.tiers if tier.source is None)
+        now = int(time.time())
+        since = now - now % raw_width
+        for row in self._raw_rows(conn, format_epoch(since), until):
+            self._feed(row)
+
+        # 由其他层级合并的层级：读取当前桶内已结束的子桶
+        for tier in self.tiers:
+            if tier.source is None:
+                continue
+            source = self._tier(tier.source)
+            start = now - now % tier.width
+            bucket = self._open[tier.name]
+            bucket.start = start
+            for row in conn.execute(f'''
+                SELECT bucket, service_port, metric, samples, sum, min, max, p95
+                FROM {source.table}
+                WHERE bucket >= ? AND bucket < ?
+            ''', (start, since)):
+                bucket.series.setdefault((row[1], row[2]), {})[row[0]] = tuple(row[3:])
+
+        # 只恢复内存状态，数据库中已有这些汇总
+        self._collect()
+
+    def rebuild(self, conn, until=None, batch_size=5000):
+        """由 monitor_data 中的全部原始数据重建汇总"""
+        self._open = {tier.name: _OpenBucket() for tier in self.tiers}
+        count = 0
+        for row in self._raw_rows(conn, until=until):
+            self._feed(row)
+            count += 1
+            if len(self._pending) >= batch_size:
+                self._write(conn, self._pending)
+                self._pending = []
+        self._write(conn, self._collect())
+        if count:
+            logger.info(f"已由 {count} 条原始监控数据重建汇总")
+
+    def prune(self, conn, batch_size=5000):
+        """按保留期限分批删除原始数据与汇总数据，避免长时间锁表"""
+        now = int(time.time())
+        deleted = self._delete_batched(
+            conn, 'monitor_data', 'timestamp < ?',
+            format_epoch(now - RAW_RETENTION_DAYS * 86400), batch_size
+        )
+        for tier in self.tiers:
+            deleted += self._delete_batched(
+                conn, tier.table, 'bucket < ?',
+                now - tier.retention_days * 86400, batch_size
+            )
+        return deleted
+
+    def query(self, conn, hours, port=None, max_points=DEFAULT_POINTS, raw_interval=None):
+        """查询历史数据，按时间范围选择层级，返回点数不超过 max_points
+
+        返回 (分辨率名称, 每点秒数, 数据列表)
+        """
+        max_points = max(1, min(int(max_points), MAX_POINTS))
+        window = hours * 3600
+        since = int(time.time()) - window
+        service_port = SYSTEM_PORT if port is None else int(port)
+
+        # 原始数据足够稀疏时直接返回原始样本
+        if raw_interval and window / raw_interval <= max_points:
+            return 'raw', raw_interval, self._query_raw(conn, since, port, max_points)
+
+        tier = next((t for t in self.tiers if window / t.width <= max_points), self.tiers[-1])
+        # 最粗层级仍超过点数时，在查询中把相邻桶再合并
+        step = tier.width * max(1, math.ceil(window / max_points / tier.width))
+
+        series = {}
+        for row in conn.execute(f'''
+            SELECT (bucket / ?) * ? AS point, metric,
+                   SUM(samples), SUM(sum), MIN(min), MAX(max), MAX(p95)
+            FROM {tier.table}
+            WHERE service_port = ? AND bucket >= ?
+            GROUP BY point, metric
+            ORDER BY point
+        ''', (step, step, service_port, since - since % step)):
+            point, metric, samples, total, low, high, p95 = row
+            item = series.get(point)
+            if item is None:
+                item = series[point] = {'timestamp': format_epoch(point), 'stats': {}}
+            avg = round(total / samples, 2) if samples else 0
+            item[metric] = avg
+            item['stats'][metric] = {'min': low, 'avg': avg, 'max': high, 'p95': p95}
+
+        name = tier.name if step == tier.width else f'{step}s'
+        return name, step, list(series.values())[-max_points:]
+
+    def _query_raw(self, conn, since, port, max_points):
+        if port is None:
+            condition, params = 'service_port IS NULL', ()
+        else:
+            condition, params = 'service_port = ?', (int(port),)
+        rows = conn.execute(f'''
+            SELECT {', '.join(METRICS)}, timestamp
+            FROM monitor_data
+            WHERE {condition} AND timestamp >= ?
+            ORDER BY timestamp DESC
+            LIMIT ?
+        ''', params + (format_epoch(since), max_points)).fetchall()
+
+        data = []
+        for row in reversed(rows):
+            item = {'timestamp': row[-1], 'stats': {}}
+            for metric, value in zip(METRICS, row):
+                value = value or 0
+                item[metric] = value
+                item['stats'][metric] = {'min': value, 'avg': value, 'max': value, 'p95': value}
+            data.append(item)
+        return data
+
+    def _tier(self, name):
+        return next(tier for tier in self.tiers if tier.name == name)
+
+    def _raw_rows(self, conn, since=None, until=None):
+        conditions, params = [], []
+        if since:
+            conditions.append('timestamp >= ?')
+            params.append(since)
+        if until:
+            conditions.append('timestamp < ?')
+            params.append(until)
+        sql = f'SELECT service_port, {", ".join(METRICS)}, timestamp FROM monitor_data'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        return conn.execute(sql + ' ORDER BY timestamp', params)
+
+    def _feed(self, row):
+        """把一行原始数据加入各层级的当前桶"""
+        try:
+            epoch = to_epoch(row[-1])
+        except (TypeError, ValueError):
+            return
+        port = SYSTEM_PORT if row[0] is None else int(row[0])
+
+        for tier in self.tiers:
+            if tier.source is not None:
+                continue
+            bucket = self._advance(tier, epoch)
+            if bucket is None:
+                continue
+            for metric, value in zip(METRICS, row[1:]):
+                key = (port, metric)
+                bucket.series.setdefault(key, []).append(value or 0)
+                bucket.dirty.add(key)
+
+    def _advance(self, tier, epoch):
+        """返回 epoch 所在的当前桶；进入新桶时先输出旧桶，过期样本返回None"""
+        start = epoch - epoch % tier.width
+        bucket = self._open[tier.name]
+        if bucket.start is None or start > bucket.start:
+            self._close(tier, bucket)
+            bucket = self._open[tier.name] = _OpenBucket(start)
+        elif start < bucket.start:
+            return None
+        return bucket
+
+    def _close(self, tier, bucket):
+        """输出旧桶中尚未写入的数据"""
+        if bucket.dirty:
+            self._pending.extend(self._flush_tier(tier, bucket))
+
+    def _collect(self):
+        """输出所有层级当前桶中变化的数据，返回待写入行"""
+        for tier in self.tiers:
+            self._pending.extend(self._flush_tier(tier, self._open[tier.name]))
+        pending, self._pending = self._pending, []
+        return pending
+
+    def _flush_tier(self, tier, bucket):
+        rows = []
+        for key in bucket.dirty:
+            series = bucket.series[key]
+            stats = merge(series.values()) if tier.source else summarize(series)
+            rows.append((tier, bucket.start, key, stats))
+            self._propagate(tier, bucket.start, key, stats)
+        bucket.dirty = set()
+        return rows
+
+    def _propagate(self, source, start, key, stats):
+        """把源层级的桶统计传给由它合并的层级"""
+        for tier in self.tiers:
+            if tier.source != source.name:
+                continue
+            bucket = self._advance(tier, start)
+            if bucket is None:
+                continue
+            bucket.series.setdefault(key, {})[start] = stats
+            bucket.dirty.add(key)
+
+    def _write(self, conn, rows):
+        by_table = {}
+        for tier, start, (port, metric), stats in rows:
+            by_table.setdefault(tier.table, []).append((start, port, metric) + tuple(stats))
+        for table, params in by_table.items():
+            conn.executemany(f'''
+                INSERT OR REPLACE INTO {table}
+                    (bucket, service_port, metric, samples, sum, min, max, p95)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', params)
+            self.rows_written += len(params)
+
+    def _delete_batched(self, conn, table, condition, value, batch_size):
+        deleted = 0
+        while True:
+            cursor = conn.execute(f'''
+                DELETE FROM {table} WHERE rowid IN (
+                    SELECT rowid FROM {table} WHERE {condition} LIMIT ?
+                )
+            ''', (value, batch_size))
+            conn.commit()
+            deleted += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                return deleted
+
+
+# 创建全局实例
+metrics_rollup = MetricsRollup()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端口分配模块 - 基于位图的SS服务端口分配，支持预留与按用户/范围划分的端口池
+"""
+
+import os
+import time
+import random
+import threading
+import logging
+
+from service_registry import service_registry
+from socket_table import socket_table
+from xray_stats import API_PORT_BASE, API_PORT_RANGE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL = 'default'
+# 与Shell脚本的 random_port 一致，避开Xray API端口范围
+DEFAULT_RANGE = (10000, 60000)
+# 预留未提交的端口在该时间 (秒) 后自动释放
+RESERVATION_TTL = 300
+# 共用Xray进程的API端口 (见 consolidated_runtime.DEFAULT_API_PORT)
+RESERVED_PORTS = (API_PORT_BASE - 1,)
+
+
+class PortAllocationError(Exception):
+    """端口池中没有可用端口"""
+
+
+def parse_ranges(spec):
+    """解析 'default=10000-60000;vip=20000-20999' 为 {名称: (起, 止)}"""
+    pools = {}
+    for item in (spec or '').replace(',', ';').split(';'):
+        if not item.strip():
+            continue
+        name, _, value = item.partition('=')
+        start, _, end = value.partition('-')
+        start, end = int(start), int(end or start)
+        if not 1 <= start <= end <= 65535:
+            raise ValueError(f'端口范围无效: {item}')
+        pools[name.strip()] = (start, end)
+    return pools
+
+
+def parse_mapping(spec):
+    """解析 'alice=vip;bob=vip' 为 {用户名: 端口池}"""
+    mapping = {}
+    for item in (spec or '').replace(',', ';').split(';'):
+        name, _, pool = item.partition('=')
+        if name.strip() and pool.strip():
+            mapping[name.strip()] = pool.strip()
+    return mapping
+
+
+def _range_mask(start, end):
+    """端口 [start, end] 的位掩码"""
+    return ((1 << (end - start + 1)) - 1) << start
+
+
+def _lowest_bit(bits):
+    return (bits & -bits).bit_length() - 1
+
+
+def _count(bits):
+    return bin(bits).count('1')
+
+
+class PortAllocator:
+    """SS服务端口分配器
+
+    每类占用各用一个65536位的整数位图：
+    - used: 服务目录中已有的服务 (来自 service_registry，含尚无信息文件的端口目录)
+    - recycled: 回收站中的服务，保留原端口以便恢复
+    - bound: 系统中已被监听或绑定的端口 (来自 socket_table)
+    - reserved: 已预留、尚未创建服务目录的端口
+    分配时把端口池掩码与各位图合并后取随机起点之后的第一个空闲位，
+    耗时只取决于位图大小，不会随已用端口增多而变慢或失败。
+    位图在服务目录、套接字快照或回收站变化后才重建。
+    所有预留在同一把锁内完成，并发请求不会拿到同一个端口。
+    """
+
+    def __init__(self, recycle_dirs=(), pools=None, user_pools=None, reservation_ttl=RESERVATION_TTL):
+        self.recycle_dirs = list(recycle_dirs)
+        self.pools = dict(pools or {DEFAULT_POOL: DEFAULT_RANGE})
+        self.user_pools = dict(user_pools or {})
+        self.reservation_ttl = reservation_ttl
+
+        self._lock = threading.Lock()
+        self._used = 0
+        self._recycled = 0
+        self._bound = 0
+        self._reserved = 0
+        # 始终不分配的端口：Xray API端口范围
+        self._blocked = _range_mask(API_PORT_BASE, API_PORT_BASE + API_PORT_RANGE - 1)
+        for port in RESERVED_PORTS:
+            self._blocked |= 1 << port
+
+        # 端口 -> {'owner', 'pool', 'expires'}
+        self._reservations = {}
+        # 已提交但服务注册表可能尚未刷新的端口
+        self._committed = set()
+        self._sources = None
+
+        # 统计
+        self.allocation_count = 0
+        self.rebuild_count = 0
+
+    def configure(self, recycle_dirs=None, pools=None, user_pools=None, reservation_ttl=None):
+        """设置回收站目录、端口池与用户对应的端口池"""
+        with self._lock:
+            if recycle_dirs is not None:
+                self.recycle_dirs = list(recycle_dirs)
+            if pools:
+                self.pools = dict(pools)
+                self.pools.setdefault(DEFAULT_POOL, DEFAULT_RANGE)
+            if user_pools is not None:
+                self.user_pools = dict(user_pools)
+            if reservation_ttl is not None:
+                self.reservation_ttl = reservation_ttl
+            self._sources = None
+
+    def reserve(self, pool=None, user=None, owner=None, ttl=None):
+        """从端口池中预留一个端口并返回
+
+        pool 未指定时使用用户对应的端口池，再退回到默认端口池。
+        创建服务目录后调用 commit()，放弃时调用 release()。
+        """
+        name = self.pool_for(pool, user)
+        start, end = self.pools[name]
+        with self._lock:
+            self._refresh()
+            free = _range_mask(start, end) & ~self._occupied()
+            if not free:
+                raise PortAllocationError(f'端口池 {name} ({start}-{end}) 中没有可用端口')
+
+            begin = random.randint(start, end)
+            above = free >> begin
+            port = begin + _lowest_bit(above) if above else _lowest_bit(free)
+            self._hold(port, owner or user, name, ttl)
+            self.allocation_count += 1
+            return port
+
+    def reserve_port(self, port, owner=None, ttl=None):
+        """预留指定端口 (如用户手动填写)，端口不可用时返回False"""
+        port = int(port)
+        with self._lock:
+            self._refresh()
+            if not 1 <= port <= 65535 or self._occupied() >> port & 1:
+                return False
+            self._hold(port, owner, None, ttl)
+            return True
+
+    def commit(self, port):
+        """服务目录已创建，预留转为占用"""
+        port = int(port)
+        with self._lock:
+            self._drop(port)
+            self._committed.add(port)
+            self._used |= 1 << port
+
+    def release(self, port):
+        """放弃预留的端口"""
+        with self._lock:
+            self._drop(int(port))
+
+    def is_available(self, port):
+        """端口当前是否可分配"""
+        with self._lock:
+            self._refresh()
+            return not self._occupied() >> int(port) & 1
+
+    def pool_for(self, pool=None, user=None):
+        """端口池名称：指定的端口池 > 用户对应的端口池 > 默认端口池"""
+        name = pool or self.user_pools.get(user) or DEFAULT_POOL
+        if name not in self.pools:
+            raise PortAllocationError(f'端口池不存在: {name}')
+        return name
+
+    def get_stats(self):
+        """各端口池的容量与占用，以及当前的预留"""
+        with self._lock:
+            self._refresh()
+            occupied = self._occupied()
+            pools = {}
+            for name, (start, end) in self.pools.items():
+                mask = _range_mask(start, end)
+                pools[name] = {
+                    'range': [start, end],
+                    'total': end - start + 1,
+                    'free': _count(mask & ~occupied),
+                    'used': _count(mask & self._used),
+                    'recycled': _count(mask & self._recycled),
+                    'bound': _count(mask & self._bound & ~self._used),
+                    'reserved': _count(mask & self._reserved)
+                }
+            return {
+                'pools': pools,
+                'user_pools': dict(self.user_pools),
+                'reservations': {
+                    port: {'owner': r['owner'], 'pool': r['pool'], 'expires': r['expires']}
+                    for port, r in sorted(self._reservations.items())
+                },
+                'allocation_count': self.allocation_count,
+                'rebuild_count': self.rebuild_count
+            }
+
+    # ---- 内部工具 (调用方持有锁) ----
+
+    def _occupied(self):
+        return self._used | self._recycled | self._bound | self._reserved | self._blocked
+
+    def _hold(self, port, owner, pool, ttl):
+        ttl = self.reservation_ttl if ttl is None else ttl
+        self._reservations[port] = {'owner': owner, 'pool': pool, 'expires': time.time() + ttl}
+        self._reserved |= 1 << port
+
+    def _drop(self, port):
+        if self._reservations.pop(port, None) is not None:
+            self._reserved &= ~(1 << port)
+
+    def _refresh(self):
+        """数据来源变化时重建位图，并清理过期的预留"""
+        now = time.time()
+        for port in [p for p, r in self._reservations.items() if r['expires'] <= now]:
+            logger.info(f"端口 {port} 预留已过期 (预留者: {self._reservations[port]['owner']})")
+            self._drop(port)
+
+        sockets = socket_table.snapshot()
+        sources = (service_registry.version, self._mtime(service_registry.service_dir),
+                   sockets.timestamp, self._recycle_signature())
+        if sources == self._sources:
+            return
+
+        used = 0
+        registered = {int(port) for port in service_registry.port_dirs()}
+        for record in service_registry.snapshot():
+            try:
+                registered.add(int(record['port']))
+            except (KeyError, TypeError, ValueError):
+                continue
+        # 注册表已包含的端口不再需要单独记录
+        self._committed -= registered
+        for port in registered | self._committed:
+            used |= 1 << port
+
+        bound = 0
+        for port, entry in sockets.ports.items():
+            if entry['listen'] or entry['udp']:
+                bound |= 1 << port
+
+        recycled = 0
+        for port in self._recycled_ports():
+            recycled |= 1 << port
+
+        self._used, self._bound, self._recycled = used, bound, recycled
+        self._sources = sources
+        self.rebuild_count += 1
+
+    def _recycle_signature(self):
+        return tuple(self._mtime(path) for path in self.recycle_dirs)
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except (OSError, TypeError):
+            return None
+
+    def _recycled_ports(self):
+        """回收站中的端口 (目录名为 端口 或 端口_删除时间)"""
+        ports = set()
+        for path in self.recycle_dirs:
+            try:
+                names = os.listdir(path)
+            except OSError:
+                continue
+            for name in names:
+                prefix = name.split('_', 1)[0]
+                if prefix.isdigit() and 1 <= int(prefix) <= 65535:
+                    ports.add(int(prefix))
+        return ports
+
+
+# 创建全局实例
+port_allocator = PortAllocator()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+探测历史模块 - 每个端口的探测结果 (延迟与是否成功) 及多级时间桶汇总 (5分钟/1小时/1天)
+
+汇总桶保存对数刻度的延迟直方图，任意多个桶合并后仍能计算 p50/p95/p99，
+因此长时间范围的查询只读取少量粗粒度的桶。
+"""
+
+import math
+import time
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 原始探测结果保留天数，更长的时间范围由汇总表提供
+RAW_RETENTION_DAYS = 7
+
+# 历史查询默认/最大返回点数
+DEFAULT_POINTS = 300
+MAX_POINTS = 1000
+
+# 服务列表中"近期延迟"的时间范围 (小时)
+RECENT_HOURS = 1
+
+# 延迟直方图：第0档为不超过 HIST_MIN 毫秒，此后每档上限为前一档的 HIST_BASE 倍
+# (相对误差约5%)，最后一档包含所有更大的值，共覆盖 0.1ms ~ 60s
+HIST_MIN = 0.1
+HIST_BASE = 1.1
+HIST_BINS = 142
+
+_HIST_ENTRY = struct.Struct('<HI')
+
+
+class ProbeTier:
+    """汇总层级"""
+
+    def __init__(self, name, width, retention_days):
+        self.name = name
+        self.width = width
+        self.retention_days = retention_days
+        self.table = f'probe_rollup_{name}'
+
+
+PROBE_TIERS = (
+    ProbeTier('5m', 300, 14),
+    ProbeTier('1h', 3600, 180),
+    ProbeTier('1d', 86400, 1095),
+)
+
+
+def create_tables(cursor):
+    """创建探测结果表与汇总表 (由 init_db 调用)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS probe_results (
+            port INTEGER NOT NULL,
+            checked_at INTEGER NOT NULL,
+            latency REAL,
+            success INTEGER NOT NULL,
+            PRIMARY KEY (port, checked_at)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_probe_results_checked_at ON probe_results (checked_at)')
+    for tier in PROBE_TIERS:
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {tier.table} (
+                port INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                samples INTEGER NOT NULL,
+                successes INTEGER NOT NULL,
+                latency_sum REAL NOT NULL,
+                latency_min REAL,
+                latency_max REAL,
+                hist BLOB NOT NULL,
+                PRIMARY KEY (port, bucket)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{tier.table}_bucket ON {tier.table} (bucket)')
+
+
+def hist_bin(latency):
+    """延迟 (毫秒) 所在的直方图档位"""
+    if latency <= HIST_MIN:
+        return 0
+    return min(HIST_BINS - 1, math.ceil(math.log(latency / HIST_MIN, HIST_BASE)))
+
+
+def bin_value(index):
+    """档位的代表值：档位上下限的几何中点"""
+    if index == 0:
+        return HIST_MIN
+    return HIST_MIN * HIST_BASE ** (index - 0.5)
+
+
+def encode_hist(hist):
+    """各档次数的列表 -> 紧凑的二进制表示 (只保存非零的档位)"""
+    return b''.join(_HIST_ENTRY.pack(index, count) for index, count in enumerate(hist) if count)
+
+
+def decode_hist(data, into=None):
+    """二进制直方图 -> 各档次数的列表，into 不为空时累加到其中"""
+    hist = [0] * HIST_BINS if into is None else into
+    for index, count in _HIST_ENTRY.iter_unpack(data or b''):
+        hist[index] += count
+    return hist
+
+
+def percentile(hist, q, total=None):
+    """直方图的分位数 (最近秩)，没有样本时返回None"""
+    total = sum(hist) if total is None else total
+    if not total:
+        return None
+    rank = max(1, math.ceil(total * q))
+    seen = 0
+    for index, count in enumerate(hist):
+        seen += count
+        if seen >= rank:
+            return round(bin_value(index), 2)
+    return None
+
+
+class _Stats:
+    """若干探测结果或汇总桶的累计统计"""
+
+    __slots__ = ('samples', 'successes', 'latency_sum', 'latency_min', 'latency_max', 'hist')
+
+    def __init__(self):
+        self.samples = 0
+        self.successes = 0
+        self.latency_sum = 0.0
+        self.latency_min = None
+        self.latency_max = None
+        self.hist = [0] * HIST_BINS
+
+    def add(self, success, latency):
+        self.samples += 1
+        if not success or latency is None or latency < 0:
+            return
+        self.successes += 1
+        self.latency_sum += latency
+        self.latency_min = latency if self.latency_min is None else min(self.latency_min, latency)
+        self.latency_max = latency if self.latency_max is None else max(self.latency_max, latency)
+        self.hist[hist_bin(latency)] += 1
+
+    def merge_row(self, samples, successes, latency_sum, latency_min, latency_max, hist):
+        self.samples += samples
+        self.successes += successes
+        self.latency_sum += latency_sum
+        if latency_min is not None:
+            self.latency_min = latency_min if self.latency_min is None else min(self.latency_min, latency_min)
+        if latency_max is not None:
+            self.latency_max = latency_max if self.latency_max is None else max(self.latency_max, latency_max)
+        decode_hist(hist, self.hist)
+
+    def row(self):
+        return (self.samples, self.successes, self.latency_sum,
+                self.latency_min, self.latency_max, encode_hist(self.hist))
+
+    def to_dict(self):
+        successes = self.successes
+        return {
+            'samples': self.samples,
+            'successes': successes,
+            'availability': round(successes * 100 / self.samples, 2) if self.samples else None,
+            'avg': round(self.latency_sum / successes, 2) if successes else None,
+            'min': self.latency_min,
+            'max': self.latency_max,
+            'p50': percentile(self.hist, 0.50, successes),
+            'p95': percentile(self.hist, 0.95, successes),
+            'p99': percentile(self.hist, 0.99, successes)
+        }
+
+
+class ProbeHistory:
+    """探测历史存储
+
+    record() 在同一事务中写入原始结果，并以读-合并-写的方式更新各层级中
+    对应的桶，不在内存中保留状态，进程重启不影响汇总。统计与排名把时间范围
+    拆成各层级的完整桶 (见 _cover)，每个端口只需读取几十个桶；曲线使用
+    满足点数要求的最粗层级，再把相邻桶合并为每个点。
+    """
+
+    def __init__(self, tiers=PROBE_TIERS):
+        self.tiers = tiers
+
+        # 统计
+        self.results_written = 0
+        self.rows_written = 0
+
+    def record(self, conn, results):
+        """记录一批探测结果 [(端口, 时间戳, 延迟毫秒, 是否成功)]，由调用方提交事务"""
+        rows = []
+        for port, checked_at, latency, success in results:
+            success = bool(success)
+            latency = round(latency, 2) if success and latency is not None and latency >= 0 else None
+            rows.append((int(port), int(checked_at), latency, int(success)))
+        if not rows:
+            return 0
+
+        conn.executemany('''
+            INSERT OR REPLACE INTO probe_results (port, checked_at, latency, success)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+        for tier in self.tiers:
+            self._update_tier(conn, tier, rows)
+        self.results_written += len(rows)
+        return len(rows)
+
+    def _update_tier(self, conn, tier, rows):
+        buckets = {}
+        for port, checked_at, latency, success in rows:
+            key = (port, checked_at - checked_at % tier.width)
+            buckets.setdefault(key, []).append((success, latency))
+
+        params = []
+        for (port, bucket), items in buckets.items():
+            stats = _Stats()
+            existing = conn.execute(f'''
+                SELECT samples, successes, latency_sum, latency_min, latency_max, hist
+                FROM {tier.table} WHERE port = ? AND bucket = ?
+            ''', (port, bucket)).fetchone()
+            if existing:
+                stats.merge_row(*existing)
+            for success, latency in items:
+                stats.add(success, latency)
+            params.append((port, bucket) + stats.row())
+
+        conn.executemany(f'''
+            INSERT OR REPLACE INTO {tier.table}
+                (port, bucket, samples, successes, latency_sum, latency_min, latency_max, hist)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', params)
+        self.rows_written += len(params)
+
+    def summary(self, conn, hours, ports=None):
+        """时间范围内每个端口的统计 {端口: {samples, availability, avg, p50, p95, p99, ...}}"""
+        since = int(time.time() - hours * 3600)
+        condition, port_params = '', []
+        if ports is not None:
+            port_params = [int(port) for port in ports]
+            if not port_params:
+                return {}
+            condition = f" AND port IN ({','.join('?' * len(port_params))})"
+
+        totals = {}
+        for tier, start, end in self._cover(since):
+            sql = f'''
+                SELECT port, samples, successes, latency_sum, latency_min, latency_max, hist
+                FROM {tier.table} WHERE bucket >= ?{' AND bucket < ?' if end is not None else ''}{condition}
+            '''
+            params = [start] + ([end] if end is not None else []) + port_params
+            for row in conn.execute(sql, params):
+                stats = totals.get(row[0])
+                if stats is None:
+                    stats = totals[row[0]] = _Stats()
+                stats.merge_row(*row[1:])
+        return {port: stats.to_dict() for port, stats in totals.items()}
+
+    def _cover(self, since):
+        """把从 since 到现在的时间范围拆成各层级的桶范围 [(层级, 起, 止)]
+
+        粗层级只取起点在 since 之后的完整桶，起点附近的零头依次由更细的层级补齐，
+        最细的可用层级向下对齐 (多统计的部分不超过一个桶)。保留期不到 since 的
+        层级不参与，止为None表示直到现在。
+        """
+        now = time.time()
+        usable = [tier for tier in self.tiers if now - tier.retention_days * 86400 <= since]
+        usable = usable or [self.tiers[-1]]
+        ranges = []
+        end = None
+        for tier in reversed(usable):
+            if tier is usable[0]:
+                start = since - since % tier.width
+            else:
+                start = -(-since // tier.width) * tier.width
+            if end is not None and start >= end:
+                continue
+            ranges.append((tier, start, end))
+            end = start
+        return ranges
+
+    def recent(self, conn, ports=None):
+        """近期 (RECENT_HOURS) 的统计，用于服务列表"""
+        return self.summary(conn, RECENT_HOURS, ports)
+
+    def ranking(self, conn, hours, order='fastest', limit=10, min_samples=1, ports=None):
+        """最快 (按p50升序) 或最不可靠 (按可用率升序) 的节点"""
+        items = [dict(stats, port=port) for port, stats in self.summary(conn, hours, ports).items()
+                 if stats['samples'] >= min_samples]
+        if order == 'fastest':
+            items = [item for item in items if item['p50'] is not None]
+            items.sort(key=lambda item: (item['p50'], item['p95'], -item['availability']))
+        elif order == 'unreliable':
+            items.sort(key=lambda item: (item['availability'], -item['samples'],
+                                         -(item['p95'] or 0)))
+        else:
+            raise ValueError(f'未知的排序方式: {order}')
+        return items[:max(1, limit)]
+
+    def series(self, conn, port, hours, max_points=DEFAULT_POINTS):
+        """端口的延迟曲线，返回 (分辨率名称, 每点秒数, 数据列表)
+
+        时间范围内的点数不超过 max_points 时返回原始结果，
+        否则使用汇总层级，最粗层级仍超过点数时在查询中合并相邻桶。
+        """
+        max_points = max(1, min(int(max_points), MAX_POINTS))
+        window = hours * 3600
+        now = int(time.time())
+        since = now - window
+        port = int(port)
+
+        if window <= RAW_RETENTION_DAYS * 86400:
+            count = conn.execute(
+                'SELECT COUNT(*) FROM probe_results WHERE port = ? AND checked_at >= ?', (port, since)
+            ).fetchone()[0]
+            if count <= max_points:
+                return 'raw', None, self._series_raw(conn, port, since)
+
+        # 桶宽度不超过每点秒数且保留期覆盖时间范围的最粗层级
+        retained = [t for t in self.tiers if t.retention_days * 86400 >= window] or [self.tiers[-1]]
+        tier = retained[0]
+        for candidate in retained:
+            if candidate.width <= window / max_points:
+                tier = candidate
+        step = tier.width * max(1, math.ceil(window / max_points / tier.width))
+        points = {}
+        for row in conn.execute(f'''
+            SELECT bucket, samples, successes, latency_sum, latency_min, latency_max, hist
+            FROM {tier.table}
+            WHERE port = ? AND bucket >= ?
+            ORDER BY bucket
+        ''', (port, since - since % step)):
+            point = row[0] - row[0] % step
+            stats = points.get(point)
+            if stats is None:
+                stats = points[point] = _Stats()
+            stats.merge_row(*row[1:])
+
+        name = tier.name if step == tier.width else f'{step}s'
+        data = [dict(stats.to_dict(), timestamp=point) for point, stats in sorted(points.items())]
+        return name, step, data[-max_points:]
+
+    def _series_raw(self, conn, port, since):
+        return [{
+            'timestamp': row[0],
+            'latency': row[1],
+            'success': bool(row[2])
+        } for row in conn.execute('''
+            SELECT checked_at, latency, success FROM probe_results
+            WHERE port = ? AND checked_at >= ?
+            ORDER BY checked_at
+        ''', (port, since))]
+
+    def prune(self, conn, batch_size=5000):
+        """按保留期限分批删除原始结果与汇总数据"""
+        now = int(time.time())
+        deleted = self._delete_batched(conn, 'probe_results', 'checked_at',
+                                       now - RAW_RETENTION_DAYS * 86400, batch_size)
+        for tier in self.tiers:
+            deleted += self._delete_batched(conn, tier.table, 'bucket',
+                                            now - tier.retention_days * 86400, batch_size)
+        return deleted
+
+    def _delete_batched(self, conn, table, column, value, batch_size):
+        # WITHOUT ROWID 表没有rowid，每批先找出第 batch_size 个过期的时间，再按时间删除
+        deleted = 0
+        while True:
+            cutoff = conn.execute(f'''
+                SELECT MAX({column}) FROM (
+                    SELECT {column} FROM {table} WHERE {column} < ? ORDER BY {column} LIMIT ?
+                )
+            ''', (value, batch_size)).fetchone()[0]
+            if cutoff is None:
+                return deleted
+            cursor = conn.execute(f'DELETE FROM {table} WHERE {column} <= ?', (cutoff,))
+            conn.commit()
+            deleted += cursor.rowcount
+
+
+# 创建全局实例
+probe_history = ProbeHistory()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+定时探测模块 - 后台按周期探测所有运行中的服务，缓存每个端口的最新结果
+"""
+
+import time
+import random
+import sqlite3
+import threading
+import logging
+
+from ss_probe import run_probes, probe_tcp, DEFAULT_TIMEOUT, DEFAULT_CONCURRENCY
+from probe_history import probe_history
+
+logger = logging.getLogger(__name__)
+
+# 探测周期 (秒)
+DEFAULT_INTERVAL = 60
+MIN_INTERVAL = 10
+# 每个周期的等待时间在 interval * (1 ± jitter) 之间随机，避免多个实例同时探测
+DEFAULT_JITTER = 0.1
+
+
+class ProbeScheduler:
+    """后台定时探测器
+
+    每个周期由 targets_fn 取得运行中服务的探测目标 (与批量测试相同的格式，
+    key 为端口)，并发探测，同时进行的探测不超过 concurrency 个，整批不超过
+    一个周期。结果写入探测历史 (见 probe_history)，并按端口缓存最新结果与
+    探测时间；服务列表与手动测试直接读取缓存，不在请求中发起探测。
+    """
+
+    def __init__(self, db_path=None, targets_fn=None, probe=probe_tcp, mode='tcp',
+                 interval=DEFAULT_INTERVAL, jitter=DEFAULT_JITTER,
+                 concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+        self.db_path = db_path
+        # 返回 [{'key': 端口, 'server', 'port', 'method', 'password', ...}]
+        self.targets_fn = targets_fn
+        self.probe = probe
+        self.mode = mode
+        self.interval = interval
+        self.jitter = jitter
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        # 端口 -> 最新结果 (含 probe_mode 与 checked_at)
+        self._cache = {}
+
+        # 统计
+        self.cycle_count = 0
+        self.probe_count = 0
+        self.last_cycle = None
+        self.last_duration_ms = 0
+
+    def configure(self, db_path=None, targets_fn=None, probe=None, mode=None, interval=None,
+                  jitter=None, concurrency=None, timeout=None):
+        """设置数据库路径、探测目标来源、探测方式、周期、抖动、并发上限与超时"""
+        if db_path is not None:
+            self.db_path = db_path
+        if targets_fn is not None:
+            self.targets_fn = targets_fn
+        if probe is not None:
+            self.probe = probe
+        if mode is not None:
+            self.mode = mode
+        if interval is not None:
+            self.interval = max(MIN_INTERVAL, interval)
+        if jitter is not None:
+            self.jitter = min(max(0.0, jitter), 0.5)
+        if concurrency is not None:
+            self.concurrency = max(1, concurrency)
+        if timeout is not None:
+            self.timeout = timeout
+
+    @property
+    def max_age(self):
+        """缓存结果的有效期 (秒)：两个周期内的结果视为最新"""
+        return self.interval * (1 + self.jitter) * 2
+
+    def start(self):
+        """启动探测线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='probe-scheduler', daemon=True)
+        self._thread.start()
+        logger.info(f"定时探测已启动 (周期 {self.interval}s，并发上限 {self.concurrency})")
+
+    def stop(self):
+        """停止探测线程"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        # 首个周期也随机延后，多个实例启动时错开
+        self._stop_event.wait(random.uniform(0, self.interval * self.jitter))
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"定时探测失败: {e}")
+            self._stop_event.wait(self.interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def run_once(self):
+        """探测所有目标一次，返回探测的目标数"""
+        start = time.time()
+        targets = self.targets_fn() if self.targets_fn else []
+        results = self.probe_targets(targets)
+
+        # 已停止或删除的服务不再保留缓存
+        active = {str(target['key']) for target in targets}
+        with self._lock:
+            for port in [p for p in self._cache if p not in active]:
+                del self._cache[port]
+
+        self.cycle_count += 1
+        self.last_cycle = time.time()
+        self.last_duration_ms = round((self.last_cycle - start) * 1000, 2)
+        return len(results)
+
+    def probe_targets(self, targets, probe=None, mode=None, timeout=None):
+        """探测一组目标，更新缓存并写入探测历史，返回 [(target, 结果)]"""
+        if not targets:
+            return []
+        results = run_probes(targets, probe=probe or self.probe, concurrency=self.concurrency,
+                             timeout=timeout or self.timeout,
+                             deadline=max(self.timeout, self.interval))
+        checked_at = time.time()
+        for target, result in results:
+            self.update(target['key'], result, mode or self.mode, checked_at)
+        self._record([(target['key'], checked_at, result['latency'], result['success'])
+                      for target, result in results])
+        self.probe_count += len(results)
+        return results
+
+    def update(self, port, result, mode, checked_at=None):
+        """缓存端口的最新结果 (手动测试的结果也写入缓存)"""
+        # probe_mode 为请求的探测方式；握手探测退回TCP时结果中的 mode 为 'tcp'
+        entry = dict(result, probe_mode=mode,
+                     checked_at=time.time() if checked_at is None else checked_at)
+        with self._lock:
+            self._cache[str(port)] = entry
+
+    def get(self, port, mode=None, max_age=None):
+        """端口的缓存结果 (附带 age 秒数)，没有、已过期或探测方式不同时返回None"""
+        with self._lock:
+            entry = self._cache.get(str(port))
+        if entry is None:
+            return None
+        age = time.time() - entry['checked_at']
+        if age > (self.max_age if max_age is None else max_age):
+            return None
+        if mode is not None and entry['probe_mode'] != mode:
+            return None
+        return dict(entry, age=round(age, 1))
+
+    def get_stats(self):
+        """探测统计"""
+        with self._lock:
+            cached = len(self._cache)
+            healthy = sum(1 for entry in self._cache.values() if entry['success'])
+        return {
+            'mode': self.mode,
+            'interval': self.interval,
+            'jitter': self.jitter,
+            'concurrency': self.concurrency,
+            'timeout': self.timeout,
+            'cycle_count': self.cycle_count,
+            'probe_count': self.probe_count,
+            'last_cycle': self.last_cycle,
+            'last_duration_ms': self.last_duration_ms,
+            'cached': cached,
+            'healthy': healthy
+        }
+
+    def _record(self, rows):
+        """写入探测历史"""
+        if not rows or not self.db_path:
+            return
+        try:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                with conn:
+                    probe_history.record(conn, rows)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.error(f"记录定时探测结果失败: {e}")
+
+
+# 创建全局实例
+probe_scheduler = ProbeScheduler()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程扫描模块 - 单次扫描/proc批量判断所有Xray服务的存活状态
+"""
+
+import os
+import re
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 从Xray命令行的配置文件路径中提取端口: .../services/<port>/config.json
+CONFIG_PATH_PATTERN = re.compile(r'(?:^|/)(\d+)/config\.json$')
+CONFIG_FLAGS = ('-config', '--config', '-c')
+
+
+def _parse_config_paths(argv):
+    """从Xray命令行参数中解析配置文件路径"""
+    # argv[0]为xray，或经解释器启动时argv[1]为xray
+    if not any('xray' in os.path.basename(arg).lower() for arg in argv[:2]):
+        return []
+
+    paths = []
+    for i, arg in enumerate(argv[1:], 1):
+        if arg in CONFIG_FLAGS and i + 1 < len(argv):
+            paths.append(argv[i + 1])
+        elif '=' in arg and arg.split('=', 1)[0] in CONFIG_FLAGS:
+            paths.append(arg.split('=', 1)[1])
+    return paths
+
+
+def _parse_config_port(argv):
+    """从Xray命令行参数中解析服务端口"""
+    for path in _parse_config_paths(argv):
+        match = CONFIG_PATH_PATTERN.search(path)
+        if match:
+            return match.group(1)
+    return None
+
+
+class ProcessScanner:
+    """Xray进程扫描器
+
+    一次读取/proc得到 端口 -> 进程 的映射，并结合PID文件判断状态：
+    - PID文件中的进程存在且命令行对应该端口的配置：running
+    - PID文件中的进程存在但不是该服务的Xray (PID被复用)：stopped, pid_reused=True
+    - PID文件失效但有该端口配置的Xray在运行：running (以实际进程为准)
+    多个服务共用一个Xray进程时，由 register_shared() 登记该进程的配置文件
+    与其中的端口，扫描时这些端口都对应到该进程。
+    扫描结果在ttl秒内复用，多个请求共享同一次扫描。
+    """
+
+    def __init__(self, proc_root='/proc', ttl=1.0):
+        self.proc_root = proc_root
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._scan_time = 0
+        self._processes = {}
+        self._live_pids = frozenset()
+        self._known = {}
+        self._shared = {}
+        self._boot_time = None
+        self._clock_ticks = None
+
+        # 实际执行扫描的次数
+        self.scan_count = 0
+
+    @property
+    def available(self):
+        """当前系统是否支持/proc扫描"""
+        return os.path.isdir(os.path.join(self.proc_root, 'self'))
+
+    def register_shared(self, config_file, ports):
+        """登记共用进程的配置文件及其服务端口，ports为空时取消登记"""
+        with self._lock:
+            if ports:
+                self._shared[config_file] = tuple(str(port) for port in ports)
+            else:
+                self._shared.pop(config_file, None)
+            # 下一次查询重新扫描
+            self._scan_time = 0
+
+    def scan(self, force=False):
+        """扫描/proc，返回 {端口: {'pid', 'start_time', 'started_at'}}"""
+        with self._lock:
+            if not force and time.time() - self._scan_time < self.ttl:
+                return self._processes
+
+            processes = {}
+            live_pids = set()
+
+            try:
+                entries = os.listdir(self.proc_root)
+            except OSError:
+                entries = []
+
+            for entry in entries:
+                if not entry.isdigit():
+                    continue
+                pid = int(entry)
+                live_pids.add(pid)
+
+                try:
+                    with open(os.path.join(self.proc_root, entry, 'cmdline'), 'rb') as f:
+                        cmdline = f.read()
+                except OSError:
+                    continue
+
+                if b'xray' not in cmdline.lower():
+                    continue
+
+                argv = cmdline.rstrip(b'\0').decode('utf-8', 'replace').split('\0')
+                ports = next((self._shared[path] for path in _parse_config_paths(argv)
+                              if path in self._shared), None)
+                if ports is None:
+                    port = _parse_config_port(argv)
+                    if port is None:
+                        continue
+                    ports = (port,)
+
+                start_time = self._read_start_time(entry)
+                if start_time is None:
+                    continue
+
+                for port in ports:
+                    # 同一端口有多个进程时取最新启动的
+                    existing = processes.get(port)
+                    if existing and existing['start_time'] > start_time:
+                        continue
+
+                    processes[port] = {
+                        'pid': pid,
+                        'start_time': start_time,
+                        'started_at': self._ticks_to_epoch(start_time)
+                    }
+
+            self._detect_restarts(processes)
+            self._processes = processes
+            self._live_pids = frozenset(live_pids)
+            self._scan_time = time.time()
+            self.scan_count += 1
+            return processes
+
+    def states(self, pidfiles=None, force=False):
+        """返回所有服务的状态映射 {端口: 状态字典}
+
+        pidfiles: {端口: PID文件中的pid}，可选；端口统一为字符串。
+        """
+        pidfiles = {str(k): v for k, v in (pidfiles or {}).items()}
+
+        if not self.available:
+            return self._states_without_proc(pidfiles)
+
+        processes = self.scan(force=force)
+        live_pids = self._live_pids
+
+        states = {}
+        for port in set(pidfiles) | set(processes):
+            pidfile_pid = pidfiles.get(port)
+            process = processes.get(port)
+
+            state = {
+                'status': 'stopped',
+                'pid': None,
+                'pidfile_pid': pidfile_pid,
+                'started_at': None,
+                'pid_reused': False
+            }
+
+            if process:
+                state.update({
+                    'status': 'running',
+                    'pid': process['pid'],
+                    'started_at': process['started_at']
+                })
+            elif pidfile_pid and pidfile_pid in live_pids:
+                state['pid_reused'] = True
+
+            states[port] = state
+
+        return states
+
+    def _states_without_proc(self, pidfiles):
+        """没有/proc时 (如macOS) 退回到 kill(pid, 0) 检查"""
+        states = {}
+        for port, pid in pidfiles.items():
+            running = False
+            if pid:
+                try:
+                    os.kill(pid, 0)
+                    running = True
+                except OSError:
+                    pass
+            states[port] = {
+                'status': 'running' if running else 'stopped',
+                'pid': pid if running else None,
+                'pidfile_pid': pid,
+                'started_at': None,
+                'pid_reused': False
+            }
+        return states
+
+    def _detect_restarts(self, processes):
+        """对比上一次扫描，记录进程重启或PID复用"""
+        for port, process in processes.items():
+            previous = self._known.get(port)
+            if previous and previous[0] == process['pid'] and previous[1] != process['start_time']:
+                logger.warning(f"端口 {port} 的PID {process['pid']} 已被新进程复用")
+        self._known = {port: (p['pid'], p['start_time']) for port, p in processes.items()}
+
+    def _read_start_time(self, pid_entry):
+        """读取进程启动时间 (开机后的时钟节拍数)"""
+        try:
+            with open(os.path.join(self.proc_root, pid_entry, 'stat'), 'rb') as f:
+                stat = f.read()
+            # comm字段可能包含空格，从最后一个')'之后解析
+            fields = stat[stat.rfind(b')') + 2:].split()
+            return int(fields[19])
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def _ticks_to_epoch(self, ticks):
+        """将时钟节拍数转换为时间戳"""
+        if self._boot_time is None:
+            self._clock_ticks = os.sysconf('SC_CLK_TCK')
+            self._boot_time = 0
+            try:
+                with open(os.path.join(self.proc_root, 'stat'), 'r') as f:
+                    for line in f:
+                        if line.startswith('btime'):
+                            self._boot_time = int(line.split()[1])
+                            break
+            except OSError:
+                pass
+        return self._boot_time + ticks / self._clock_ticks
+
+
+# 创建全局实例
+process_scanner = ProcessScanner()
+
+if __name__ == "__main__":
+    # 测试输出
+    import json
+    print(json.dumps(process_scanner.states(), indent=2))
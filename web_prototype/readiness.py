@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+就绪/退出检测模块 - 带截止时间与退避的等待，替代固定的sleep
+"""
+
+import os
+import time
+import errno
+import select
+import socket
+import subprocess
+import logging
+
+from socket_table import port_listening
+
+logger = logging.getLogger(__name__)
+
+
+class Backoff:
+    """指数退避的等待间隔：initial, initial*factor, ... 不超过maximum"""
+
+    def __init__(self, initial=0.01, maximum=0.05, factor=2.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self._delay = initial
+
+    def next(self):
+        delay = self._delay
+        self._delay = min(self._delay * self.factor, self.maximum)
+        return delay
+
+
+class ProcessHandle:
+    """进程句柄：子进程用Popen，其他进程用pidfd，都不可用时回退到kill(0)
+
+    wait(timeout) 在进程退出时立即返回，可作为轮询间隔的"可中断sleep"。
+    """
+
+    def __init__(self, pid, proc=None):
+        self.pid = pid
+        self.proc = proc
+        # -1 表示打开时进程已不存在，None 表示系统不支持pidfd
+        self._fd = None
+        if hasattr(os, 'pidfd_open'):
+            try:
+                self._fd = os.pidfd_open(pid)
+            except ProcessLookupError:
+                self._fd = -1
+            except OSError:
+                self._fd = None
+
+    def exited(self):
+        """进程是否已退出"""
+        return self.wait(0)
+
+    def fileno(self):
+        """pidfd，进程退出时可读；系统不支持或进程已不存在时返回None"""
+        return self._fd if self._fd is not None and self._fd >= 0 else None
+
+    def returncode(self):
+        return self.proc.poll() if self.proc else None
+
+    def wait(self, timeout):
+        """等待最多timeout秒，进程退出返回True"""
+        if self.proc is not None and self.proc.poll() is not None:
+            return True
+        if self._fd == -1:
+            return True
+
+        if self._fd is not None:
+            ready, _, _ = select.select([self._fd], [], [], timeout)
+            if self.proc is not None:
+                # 子进程退出后回收，避免留下僵尸进程
+                return self.proc.poll() is not None
+            return bool(ready)
+
+        if self.proc is not None:
+            try:
+                self.proc.wait(timeout=timeout)
+                return True
+            except subprocess.TimeoutExpired:
+                return False
+
+        deadline = time.monotonic() + timeout
+        while _alive(self.pid):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(min(0.05, max(0, deadline - time.monotonic())))
+        return True
+
+    def close(self):
+        if self._fd is not None and self._fd >= 0:
+            os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError as e:
+        return e.errno == errno.EPERM
+
+
+def is_listening(port, connect_timeout=0.05):
+    """端口是否已在监听 (没有/proc/net时尝试连接)"""
+    listening = port_listening(port)
+    if listening is not None:
+        return listening
+    try:
+        with socket.create_connection(('127.0.0.1', int(port)), timeout=connect_timeout):
+            return True
+    except OSError:
+        return False
+
+
+def wait_for_listen(port, handle, timeout, backoff=None, listening=None):
+    """等待进程开始监听端口
+
+    返回 (ready, 错误信息, 耗时秒)；进程提前退出时立即返回。
+    listening(port) 用于替换默认的端口级检测 (如平滑重启时只看新进程自己的套接字)。
+    """
+    listening = listening or is_listening
+    backoff = backoff or Backoff()
+    start = time.monotonic()
+    deadline = start + timeout
+    while True:
+        if listening(port):
+            return True, None, time.monotonic() - start
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False, f'等待端口 {port} 监听超时 ({timeout}秒)', time.monotonic() - start
+        # 在退避间隔内等待进程退出事件，而不是单纯sleep
+        if handle.wait(min(backoff.next(), remaining)):
+            code = handle.returncode()
+            detail = f' (退出码 {code})' if code is not None else ''
+            return False, f'Xray进程已退出{detail}', time.monotonic() - start
+
+
+def wait_for_exit(handle, timeout):
+    """等待进程退出，返回 (exited, 耗时秒)"""
+    start = time.monotonic()
+    return handle.wait(timeout), time.monotonic() - start
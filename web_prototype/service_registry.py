@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务注册表模块 - 常驻内存的服务列表，基于inotify增量更新
+"""
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+import logging
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+# 服务目录中会影响服务信息的文件
+WATCHED_FILES = ('info.txt', 'config.env', 'info', 'xray.pid')
+
+# inotify 常量 (见 <sys/inotify.h>)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+ROOT_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+SERVICE_MASK = (IN_CLOSE_WRITE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO |
+                IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+# info.txt 中文字段到标准字段名的映射
+INFO_TXT_FIELDS = {
+    '节点名称': 'node_name',
+    'Shadowsocks端口': 'ss_port',
+    'Shadowsocks密码': 'ss_password',
+    'SOCKS5后端': 'socks_backend',
+    '状态': 'file_status',
+    '有效期': 'expires_display',
+    '创建时间': 'created_at',
+    '协议': 'protocol',
+    '加密方式': 'encryption',
+    'SOCKS5认证': 'socks_auth',
+}
+
+
+def parse_service_dir(port_dir, port_path):
+    """解析单个服务目录，返回服务信息字典 (没有信息文件时返回None)"""
+    # 尝试读取info.txt文件 (新格式)
+    info_txt_file = os.path.join(port_path, 'info.txt')
+    config_env_file = os.path.join(port_path, 'config.env')
+    info_file = os.path.join(port_path, 'info')
+
+    service = {'port': port_dir}
+
+    try:
+        # 优先读取info.txt文件 (新格式)
+        if os.path.exists(info_txt_file):
+            with open(info_txt_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if ':' in line:
+                        key, value = line.split(':', 1)
+                        field = INFO_TXT_FIELDS.get(key.strip())
+                        if field:
+                            service[field] = value.strip()
+
+        # 读取config.env文件获取详细配置
+        elif os.path.exists(config_env_file):
+            with open(config_env_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if '=' in line:
+                        key, value = line.strip().split('=', 1)
+                        service[key.lower()] = value
+
+        # 兼容旧格式info文件
+        elif os.path.exists(info_file):
+            with open(info_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if '=' in line:
+                        key, value = line.strip().split('=', 1)
+                        service[key.lower()] = value
+
+        # 如果没有找到任何信息文件，跳过
+        else:
+            return None
+    except OSError:
+        # 目录在读取过程中被删除
+        return None
+
+    # 设置默认值
+    if 'node_name' not in service:
+        service['node_name'] = f'服务{port_dir}'
+
+    # 读取PID文件
+    service['pid'] = None
+    try:
+        with open(os.path.join(port_path, 'xray.pid'), 'r') as f:
+            service['pid'] = int(f.read().strip())
+    except (OSError, ValueError):
+        pass
+
+    # 确保有必要的字段用于显示
+    if 'ss_port' not in service:
+        service['ss_port'] = service['port']
+
+    # 解析SOCKS5后端地址为IP和端口
+    if service.get('socks_backend'):
+        if ':' in service['socks_backend']:
+            socks_ip, socks_port = service['socks_backend'].split(':', 1)
+            service['socks_ip'] = socks_ip
+            service['socks_port'] = socks_port
+        else:
+            service['socks_ip'] = service['socks_backend']
+            service['socks_port'] = ''
+
+    # 处理有效期显示
+    if 'expires_display' in service:
+        if service['expires_display'] == '永久':
+            service['expires_at'] = '0'
+        else:
+            service['expires_at'] = service.get('expires_at', '0')
+
+    return service
+
+
+class _Inotify:
+    """基于ctypes的最小inotify封装"""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self, timeout):
+        """等待并读取事件，返回 [(wd, mask, name), ...]"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', 'replace')
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ServiceRegistry:
+    """服务注册表
+
+    首次访问时加载全部服务，之后通过inotify监听服务目录，
+    只重新解析发生变化的服务目录；inotify不可用时退回到mtime轮询。
+    对外提供不可变快照，请求处理时不再访问文件系统。
+    """
+
+    def __init__(self, service_dir=None, poll_interval=5, debounce=0.05):
+        self.service_dir = service_dir
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+
+        self._records = {}
+        self._signatures = {}
+        self._snapshot = ()
+        self._version = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._watcher = None
+        self._stop_event = threading.Event()
+        self.mode = None
+
+    def configure(self, service_dir=None, poll_interval=None):
+        """设置服务目录等运行参数"""
+        if service_dir is not None:
+            self.service_dir = service_dir
+        if poll_interval is not None:
+            self.poll_interval = poll_interval
+
+    @property
+    def version(self):
+        """快照版本号，每次内容变化时递增"""
+        return self._version
+
+    def snapshot(self):
+        """获取当前服务快照 (按端口排序的只读记录元组)"""
+        if not self._loaded:
+            self.start()
+        return self._snapshot
+
+    def get(self, port):
+        """获取单个服务的只读记录"""
+        if not self._loaded:
+            self.start()
+        return self._records.get(str(port))
+
+    def port_dirs(self):
+        """服务目录下的全部端口目录 (包括尚未写入信息文件的目录)"""
+        return self._list_port_dirs()
+
+    def start(self):
+        """加载全部服务并启动目录监听"""
+        with self._lock:
+            if self._loaded:
+                return
+            self._full_scan()
+            self._loaded = True
+
+            self._stop_event.clear()
+            self._watcher = threading.Thread(target=self._watch_loop, daemon=True)
+            self._watcher.start()
+
+    def stop(self):
+        """停止目录监听"""
+        self._stop_event.set()
+        if self._watcher:
+            self._watcher.join(timeout=2)
+        with self._lock:
+            self._loaded = False
+
+    def invalidate(self, port=None):
+        """立即重新解析指定服务 (不指定端口时全量重建)
+
+        写入服务文件的代码路径调用此方法，避免等待inotify事件。
+        """
+        with self._lock:
+            if port is None:
+                self._full_scan()
+            else:
+                self._refresh_ports([str(port)])
+
+    def _list_port_dirs(self):
+        """列出服务目录下的端口目录"""
+        if not self.service_dir or not os.path.isdir(self.service_dir):
+            return []
+        return [
+            entry.name for entry in os.scandir(self.service_dir)
+            if entry.name.isdigit() and entry.is_dir()
+        ]
+
+    def _signature(self, port_dir):
+        """服务目录中相关文件的mtime签名，用于轮询模式"""
+        port_path = os.path.join(self.service_dir, port_dir)
+        signature = []
+        for name in WATCHED_FILES:
+            try:
+                st = os.stat(os.path.join(port_path, name))
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _full_scan(self):
+        """全量加载 (调用方持有锁)"""
+        records = {}
+        signatures = {}
+        for port_dir in self._list_port_dirs():
+            signatures[port_dir] = self._signature(port_dir)
+            service = parse_service_dir(port_dir, os.path.join(self.service_dir, port_dir))
+            if service is not None:
+                records[port_dir] = MappingProxyType(service)
+
+        self._records = records
+        self._signatures = signatures
+        self._publish()
+        logger.info(f"服务注册表已加载 {len(records)} 个服务")
+
+    def _refresh_ports(self, ports):
+        """重新解析指定端口 (调用方持有锁)"""
+        changed = False
+        for port_dir in ports:
+            port_path = os.path.join(self.service_dir, port_dir)
+            service = None
+            if os.path.isdir(port_path):
+                self._signatures[port_dir] = self._signature(port_dir)
+                service = parse_service_dir(port_dir, port_path)
+            else:
+                self._signatures.pop(port_dir, None)
+
+            if service is None:
+                changed |= self._records.pop(port_dir, None) is not None
+            else:
+                self._records[port_dir] = MappingProxyType(service)
+                changed = True
+
+        if changed:
+            self._publish()
+
+    def _publish(self):
+        """生成新的不可变快照 (调用方持有锁)"""
+        self._snapshot = tuple(
+            self._records[port] for port in sorted(self._records, key=int)
+        )
+        self._version += 1
+
+    def _watch_loop(self):
+        """监听线程：优先inotify，失败时退回轮询"""
+        try:
+            self._inotify_loop()
+        except Exception as e:
+            if not self._stop_event.is_set():
+                logger.warning(f"inotify不可用，改用轮询监听服务目录: {e}")
+                self._poll_loop()
+
+    def _inotify_loop(self):
+        inotify = _Inotify()
+        self.mode = 'inotify'
+        try:
+            root_wd = inotify.add_watch(self.service_dir, ROOT_MASK)
+            wd_to_port = {}
+
+            def watch_port(port_dir):
+                try:
+                    wd = inotify.add_watch(os.path.join(self.service_dir, port_dir), SERVICE_MASK)
+                    wd_to_port[wd] = port_dir
+                except OSError:
+                    pass
+
+            for port_dir in self._list_port_dirs():
+                watch_port(port_dir)
+
+            # 监听建立前可能有变化，补一次全量
+            with self._lock:
+                self._full_scan()
+
+            while not self._stop_event.is_set():
+                events = inotify.read_events(1.0)
+                if not events:
+                    continue
+
+                # 合并短时间内的连续事件
+                time.sleep(self.debounce)
+                events.extend(inotify.read_events(0))
+
+                dirty = set()
+                rescan = False
+                for wd, mask, name in events:
+                    if mask & IN_Q_OVERFLOW:
+                        rescan = True
+                    elif wd == root_wd:
+                        if not name.isdigit():
+                            continue
+                        if mask & (IN_CREATE | IN_MOVED_TO):
+                            watch_port(name)
+                        dirty.add(name)
+                    elif wd in wd_to_port:
+                        port_dir = wd_to_port[wd]
+                        if mask & IN_IGNORED:
+                            wd_to_port.pop(wd, None)
+                            dirty.add(port_dir)
+                        elif mask & (IN_DELETE_SELF | IN_MOVE_SELF) or name in WATCHED_FILES:
+                            dirty.add(port_dir)
+
+                with self._lock:
+                    if rescan:
+                        self._full_scan()
+                    elif dirty:
+                        self._refresh_ports(sorted(dirty))
+        finally:
+            inotify.close()
+
+    def _poll_loop(self):
+        self.mode = 'poll'
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                port_dirs = set(self._list_port_dirs())
+                dirty = [p for p in port_dirs if self._signatures.get(p) != self._signature(p)]
+                dirty.extend(p for p in list(self._signatures) if p not in port_dirs)
+                if dirty:
+                    with self._lock:
+                        self._refresh_ports(dirty)
+            except Exception as e:
+                logger.error(f"轮询服务目录失败: {e}")
+
+
+# 创建全局实例
+service_registry = ServiceRegistry()
+
+if __name__ == "__main__":
+    # 测试输出
+    import sys
+    service_registry.configure(service_dir=sys.argv[1] if len(sys.argv) > 1 else
+                               os.path.join(os.path.dirname(__file__), '..', 'data', 'services'))
+    start = time.time()
+    services = service_registry.snapshot()
+    print(f"加载 {len(services)} 个服务: {round((time.time() - start) * 1000, 2)}ms")
+    start = time.time()
+    for _ in range(1000):
+        service_registry.snapshot()
+    print(f"快照读取: {round((time.time() - start) * 1000, 3)}us/次")
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务守护模块 - 通过pidfd即时感知Xray进程退出，按指数退避自动重启，替代monitor.sh轮询
+"""
+
+import os
+import time
+import fcntl
+import random
+import select
+import threading
+import logging
+from collections import deque
+
+from event_bus import event_bus
+from process_scanner import process_scanner
+from readiness import ProcessHandle
+from service_registry import service_registry
+from xray_supervisor import xray_supervisor
+
+logger = logging.getLogger(__name__)
+
+
+def backoff_delay(attempt, initial, maximum):
+    """第attempt次重启前的等待秒数：指数增长，取上限后在后一半区间内随机抖动
+
+    抖动避免大量服务同时崩溃后在同一时刻一起重启。
+    """
+    base = min(maximum, initial * (2 ** attempt))
+    return base / 2 + random.uniform(0, base / 2)
+
+
+class ServiceWatchdog:
+    """服务进程守护
+
+    - 以服务目录中的PID文件作为"应当运行"的标志：stop() 会删除PID文件，
+      进程退出而PID文件仍在即视为崩溃
+    - 每个受守护的进程持有一个pidfd，单个线程poll等待，进程退出立即感知；
+      不支持pidfd时按 poll_interval 检查
+    - 崩溃后按指数退避+抖动重启，进程稳定运行 stable_after 秒后退避归零
+    - crash_window 秒内崩溃 crash_limit 次即隔离，quarantine_time 秒后再尝试一次；
+      手动启动服务会解除隔离
+    - 已过期的服务不重启，仍在运行的在对账时停止 (共用进程中为在线移除入站)；
+      内存中的过期时间索引随服务注册表更新
+    - 重启、隔离等事件以 'watchdog' 类型推送到事件总线
+    同一时间只有一个守护实例生效 (lock_file)，Web进程与Shell启动的守护进程不会重复重启。
+    """
+
+    def __init__(self, backoff_initial=1.0, backoff_max=60.0, stable_after=60.0, crash_limit=5,
+                 crash_window=300.0, quarantine_time=600.0, resync_interval=30.0,
+                 poll_interval=5.0, lock_file=None):
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.stable_after = stable_after
+        self.crash_limit = crash_limit
+        self.crash_window = crash_window
+        self.quarantine_time = quarantine_time
+        self.resync_interval = resync_interval
+        self.poll_interval = poll_interval
+        self.lock_file = lock_file
+
+        self._ports = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._wake_r = self._wake_w = None
+        self._lock_fd = None
+        # 守护线程自己发起的启动，不视为手动启动
+        self._restarting = None
+
+        # 过期时间索引 {端口: 过期时间戳}，随服务注册表版本重建
+        self._expiry = {}
+        self._expiry_version = None
+
+        # 统计
+        self.counters = {
+            'crashes': 0,
+            'restarts': 0,
+            'restart_failures': 0,
+            'quarantines': 0,
+            'skipped_expired': 0,
+            'stopped_expired': 0
+        }
+
+    def configure(self, lock_file=None, **options):
+        """设置锁文件与退避/隔离参数"""
+        if lock_file is not None:
+            self.lock_file = lock_file
+        for key, value in options.items():
+            if value is not None and hasattr(self, key):
+                setattr(self, key, value)
+
+    @property
+    def active(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def start(self):
+        """启动守护线程，已有其他守护实例时返回False"""
+        if self.active:
+            return True
+        if not self._acquire_lock():
+            logger.info("已有其他服务守护实例在运行，本进程不启动守护")
+            return False
+
+        self._stop_event.clear()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        xray_supervisor.listeners.append(self._on_supervisor_event)
+        self._thread = threading.Thread(target=self._run, name='service-watchdog', daemon=True)
+        self._thread.start()
+        logger.info("服务守护已启动")
+        return True
+
+    def stop(self):
+        """停止守护线程"""
+        self._stop_event.set()
+        self._wake()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._on_supervisor_event in xray_supervisor.listeners:
+            xray_supervisor.listeners.remove(self._on_supervisor_event)
+        with self._lock:
+            for state in self._ports.values():
+                self._close_handle(state)
+            self._ports = {}
+        for fd in (self._wake_r, self._wake_w):
+            if fd is not None:
+                os.close(fd)
+        self._wake_r = self._wake_w = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def release(self, port):
+        """解除隔离并清空崩溃记录"""
+        with self._lock:
+            state = self._ports.get(str(port))
+            if not state or not state['quarantined_until']:
+                return False
+            self._reset(state)
+        self._publish('released', str(port))
+        self._wake()
+        return True
+
+    def get_stats(self):
+        """守护状态与计数"""
+        now = time.time()
+        with self._lock:
+            watched = sum(1 for s in self._ports.values() if s['handle'])
+            pending = {port: round(max(0, s['restart_at'] - time.monotonic()), 1)
+                       for port, s in self._ports.items() if s['restart_at'] is not None}
+            quarantined = {port: round(s['quarantined_until'] - now)
+                           for port, s in self._ports.items() if s['quarantined_until']}
+        return {
+            'active': self.active,
+            'mode': 'pidfd' if hasattr(os, 'pidfd_open') else 'poll',
+            'watched': watched,
+            'pending_restarts': pending,
+            'quarantined': quarantined,
+            'counters': dict(self.counters)
+        }
+
+    # ---- 守护线程 ----
+
+    def _run(self):
+        next_resync = 0
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            if now >= next_resync:
+                try:
+                    self._resync()
+                except Exception as e:
+                    logger.error(f"服务守护同步进程状态失败: {e}")
+                next_resync = now + self.resync_interval
+
+            with self._lock:
+                handles = {port: s['handle'] for port, s in self._ports.items() if s['handle']}
+                due = [s['restart_at'] for s in self._ports.values() if s['restart_at'] is not None]
+            timeout = max(0, min(due + [next_resync]) - time.monotonic())
+            polled = {port: h for port, h in handles.items() if h.fileno() is None}
+            if polled:
+                timeout = min(timeout, self.poll_interval)
+
+            # 使用poll而不是select，服务数量多时不受FD_SETSIZE限制
+            fds = {h.fileno(): port for port, h in handles.items() if h.fileno() is not None}
+            poller = select.poll()
+            for fd in (self._wake_r, *fds):
+                poller.register(fd, select.POLLIN)
+            # 句柄在等待期间被其他线程关闭时返回POLLNVAL，忽略即可
+            readable = [fd for fd, mask in poller.poll(timeout * 1000) if not mask & select.POLLNVAL]
+            if self._wake_r in readable:
+                self._drain_wake()
+
+            exited = [fds[fd] for fd in readable if fd in fds]
+            exited += [port for port, h in polled.items() if h.exited()]
+            for port in exited:
+                self._on_exit(port, handles[port])
+
+            self._run_due_restarts()
+
+    def _resync(self):
+        """与PID文件和进程表对账：接管已在运行的进程，发现守护停止期间崩溃的服务"""
+        records = service_registry.snapshot()
+        self._refresh_expiry(records)
+        pidfiles = {r['port']: r.get('pid') for r in records}
+        states = process_scanner.states(pidfiles, force=True)
+
+        with self._lock:
+            for port in list(self._ports):
+                if port not in pidfiles:
+                    self._close_handle(self._ports.pop(port))
+
+            crashed = []
+            for port, pidfile_pid in pidfiles.items():
+                state = self._ports.get(port)
+                running = states.get(port, {}).get('status') == 'running'
+                if running:
+                    pid = states[port]['pid']
+                    if not state or not state['handle'] or state['handle'].pid != pid:
+                        self._watch(port, pid)
+                elif pidfile_pid and not (state and (state['handle'] or state['restart_at'] is not None
+                                                     or state['quarantined_until'])):
+                    crashed.append(port)
+                elif not pidfile_pid and state and state['handle']:
+                    # 由Shell脚本停止
+                    self._close_handle(state)
+
+        for port in crashed:
+            self._record_crash(port, None, '进程不存在但PID文件仍在')
+
+        for port in sorted(pidfiles, key=int):
+            if states.get(port, {}).get('status') == 'running' and self._is_expired(port):
+                self._stop_expired(port)
+
+    def _stop_expired(self, port):
+        """停止已过期但仍在运行的服务"""
+        result = xray_supervisor.stop(port)
+        service_registry.invalidate(port)
+        if result['success']:
+            self.counters['stopped_expired'] += 1
+            logger.info(f"端口 {port} 已过期，已停止")
+            self._publish('expired', port)
+        else:
+            logger.error(f"停止已过期的端口 {port} 失败: {result['message']}")
+
+    def _on_exit(self, port, handle):
+        with self._lock:
+            state = self._ports.get(port)
+            if not state or state['handle'] is not handle:
+                return
+            self._close_handle(state)
+        code = xray_supervisor.reap().get(port)
+
+        # stop() 会删除PID文件，PID文件不在说明是正常停止
+        if not os.path.exists(self._pidfile(port)):
+            return
+        self._record_crash(port, code, f'进程退出 (退出码 {code})' if code is not None else '进程退出')
+
+    def _record_crash(self, port, code, reason):
+        """记录一次崩溃，安排退避重启或进入隔离"""
+        if self._is_expired(port):
+            self.counters['skipped_expired'] += 1
+            logger.info(f"端口 {port} {reason}，服务已过期，不再重启")
+            self._publish('skipped', port, reason=f'{reason}，服务已过期')
+            return
+
+        now = time.time()
+        with self._lock:
+            state = self._ports.setdefault(port, self._new_state())
+            if state['started_at'] and now - state['started_at'] >= self.stable_after:
+                state['attempt'] = 0
+            state['crashes'].append(now)
+            while state['crashes'] and now - state['crashes'][0] > self.crash_window:
+                state['crashes'].popleft()
+            self.counters['crashes'] += 1
+
+            if len(state['crashes']) >= self.crash_limit:
+                state['quarantined_until'] = now + self.quarantine_time
+                state['restart_at'] = time.monotonic() + self.quarantine_time
+                self.counters['quarantines'] += 1
+                crashes = len(state['crashes'])
+                delay = None
+            else:
+                delay = backoff_delay(state['attempt'], self.backoff_initial, self.backoff_max)
+                state['attempt'] += 1
+                state['restart_at'] = time.monotonic() + delay
+
+        if delay is None:
+            logger.warning(f"端口 {port} 在 {self.crash_window:.0f} 秒内崩溃 {crashes} 次，"
+                           f"隔离 {self.quarantine_time:.0f} 秒")
+            self._publish('quarantined', port, reason=reason, exit_code=code, crashes=crashes,
+                          quarantine_seconds=self.quarantine_time)
+        else:
+            logger.warning(f"端口 {port} {reason}，{delay:.1f} 秒后重启")
+            self._publish('crashed', port, reason=reason, exit_code=code, restart_in=round(delay, 2))
+
+    def _run_due_restarts(self):
+        now = time.monotonic()
+        with self._lock:
+            due = [port for port, s in self._ports.items()
+                   if s['restart_at'] is not None and s['restart_at'] <= now]
+        for port in due:
+            if self._stop_event.is_set():
+                return
+            self._restart(port)
+
+    def _restart(self, port):
+        with self._lock:
+            state = self._ports.get(port)
+            if not state or state['restart_at'] is None:
+                return
+            state['restart_at'] = None
+            # 上次由守护发起的启动失败会删除PID文件，此时仍需重试
+            retrying = state['retrying']
+            if state['quarantined_until'] and time.time() >= state['quarantined_until']:
+                # 隔离期满，清空记录后再尝试一次
+                logger.info(f"端口 {port} 隔离期满，尝试重新启动")
+                self._reset(state)
+                state['retrying'] = retrying
+
+        if not retrying and not os.path.exists(self._pidfile(port)):
+            return
+        if self._is_expired(port):
+            return
+
+        self._restarting = port
+        try:
+            result = xray_supervisor.start(port)
+        finally:
+            self._restarting = None
+
+        if result['success']:
+            self.counters['restarts'] += 1
+            with self._lock:
+                state['retrying'] = False
+            logger.info(f"端口 {port} 已自动重启 (PID: {result['pid']})")
+            self._publish('restarted', port, pid=result['pid'], startup_ms=result.get('startup_ms'))
+        else:
+            self.counters['restart_failures'] += 1
+            with self._lock:
+                state['retrying'] = True
+            self._record_crash(port, None, f"自动重启失败: {result['message']}")
+
+    def _on_supervisor_event(self, event, port, pid):
+        """xray_supervisor 的进程事件"""
+        port = str(port)
+        with self._lock:
+            state = self._ports.setdefault(port, self._new_state())
+            if event == 'started':
+                if self._restarting != port:
+                    # 手动启动：解除隔离，清空崩溃记录
+                    self._reset(state)
+                self._watch(port, pid)
+            elif event == 'stopping':
+                # 正常停止，不再守护
+                self._close_handle(state)
+                self._reset(state)
+        self._wake()
+
+    # ---- 内部工具 ----
+
+    @staticmethod
+    def _new_state():
+        return {
+            'handle': None,
+            'started_at': None,
+            'attempt': 0,
+            'crashes': deque(),
+            'restart_at': None,
+            'quarantined_until': None,
+            'retrying': False
+        }
+
+    @staticmethod
+    def _reset(state):
+        state['attempt'] = 0
+        state['crashes'].clear()
+        state['restart_at'] = None
+        state['quarantined_until'] = None
+        state['retrying'] = False
+
+    def _watch(self, port, pid):
+        """开始守护进程 (调用方持有锁)"""
+        state = self._ports.setdefault(port, self._new_state())
+        self._close_handle(state)
+        state['handle'] = ProcessHandle(pid)
+        state['started_at'] = time.time()
+        state['restart_at'] = None
+
+    @staticmethod
+    def _close_handle(state):
+        if state['handle']:
+            state['handle'].close()
+            state['handle'] = None
+
+    def _refresh_expiry(self, records):
+        if self._expiry_version == service_registry.version:
+            return
+        expiry = {}
+        for record in records:
+            try:
+                expires_at = int(record.get('expires_at') or 0)
+            except ValueError:
+                expires_at = 0
+            if expires_at:
+                expiry[record['port']] = expires_at
+        self._expiry = expiry
+        self._expiry_version = service_registry.version
+
+    def _is_expired(self, port):
+        self._refresh_expiry(service_registry.snapshot())
+        expires_at = self._expiry.get(port)
+        return bool(expires_at) and time.time() > expires_at
+
+    def _pidfile(self, port):
+        return os.path.join(xray_supervisor.service_dir, port, 'xray.pid')
+
+    def _publish(self, action, port, **details):
+        event_bus.publish('watchdog', dict(details, action=action, port=port,
+                                           counters=dict(self.counters),
+                                           timestamp=time.time()))
+
+    def _wake(self):
+        if self._wake_w is not None:
+            try:
+                os.write(self._wake_w, b'\0')
+            except OSError:
+                pass
+
+    def _drain_wake(self):
+        try:
+            while os.read(self._wake_r, 512):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _acquire_lock(self):
+        if not self.lock_file:
+            return True
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f'{os.getpid()}\n'.encode())
+        self._lock_fd = fd
+        return True
+
+
+# 创建全局实例
+service_watchdog = ServiceWatchdog()
+
+if __name__ == "__main__":
+    # 独立运行，供Shell脚本的 start_monitor 调用
+    import signal
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Xray服务守护')
+    parser.add_argument('--service-dir', default=os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'services'))
+    parser.add_argument('--xray-bin', default=None)
+    parser.add_argument('--log-file', default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filename=args.log_file
+    )
+    data_dir = os.path.dirname(args.service_dir)
+    xray_supervisor.configure(
+        service_dir=args.service_dir,
+        xray_bin=args.xray_bin or os.path.join(os.path.dirname(data_dir), 'xray'),
+        mode=os.environ.get('XRAY_RUNTIME_MODE', 'process')
+    )
+    service_registry.configure(service_dir=args.service_dir)
+    service_watchdog.configure(lock_file=os.path.join(data_dir, 'watchdog.lock'))
+
+    if not service_watchdog.start():
+        raise SystemExit(1)
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    stop_event.wait()
+    service_watchdog.stop()
+    logger.info("服务守护已停止")
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+套接字快照模块 - 解析/proc/net/{tcp,tcp6,udp,udp6}，按端口建立索引
+"""
+
+import os
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# /proc/net/tcp 中的状态码 (见 include/net/tcp_states.h)
+TCP_STATES = {
+    '01': 'ESTABLISHED',
+    '02': 'SYN_SENT',
+    '03': 'SYN_RECV',
+    '04': 'FIN_WAIT1',
+    '05': 'FIN_WAIT2',
+    '06': 'TIME_WAIT',
+    '07': 'CLOSE',
+    '08': 'CLOSE_WAIT',
+    '09': 'LAST_ACK',
+    '0A': 'LISTEN',
+    '0B': 'CLOSING',
+    '0C': 'NEW_SYN_RECV',
+}
+
+PROC_NET_FILES = (('tcp', 'tcp'), ('tcp6', 'tcp'), ('udp', 'udp'), ('udp6', 'udp'))
+
+
+class SocketSnapshot:
+    """某一时刻的套接字表，按本地端口索引"""
+
+    def __init__(self, ports=None, totals=None, timestamp=None):
+        # 端口 -> {'listen': bool, 'udp': bool, 'established': int, 'states': {状态: 数量}}
+        self.ports = ports or {}
+        # 全部TCP套接字的状态统计
+        self.totals = totals or {}
+        self.timestamp = timestamp or time.time()
+
+    def is_listening(self, port):
+        """端口是否有TCP监听"""
+        entry = self.ports.get(int(port))
+        return bool(entry and entry['listen'])
+
+    def is_bound(self, port):
+        """端口是否被TCP监听或UDP绑定"""
+        entry = self.ports.get(int(port))
+        return bool(entry and (entry['listen'] or entry['udp']))
+
+    def established(self, port):
+        """端口上的已建立连接数"""
+        entry = self.ports.get(int(port))
+        return entry['established'] if entry else 0
+
+    @property
+    def total_established(self):
+        return self.totals.get('ESTABLISHED', 0)
+
+    def to_dict(self):
+        return {
+            'timestamp': self.timestamp,
+            'totals': dict(self.totals),
+            'listening_ports': sorted(p for p, e in self.ports.items() if e['listen'])
+        }
+
+
+def _new_entry():
+    return {'listen': False, 'udp': False, 'established': 0, 'states': {}}
+
+
+def parse_proc_net(content, protocol, ports, totals):
+    """解析一个/proc/net文件的内容，累加到 ports/totals"""
+    lines = content.splitlines()
+    for line in lines[1:]:
+        # 只需要 local_address 与 st 两列
+        fields = line.split(None, 4)
+        if len(fields) < 4:
+            continue
+        local, state = fields[1], fields[3]
+        try:
+            port = int(local[local.rfind(':') + 1:], 16)
+        except ValueError:
+            continue
+
+        entry = ports.get(port)
+        if entry is None:
+            entry = ports[port] = _new_entry()
+
+        if protocol == 'udp':
+            entry['udp'] = True
+            continue
+
+        state_name = TCP_STATES.get(state, state)
+        totals[state_name] = totals.get(state_name, 0) + 1
+        entry['states'][state_name] = entry['states'].get(state_name, 0) + 1
+        if state_name == 'LISTEN':
+            entry['listen'] = True
+        elif state_name == 'ESTABLISHED':
+            entry['established'] += 1
+
+
+def port_listening(port, proc_root='/proc'):
+    """只检查单个端口是否处于TCP监听状态 (比构建完整快照更轻量)
+
+    没有/proc/net时返回None，由调用方自行回退。
+    """
+    needle = f':{int(port):04X} '
+    found = None
+    for name in ('tcp', 'tcp6'):
+        try:
+            with open(os.path.join(proc_root, 'net', name), 'r') as f:
+                content = f.read()
+        except OSError:
+            continue
+        found = False
+        start = content.find(needle)
+        while start != -1:
+            # 本地地址列之后依次为远端地址与状态
+            fields = content[start:content.find('\n', start)].split(None, 3)
+            if len(fields) > 2 and fields[2] == '0A':
+                return True
+            start = content.find(needle, start + 1)
+    return found
+
+
+def process_port_sockets(pid, port, proc_root='/proc'):
+    """统计进程自己在本地端口上的TCP套接字，返回 {'listen': 数量, 'established': 数量}
+
+    多个进程通过SO_REUSEPORT监听同一端口时，端口级的快照无法区分，这里用
+    /proc/<pid>/fd 中的socket inode与 /proc/<pid>/net/tcp 的inode列匹配。
+    进程不存在或无权限读取时返回None。
+    """
+    fd_dir = os.path.join(proc_root, str(pid), 'fd')
+    inodes = set()
+    try:
+        for fd in os.listdir(fd_dir):
+            try:
+                target = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            if target.startswith('socket:['):
+                inodes.add(target[8:-1])
+    except OSError:
+        return None
+
+    counts = {'listen': 0, 'established': 0}
+    needle = f':{int(port):04X}'
+    for name in ('tcp', 'tcp6'):
+        try:
+            with open(os.path.join(proc_root, str(pid), 'net', name), 'r') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            continue
+        for line in lines[1:]:
+            # sl local rem st tx:rx tr:when retrnsmt uid timeout inode
+            fields = line.split(None, 10)
+            if len(fields) < 10 or not fields[1].endswith(needle) or fields[9] not in inodes:
+                continue
+            if fields[3] == '0A':
+                counts['listen'] += 1
+            elif fields[3] == '01':
+                counts['established'] += 1
+    return counts
+
+
+class SocketTable:
+    """套接字快照构建器
+
+    每个interval内最多解析一次/proc/net，SystemMonitor 与
+    get_system_stats() 共享同一份端口索引。
+    """
+
+    def __init__(self, proc_root='/proc', interval=2.0):
+        self.proc_root = proc_root
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+        # 实际构建快照的次数
+        self.build_count = 0
+
+    def snapshot(self, force=False):
+        """获取套接字快照 (interval内复用)"""
+        with self._lock:
+            snapshot = self._snapshot
+            if force or snapshot is None or time.time() - snapshot.timestamp >= self.interval:
+                snapshot = self._snapshot = self._build()
+                self.build_count += 1
+            return snapshot
+
+    def _build(self):
+        net_dir = os.path.join(self.proc_root, 'net')
+        if not os.path.exists(os.path.join(net_dir, 'tcp')):
+            return self._build_with_psutil()
+
+        ports = {}
+        totals = {}
+        for name, protocol in PROC_NET_FILES:
+            try:
+                with open(os.path.join(net_dir, name), 'r') as f:
+                    content = f.read()
+            except OSError:
+                continue
+            parse_proc_net(content, protocol, ports, totals)
+        return SocketSnapshot(ports, totals)
+
+    def _build_with_psutil(self):
+        """没有/proc/net时 (如macOS) 使用psutil构建"""
+        ports = {}
+        totals = {}
+        try:
+            import psutil
+            import socket
+            for conn in psutil.net_connections():
+                if not conn.laddr:
+                    continue
+                entry = ports.get(conn.laddr.port)
+                if entry is None:
+                    entry = ports[conn.laddr.port] = _new_entry()
+                if conn.type == socket.SOCK_DGRAM:
+                    entry['udp'] = True
+                    continue
+                state = conn.status
+                totals[state] = totals.get(state, 0) + 1
+                entry['states'][state] = entry['states'].get(state, 0) + 1
+                if state == 'LISTEN':
+                    entry['listen'] = True
+                elif state == 'ESTABLISHED':
+                    entry['established'] += 1
+        except Exception as e:
+            logger.warning(f"获取套接字列表失败: {e}")
+        return SocketSnapshot(ports, totals)
+
+
+# 创建全局实例
+socket_table = SocketTable()
+
+if __name__ == "__main__":
+    # 基准测试: 10k套接字 / 1k服务
+    import random
+    import tempfile
+
+    def fake_line(i, port, state):
+        return (f"{i:4d}: 0100007F:{port:04X} 0100007F:{random.randint(1024, 65535):04X} "
+                f"{state} 00000000:00000000 00:00000000 00000000     0        0 {i} 1\n")
+
+    header = "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+    service_ports = list(range(20000, 21000))
+    proc_root = tempfile.mkdtemp()
+    os.makedirs(os.path.join(proc_root, 'net'))
+    with open(os.path.join(proc_root, 'net', 'tcp'), 'w') as f:
+        f.write(header)
+        for i, port in enumerate(service_ports):
+            f.write(fake_line(i, port, '0A'))
+        for i in range(len(service_ports), 10000):
+            f.write(fake_line(i, random.choice(service_ports), random.choice(['01', '01', '06', '08'])))
+    for name in ('tcp6', 'udp', 'udp6'):
+        with open(os.path.join(proc_root, 'net', name), 'w') as f:
+            f.write(header)
+
+    table = SocketTable(proc_root=proc_root)
+    rounds = 20
+    start = time.time()
+    for _ in range(rounds):
+        snapshot = table.snapshot(force=True)
+        for port in service_ports:
+            snapshot.is_listening(port)
+            snapshot.established(port)
+    elapsed = (time.time() - start) / rounds
+
+    print(f"套接字: 10000, 服务: {len(service_ports)}")
+    print(f"构建快照 + {len(service_ports)} 次端口查询: {round(elapsed * 1000, 2)}ms")
+    print(f"统计: {snapshot.totals}")
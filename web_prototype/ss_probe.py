@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量探测模块 - 基于asyncio并发探测SS服务，限制并发数、单次超时与整体截止时间
+
+探测方式：
+- probe_tcp: 只检查端口能否连通
+- probe_handshake: 用服务的加密方式与密码完成Shadowsocks AEAD握手，
+  经服务的SOCKS5出站连接目标地址，测量首字节时间与少量吞吐
+"""
+
+import os
+import time
+import hmac
+import queue
+import asyncio
+import hashlib
+import ipaddress
+import threading
+import logging
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+except ImportError:
+    # 未安装cryptography时握手探测退回为TCP连接探测 (结果标记为 degraded)
+    InvalidTag = AESGCM = ChaCha20Poly1305 = None
+
+# 是否能进行AEAD握手探测 (cryptography 见 requirements.txt)
+HANDSHAKE_SUPPORTED = AESGCM is not None
+
+logger = logging.getLogger(__name__)
+
+# 同时进行的探测数
+DEFAULT_CONCURRENCY = 20
+# 单次探测超时 (秒)
+DEFAULT_TIMEOUT = 5.0
+# 整体截止时间 (秒)，到达后未完成的探测直接返回超时
+DEFAULT_DEADLINE = 30.0
+# 探测在自身超时后返回结果的余量 (秒)，超出后才由外层判定为超时
+PROBE_GRACE = 0.5
+
+# 握手探测经隧道连接的目标地址与发送的请求
+DEFAULT_DEST = ('www.gstatic.com', 80)
+# 吞吐采样：收到首字节后最多再接收的字节数与时长 (秒)，对端关闭时提前结束
+SAMPLE_BYTES = 64 * 1024
+SAMPLE_WINDOW = 1.0
+
+# 加密方式 -> (密钥长度, AEAD算法)，与 config_renderer.SS_METHODS 中的AEAD方式对应
+AEAD_METHODS = {
+    'aes-128-gcm': (16, 'AESGCM'),
+    'aes-256-gcm': (32, 'AESGCM'),
+    'chacha20-poly1305': (32, 'ChaCha20Poly1305'),
+    'chacha20-ietf-poly1305': (32, 'ChaCha20Poly1305')
+}
+# AEAD单个数据块的最大负载与认证标签长度 (SIP004)
+MAX_CHUNK = 0x3FFF
+TAG_SIZE = 16
+
+
+def probe_result(success, latency=-1, message=''):
+    """探测结果 (与 test_ss_connection 的返回格式一致)"""
+    return {'success': success, 'latency': latency, 'message': message}
+
+
+async def probe_tcp(target, timeout):
+    """TCP连接探测：只检查端口能否连通，latency为建立连接的耗时 (毫秒)"""
+    start = time.monotonic()
+    try:
+        _, writer = await asyncio.wait_for(
+            asyncio.open_connection(target['server'], target['port']), timeout)
+    except asyncio.TimeoutError:
+        return probe_result(False, message='Connection timeout')
+    except OSError as e:
+        return probe_result(False, message=f'Connection failed: {e.strerror or e}')
+    latency = round((time.monotonic() - start) * 1000, 2)
+
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return probe_result(True, latency, 'Connection successful')
+
+
+def parse_dest(spec):
+    """解析 'host:port' (IPv6写作 '[::1]:port') 为 (host, port)"""
+    host, _, port = (spec or '').strip().rpartition(':')
+    host = host.strip('[]')
+    if not host or not port.isdigit() or not 1 <= int(port) <= 65535:
+        raise ValueError(f'目标地址无效: {spec}')
+    return host, int(port)
+
+
+def socks_address(host, port):
+    """SOCKS5格式的地址 (ATYP + 地址 + 端口)，也是SS请求的头部"""
+    try:
+        ip = ipaddress.ip_address(host)
+        atyp = b'\x01' if ip.version == 4 else b'\x04'
+        address = atyp + ip.packed
+    except ValueError:
+        name = host.encode('idna')
+        address = b'\x03' + bytes([len(name)]) + name
+    return address + int(port).to_bytes(2, 'big')
+
+
+def http_request(dest):
+    """握手探测默认发送的HTTP请求"""
+    host, port = dest
+    if port != 80:
+        host = f'{host}:{port}'
+    return (f'GET / HTTP/1.1\r\nHost: {host}\r\nUser-Agent: ss-probe\r\n'
+            f'Connection: close\r\n\r\n').encode()
+
+
+def evp_bytes_to_key(password, key_len):
+    """由密码得到主密钥 (OpenSSL EVP_BytesToKey，MD5，与Xray/shadowsocks-libev一致)"""
+    key = prev = b''
+    while len(key) < key_len:
+        prev = hashlib.md5(prev + password).digest()
+        key += prev
+    return key[:key_len]
+
+
+def hkdf_sha1(key, salt, info, length):
+    """HKDF-SHA1，由主密钥与salt派生每个连接方向的子密钥"""
+    prk = hmac.new(salt, key, hashlib.sha1).digest()
+    okm = block = b''
+    counter = 1
+    while len(okm) < length:
+        block = hmac.new(prk, block + info + bytes([counter]), hashlib.sha1).digest()
+        okm += block
+        counter += 1
+    return okm[:length]
+
+
+class AEADStream:
+    """Shadowsocks AEAD的单向数据流
+
+    数据分块为 [加密的2字节长度 + 标签][加密的负载 + 标签]，
+    nonce为12字节小端计数器，每次加解密后加一。
+    """
+
+    def __init__(self, method, key, salt):
+        key_len, algorithm = AEAD_METHODS[method]
+        cipher = AESGCM if algorithm == 'AESGCM' else ChaCha20Poly1305
+        self.aead = cipher(hkdf_sha1(key, salt, b'ss-subkey', key_len))
+        self.counter = 0
+
+    def _nonce(self):
+        nonce = self.counter.to_bytes(12, 'little')
+        self.counter += 1
+        return nonce
+
+    def seal(self, data):
+        """加密并分块"""
+        out = b''
+        for i in range(0, len(data), MAX_CHUNK):
+            chunk = data[i:i + MAX_CHUNK]
+            out += self.aead.encrypt(self._nonce(), len(chunk).to_bytes(2, 'big'), None)
+            out += self.aead.encrypt(self._nonce(), chunk, None)
+        return out
+
+    async def read_chunk(self, reader):
+        """读取并解密一个数据块，密钥不匹配时抛出 InvalidTag"""
+        header = await reader.readexactly(2 + TAG_SIZE)
+        length = int.from_bytes(self.aead.decrypt(self._nonce(), header, None), 'big') & MAX_CHUNK
+        return self.aead.decrypt(self._nonce(), await reader.readexactly(length + TAG_SIZE), None)
+
+
+async def probe_handshake(target, timeout, dest=DEFAULT_DEST, payload=None,
+                          sample_bytes=SAMPLE_BYTES, sample_window=SAMPLE_WINDOW):
+    """AEAD握手探测：经SS服务与其SOCKS5出站连接dest并发送payload
+
+    target 需包含 server、port、method、password。latency为建立连接的耗时，
+    ttfb为发出请求到收到第一个解密字节的耗时 (毫秒)，throughput为首字节之后
+    的接收速率 (KB/s，样本过小时为None)。加密方式不受支持或未安装cryptography时
+    退回为TCP连接探测：结果的 mode 为 'tcp'、degraded 为True，成功只说明端口可连通。
+    """
+    method = (target.get('method') or '').lower()
+    if not HANDSHAKE_SUPPORTED or method not in AEAD_METHODS:
+        reason = '未安装cryptography' if not HANDSHAKE_SUPPORTED else f'不支持的加密方式 {method}'
+        result = await probe_tcp(target, timeout)
+        result['message'] = f"{result['message']} (仅TCP探测: {reason})"
+        result['mode'] = 'tcp'
+        result['degraded'] = True
+        return result
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    end = start + timeout
+
+    def remaining():
+        return max(0.0, end - loop.time())
+
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(target['server'], target['port']), remaining())
+    except asyncio.TimeoutError:
+        return probe_result(False, message='Connection timeout')
+    except OSError as e:
+        return probe_result(False, message=f'Connection failed: {e.strerror or e}')
+    latency = round((loop.time() - start) * 1000, 2)
+
+    key_len = AEAD_METHODS[method][0]
+    key = evp_bytes_to_key(target['password'].encode(), key_len)
+    salt = os.urandom(key_len)
+    request = http_request(dest) if payload is None else payload
+    received = first_len = 0
+    ttfb = first_at = last_at = None
+    try:
+        writer.write(salt + AEADStream(method, key, salt).seal(socks_address(*dest) + request))
+        await asyncio.wait_for(writer.drain(), remaining())
+        sent_at = loop.time()
+
+        decoder = AEADStream(method, key, await asyncio.wait_for(reader.readexactly(key_len), remaining()))
+        while received < sample_bytes:
+            chunk = await asyncio.wait_for(decoder.read_chunk(reader), remaining())
+            last_at = loop.time()
+            if first_at is None:
+                first_at = last_at
+                first_len = len(chunk)
+                ttfb = round((first_at - sent_at) * 1000, 2)
+                end = min(end, first_at + sample_window)
+            received += len(chunk)
+    except asyncio.IncompleteReadError:
+        # 收到数据前被关闭：服务端无法解密请求，或SOCKS5后端/目标不可达
+        if first_at is None:
+            return _handshake_result(False, latency, 'Tunnel closed before response: '
+                                     'wrong password/method or SOCKS5 backend/target unreachable')
+    except asyncio.TimeoutError:
+        if first_at is None:
+            return _handshake_result(False, latency, 'Handshake timeout: '
+                                     'wrong password/method or upstream not responding')
+    except InvalidTag:
+        return _handshake_result(False, latency, 'Response decryption failed: password or method mismatch')
+    except OSError as e:
+        return _handshake_result(False, latency, f'Tunnel error: {e.strerror or e}')
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+    throughput = None
+    if last_at is not None and last_at > first_at:
+        throughput = round((received - first_len) / 1024 / (last_at - first_at), 2)
+    return _handshake_result(True, latency, 'Handshake successful', ttfb, throughput, received)
+
+
+def _handshake_result(success, latency, message, ttfb=None, throughput=None, received=0):
+    result = probe_result(success, latency if success else -1, message)
+    result.update({'mode': 'handshake', 'connect_latency': latency, 'ttfb': ttfb,
+                   'throughput': throughput, 'bytes': received})
+    return result
+
+
+async def iter_probes(targets, probe=probe_tcp, concurrency=DEFAULT_CONCURRENCY,
+                      timeout=DEFAULT_TIMEOUT, deadline=DEFAULT_DEADLINE):
+    """并发探测，按完成顺序产出 (target, 结果)
+
+    每个探测的超时不超过剩余的整体时间；截止时间后仍在排队的目标
+    不再探测，直接返回超时结果，因此整批耗时不超过deadline。
+    """
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(target):
+        async with semaphore:
+            remaining = end - loop.time()
+            if remaining <= 0:
+                return target, probe_result(False, message='Deadline exceeded')
+            limit = min(timeout, remaining)
+            try:
+                return target, await asyncio.wait_for(probe(target, limit), limit + PROBE_GRACE)
+            except asyncio.TimeoutError:
+                return target, probe_result(False, message='Probe timeout')
+            except Exception as e:
+                logger.error(f"探测 {target.get('server')}:{target.get('port')} 失败: {e}")
+                return target, probe_result(False, message=f'Probe error: {e}')
+
+    for future in asyncio.as_completed([run(target) for target in targets]):
+        yield await future
+
+
+def stream_probes(targets, **options):
+    """同步生成器：在后台线程中运行事件循环，每完成一个探测产出一个 (target, 结果)
+
+    供Flask流式响应与命令行工具使用；调用方提前停止迭代时，
+    后台探测最迟在截止时间后结束。
+    """
+    results = queue.Queue()
+    done = object()
+
+    async def main():
+        try:
+            async for item in iter_probes(targets, **options):
+                results.put(item)
+        except Exception as e:
+            logger.error(f"批量探测失败: {e}")
+        finally:
+            results.put(done)
+
+    threading.Thread(target=asyncio.run, args=(main(),), name='ss-probe', daemon=True).start()
+    while True:
+        item = results.get()
+        if item is done:
+            return
+        yield item
+
+
+def run_probes(targets, **options):
+    """探测全部目标，返回按完成顺序排列的 [(target, 结果)]"""
+    return list(stream_probes(targets, **options))
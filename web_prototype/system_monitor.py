@@ -9,17 +9,260 @@ import psutil
 import time
 import json
 import subprocess
+import threading
+import logging
+from collections import deque
 from datetime import datetime, timedelta
+from process_scanner import process_scanner
+from socket_table import socket_table
+
+logger = logging.getLogger(__name__)
+
+class MetricsSampler:
+    """后台指标采样器
+
+    按固定间隔在后台线程中采集CPU、负载、内存、磁盘I/O与网络计数器，
+    用相邻两次采样的差值计算每秒速率。请求只读取最新一次采样，不再阻塞。
+    """
+
+    def __init__(self, interval=2.0, history_size=300):
+        self.interval = interval
+        self._history = deque(maxlen=history_size)
+        self._latest = None
+        self._previous = None
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def configure(self, interval=None, history_size=None):
+        """设置采样间隔(秒)与保留的采样数量"""
+        with self._lock:
+            if interval is not None:
+                self.interval = max(0.1, float(interval))
+            if history_size is not None:
+                self._history = deque(self._history, maxlen=history_size)
+
+    def start(self):
+        """启动采样线程
+
+        还没有采样时先同步采集一次，线程从下一个间隔开始采样，
+        避免两次采样同时进行、第一次的CPU使用率与速率失真。
+        """
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            if self._latest is None:
+                self.sample()
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止采样线程"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def latest(self):
+        """获取最新一次采样 (首次调用时启动采样线程)"""
+        if self._latest is None:
+            self.start()
+        return self._latest
+
+    def history(self, seconds=None):
+        """获取最近的采样列表"""
+        with self._lock:
+            samples = list(self._history)
+        if seconds is not None:
+            cutoff = time.time() - seconds
+            samples = [s for s in samples if s['timestamp'] >= cutoff]
+        return samples
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"系统指标采样失败: {e}")
+
+    def _read_counters(self):
+        """读取累计计数器"""
+        disk_io = psutil.disk_io_counters()
+        net_io = psutil.net_io_counters()
+        return {
+            'time': time.monotonic(),
+            'disk_read_bytes': disk_io.read_bytes if disk_io else 0,
+            'disk_write_bytes': disk_io.write_bytes if disk_io else 0,
+            'disk_read_count': disk_io.read_count if disk_io else 0,
+            'disk_write_count': disk_io.write_count if disk_io else 0,
+            'net_bytes_recv': net_io.bytes_recv if net_io else 0,
+            'net_bytes_sent': net_io.bytes_sent if net_io else 0,
+            'net_packets_recv': net_io.packets_recv if net_io else 0,
+            'net_packets_sent': net_io.packets_sent if net_io else 0
+        }
+
+    def sample(self):
+        """执行一次采样"""
+        # interval=None 返回距上次调用的CPU使用率，不会阻塞；
+        # 第一次采样没有基准值，短暂测量一次
+        cpu_percent = psutil.cpu_percent(interval=None if self._previous else 0.1)
+        try:
+            load_avg = os.getloadavg()
+        except:
+            load_avg = [0, 0, 0]
+        memory = psutil.virtual_memory()
+        swap = psutil.swap_memory()
+        counters = self._read_counters()
+
+        with self._lock:
+            previous = self._previous
+            self._previous = counters
+
+        rates = {}
+        elapsed = counters['time'] - previous['time'] if previous else 0
+        for key, value in counters.items():
+            if key == 'time':
+                continue
+            delta = value - previous[key] if previous else 0
+            # 计数器回绕或重置时按0处理
+            rates[f'{key}_rate'] = round(delta / elapsed, 1) if elapsed > 0 and delta > 0 else 0
+
+        sample = {
+            'timestamp': time.time(),
+            'elapsed': round(elapsed, 3),
+            'cpu_percent': round(cpu_percent, 1),
+            'load_avg': [round(v, 2) for v in load_avg],
+            'memory_percent': round(memory.percent, 1),
+            'swap_percent': round(swap.percent, 1) if swap.total > 0 else 0,
+            'totals': {key: value for key, value in counters.items() if key != 'time'},
+            'rates': rates
+        }
+
+        with self._lock:
+            self._latest = sample
+            self._history.append(sample)
+        return sample
+
+
+class TieredCache:
+    """按字段分级TTL的缓存
+
+    ttl为None的字段只计算一次；同一字段并发的未命中请求只执行一次计算
+    (single-flight)，其余请求等待并共享结果。
+    """
+
+    def __init__(self, ttls, default_ttl=5):
+        self.ttls = dict(ttls)
+        self.default_ttl = default_ttl
+        self._entries = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _stat(self, key):
+        stat = self._stats.get(key)
+        if stat is None:
+            stat = self._stats[key] = {'hits': 0, 'misses': 0, 'shared': 0, 'errors': 0}
+        return stat
+
+    def get(self, key, loader, cacheable=None):
+        """获取字段值，过期或不存在时调用loader计算
+
+        cacheable(value) 返回False时结果不写入缓存 (如计算出错)。
+        """
+        ttl = self.ttls.get(key, self.default_ttl)
+
+        with self._lock:
+            stat = self._stat(key)
+            entry = self._entries.get(key)
+            if entry and (ttl is None or time.monotonic() - entry[1] < ttl):
+                stat['hits'] += 1
+                return entry[0]
+
+            flight = self._inflight.get(key)
+            if flight is None:
+                stat['misses'] += 1
+                flight = self._inflight[key] = {'event': threading.Event(), 'value': None, 'error': None}
+                leader = True
+            else:
+                stat['shared'] += 1
+                leader = False
+
+        if not leader:
+            flight['event'].wait()
+            if flight['error'] is not None:
+                raise flight['error']
+            return flight['value']
+
+        try:
+            value = loader()
+            flight['value'] = value
+            if cacheable is None or cacheable(value):
+                with self._lock:
+                    self._entries[key] = (value, time.monotonic())
+            return value
+        except Exception as e:
+            flight['error'] = e
+            with self._lock:
+                self._stat(key)['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight['event'].set()
+
+    def invalidate(self, key=None):
+        """清除指定字段 (不指定时清除全部)"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """各字段的命中/未命中统计"""
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for key, stat in self._stats.items():
+                entry = self._entries.get(key)
+                result[key] = dict(stat, ttl=self.ttls.get(key, self.default_ttl),
+                                   age=round(now - entry[1], 1) if entry else None)
+            return result
+
+
+# 各字段缓存时间(秒)：None表示只计算一次
+CACHE_TTLS = {
+    'system': None,           # 静态系统信息
+    'disk_partitions': 300,   # 磁盘分区列表
+    'net_interfaces': 300,    # 网卡及地址
+    'disk': 10,               # 分区使用量
+    'processes': 5,           # 进程列表
+    'xray_services': 5,       # Xray服务状态
+    'cpu': 2,                 # 计数器类
+    'memory': 2,
+    'network': 2,
+}
+
+
+def _cacheable(value):
+    """出错的结果不缓存"""
+    return not (isinstance(value, dict) and 'error' in value)
+
 
 class SystemMonitor:
-    def __init__(self):
+    def __init__(self, sample_interval=2.0):
         self.start_time = time.time()
+        self.sampler = MetricsSampler(interval=sample_interval)
+        self.cache = TieredCache(CACHE_TTLS)
     
     def get_cpu_info(self):
         """获取CPU信息"""
         try:
-            # CPU使用率
-            cpu_percent = psutil.cpu_percent(interval=1)
+            # CPU使用率 (取后台采样结果，不阻塞请求)
+            sample = self.sampler.latest()
+            cpu_percent = sample['cpu_percent']
             
             # CPU核心数
             cpu_count = psutil.cpu_count()
@@ -29,10 +272,7 @@ class SystemMonitor:
             cpu_freq = psutil.cpu_freq()
             
             # 负载平均值 (Linux/macOS)
-            try:
-                load_avg = os.getloadavg()
-            except:
-                load_avg = [0, 0, 0]
+            load_avg = sample['load_avg']
             
             return {
                 'usage': round(cpu_percent, 1),
@@ -81,7 +321,7 @@ class SystemMonitor:
         """获取磁盘信息"""
         try:
             # 获取所有磁盘分区
-            partitions = psutil.disk_partitions()
+            partitions = self.cache.get('disk_partitions', psutil.disk_partitions)
             disk_info = []
             
             total_size = 0
@@ -115,6 +355,7 @@ class SystemMonitor:
             
             # 磁盘I/O统计
             disk_io = psutil.disk_io_counters()
+            rates = self.sampler.latest()['rates']
             
             return {
                 'partitions': disk_info,
@@ -128,7 +369,11 @@ class SystemMonitor:
                     'read_bytes': self._bytes_to_gb(disk_io.read_bytes) if disk_io else 0,
                     'write_bytes': self._bytes_to_gb(disk_io.write_bytes) if disk_io else 0,
                     'read_count': disk_io.read_count if disk_io else 0,
-                    'write_count': disk_io.write_count if disk_io else 0
+                    'write_count': disk_io.write_count if disk_io else 0,
+                    'read_rate': rates.get('disk_read_bytes_rate', 0),
+                    'write_rate': rates.get('disk_write_bytes_rate', 0),
+                    'read_iops': rates.get('disk_read_count_rate', 0),
+                    'write_iops': rates.get('disk_write_count_rate', 0)
                 }
             }
         except Exception as e:
@@ -139,45 +384,55 @@ class SystemMonitor:
         try:
             # 网络I/O统计
             net_io = psutil.net_io_counters()
+            rates = self.sampler.latest()['rates']
             
             # 网络接口信息
-            interfaces = []
-            net_if_addrs = psutil.net_if_addrs()
-            net_if_stats = psutil.net_if_stats()
-            
-            for interface_name, addresses in net_if_addrs.items():
-                if interface_name in net_if_stats:
-                    stats = net_if_stats[interface_name]
-                    
-                    # 获取IP地址
-                    ipv4_addr = None
-                    ipv6_addr = None
-                    
-                    for addr in addresses:
-                        if addr.family == 2:  # IPv4
-                            ipv4_addr = addr.address
-                        elif addr.family == 10:  # IPv6
-                            ipv6_addr = addr.address
-                    
-                    interfaces.append({
-                        'name': interface_name,
-                        'ipv4': ipv4_addr,
-                        'ipv6': ipv6_addr,
-                        'is_up': stats.isup,
-                        'speed': stats.speed,
-                        'mtu': stats.mtu
-                    })
+            interfaces = self.cache.get('net_interfaces', self._get_interfaces)
             
             return {
                 'total_sent': self._bytes_to_gb(net_io.bytes_sent),
                 'total_recv': self._bytes_to_gb(net_io.bytes_recv),
                 'packets_sent': net_io.packets_sent,
                 'packets_recv': net_io.packets_recv,
+                'recv_rate': rates.get('net_bytes_recv_rate', 0),
+                'sent_rate': rates.get('net_bytes_sent_rate', 0),
+                'packets_recv_rate': rates.get('net_packets_recv_rate', 0),
+                'packets_sent_rate': rates.get('net_packets_sent_rate', 0),
                 'interfaces': interfaces
             }
         except Exception as e:
             return {'error': str(e)}
     
+    def _get_interfaces(self):
+        """获取网络接口列表"""
+        interfaces = []
+        net_if_addrs = psutil.net_if_addrs()
+        net_if_stats = psutil.net_if_stats()
+        
+        for interface_name, addresses in net_if_addrs.items():
+            if interface_name in net_if_stats:
+                stats = net_if_stats[interface_name]
+                
+                # 获取IP地址
+                ipv4_addr = None
+                ipv6_addr = None
+                
+                for addr in addresses:
+                    if addr.family == 2:  # IPv4
+                        ipv4_addr = addr.address
+                    elif addr.family == 10:  # IPv6
+                        ipv6_addr = addr.address
+                
+                interfaces.append({
+                    'name': interface_name,
+                    'ipv4': ipv4_addr,
+                    'ipv6': ipv6_addr,
+                    'is_up': stats.isup,
+                    'speed': stats.speed,
+                    'mtu': stats.mtu
+                })
+        return interfaces
+    
     def get_process_info(self):
         """获取进程信息"""
         try:
@@ -247,40 +502,28 @@ class SystemMonitor:
             data_dir = os.path.join(os.path.dirname(__file__), '..', 'data', 'services')
             
             if os.path.exists(data_dir):
+                # 一次扫描/proc得到所有服务的进程状态与套接字快照
+                states = process_scanner.states()
+                sockets = socket_table.snapshot()
+
                 for port_dir in os.listdir(data_dir):
                     port_path = os.path.join(data_dir, port_dir)
-                    if os.path.isdir(port_path):
-                        pid_file = os.path.join(port_path, 'xray.pid')
+                    if port_dir.isdigit() and os.path.isdir(port_path):
                         log_file = os.path.join(port_path, 'xray.log')
                         
-                        status = 'stopped'
-                        pid = None
-                        
-                        # 检查PID文件
-                        if os.path.exists(pid_file):
-                            try:
-                                with open(pid_file, 'r') as f:
-                                    pid = int(f.read().strip())
-                                
-                                # 检查进程是否存在
-                                if psutil.pid_exists(pid):
-                                    try:
-                                        proc = psutil.Process(pid)
-                                        if proc.is_running():
-                                            status = 'running'
-                                    except:
-                                        status = 'error'
-                            except:
-                                pass
+                        state = states.get(port_dir)
+                        status = state['status'] if state else 'stopped'
+                        pid = state['pid'] if state else None
                         
                         # 检查端口监听
-                        port_listening = self._check_port_listening(int(port_dir))
+                        port_listening = sockets.is_listening(int(port_dir))
                         
                         services.append({
                             'port': int(port_dir),
                             'status': status,
                             'pid': pid,
                             'port_listening': port_listening,
+                            'connections': sockets.established(int(port_dir)),
                             'log_exists': os.path.exists(log_file)
                         })
             
@@ -291,11 +534,7 @@ class SystemMonitor:
     def _check_port_listening(self, port):
         """检查端口是否在监听"""
         try:
-            connections = psutil.net_connections()
-            for conn in connections:
-                if conn.laddr.port == port and conn.status == 'LISTEN':
-                    return True
-            return False
+            return socket_table.snapshot().is_listening(port)
         except:
             return False
     
@@ -304,16 +543,17 @@ class SystemMonitor:
         return round(bytes_value / (1024**3), 2)
     
     def get_all_info(self):
-        """获取所有系统信息"""
+        """获取所有系统信息 (各字段按 CACHE_TTLS 缓存)"""
+        cached = lambda key, loader: self.cache.get(key, loader, cacheable=_cacheable)
         return {
             'timestamp': datetime.now().isoformat(),
-            'system': self.get_system_info(),
-            'cpu': self.get_cpu_info(),
-            'memory': self.get_memory_info(),
-            'disk': self.get_disk_info(),
-            'network': self.get_network_info(),
-            'processes': self.get_process_info(),
-            'xray_services': self.get_xray_services_status()
+            'system': cached('system', self.get_system_info),
+            'cpu': cached('cpu', self.get_cpu_info),
+            'memory': cached('memory', self.get_memory_info),
+            'disk': cached('disk', self.get_disk_info),
+            'network': cached('network', self.get_network_info),
+            'processes': cached('processes', self.get_process_info),
+            'xray_services': cached('xray_services', self.get_xray_services_status)
         }
 
 # 创建全局实例
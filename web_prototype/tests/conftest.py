@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试公共夹具 - 模块按 web_prototype 目录下的平铺方式导入
+"""
+
+import os
+import sys
+import socket
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+WEB_DIR = os.path.dirname(TESTS_DIR)
+if WEB_DIR not in sys.path:
+    sys.path.insert(0, WEB_DIR)
+
+# 测试用的假xray (见 fake_xray.py)
+FAKE_XRAY = os.path.join(TESTS_DIR, 'fake_xray.py')
+
+
+def free_port():
+    """取一个当前空闲的本地端口"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """导入Flask应用，日志与相对路径的数据目录写入临时目录"""
+    workdir = tmp_path_factory.mktemp('app')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+    return app
+
+
+@pytest.fixture
+def service_dir(app_module, tmp_path):
+    """让服务注册表指向临时服务目录，结束后恢复"""
+    registry = app_module.service_registry
+    original = registry.service_dir
+    path = tmp_path / 'services'
+    path.mkdir()
+
+    registry.stop()
+    registry.configure(service_dir=str(path))
+    yield path
+    registry.stop()
+    registry.configure(service_dir=original)
+
+
+@pytest.fixture
+def app_env(app_module, service_dir, tmp_path, monkeypatch):
+    """应用使用临时数据库与临时服务目录"""
+    db_path = str(tmp_path / 'xray_web.db')
+    monkeypatch.setattr(app_module, 'DB_PATH', db_path)
+    monkeypatch.setattr(app_module, 'SERVICE_DIR', str(service_dir))
+    monkeypatch.setattr(app_module.job_queue, 'db_path', db_path)
+    app_module.init_db()
+    return app_module
+
+
+def write_service(service_dir, port, **fields):
+    """写入一个 info.txt 格式的服务目录"""
+    lines = {
+        '节点名称': fields.get('node_name', f'node{port}'),
+        'Shadowsocks端口': port,
+        'Shadowsocks密码': fields.get('password', f'pw{port}'),
+        'SOCKS5后端': fields.get('socks_backend', '127.0.0.1:1080'),
+        '加密方式': fields.get('method', 'aes-256-gcm'),
+    }
+    path = service_dir / str(port)
+    path.mkdir()
+    (path / 'info.txt').write_text(''.join(f'{k}: {v}\n' for k, v in lines.items()), encoding='utf-8')
+    return path
+
+
+class StandIn:
+    """本地HTTP替身：按路径返回固定内容，可设置延迟，并统计请求数"""
+
+    def __init__(self, routes):
+        # 路径 -> (状态码, 内容, 延迟秒数)
+        self.routes = routes
+        self.hits = {}
+        self._lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stand_in._lock:
+                    stand_in.hits[self.path] = stand_in.hits.get(self.path, 0) + 1
+                status, body, delay = stand_in.routes.get(self.path, (404, '', 0))
+                if delay:
+                    threading.Event().wait(delay)
+                data = body.encode()
+                self.send_response(status)
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def http_stand_in():
+    """创建本地HTTP替身的工厂"""
+    servers = []
+
+    def make(routes):
+        server = StandIn(routes)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture
+def supervisor(tmp_path):
+    """使用假xray与临时服务目录的进程管理器，结束时停止所有服务"""
+    from xray_supervisor import XraySupervisor
+
+    os.chmod(FAKE_XRAY, 0o755)
+    service_dir = tmp_path / 'services'
+    service_dir.mkdir()
+    supervisor = XraySupervisor(service_dir=str(service_dir), xray_bin=FAKE_XRAY,
+                                ready_timeout=3.0, stop_timeout=1.0, kill_timeout=1.0, drain_timeout=1.0)
+    yield supervisor
+    for port in os.listdir(service_dir):
+        supervisor.stop(port)
+
+
+def make_config(service_dir, port=None, password='secret', method=None):
+    """用 config_renderer 生成一个服务配置，返回端口"""
+    from config_renderer import generate
+
+    port = port or free_port()
+    result = generate(str(service_dir), port, password, '127.0.0.1', 1080, method=method)
+    assert result['success'], result['message']
+    return str(port)
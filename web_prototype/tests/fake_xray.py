@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试用的假xray - 只实现进程管理与在线配置用到的行为
+
+- run -config <config.json>: 为每个入站监听端口 (shadowsocks入站按customSockopt
+  开启SO_REUSEPORT)，接受连接并保持到客户端关闭；API入站 (tag为api) 接受
+  下面 api 子命令发来的请求，在线增删入站与出站
+- api adi/ado --server=127.0.0.1:<端口> <配置文件>、api rmi/rmo --server=127.0.0.1:<端口>
+  -tags <标签...> 或 <配置文件>: 转发给运行中的进程；与真实xray一样，没有 -tags 时
+  rmi/rmo 的参数按配置文件路径读取
+- api adrules --server=... [-append] <配置文件>、api rmrules --server=... <ruleTag...>: 增删路由规则
+通过环境变量模拟异常：
+- FAKE_XRAY_DELAY: 监听前等待的秒数
+- FAKE_XRAY_EXIT: 监听前以该退出码退出
+- FAKE_XRAY_IGNORE_TERM: 忽略SIGTERM，只能被SIGKILL结束
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import threading
+
+API_TAG = 'api'
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+
+
+def reuseport(inbound):
+    custom = ((inbound.get('streamSettings') or {}).get('sockopt') or {}).get('customSockopt') or []
+    return any(o.get('level') == '1' and o.get('opt') == '15' for o in custom)
+
+
+class FakeXray:
+    def __init__(self, config):
+        self.lock = threading.Lock()
+        self.listeners = {}
+        self.outbounds = {o.get('tag', ''): o for o in config.get('outbounds', [])}
+        self.rules = {r.get('ruleTag', ''): r for r in (config.get('routing') or {}).get('rules', [])}
+        for inbound in config.get('inbounds', []):
+            self.add_inbound(inbound)
+
+    def add_inbound(self, inbound):
+        tag = inbound.get('tag', '')
+        with self.lock:
+            if tag in self.listeners:
+                raise ValueError(f'existing tag found: {tag}')
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuseport(inbound):
+                sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+            sock.bind((inbound.get('listen') or '0.0.0.0', inbound['port']))
+            sock.listen(128)
+            self.listeners[tag] = sock
+        handler = self.serve_api if tag == API_TAG else self.hold
+        threading.Thread(target=self.accept_loop, args=(sock, handler), daemon=True).start()
+
+    def remove_inbound(self, tag):
+        with self.lock:
+            sock = self.listeners.pop(tag, None)
+        if sock is None:
+            raise ValueError(f'handler not found: {tag}')
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+    def accept_loop(self, sock, handler):
+        while True:
+            try:
+                conn, _ = sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=handler, args=(conn,), daemon=True).start()
+
+    @staticmethod
+    def hold(conn):
+        """保持连接直到客户端关闭"""
+        with conn:
+            while conn.recv(4096):
+                pass
+
+    def serve_api(self, conn):
+        with conn, conn.makefile('rwb') as stream:
+            request = json.loads(stream.readline())
+            try:
+                self.apply(request)
+                reply = {'ok': True}
+            except (ValueError, KeyError, OSError) as e:
+                reply = {'error': str(e)}
+            stream.write(json.dumps(reply).encode() + b'\n')
+            stream.flush()
+
+    @staticmethod
+    def tags(args, key):
+        """rmi/rmo 要删除的标签：-tags 之后的参数，否则从配置文件中读取"""
+        if args[:1] == ['-tags']:
+            return args[1:]
+        tags = []
+        for path in args:
+            with open(path) as f:
+                tags.extend(h.get('tag', '') for h in json.load(f)[key])
+        return tags
+
+    def apply(self, request):
+        command, args = request['command'], request['args']
+        if command in ('adi', 'ado'):
+            with open(args[-1]) as f:
+                config = json.load(f)
+            if command == 'adi':
+                for inbound in config['inbounds']:
+                    self.add_inbound(inbound)
+            else:
+                for outbound in config['outbounds']:
+                    if outbound.get('tag', '') in self.outbounds:
+                        raise ValueError(f"existing tag found: {outbound.get('tag')}")
+                    self.outbounds[outbound.get('tag', '')] = outbound
+        elif command == 'rmi':
+            for tag in self.tags(args, 'inbounds'):
+                self.remove_inbound(tag)
+        elif command == 'rmo':
+            for tag in self.tags(args, 'outbounds'):
+                if self.outbounds.pop(tag, None) is None:
+                    raise ValueError(f'handler not found: {tag}')
+        elif command == 'adrules':
+            with open(args[-1]) as f:
+                for rule in json.load(f)['routing']['rules']:
+                    self.rules[rule.get('ruleTag', '')] = rule
+        elif command == 'rmrules':
+            for tag in args:
+                if self.rules.pop(tag, None) is None:
+                    raise ValueError(f'rule not found: {tag}')
+        else:
+            raise ValueError(f'unknown command: {command}')
+
+
+def run(argv):
+    config_file = argv[argv.index('-config') + 1]
+    if os.environ.get('FAKE_XRAY_IGNORE_TERM'):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    time.sleep(float(os.environ.get('FAKE_XRAY_DELAY', 0)))
+    if os.environ.get('FAKE_XRAY_EXIT'):
+        print('Failed to start: fake failure', flush=True)
+        return int(os.environ['FAKE_XRAY_EXIT'])
+
+    with open(config_file) as f:
+        config = json.load(f)
+    try:
+        FakeXray(config)
+    except OSError as e:
+        print(f'Failed to start: {e}', flush=True)
+        return 23
+    print(f'Xray fake started (PID: {os.getpid()})', flush=True)
+    while True:
+        time.sleep(3600)
+
+
+def api(argv):
+    command = argv[0]
+    server = next(a.split('=', 1)[1] for a in argv if a.startswith('--server='))
+    args = [a for a in argv[1:] if not a.startswith('--server=') and a != '-append']
+    host, port = server.rsplit(':', 1)
+    try:
+        with socket.create_connection((host, int(port)), timeout=2) as conn, conn.makefile('rwb') as stream:
+            stream.write(json.dumps({'command': command, 'args': args}).encode() + b'\n')
+            stream.flush()
+            reply = json.loads(stream.readline() or '{"error": "connection closed"}')
+    except OSError as e:
+        print(f'failed to dial {server}: {e}', file=sys.stderr)
+        return 1
+    if 'error' in reply:
+        print(reply['error'], file=sys.stderr)
+        return 1
+    return 0
+
+
+def main(argv):
+    if argv[:1] == ['run']:
+        return run(argv[1:])
+    if argv[:1] == ['api']:
+        return api(argv[1:])
+    if argv[:1] == ['version']:
+        print('Xray 0.0.0 (fake)')
+        return 0
+    print(f'unknown command: {argv}', file=sys.stderr)
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
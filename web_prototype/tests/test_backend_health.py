@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SOCKS5后端健康检查测试 - 本地SOCKS5替身上的问候、认证与CONNECT探测，
+以及历史记录中的后端标识
+"""
+
+import os
+import stat
+import asyncio
+import hashlib
+import sqlite3
+import threading
+
+import pytest
+
+import backend_health
+from backend_health import (BackendHealth, backend_id, backend_name, backend_of, load_key,
+                            create_tables, probe_socks5)
+
+BACKEND = ('127.0.0.1', 1080, 'user', 'secret')
+DEST = ('127.0.0.1', 80)
+
+
+def socks5(user=None, password=None, reply=0, methods=None, silent=False):
+    """SOCKS5替身：user为None时不要求认证；methods 固定返回的方法；reply 为CONNECT应答码"""
+    seen = []
+
+    async def handle(reader, writer):
+        try:
+            if silent:
+                await reader.read()
+                return
+            _, count = await reader.readexactly(2)
+            offered = await reader.readexactly(count)
+            if methods is not None:
+                method = methods
+            elif user is None:
+                method = 0x00
+            else:
+                method = 0x02 if 0x02 in offered else 0xFF
+            writer.write(bytes([5, method]))
+            if method == 0xFF:
+                return
+            if method == 0x02:
+                _, ulen = await reader.readexactly(2)
+                name = (await reader.readexactly(ulen)).decode()
+                plen = (await reader.readexactly(1))[0]
+                secret = (await reader.readexactly(plen)).decode()
+                seen.append((name, secret))
+                ok = (name, secret) == (user, password)
+                writer.write(bytes([1, 0 if ok else 1]))
+                if not ok:
+                    return
+            _, cmd, _, atyp = await reader.readexactly(4)
+            await reader.readexactly({1: 4, 4: 16}.get(atyp) or (await reader.readexactly(1))[0])
+            await reader.readexactly(2)
+            writer.write(bytes([5, reply, 0, 1]) + bytes(6))
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    handle.seen = seen
+    return handle
+
+
+def probe(handler, user='', password='', timeout=1.0):
+    async def main():
+        server = await asyncio.start_server(handler, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            return await probe_socks5({'server': '127.0.0.1', 'port': port, 'user': user,
+                                       'password': password}, timeout, dest=DEST)
+        finally:
+            server.close()
+    return asyncio.run(main())
+
+
+def test_no_auth_connect():
+    result = probe(socks5())
+    assert result['success'] and result['stage'] == 'done'
+    assert result['latency'] >= result['connect_latency'] >= 0
+    assert not result['auth_failed']
+
+
+def test_auth_accepted():
+    handler = socks5('user', 'secret')
+    result = probe(handler, 'user', 'secret')
+    assert result['success'], result['message']
+    assert handler.seen == [('user', 'secret')]
+
+
+def test_auth_rejected():
+    result = probe(socks5('user', 'secret'), 'user', 'wrong')
+    assert not result['success'] and result['auth_failed']
+    assert result['stage'] == 'auth' and result['message'] == 'Authentication failed'
+
+
+def test_no_acceptable_method():
+    result = probe(socks5(methods=0xFF), 'user', 'secret')
+    assert not result['success'] and result['auth_failed']
+    assert result['message'] == 'No acceptable authentication method'
+
+    # 后端要求认证而未配置用户名
+    result = probe(socks5('user', 'secret'))
+    assert result['auth_failed'] and result['message'] == 'Authentication required'
+
+
+@pytest.mark.parametrize('reply, message', [
+    (0x05, 'CONNECT failed: connection refused'),
+    (0x02, 'CONNECT failed: connection not allowed by ruleset'),
+    (0x42, 'CONNECT failed: reply 66'),
+])
+def test_connect_rejected(reply, message):
+    result = probe(socks5(reply=reply))
+    assert not result['success'] and not result['auth_failed']
+    assert result['stage'] == 'connect' and result['message'] == message
+
+
+def test_silent_server():
+    result = probe(socks5(silent=True), timeout=0.3)
+    assert not result['success']
+    assert result['stage'] == 'greeting' and result['message'] == 'Timeout during greeting'
+
+
+def test_connection_refused():
+    async def main():
+        server = await asyncio.start_server(socks5(), '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        server.close()
+        await server.wait_closed()
+        return await probe_socks5({'server': '127.0.0.1', 'port': port}, 1.0, dest=DEST)
+
+    result = asyncio.run(main())
+    assert not result['success'] and result['stage'] == 'tcp'
+    assert result['message'].startswith('Connection failed')
+
+
+@pytest.mark.parametrize('record, expected', [
+    ({'socks_ip': '10.0.0.1', 'socks_port': '1080', 'socks_user': 'u', 'socks_pass': 'p'},
+     ('10.0.0.1', 1080, 'u', 'p')),
+    ({'socks_ip': '10.0.0.1', 'socks_port': 1080, 'socks_auth': 'u:p:q'}, ('10.0.0.1', 1080, 'u', 'p:q')),
+    ({'socks_ip': '10.0.0.1', 'socks_port': 1080, 'socks_auth': '无'}, ('10.0.0.1', 1080, '', '')),
+    ({'socks_ip': '10.0.0.1', 'socks_port': 'x'}, None),
+    ({'socks_ip': '', 'socks_port': 1080}, None),
+])
+def test_backend_of(record, expected):
+    assert backend_of(record) == expected
+
+
+def test_backend_id_not_derived_from_password_alone(tmp_path):
+    key_file = str(tmp_path / 'backend_health.key')
+    checker = BackendHealth(key_file=key_file)
+    identity = checker.backend_id(BACKEND)
+
+    assert identity.startswith(backend_name(BACKEND) + '#')
+    assert hashlib.sha1(b'secret').hexdigest()[:8] not in identity
+    assert hashlib.sha256(b'secret').hexdigest()[:12] not in identity
+    assert 'secret' not in identity
+
+    # 同一用户的不同密码仍可区分，没有认证时只用显示名称
+    assert checker.backend_id(BACKEND[:3] + ('other',)) != identity
+    assert checker.backend_id(('127.0.0.1', 1080, '', '')) == '127.0.0.1:1080'
+
+    # 密钥持久化，重启后标识不变；不同密钥得到不同标识
+    assert stat.S_IMODE(os.stat(key_file).st_mode) == 0o600
+    assert BackendHealth(key_file=key_file).backend_id(BACKEND) == identity
+    assert backend_id(BACKEND, os.urandom(32)) != identity
+
+
+def test_load_key_reuses_existing_file(tmp_path):
+    key_file = str(tmp_path / 'data' / 'backend_health.key')
+    key = load_key(key_file)
+    assert len(key) == 32 and load_key(key_file) == key
+
+
+def test_backend_id_without_key_file(caplog):
+    checker = BackendHealth()
+    identity = checker.backend_id(BACKEND)
+    assert checker.backend_id(BACKEND) == identity
+    assert '临时密钥' in caplog.text
+
+
+def test_check_once_records_history(tmp_path, monkeypatch):
+    handler = socks5('user', 'secret')
+
+    async def serve():
+        return await asyncio.start_server(handler, '127.0.0.1', 0)
+
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(serve())
+    port = server.sockets[0].getsockname()[1]
+    records = [{'port': p, 'socks_ip': '127.0.0.1', 'socks_port': port, 'socks_user': 'user',
+                'socks_pass': password} for p, password in ((20001, 'secret'), (20002, 'secret'), (20003, 'wrong'))]
+    monkeypatch.setattr(backend_health.service_registry, 'snapshot', lambda: records)
+
+    db_path = str(tmp_path / 'health.db')
+    conn = sqlite3.connect(db_path)
+    create_tables(conn.cursor())
+    conn.commit()
+    checker = BackendHealth(db_path=db_path, key_file=str(tmp_path / 'key'), timeout=1.0, dest=DEST)
+
+    # 探测在独立线程的事件循环中运行，替身所在的事件循环在后台线程中服务
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        # 两个服务共用的后端只探测一次
+        assert checker.check_once() == 2
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+
+    stats = {b['id']: b for b in checker.get_stats()['backends']}
+    good = checker.backend_id(backend_of(records[0]))
+    bad = checker.backend_id(backend_of(records[2]))
+    assert stats[good]['success'] and stats[good]['ports'] == ['20001', '20002']
+    assert not stats[bad]['success'] and stats[bad]['auth_failures'] == 1
+
+    history = checker.history(conn, bad)
+    assert len(history) == 1 and history[0]['auth_failed']
+    assert checker.for_service(records[1])['id'] == good
+    conn.close()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量操作测试 - 用桩动作检查并发数、max_unavailable 与 max_failures 限制
+"""
+
+import time
+import threading
+
+import pytest
+
+from bulk_ops import BulkRunner, parse_max_unavailable
+
+PORTS = [str(port) for port in range(20001, 20011)]
+
+
+class Action:
+    """记录调用次数与同时执行数的桩动作"""
+
+    def __init__(self, success=True, delay=0.05):
+        self.success = success
+        self.delay = delay
+        self.calls = []
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, port):
+        with self._lock:
+            self.calls.append(port)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+        return {'success': self.success, 'message': 'ok' if self.success else 'fake failure'}
+
+
+def run(action, **kwargs):
+    kwargs.setdefault('running', PORTS)
+    return BulkRunner(actions={'restart': action}, concurrency=8).run('restart', PORTS, **kwargs)
+
+
+def test_concurrency_limit():
+    action = Action()
+    summary = run(action, concurrency=3)
+    assert summary['succeeded'] == 10 and action.peak == 3
+    assert [r['port'] for r in summary['results']] == PORTS
+
+
+def test_max_unavailable_limits_running_services():
+    action = Action()
+    summary = run(action, max_unavailable=2)
+    assert summary['succeeded'] == 10 and summary['max_unavailable'] == 2
+    assert action.peak == 2
+
+
+def test_max_unavailable_ignores_stopped_services():
+    # 未运行的服务重启即启动，不占用名额
+    action = Action()
+    summary = run(action, max_unavailable=1, running=PORTS[:2])
+    assert summary['succeeded'] == 10 and action.peak > 1
+
+
+def test_max_failures_with_rolling_restart():
+    action = Action(success=False)
+    summary = run(action, max_unavailable=1, max_failures=0)
+    assert len(action.calls) == 1
+    assert summary['failed'] == 1 and summary['skipped'] == 9
+    assert all(r['message'] == '失败过多，已跳过' for r in summary['results'] if r.get('skipped'))
+
+
+def test_max_failures_sequential():
+    action = Action(success=False, delay=0)
+    summary = run(action, concurrency=1, max_failures=2)
+    assert len(action.calls) == 3
+    assert summary['failed'] == 3 and summary['skipped'] == 7
+
+
+def test_action_exception_counts_as_failure():
+    def boom(port):
+        raise RuntimeError('boom')
+
+    summary = run(boom, concurrency=1, max_failures=0)
+    assert summary['failed'] == 1 and summary['results'][0]['message'] == 'boom'
+
+
+def test_unknown_action():
+    with pytest.raises(ValueError):
+        BulkRunner(actions={'restart': Action()}).run('reload', PORTS, running=PORTS)
+
+
+@pytest.mark.parametrize('value, total, expected', [
+    (3, 10, 3), ('2', 10, 2), ('25%', 10, 2), ('1%', 10, 1), ('100%', 4, 4)])
+def test_parse_max_unavailable(value, total, expected):
+    assert parse_max_unavailable(value, total) == expected
+
+
+@pytest.mark.parametrize('value', [0, '-1', '0%', '150%', 'abc'])
+def test_parse_max_unavailable_rejects(value):
+    with pytest.raises(ValueError):
+        parse_max_unavailable(value, 10)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+配置生成测试 - 结构校验的拒绝项、相同内容跳过写入、原子写入失败时的清理与渲染性能
+"""
+
+import os
+import time
+import json
+import copy
+
+import pytest
+
+import config_renderer
+from config_renderer import (CONFIG_SCHEMA, check_schema, validate, render, dumps, write_file,
+                             write_config, generate, CONFIG_FILE)
+from xray_stats import API_TAG
+
+
+def config(port=20001, **kwargs):
+    return render(port, 'secret', '10.0.0.1', 1080, 'user', 'pass', api_port=62001, **kwargs)
+
+
+def test_rendered_config_is_valid():
+    assert validate(config(), 20001) is None
+    assert validate(render(20001, 'secret', '10.0.0.1', 1080), 20001) is None
+    assert not check_schema(config(), CONFIG_SCHEMA)
+
+
+@pytest.mark.parametrize('change, error', [
+    (lambda c: c.pop('outbounds'), 'config.outbounds: 缺少字段'),
+    (lambda c: c['inbounds'].clear(), 'config.inbounds: 至少需要 1 项'),
+    (lambda c: c['inbounds'][0].update(port=70000), 'config.inbounds[0].port: 超出范围 1-65535'),
+    (lambda c: c['inbounds'][0].update(port='20001'), 'config.inbounds[0].port: 应为整数'),
+    (lambda c: c['inbounds'][0].update(port=True), 'config.inbounds[0].port: 应为整数'),
+    (lambda c: c['inbounds'][0].update(protocol='vmess'), "config.inbounds[0].protocol: 不支持的值 'vmess'"),
+    (lambda c: c['inbounds'][0].update(tag=''), 'config.inbounds[0].tag: 不能为空'),
+    (lambda c: c['inbounds'][0]['settings'].update(method='rc4-md5'),
+     "config.inbounds[0].settings.method: 不支持的值 'rc4-md5'"),
+    (lambda c: c['inbounds'][0]['settings'].pop('password'), 'config.inbounds[0].settings.password: 缺少字段'),
+    (lambda c: c['outbounds'][0]['settings']['servers'].clear(),
+     'config.outbounds[0].settings.servers: 至少需要 1 项'),
+    (lambda c: c['outbounds'][0]['settings']['servers'][0]['users'][0].pop('pass'),
+     'config.outbounds[0].settings.servers[0].users[0].pass: 缺少字段'),
+    (lambda c: c['routing']['rules'][0].update(type='chinasites'),
+     "config.routing.rules[0].type: 不支持的值 'chinasites'"),
+    (lambda c: c['api'].update(services='StatsService'), 'config.api.services: 应为数组'),
+])
+def test_schema_rejections(change, error):
+    broken = config()
+    change(broken)
+    assert error in validate(broken, 20001)
+
+
+def test_semantic_rejections():
+    assert '入站端口 20001 与服务端口 20002 不一致' in validate(config(), 20002)
+
+    broken = config()
+    broken['inbounds'] = [i for i in broken['inbounds'] if i['protocol'] != 'shadowsocks']
+    assert '缺少shadowsocks入站' in validate(broken)
+
+    broken = config()
+    broken['outbounds'][1]['tag'] = API_TAG
+    assert f'标签重复 {API_TAG}' in validate(broken)
+
+    # 多个错误一并报告
+    broken = config()
+    broken['inbounds'][0]['port'] = 0
+    broken['outbounds'][0]['protocol'] = 'http'
+    assert len(validate(broken).split('; ')) == 2
+
+
+def test_write_file_skips_identical_bytes(tmp_path):
+    path = str(tmp_path / CONFIG_FILE)
+    data = dumps(config())
+    assert write_file(path, data)
+    mtime = os.stat(path).st_mtime_ns
+    inode = os.stat(path).st_ino
+
+    assert not write_file(path, dumps(copy.deepcopy(config())))
+    assert os.stat(path).st_ino == inode and os.stat(path).st_mtime_ns == mtime
+
+    changed = dumps(config(method='chacha20-poly1305'))
+    assert write_file(path, changed)
+    with open(path, 'rb') as f:
+        assert f.read() == changed
+    assert os.listdir(tmp_path) == [CONFIG_FILE]
+
+
+def test_write_file_cleans_up_on_failure(tmp_path, monkeypatch):
+    path = str(tmp_path / CONFIG_FILE)
+    write_file(path, b'old\n')
+
+    def fail(src, dst):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(config_renderer.os, 'replace', fail)
+    with pytest.raises(OSError):
+        write_file(path, b'new\n')
+    # 临时文件已删除，原文件保持不变
+    assert os.listdir(tmp_path) == [CONFIG_FILE]
+    with open(path, 'rb') as f:
+        assert f.read() == b'old\n'
+
+
+def test_write_config_rejects_invalid(tmp_path):
+    path = str(tmp_path / CONFIG_FILE)
+    broken = config()
+    broken['inbounds'][0]['settings']['method'] = 'none'
+    written, error = write_config(path, broken, 20001)
+    assert not written and 'method' in error
+    assert not os.path.exists(path)
+
+
+def test_generate_keeps_method(tmp_path):
+    service_dir = str(tmp_path)
+    result = generate(service_dir, 20001, 'secret', '10.0.0.1', 1080, method='chacha20-poly1305')
+    assert result['success'] and result['changed']
+
+    # 重新生成沿用现有加密方式，内容不变时不写入
+    result = generate(service_dir, 20001, 'secret', '10.0.0.1', 1080)
+    assert result['success'] and not result['changed']
+    with open(result['path']) as f:
+        assert json.load(f)['inbounds'][0]['settings']['method'] == 'chacha20-poly1305'
+
+    result = generate(service_dir, 20001, 'secret', '10.0.0.1', 'x')
+    assert not result['success'] and result['message'].startswith('生成配置失败')
+    assert not any(n.endswith('.tmp') for n in os.listdir(os.path.join(service_dir, '20001')))
+
+
+def test_render_validate_1000_configs_fast():
+    start = time.perf_counter()
+    configs = [render(p, 'secret', '10.0.0.1', 1080, 'user', 'pass', api_port=62000 + i)
+               for i, p in enumerate(range(20000, 21000))]
+    errors = [validate(c, p) for p, c in zip(range(20000, 21000), configs)]
+    data = [dumps(c) for c in configs]
+    elapsed = time.perf_counter() - start
+
+    assert not any(errors) and len(set(data)) == 1000
+    assert elapsed < 1.0, f'渲染/校验/序列化 1000 个配置耗时 {elapsed:.2f}s'
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+合并运行测试 - 配置合并、成员持久化，以及在假xray共用进程中在线增删服务
+"""
+
+import os
+import json
+import socket
+
+import pytest
+
+from conftest import make_config, free_port
+from consolidated_runtime import (ConsolidatedRuntime, merge_configs, port_tags, inbound_tag,
+                                  BLOCK_TAG, CONSOLIDATED_MODE, MEMBERS_FILE)
+from readiness import is_listening
+from xray_stats import API_TAG
+
+
+def load(service_dir, port):
+    with open(os.path.join(str(service_dir), port, 'config.json')) as f:
+        return json.load(f)
+
+
+def test_merge_configs(tmp_path):
+    ports = sorted((make_config(tmp_path), make_config(tmp_path)), key=int)
+    merged = merge_configs({port: load(tmp_path, port) for port in ports}, 61000)
+
+    # 每个服务一个入站，各服务的API入站合并为一个
+    tags = [i['tag'] for i in merged['inbounds']]
+    assert tags == [inbound_tag(port) for port in ports] + [API_TAG]
+    assert next(i for i in merged['inbounds'] if i['tag'] == API_TAG)['port'] == 61000
+    assert merged['outbounds'][0]['tag'] == BLOCK_TAG
+
+    for port in ports:
+        tag, outbounds, rules = port_tags(merged, port)
+        assert tag == inbound_tag(port)
+        assert outbounds == [f'socks-out-{port}', f'direct-{port}']
+        service_rules = [r for r in merged['routing']['rules'] if r['inboundTag'] == [tag]]
+        assert [r['ruleTag'] for r in service_rules] == rules
+        # 最后一条规则把其余流量交给服务的第一个出站
+        assert service_rules[-1]['outboundTag'] == f'socks-out-{port}'
+    assert len({r['ruleTag'] for r in merged['routing']['rules'] if r.get('ruleTag')}) == \
+        len([r for r in merged['routing']['rules'] if r.get('ruleTag')])
+
+
+@pytest.fixture
+def consolidated(supervisor):
+    supervisor.configure(mode=CONSOLIDATED_MODE)
+    supervisor.consolidated.configure(api_port=free_port())
+    return supervisor
+
+
+def test_members_persist(consolidated):
+    a, b = make_config(consolidated.service_dir), make_config(consolidated.service_dir)
+    first, second = consolidated.start(a), consolidated.start(b)
+    assert first['success'] and second['success'], (first, second)
+    assert first['pid'] == second['pid']
+
+    runtime = consolidated.consolidated
+    with open(os.path.join(runtime._dir(), MEMBERS_FILE)) as f:
+        assert sorted(json.load(f)) == sorted([a, b])
+    # Web进程重启后从 members.json 与 consolidated.json 恢复
+    restored = ConsolidatedRuntime(consolidated, runtime_dir=runtime._dir(), api_port=runtime.api_port)
+    assert restored.members() == sorted([a, b], key=int)
+    assert set(restored.stats_targets()) == {a, b}
+
+
+def test_live_add_and_remove(consolidated):
+    runtime = consolidated.consolidated
+    a, b = make_config(consolidated.service_dir), make_config(consolidated.service_dir)
+    pid = consolidated.start(a)['pid']
+    reloads = runtime.reload_count
+
+    with socket.create_connection(('127.0.0.1', int(a))) as conn:
+        result = consolidated.start(b)
+        assert result['success'] and result['pid'] == pid
+        assert is_listening(b)
+
+        result = consolidated.stop(b)
+        assert result['success'] and result['pid'] == pid
+        assert not is_listening(b)
+
+        result = consolidated.restart(a)
+        assert result['success'] and result['pid'] == pid
+
+        # 在线增删，共用进程未重新加载，已有连接不受影响
+        conn.settimeout(0.2)
+        with pytest.raises(socket.timeout):
+            conn.recv(1)
+    assert runtime.reload_count == reloads and runtime.live_count == 4
+    assert runtime.members() == [a]
+    assert not os.path.exists(os.path.join(consolidated.service_dir, b, 'xray.pid'))
+
+
+def test_failed_stop_keeps_membership(consolidated, monkeypatch):
+    runtime = consolidated.consolidated
+    a, b = make_config(consolidated.service_dir), make_config(consolidated.service_dir)
+    consolidated.start(a)
+    pid = consolidated.start(b)['pid']
+
+    def fail(port):
+        from xray_handler import HandlerError
+        raise HandlerError('fake')
+
+    # 在线移除失败，重新加载时共用进程未能退出
+    monkeypatch.setattr(runtime, '_live_remove', fail)
+    monkeypatch.setattr(consolidated, '_terminate', lambda handle: (False, 0.0))
+    result = consolidated.stop(b)
+    assert not result['success'] and '停止服务失败' in result['message']
+
+    # 服务仍在共用进程中运行，仍是成员
+    assert is_listening(b) and runtime.is_member(b)
+    assert os.path.exists(os.path.join(consolidated.service_dir, b, 'xray.pid'))
+    again = consolidated.start(b)
+    assert again['success'] and again['pid'] == pid
+
+    monkeypatch.undo()
+    assert consolidated.stop(b)['success'] and not runtime.is_member(b)
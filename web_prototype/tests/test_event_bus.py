@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+事件总线测试 - 分发、慢订阅者丢弃旧事件、数据源差异推送与SSE格式
+"""
+
+import json
+import queue
+
+from event_bus import EventBus, format_sse
+
+
+def drain(q, timeout=2.0):
+    events = [q.get(timeout=timeout)]
+    while True:
+        try:
+            events.append(q.get_nowait())
+        except queue.Empty:
+            return events
+
+
+def drain_quiet(q, timeout=0.1):
+    try:
+        return [q.get(timeout=timeout)]
+    except queue.Empty:
+        return []
+
+
+def test_publish_to_all_subscribers():
+    bus = EventBus()
+    first, second = bus.subscribe(), bus.subscribe()
+    event = bus.publish('service', {'port': 20001})
+    assert first.get_nowait() is event and second.get_nowait() is event
+
+    bus.unsubscribe(second)
+    assert bus.publish('service', {})['id'] == event['id'] + 1
+    assert second.empty() and bus.subscriber_count == 1
+
+
+def test_slow_subscriber_drops_oldest():
+    bus = EventBus(queue_size=3)
+    slow, fast = bus.subscribe(), bus.subscribe()
+    for i in range(5):
+        bus.publish('tick', i)
+        fast.get_nowait()
+    assert [e['data'] for e in drain(slow)] == [2, 3, 4]
+
+
+def test_diff_source():
+    bus = EventBus(tick=0.01)
+    state = {'20001': 'running', '20002': 'running'}
+    bus.add_source('status', lambda: dict(state), interval=0.01)
+    q = bus.subscribe()
+
+    assert q.get(timeout=2)['data'] == {'changed': state, 'removed': []}
+    assert bus.snapshot() == [{'id': 0, 'type': 'status', 'data': {'changed': state, 'removed': []}}]
+
+    state['20002'] = 'stopped'
+    state['20003'] = 'running'
+    del state['20001']
+    data = q.get(timeout=2)['data']
+    assert data == {'changed': {'20002': 'stopped', '20003': 'running'}, 'removed': ['20001']}
+    # 没有变化时不推送
+    assert drain_quiet(q) == []
+    bus.unsubscribe(q)
+
+
+def test_full_value_source_and_idle():
+    bus = EventBus(tick=0.01)
+    values = iter([1, 1, 2, 2, 2] + [3] * 1000)
+    calls = []
+
+    def source():
+        calls.append(1)
+        return {'value': next(values)}
+
+    bus.add_source('metrics', source, interval=0.01, diff=False)
+    # 没有订阅者时不采集
+    assert calls == [] and bus.snapshot() == []
+
+    q = bus.subscribe()
+    assert q.get(timeout=2)['data'] == {'value': 1}
+    assert q.get(timeout=2)['data'] == {'value': 2}
+    assert q.get(timeout=2)['data'] == {'value': 3}
+    assert bus.snapshot()[0]['data'] == {'value': 3}
+    bus.unsubscribe(q)
+
+
+def test_format_sse():
+    text = format_sse({'id': 7, 'type': 'status', 'data': {'名称': '香港01'}})
+    lines = text.split('\n')
+    assert lines[:2] == ['id: 7', 'event: status'] and text.endswith('\n\n')
+    assert json.loads(lines[2][len('data: '):]) == {'名称': '香港01'}
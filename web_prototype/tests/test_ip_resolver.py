@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务器IP解析测试 - 用本地HTTP替身代替外网IP查询服务
+"""
+
+import sqlite3
+import threading
+import time
+
+from conftest import write_service
+from ip_resolver import ServerIPResolver
+
+SERVER_IP = '203.0.113.7'
+
+
+def make_resolver(stand_in, paths, tmp_path, **options):
+    return ServerIPResolver(providers=[stand_in.url + path for path in paths],
+                            cache_file=str(tmp_path / '.server_ip'), **options)
+
+
+def test_listing_500_services_resolves_once(app_module, service_dir, http_stand_in, tmp_path, monkeypatch):
+    stand_in = http_stand_in({'/ip': (200, f'{SERVER_IP}\n', 0.2)})
+    resolver = make_resolver(stand_in, ['/ip'], tmp_path)
+    monkeypatch.setattr(app_module, 'ip_resolver', resolver)
+    for port in range(20000, 20500):
+        write_service(service_dir, port)
+
+    services = app_module.get_services_from_filesystem()
+    assert len(services) == 500
+    assert all(service['server_ip'] == SERVER_IP for service in services)
+    assert resolver.resolve_count <= 1
+
+    # 并发的列表请求与后续请求都使用缓存
+    threads = [threading.Thread(target=app_module.get_services_from_filesystem) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    app_module.get_services_from_filesystem()
+    assert resolver.resolve_count == 1
+    assert stand_in.hits == {'/ip': 1}
+
+
+def test_first_valid_answer_wins(http_stand_in, tmp_path):
+    stand_in = http_stand_in({
+        '/slow': (200, '198.51.100.1', 3),
+        '/broken': (500, '', 0),
+        '/garbage': (200, 'not an ip', 0),
+        '/fast': (200, SERVER_IP, 0.1),
+    })
+    resolver = make_resolver(stand_in, ['/slow', '/broken', '/garbage', '/fast'], tmp_path)
+
+    start = time.monotonic()
+    assert resolver.get() == SERVER_IP
+    assert time.monotonic() - start < 2
+    # 结果写入缓存文件，供Shell脚本的 get_server_ip 读取
+    assert (tmp_path / '.server_ip').read_text().strip() == SERVER_IP
+
+
+def test_stale_value_served_while_refreshing(http_stand_in, tmp_path):
+    stand_in = http_stand_in({'/ip': (200, SERVER_IP, 0)})
+    resolver = make_resolver(stand_in, ['/ip'], tmp_path, ttl=0.2)
+    assert resolver.get() == SERVER_IP
+
+    stand_in.routes['/ip'] = (200, '198.51.100.2', 0.5)
+    time.sleep(0.3)
+    start = time.monotonic()
+    assert resolver.get() == SERVER_IP
+    assert time.monotonic() - start < 0.2
+
+    deadline = time.monotonic() + 5
+    while resolver.get() != '198.51.100.2' and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert resolver.get() == '198.51.100.2'
+    assert resolver.resolve_count == 2
+
+
+def test_override_from_system_settings(http_stand_in, tmp_path):
+    db_path = str(tmp_path / 'settings.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE system_settings (key TEXT PRIMARY KEY, value TEXT)')
+    conn.execute("INSERT INTO system_settings VALUES ('server_ip', '192.0.2.10')")
+    conn.commit()
+    conn.close()
+
+    stand_in = http_stand_in({'/ip': (200, SERVER_IP, 0)})
+    resolver = make_resolver(stand_in, ['/ip'], tmp_path, db_path=db_path)
+    assert resolver.get() == '192.0.2.10'
+    assert resolver.resolve_count == 0
+    assert stand_in.hits == {}
+
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+后台任务测试 - 进程重启后重新执行的创建服务任务
+"""
+
+import json
+import uuid
+
+import pytest
+
+from conftest import free_port
+from job_queue import RUNNING
+
+
+def insert_job(app, job_type, params):
+    """写入一个执行中的任务 (相当于进程在执行该任务时退出)"""
+    job_id = uuid.uuid4().hex
+    conn = app.job_queue._connect()
+    with conn:
+        conn.execute('INSERT INTO jobs (id, type, params, status, attempts) VALUES (?, ?, ?, ?, 1)',
+                     (job_id, job_type, json.dumps(params), RUNNING))
+    conn.close()
+    return job_id
+
+
+def run_job(app, job_id):
+    with app.app.app_context():
+        return app.run_create_service(app.job_queue.get(job_id), lambda progress, message=None: None)
+
+
+class Crash(Exception):
+    pass
+
+
+def crash_once(monkeypatch, module, name):
+    original = getattr(module, name)
+
+    def crash(*args, **kwargs):
+        monkeypatch.setattr(module, name, original)
+        raise Crash(name)
+
+    monkeypatch.setattr(module, name, crash)
+
+
+@pytest.mark.parametrize('explicit_port', [False, True])
+@pytest.mark.parametrize('crash_at', ['render_service_config', 'sync_service_to_db'])
+def test_create_service_retry_reuses_port(app_env, service_dir, monkeypatch, explicit_port, crash_at):
+    data = {'node_name': 'retry', 'ss_password': 'secret', 'socks_ip': '127.0.0.1', 'socks_port': 1080}
+    if explicit_port:
+        data['port'] = free_port()
+    job_id = insert_job(app_env, 'create_service', {'data': data, 'actor': {'username': 'admin', 'user_id': 1}})
+
+    crash_once(monkeypatch, app_env, crash_at)
+    with pytest.raises(Crash):
+        run_job(app_env, job_id)
+    port = app_env.job_queue.get(job_id)['params']['allocated_port']
+    if explicit_port:
+        assert port == data['port']
+
+    result = run_job(app_env, job_id)
+    assert result['success'], result['message']
+    assert result['port'] == port
+    assert [entry.name for entry in service_dir.iterdir()] == [str(port)]
+    assert (service_dir / str(port) / 'config.json').is_file()
+
+    with app_env.app.app_context():
+        rows = app_env.get_db().execute('SELECT port FROM services').fetchall()
+    assert [int(row['port']) for row in rows] == [port]
+
+
+def test_checkpoint_merges_params(app_env):
+    job_id = insert_job(app_env, 'create_service', {'data': {'node_name': 'x'}})
+    assert app_env.job_queue.checkpoint(job_id, allocated_port=20001) == {
+        'data': {'node_name': 'x'}, 'allocated_port': 20001}
+    assert app_env.job_queue.get(job_id)['params']['allocated_port'] == 20001
+    assert app_env.job_queue.checkpoint('missing', allocated_port=1) is None
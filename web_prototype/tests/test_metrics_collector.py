@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监控数据采集测试 - 系统行与服务行的批量写入、监听器事务与采集周期设置
+"""
+
+import os
+import sqlite3
+
+import pytest
+
+from metrics_collector import MetricsCollector, DEFAULT_INTERVAL, MIN_INTERVAL
+
+SCHEMA = '''
+    CREATE TABLE monitor_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        service_port INTEGER, cpu_usage REAL, memory_usage REAL, connections INTEGER,
+        traffic_in INTEGER, traffic_out INTEGER, timestamp TIMESTAMP
+    );
+    CREATE TABLE system_settings (key TEXT PRIMARY KEY, value TEXT);
+'''
+
+
+class Sampler:
+    def latest(self):
+        return {'cpu_percent': 12.5, 'memory_percent': 40.0,
+                'rates': {'net_bytes_recv_rate': 1000.0, 'net_bytes_sent_rate': 500.0}}
+
+
+@pytest.fixture
+def collector(tmp_path):
+    db_path = str(tmp_path / 'monitor.db')
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    conn.close()
+
+    services = {
+        '20001': {'status': 'running', 'pid': os.getpid(), 'connections': 3},
+        '20002': {'status': 'stopped', 'pid': None},
+        '20003': {'status': 'running', 'pid': 2 ** 22 + 1},
+    }
+    return MetricsCollector(db_path=db_path, sampler=Sampler(), services_fn=lambda: services,
+                            traffic_fn=lambda: {'20001': (300, 200)})
+
+
+def rows(collector):
+    conn = sqlite3.connect(collector.db_path)
+    try:
+        return conn.execute('SELECT service_port, cpu_usage, memory_usage, connections, traffic_in, '
+                            'traffic_out, timestamp FROM monitor_data ORDER BY id').fetchall()
+    finally:
+        conn.close()
+
+
+def test_collect_once(collector):
+    assert collector.collect_once() == 3
+    system, service, missing = rows(collector)
+
+    assert system[0] is None and system[1:3] == (12.5, 40.0) and system[4:6] == (1000, 500)
+    # 新进程的第一次采集没有CPU基准
+    assert service[0] == 20001 and service[1] == 0.0 and service[2] > 0
+    assert service[3:6] == (3, 300, 200)
+    # 已退出的进程按0记录，且不保留缓存
+    assert missing[0] == 20003 and missing[1:3] == (0.0, 0.0)
+    assert set(collector._processes) == {os.getpid()}
+    assert system[6] == service[6] == missing[6]
+
+    collector.collect_once()
+    assert len(rows(collector)) == 6
+    assert collector.samples_written == 6 and collector.flush_count == 2
+
+
+def test_listener_runs_in_transaction(collector):
+    seen = []
+    collector.listeners.append(lambda conn, batch: seen.append(len(batch)))
+    collector.collect_once()
+    assert seen == [3]
+
+    def failing(conn, batch):
+        raise sqlite3.OperationalError('汇总失败')
+
+    collector.listeners.append(failing)
+    with pytest.raises(sqlite3.OperationalError):
+        collector.collect_once()
+    # 监听器失败时本批数据一并回滚
+    assert len(rows(collector)) == 3 and collector.flush_count == 1
+
+
+@pytest.mark.parametrize('value, interval', [
+    (None, DEFAULT_INTERVAL), ('60', 60), ('1', MIN_INTERVAL), ('abc', DEFAULT_INTERVAL), ('', DEFAULT_INTERVAL),
+])
+def test_get_interval(collector, value, interval):
+    if value is not None:
+        conn = sqlite3.connect(collector.db_path)
+        with conn:
+            conn.execute('INSERT INTO system_settings (key, value) VALUES (?, ?)', ('monitor_interval', value))
+        conn.close()
+    assert collector.get_interval() == interval
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监控数据汇总测试 - 增量汇总与全量重建一致、小时桶由5分钟桶合并、重启后恢复当前桶与层级选择
+"""
+
+import math
+import random
+import sqlite3
+from types import SimpleNamespace
+import time
+
+import pytest
+
+import metrics_rollup
+from metrics_rollup import MetricsRollup, ROLLUP_TIERS, create_tables, format_epoch, merge, summarize
+
+BASE = 1_800_000_000 - 1_800_000_000 % 3600
+STEP = 30
+HOURS = 3
+
+
+def samples():
+    """每30秒一个周期：系统行 + 一个服务行，共3小时"""
+    rng = random.Random(7)
+    cycles = []
+    for t in range(BASE, BASE + HOURS * 3600, STEP):
+        timestamp = format_epoch(t)
+        cycles.append((t, [
+            (None, rng.uniform(0, 100), rng.uniform(20, 80), rng.randint(0, 500),
+             rng.randint(0, 10 ** 6), rng.randint(0, 10 ** 6), timestamp),
+            (20001, rng.uniform(0, 10), rng.uniform(0, 5), rng.randint(0, 50),
+             rng.randint(0, 10 ** 5), rng.randint(0, 10 ** 5), timestamp),
+        ]))
+    return cycles
+
+
+CYCLES = samples()
+
+
+def database():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''
+        CREATE TABLE monitor_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            service_port INTEGER, cpu_usage REAL, memory_usage REAL, connections INTEGER,
+            traffic_in INTEGER, traffic_out INTEGER, timestamp TIMESTAMP
+        )
+    ''')
+    create_tables(conn.cursor())
+    return conn
+
+
+def insert(conn, rows):
+    conn.executemany('''
+        INSERT INTO monitor_data (service_port, cpu_usage, memory_usage, connections,
+                                  traffic_in, traffic_out, timestamp)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [BASE]
+    monkeypatch.setattr(metrics_rollup, 'time', SimpleNamespace(time=lambda: now[0], strptime=time.strptime))
+    return now
+
+
+def run(conn, cycles, clock, rollup=None):
+    """按采集器的方式逐周期写入原始数据并增量汇总"""
+    rollup = rollup or MetricsRollup()
+    for t, rows in cycles:
+        clock[0] = t
+        with conn:
+            insert(conn, rows)
+            rollup.apply(conn, rows)
+    return rollup
+
+
+def tables(conn):
+    return {tier.name: [tuple(round(v, 6) if isinstance(v, float) else v for v in row)
+                        for row in conn.execute(f'SELECT * FROM {tier.table} ORDER BY service_port, metric, bucket')]
+            for tier in ROLLUP_TIERS}
+
+
+def test_summarize_and_merge():
+    assert summarize([5, 1, 3]) == (3, 9, 1, 5, 5)
+    values = list(range(1, 101))
+    assert summarize(values) == (100, 5050, 1, 100, 95)
+    assert merge([summarize(values[:50]), summarize(values[50:])]) == (100, 5050, 1, 100, 98)
+
+
+def test_incremental_matches_raw(clock):
+    conn = database()
+    assert run(conn, CYCLES, clock).rows_written > 0
+
+    # 1分钟与5分钟桶与原始数据直接计算一致
+    raw = {}
+    for t, rows in CYCLES:
+        for row in rows:
+            port = 0 if row[0] is None else row[0]
+            for metric, value in zip(metrics_rollup.METRICS, row[1:]):
+                raw.setdefault((port, metric), []).append((t, value))
+
+    for tier in ROLLUP_TIERS:
+        buckets = {}
+        for (port, metric), series in raw.items():
+            for t, value in series:
+                buckets.setdefault((port, metric, t - t % tier.width), []).append(value)
+        rows = {(r[1], r[2], r[0]): r[3:] for r in conn.execute(f'SELECT * FROM {tier.table}')}
+        assert len(rows) == len(buckets) == 2 * 5 * HOURS * 3600 // tier.width
+
+        for key, values in buckets.items():
+            count, total, low, high, p95 = rows[key]
+            assert count == len(values) and total == pytest.approx(sum(values))
+            assert (low, high) == pytest.approx((min(values), max(values)))
+            exact = sorted(values)[math.ceil(len(values) * 0.95) - 1]
+            if tier.source is None:
+                assert p95 == pytest.approx(exact)
+            else:
+                # 小时桶的p95取5分钟桶p95的最大值，不会低于精确值
+                assert exact - 1e-6 <= p95 <= high + 1e-6
+
+
+def test_rebuild_matches_incremental(clock):
+    incremental = database()
+    run(incremental, CYCLES, clock)
+
+    rebuilt = database()
+    with rebuilt:
+        for _, rows in CYCLES:
+            insert(rebuilt, rows)
+        MetricsRollup().rebuild(rebuilt, batch_size=50)
+    assert tables(rebuilt) == tables(incremental)
+
+
+@pytest.mark.parametrize('split', [len(CYCLES) // 2 + 7, 250])
+def test_restart_restores_open_buckets(clock, split):
+    continuous = database()
+    run(continuous, CYCLES, clock)
+
+    # 在桶中间重启：新实例从数据库恢复当前桶后继续
+    restarted = database()
+    run(restarted, CYCLES[:split], clock)
+    run(restarted, CYCLES[split:], clock)
+    assert tables(restarted) == tables(continuous)
+
+
+def test_query_tiers(clock):
+    conn = database()
+    rollup = run(conn, CYCLES, clock)
+    clock[0] = BASE + HOURS * 3600
+
+    name, step, data = rollup.query(conn, 1, raw_interval=STEP)
+    assert (name, step, len(data)) == ('raw', STEP, 120)
+
+    name, step, data = rollup.query(conn, 2, port=20001)
+    assert (name, step, len(data)) == ('1m', 60, 120)
+    first = [r for _, rows in CYCLES for r in rows if r[0] == 20001 and r[-1] < format_epoch(BASE + 3660)][-2:]
+    assert data[0]['cpu_usage'] == round(sum(r[1] for r in first) / 2, 2)
+
+    assert rollup.query(conn, 3, max_points=10)[:2] == ('1h', 3600)
+    assert rollup.query(conn, 3, max_points=36)[:2] == ('5m', 300)
+    name, step, data = rollup.query(conn, 3, max_points=2)
+    assert (name, step) == ('7200s', 7200) and len(data) <= 2
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端口分配测试 - 端口池选择、已用/回收站/系统占用端口的排除、预留过期与并发预留
+"""
+
+import time
+import socket
+import threading
+
+import pytest
+
+from conftest import free_port
+from port_allocator import PortAllocator, PortAllocationError, parse_ranges, parse_mapping, DEFAULT_POOL
+from socket_table import socket_table
+from xray_stats import API_PORT_BASE, API_PORT_RANGE
+
+
+def pool_range(size):
+    """一段当前没有被系统监听或绑定的端口"""
+    for _ in range(50):
+        start = free_port()
+        # 避开Xray API端口范围与共用进程的API端口
+        if start + size > 65535 or API_PORT_BASE - size <= start < API_PORT_BASE + API_PORT_RANGE:
+            continue
+        sockets = socket_table.snapshot(force=True)
+        if not any(sockets.is_bound(port) for port in range(start, start + size)):
+            return start, start + size - 1
+    pytest.skip('找不到空闲的端口段')
+
+
+def drain(allocator, pool):
+    """预留端口池中的全部端口"""
+    ports = set()
+    while True:
+        try:
+            ports.add(allocator.reserve(pool=pool))
+        except PortAllocationError:
+            return ports
+
+
+def test_pool_selection(service_dir):
+    default, vip = pool_range(20), pool_range(20)
+    allocator = PortAllocator(pools={DEFAULT_POOL: default, 'vip': vip}, user_pools={'alice': 'vip'})
+
+    assert default[0] <= allocator.reserve() <= default[1]
+    assert vip[0] <= allocator.reserve(user='alice') <= vip[1]
+    assert default[0] <= allocator.reserve(user='bob') <= default[1]
+    # 指定的端口池优先于用户对应的端口池
+    assert default[0] <= allocator.reserve(pool=DEFAULT_POOL, user='alice') <= default[1]
+    with pytest.raises(PortAllocationError, match='端口池不存在'):
+        allocator.reserve(pool='missing')
+
+
+def test_excludes_used_recycled_and_bound_ports(service_dir, tmp_path):
+    start, end = pool_range(8)
+    recycle = tmp_path / 'recycle'
+    recycle.mkdir()
+    (service_dir / str(start)).mkdir()
+    (recycle / f'{start + 1}_20260101120000').mkdir()
+    (recycle / str(start + 2)).mkdir()
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', start + 3))
+        sock.listen(1)
+        socket_table.snapshot(force=True)
+
+        allocator = PortAllocator(recycle_dirs=[str(recycle)], pools={DEFAULT_POOL: (start, end)})
+        assert not allocator.is_available(start + 3)
+        assert drain(allocator, DEFAULT_POOL) == set(range(start + 4, end + 1))
+
+    stats = allocator.get_stats()['pools'][DEFAULT_POOL]
+    assert stats['used'] == 1 and stats['recycled'] == 2 and stats['reserved'] == 4
+
+
+def test_reserve_port(service_dir):
+    start, end = pool_range(4)
+    (service_dir / str(start)).mkdir()
+    allocator = PortAllocator(pools={DEFAULT_POOL: (start, end)})
+
+    assert not allocator.reserve_port(start)
+    assert not allocator.reserve_port(API_PORT_BASE)
+    assert not allocator.reserve_port(0)
+    assert allocator.reserve_port(start + 1, owner='alice')
+    assert not allocator.reserve_port(start + 1)
+
+    # 放弃后可再次预留，提交后一直占用
+    allocator.release(start + 1)
+    assert allocator.is_available(start + 1)
+    assert allocator.reserve_port(start + 1)
+    allocator.commit(start + 1)
+    assert not allocator.is_available(start + 1)
+    assert allocator.get_stats()['reservations'] == {}
+
+
+def test_reservation_expires(service_dir):
+    start, _ = pool_range(1)
+    allocator = PortAllocator(pools={DEFAULT_POOL: (start, start)})
+
+    assert allocator.reserve(owner='alice', ttl=0.1) == start
+    with pytest.raises(PortAllocationError, match='没有可用端口'):
+        allocator.reserve()
+    assert allocator.get_stats()['reservations'][start]['owner'] == 'alice'
+
+    time.sleep(0.15)
+    assert allocator.reserve(owner='bob') == start
+
+
+def test_concurrent_reserve_never_repeats(service_dir):
+    start, end = pool_range(200)
+    allocator = PortAllocator(pools={DEFAULT_POOL: (start, end)})
+    results = []
+    barrier = threading.Barrier(16)
+
+    def worker():
+        barrier.wait()
+        ports = []
+        for _ in range(12):
+            try:
+                ports.append(allocator.reserve())
+            except PortAllocationError:
+                break
+        results.append(ports)
+
+    threads = [threading.Thread(target=worker) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    ports = [port for chunk in results for port in chunk]
+    assert len(ports) == len(set(ports)) == 192
+    assert all(start <= port <= end for port in ports)
+    assert len(drain(allocator, DEFAULT_POOL)) == 8
+
+
+def test_parse_specs():
+    assert parse_ranges('default=10000-60000;vip=20000-20999, one=30000') == {
+        'default': (10000, 60000), 'vip': (20000, 20999), 'one': (30000, 30000)}
+    with pytest.raises(ValueError):
+        parse_ranges('bad=2-1')
+    assert parse_mapping('alice=vip; bob=vip;carol=') == {'alice': 'vip', 'bob': 'vip'}
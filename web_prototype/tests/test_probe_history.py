@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+探测历史测试 - 按分钟记录数天的合成探测结果，汇总统计与原始数据对照
+"""
+
+import math
+import random
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+import probe_history
+from probe_history import ProbeHistory, create_tables, HIST_BASE
+
+# 不与任何桶边界对齐的"现在"
+NOW = 1_800_000_000 + 12_345
+DAYS = 3
+# 端口 -> (延迟中位数毫秒, 失败率)
+PORTS = {20001: (50, 0.02), 20002: (100, 0.0), 20003: (20, 0.2)}
+# 直方图代表值的最大相对误差 (档位宽度的一半)
+HIST_ERROR = math.sqrt(HIST_BASE) - 1 + 1e-6
+
+
+def nearest_rank(values, q):
+    values = sorted(values)
+    return values[max(1, math.ceil(len(values) * q)) - 1]
+
+
+@pytest.fixture(scope='module')
+def history():
+    """每分钟一次、共 DAYS 天的探测结果，按小时分批写入 (覆盖桶的读-合并-写)"""
+    rng = random.Random(42)
+    conn = sqlite3.connect(':memory:')
+    create_tables(conn.cursor())
+    store = ProbeHistory()
+    raw = []
+    start = NOW - DAYS * 86400
+    for hour in range(start, NOW, 3600):
+        batch = []
+        for port, (median, failure_rate) in PORTS.items():
+            for checked_at in range(hour, min(hour + 3600, NOW), 60):
+                success = rng.random() >= failure_rate
+                latency = round(median * rng.lognormvariate(0, 0.3), 2) if success else -1
+                batch.append((port, checked_at, latency, success))
+        store.record(conn, batch)
+        raw.extend(batch)
+    conn.commit()
+    yield store, conn, raw
+    conn.close()
+
+
+@pytest.fixture(autouse=True)
+def frozen_time(monkeypatch):
+    monkeypatch.setattr(probe_history, 'time', SimpleNamespace(time=lambda: NOW))
+
+
+@pytest.mark.parametrize('hours', [1, 5.5, 30, 72])
+def test_summary_matches_raw(history, hours):
+    store, conn, raw = history
+    since = int(NOW - hours * 3600)
+    # 最细层级向下对齐到桶边界
+    since -= since % 300
+    summary = store.summary(conn, hours)
+    assert set(summary) == set(PORTS)
+
+    for port in PORTS:
+        rows = [r for r in raw if r[0] == port and r[1] >= since]
+        latencies = [r[2] for r in rows if r[3]]
+        stats = summary[port]
+        assert stats['samples'] == len(rows)
+        assert stats['successes'] == len(latencies)
+        assert stats['availability'] == round(len(latencies) * 100 / len(rows), 2)
+        assert stats['avg'] == pytest.approx(sum(latencies) / len(latencies), abs=0.01)
+        assert stats['min'] == min(latencies) and stats['max'] == max(latencies)
+        for q in (0.50, 0.95, 0.99):
+            exact = nearest_rank(latencies, q)
+            assert abs(stats[f'p{int(q * 100)}'] / exact - 1) <= HIST_ERROR
+
+
+def test_summary_filters_ports(history):
+    store, conn, _ = history
+    assert set(store.summary(conn, 24, ports=[20001, 20003])) == {20001, 20003}
+    assert store.summary(conn, 24, ports=[]) == {}
+
+
+@pytest.mark.parametrize('hours', [0.5, 5.5, 30, 60])
+def test_cover_is_contiguous(hours):
+    since = int(NOW - hours * 3600)
+    ranges = ProbeHistory()._cover(since)
+    # 从粗到细，首尾相接直到现在
+    assert ranges[0][2] is None
+    for (_, start, _), (_, _, end) in zip(ranges, ranges[1:]):
+        assert end == start
+    tier, start, _ = ranges[-1]
+    assert tier.name == '5m' and start == since - since % 300
+    for tier, start, end in ranges:
+        assert start % tier.width == 0 and (end is None or end % tier.width == 0)
+
+
+def test_ranking(history):
+    store, conn, _ = history
+    fastest = store.ranking(conn, 24, 'fastest')
+    assert [item['port'] for item in fastest] == [20003, 20001, 20002]
+    unreliable = store.ranking(conn, 24, 'unreliable', limit=2)
+    assert [item['port'] for item in unreliable] == [20003, 20001]
+    assert store.ranking(conn, 1, min_samples=61) == []
+    with pytest.raises(ValueError):
+        store.ranking(conn, 24, 'slowest')
+
+
+def test_series_resolution(history):
+    store, conn, raw = history
+
+    name, step, data = store.series(conn, 20001, 1)
+    assert name == 'raw' and step is None and len(data) == 60
+
+    name, step, data = store.series(conn, 20001, 24)
+    assert name == '5m' and step == 300 and len(data) == 288
+
+    # 最细层级仍超过点数时合并相邻桶
+    name, step, data = store.series(conn, 20001, 72, max_points=100)
+    assert name == '2700s' and step == 2700 and len(data) <= 100
+    since = NOW - 72 * 3600
+    since -= since % step
+    assert sum(point['samples'] for point in data) == \
+        sum(1 for r in raw if r[0] == 20001 and r[1] >= since)
+    assert all(point['timestamp'] % step == 0 for point in data)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+定时探测测试 - 缓存的有效期、探测方式与清理，以及测试接口对缓存的使用
+"""
+
+import time
+import sqlite3
+
+import pytest
+
+from conftest import write_service
+from probe_history import create_tables
+from probe_scheduler import ProbeScheduler
+from ss_probe import probe_result
+
+
+class Probe:
+    """记录被探测端口的桩探测函数"""
+
+    def __init__(self, latency=12.5, **extra):
+        self.latency = latency
+        self.extra = extra
+        self.ports = []
+
+    async def __call__(self, target, timeout, **kwargs):
+        self.ports.append(str(target['key']))
+        return dict(probe_result(True, self.latency, 'ok'), **self.extra)
+
+
+def targets(*ports):
+    return [{'key': str(port), 'server': '127.0.0.1', 'port': port} for port in ports]
+
+
+def test_run_once_caches_records_and_prunes(tmp_path):
+    db_path = str(tmp_path / 'probe.db')
+    conn = sqlite3.connect(db_path)
+    create_tables(conn.cursor())
+    conn.commit()
+
+    current = targets(20001, 20002)
+    probe = Probe()
+    scheduler = ProbeScheduler(db_path=db_path, targets_fn=lambda: current, probe=probe, interval=60)
+    assert scheduler.run_once() == 2
+    cached = scheduler.get('20001')
+    assert cached['success'] and cached['latency'] == 12.5
+    assert cached['probe_mode'] == 'tcp' and cached['age'] <= 1
+    assert conn.execute('SELECT COUNT(*) FROM probe_results').fetchone()[0] == 2
+
+    # 已停止的服务不再保留缓存
+    current = targets(20001)
+    scheduler.run_once()
+    assert scheduler.get('20002') is None and scheduler.get('20001') is not None
+    assert scheduler.get_stats()['cached'] == 1 and scheduler.cycle_count == 2
+    conn.close()
+
+
+def test_get_mode_and_max_age():
+    scheduler = ProbeScheduler(interval=60, jitter=0.1)
+    assert scheduler.max_age == pytest.approx(132)
+
+    scheduler.update(20001, probe_result(True, 10, 'ok'), 'tcp')
+    assert scheduler.get(20001, mode='tcp') is not None
+    assert scheduler.get(20001, mode='handshake') is None
+    assert scheduler.get(20001, max_age=-1) is None
+
+    scheduler.update(20001, probe_result(True, 10, 'ok'), 'tcp', checked_at=time.time() - 133)
+    assert scheduler.get(20001) is None
+    assert scheduler.get(20001, max_age=200)['age'] >= 133
+
+
+@pytest.fixture
+def client(app_env, service_dir, monkeypatch):
+    """登录后的测试客户端，两个服务，服务器IP不经网络解析，缓存为空"""
+    for port in (20001, 20002):
+        write_service(service_dir, port)
+    app_env.service_registry.invalidate()
+    monkeypatch.setattr(app_env, 'get_server_ip', lambda: '127.0.0.1')
+    monkeypatch.setattr(app_env.probe_scheduler, '_cache', {})
+
+    client = app_env.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+        session['username'] = 'admin'
+    return client
+
+
+@pytest.fixture
+def tcp_probe(app_env, monkeypatch):
+    probe = Probe(latency=33.0)
+    monkeypatch.setattr(app_env, 'probe_tcp', probe)
+    return probe
+
+
+def batch(client, **body):
+    response = client.post('/api/test-ss-batch', json=dict({'ports': ['20001', '20002']}, **body))
+    assert response.status_code == 200
+    return {r['port']: r for r in response.get_json()['results']}
+
+
+def test_batch_uses_cache(app_env, client, tcp_probe):
+    app_env.probe_scheduler.update('20001', probe_result(True, 7.0, 'ok'), 'tcp')
+    results = batch(client)
+
+    assert tcp_probe.ports == ['20002']
+    assert results['20001']['cached'] and results['20001']['latency'] == 7.0
+    assert 'age' in results['20001']
+    assert not results['20002']['cached'] and results['20002']['latency'] == 33.0
+    # 本次探测的结果写入缓存
+    assert app_env.probe_scheduler.get('20002', mode='tcp')['latency'] == 33.0
+
+
+def test_batch_fresh_ignores_cache(app_env, client, tcp_probe):
+    app_env.probe_scheduler.update('20001', probe_result(True, 7.0, 'ok'), 'tcp')
+    results = batch(client, fresh=True)
+    assert sorted(tcp_probe.ports) == ['20001', '20002']
+    assert not any(r['cached'] for r in results.values())
+    assert app_env.probe_scheduler.get('20001')['latency'] == 33.0
+
+
+def test_batch_mode_mismatch_probes_again(app_env, client, tcp_probe, monkeypatch):
+    handshake = Probe(latency=50.0, mode='handshake', ttfb=60.0, throughput=1.0, bytes=10)
+    monkeypatch.setattr(app_env, 'probe_handshake', handshake)
+    app_env.probe_scheduler.update('20001', probe_result(True, 7.0, 'ok'), 'tcp')
+
+    results = batch(client, mode='handshake')
+    assert sorted(handshake.ports) == ['20001', '20002'] and tcp_probe.ports == []
+    assert not results['20001']['cached'] and results['20001']['ttfb'] == 60.0
+    assert app_env.probe_scheduler.get('20001')['probe_mode'] == 'handshake'
+
+
+def test_batch_expired_cache_probes_again(app_env, client, tcp_probe):
+    scheduler = app_env.probe_scheduler
+    scheduler.update('20001', probe_result(True, 7.0, 'ok'), 'tcp',
+                     checked_at=time.time() - scheduler.max_age - 1)
+    scheduler.update('20002', probe_result(True, 8.0, 'ok'), 'tcp')
+
+    results = batch(client)
+    assert tcp_probe.ports == ['20001']
+    assert not results['20001']['cached'] and results['20002']['cached']
+
+
+def test_single_test_uses_cache(app_env, client, monkeypatch):
+    calls = []
+
+    def fake_test_ss_link(ss_link, timeout=10):
+        calls.append(ss_link)
+        return {'ss_link': ss_link, 'parsed': True, 'connection': True, 'error': None,
+                'details': {'server': '127.0.0.1', 'port': 20001, 'latency': 21.0,
+                            'connection_message': 'ok'}}
+
+    monkeypatch.setattr(app_env, 'test_ss_link', fake_test_ss_link)
+    app_env.probe_scheduler.update('20001', probe_result(True, 7.0, 'ok'), 'tcp')
+
+    data = client.post('/api/services/20001/test-ss', json={}).get_json()
+    assert data['cached'] and data['details']['latency'] == 7.0 and 'age' in data
+    assert calls == []
+
+    data = client.post('/api/services/20001/test-ss', json={'fresh': True}).get_json()
+    assert data['success'] and not data['cached'] and data['details']['latency'] == 21.0
+    assert len(calls) == 1
+    assert app_env.probe_scheduler.get('20001')['latency'] == 21.0
+
+    response = client.post('/api/services/29999/test-ss', json={'fresh': True})
+    assert response.status_code == 404
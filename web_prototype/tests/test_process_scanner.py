@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程扫描测试 - 在构造的/proc目录上解析命令行、启动时间与PID复用
+"""
+
+import os
+
+import pytest
+
+from process_scanner import ProcessScanner, _parse_config_port
+
+BOOT_TIME = 1_700_000_000
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+
+def add_process(proc, pid, argv, start_ticks, comm='xray'):
+    path = proc / str(pid)
+    path.mkdir()
+    (path / 'cmdline').write_bytes(b'\0'.join(a.encode() for a in argv) + b'\0')
+    # 第3个字段起: state ppid pgrp ... 第22个字段为starttime
+    fields = ['S'] + ['0'] * 18 + [str(start_ticks), '0', '0']
+    (path / 'stat').write_bytes(f'{pid} ({comm}) {" ".join(fields)}\n'.encode())
+
+
+@pytest.fixture
+def proc(tmp_path):
+    proc = tmp_path / 'proc'
+    (proc / 'self').mkdir(parents=True)
+    (proc / 'stat').write_text(f'cpu  1 2 3\nbtime {BOOT_TIME}\nprocesses 10\n')
+    return proc
+
+
+@pytest.mark.parametrize('argv, port', [
+    (['/usr/local/bin/xray', 'run', '-config', '/srv/services/20001/config.json'], '20001'),
+    (['xray', 'run', '--config=/srv/services/20002/config.json'], '20002'),
+    (['python3', '/tmp/fake_xray.py', 'run', '-c', 'services/20003/config.json'], '20003'),
+    (['xray', 'run', '-config', '/etc/xray/config.json'], None),
+    (['nginx', '-c', '/srv/services/20004/config.json'], None),
+])
+def test_parse_config_port(argv, port):
+    assert _parse_config_port(argv) == port
+
+
+def test_start_time_with_spaces_in_comm(proc):
+    add_process(proc, 100, ['xray', 'run', '-config', 's/20001/config.json'], 4200, comm='xray) (x y')
+    state = ProcessScanner(str(proc)).states()['20001']
+    assert state['status'] == 'running' and state['pid'] == 100
+    assert state['started_at'] == pytest.approx(BOOT_TIME + 4200 / CLK_TCK)
+
+
+def test_states_from_one_scan(proc):
+    add_process(proc, 100, ['xray', 'run', '-config', 's/20001/config.json'], 100)
+    add_process(proc, 101, ['xray', 'run', '-config', 's/20002/config.json'], 200)
+    # 同一端口有两个进程 (平滑重启中)，取最新启动的
+    add_process(proc, 102, ['xray', 'run', '-config', 's/20002/config.json'], 300)
+    add_process(proc, 103, ['bash'], 50, comm='bash')
+
+    scanner = ProcessScanner(str(proc), ttl=60)
+    # PID文件指向已复用给其他进程的PID，或PID已不存在
+    states = scanner.states({20001: 100, 20002: 101, 20003: 103, 20004: 999})
+    assert states['20001']['status'] == 'running'
+    assert states['20002']['pid'] == 102 and states['20002']['pidfile_pid'] == 101
+    assert states['20003']['status'] == 'stopped' and states['20003']['pid_reused']
+    assert states['20004']['status'] == 'stopped' and not states['20004']['pid_reused']
+
+    # ttl内复用扫描结果
+    scanner.states()
+    assert scanner.scan_count == 1
+    scanner.states(force=True)
+    assert scanner.scan_count == 2
+
+
+def test_shared_process(proc):
+    add_process(proc, 100, ['xray', 'run', '-config', '/srv/services/shared.json'], 100)
+    scanner = ProcessScanner(str(proc), ttl=60)
+    assert scanner.scan() == {}
+
+    scanner.register_shared('/srv/services/shared.json', [20001, 20002])
+    assert sorted(scanner.scan()) == ['20001', '20002']
+    scanner.register_shared('/srv/services/shared.json', [])
+    assert scanner.scan() == {}
+
+
+def test_pid_reuse_logged(proc, caplog):
+    add_process(proc, 100, ['xray', 'run', '-config', 's/20001/config.json'], 100)
+    scanner = ProcessScanner(str(proc))
+    scanner.scan(force=True)
+
+    (proc / '100' / 'stat').unlink()
+    (proc / '100' / 'cmdline').unlink()
+    (proc / '100').rmdir()
+    add_process(proc, 100, ['xray', 'run', '-config', 's/20001/config.json'], 900)
+    assert scanner.scan(force=True)['20001']['start_time'] == 900
+    assert '已被新进程复用' in caplog.text
+
+
+def test_without_proc(tmp_path):
+    scanner = ProcessScanner(str(tmp_path / 'missing'))
+    assert not scanner.available
+    states = scanner.states({20001: os.getpid(), 20002: None})
+    assert states['20001']['status'] == 'running' and states['20001']['pid'] == os.getpid()
+    assert states['20002']['status'] == 'stopped'
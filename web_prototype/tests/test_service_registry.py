@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务注册表测试 - 服务目录解析、快照，以及inotify/轮询模式下的变化检测
+"""
+
+import os
+import time
+import shutil
+
+import pytest
+
+from conftest import write_service
+from service_registry import ServiceRegistry, parse_service_dir
+
+
+def rename(tmp_path, port, name):
+    info = tmp_path / str(port) / 'info.txt'
+    lines = info.read_text(encoding='utf-8').splitlines(keepends=True)
+    lines[0] = f'节点名称: {name}\n'
+    info.write_text(''.join(lines), encoding='utf-8')
+
+
+def wait_for(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+def test_parse_info_txt(tmp_path):
+    port_path = tmp_path / '20001'
+    port_path.mkdir()
+    (port_path / 'info.txt').write_text(
+        '节点名称: 香港01\nShadowsocks端口: 20001\nSOCKS5后端: 10.0.0.1:1080\n'
+        '有效期: 永久\n未知字段: x\n无冒号的行\n', encoding='utf-8')
+    (port_path / 'xray.pid').write_text('1234\n')
+
+    service = parse_service_dir('20001', str(port_path))
+    assert service['node_name'] == '香港01' and service['ss_port'] == '20001'
+    assert (service['socks_ip'], service['socks_port']) == ('10.0.0.1', '1080')
+    assert service['expires_at'] == '0' and service['pid'] == 1234
+    assert '未知字段' not in service
+
+
+def test_parse_legacy_formats(tmp_path):
+    port_path = tmp_path / '20002'
+    port_path.mkdir()
+    (port_path / 'config.env').write_text('SS_PASSWORD=a=b\nSOCKS_BACKEND=10.0.0.2\n')
+    (port_path / 'xray.pid').write_text('not a pid')
+    service = parse_service_dir('20002', str(port_path))
+    assert service['ss_password'] == 'a=b' and service['pid'] is None
+    assert service['node_name'] == '服务20002' and service['ss_port'] == '20002'
+
+    (port_path / 'config.env').unlink()
+    (port_path / 'info').write_text('NODE_NAME=旧格式\n')
+    assert parse_service_dir('20002', str(port_path))['node_name'] == '旧格式'
+
+    (port_path / 'info').unlink()
+    assert parse_service_dir('20002', str(port_path)) is None
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = ServiceRegistry(str(tmp_path), poll_interval=0.1)
+    yield registry
+    registry.stop()
+
+
+def test_snapshot_is_sorted_and_read_only(tmp_path, registry):
+    for port in (20010, 9000, 20002):
+        write_service(tmp_path, port)
+    (tmp_path / '20003').mkdir()
+    (tmp_path / 'logs').mkdir()
+
+    snapshot = registry.snapshot()
+    assert [s['port'] for s in snapshot] == ['9000', '20002', '20010']
+    assert sorted(registry.port_dirs()) == ['20002', '20003', '20010', '9000']
+    with pytest.raises(TypeError):
+        snapshot[0]['port'] = '1'
+    assert registry.get(20002) is snapshot[1]
+
+
+@pytest.mark.parametrize('mode', ['inotify', 'poll'])
+def test_changes_are_picked_up(tmp_path, registry, monkeypatch, mode):
+    if mode == 'poll':
+        def unavailable():
+            raise OSError('inotify不可用')
+        monkeypatch.setattr(registry, '_inotify_loop', unavailable)
+
+    write_service(tmp_path, 20001, node_name='旧名称')
+    assert registry.get(20001)['node_name'] == '旧名称'
+    assert wait_for(lambda: registry.mode == mode)
+    # inotify模式在监听建立后会补一次全量扫描
+    time.sleep(0.2)
+
+    version = registry.version
+    rename(tmp_path, 20001, '新名称')
+    assert wait_for(lambda: registry.get(20001)['node_name'] == '新名称')
+    assert registry.version > version
+
+    write_service(tmp_path, 20002)
+    assert wait_for(lambda: registry.get(20002) is not None)
+
+    shutil.rmtree(os.path.join(str(tmp_path), '20001'))
+    assert wait_for(lambda: registry.get(20001) is None)
+    assert [s['port'] for s in registry.snapshot()] == ['20002']
+
+
+def test_invalidate_without_waiting(tmp_path, registry):
+    write_service(tmp_path, 20001, node_name='旧名称')
+    registry.snapshot()
+    registry.stop()
+
+    rename(tmp_path, 20001, '新名称')
+    registry.invalidate(20001)
+    assert registry._records['20001']['node_name'] == '新名称'
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+服务守护测试 - 用假xray模拟崩溃，检查退避重启、崩溃循环隔离与正常停止
+"""
+
+import os
+import time
+import signal
+
+import pytest
+
+from conftest import make_config, FAKE_XRAY
+from process_scanner import process_scanner
+from service_watchdog import ServiceWatchdog, backoff_delay
+from xray_supervisor import xray_supervisor
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+def running_pid(port):
+    state = process_scanner.states({port: None}, force=True)[port]
+    return state['pid'] if state['status'] == 'running' else None
+
+
+@pytest.fixture
+def watchdog(service_dir, monkeypatch):
+    """全局 xray_supervisor 使用假xray与临时服务目录，守护参数缩短到毫秒级"""
+    os.chmod(FAKE_XRAY, 0o755)
+    for name, value in {'service_dir': str(service_dir), 'xray_bin': FAKE_XRAY, 'mode': 'process',
+                        'ready_timeout': 3.0, 'stop_timeout': 1.0, 'kill_timeout': 1.0,
+                        '_children': {}, 'listeners': []}.items():
+        monkeypatch.setattr(xray_supervisor, name, value)
+    monkeypatch.setattr(xray_supervisor.handler, 'xray_bin', FAKE_XRAY)
+
+    watchdog = ServiceWatchdog(backoff_initial=0.1, backoff_max=0.4, stable_after=60, crash_limit=3,
+                               crash_window=60, quarantine_time=60, resync_interval=0.5, poll_interval=0.1)
+    events = []
+    monkeypatch.setattr(watchdog, '_publish', lambda action, port, **details: events.append((action, details)))
+    watchdog.events = events
+    assert watchdog.start()
+    yield watchdog
+    watchdog.stop()
+    for port in os.listdir(service_dir):
+        xray_supervisor.stop(port)
+
+
+def service(service_dir):
+    """服务目录：config.json 与 info.txt"""
+    port = make_config(service_dir)
+    with open(os.path.join(str(service_dir), port, 'info.txt'), 'w', encoding='utf-8') as f:
+        f.write(f'节点名称: node{port}\nShadowsocks端口: {port}\n')
+    result = xray_supervisor.start(port)
+    assert result['success'], result['message']
+    return port, result['pid']
+
+
+def actions(watchdog):
+    return [action for action, _ in watchdog.events]
+
+
+def test_backoff_delay_bounds():
+    for attempt, (low, high) in enumerate([(0.5, 1), (1, 2), (2, 4), (4, 8), (5, 10), (5, 10)]):
+        for _ in range(20):
+            assert low <= backoff_delay(attempt, 1, 10) <= high
+
+
+def test_crash_is_restarted(watchdog, service_dir):
+    port, pid = service(service_dir)
+    os.kill(pid, signal.SIGKILL)
+
+    assert wait_until(lambda: watchdog.counters['restarts'] == 1)
+    new_pid = running_pid(port)
+    assert new_pid and new_pid != pid
+    assert actions(watchdog) == ['crashed', 'restarted']
+    crashed = watchdog.events[0][1]
+    assert crashed['exit_code'] == -signal.SIGKILL and 0.05 <= crashed['restart_in'] <= 0.1
+    assert watchdog.get_stats()['watched'] == 1
+
+
+def test_restart_backoff_grows(watchdog, service_dir):
+    port, pid = service(service_dir)
+    for restarts in (1, 2):
+        os.kill(pid, signal.SIGKILL)
+        assert wait_until(lambda: watchdog.counters['restarts'] == restarts)
+        pid = running_pid(port)
+
+    # 稳定运行前再次崩溃，退避翻倍
+    delays = [details['restart_in'] for action, details in watchdog.events if action == 'crashed']
+    assert 0.05 <= delays[0] <= 0.1 and 0.1 <= delays[1] <= 0.2
+
+
+def test_crash_loop_is_quarantined(watchdog, service_dir):
+    port, pid = service(service_dir)
+    for restarts in (1, 2):
+        os.kill(pid, signal.SIGKILL)
+        assert wait_until(lambda: watchdog.counters['restarts'] == restarts)
+        pid = running_pid(port)
+    os.kill(pid, signal.SIGKILL)
+
+    assert wait_until(lambda: watchdog.counters['quarantines'] == 1)
+    assert actions(watchdog)[-1] == 'quarantined'
+    assert watchdog.events[-1][1]['crashes'] == 3
+    assert port in watchdog.get_stats()['quarantined']
+    # 隔离期间不再重启，PID文件保留
+    time.sleep(0.5)
+    assert running_pid(port) is None and watchdog.counters['restarts'] == 2
+    assert os.path.exists(os.path.join(str(service_dir), port, 'xray.pid'))
+
+    # 手动启动解除隔离
+    assert xray_supervisor.start(port)['success']
+    assert wait_until(lambda: not watchdog.get_stats()['quarantined'])
+
+
+def test_intentional_stop_is_not_a_crash(watchdog, service_dir):
+    port, _ = service(service_dir)
+    assert xray_supervisor.stop(port)['success']
+
+    # 经过至少一次对账仍未被当作崩溃
+    time.sleep(0.8)
+    assert watchdog.counters['crashes'] == 0 and watchdog.counters['restarts'] == 0
+    assert running_pid(port) is None and watchdog.events == []
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+套接字快照测试 - /proc/net 解析、单端口监听检查与进程自身的套接字统计
+"""
+
+import os
+import socket
+
+import pytest
+
+from socket_table import SocketTable, parse_proc_net, port_listening, process_port_sockets
+
+HEADER = '  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n'
+
+
+def line(i, local, state, remote='0100007F:C350'):
+    return (f'{i:4d}: {local} {remote} {state} 00000000:00000000 00:00000000 00000000     0        0 '
+            f'{1000 + i} 1 0000000000000000 100 0 0 10 0\n')
+
+
+TCP = HEADER + ''.join([
+    line(0, '00000000:4E21', '0A', '00000000:0000'),
+    line(1, '0100007F:4E21', '01'),
+    line(2, '0100007F:4E21', '01'),
+    line(3, '0100007F:4E21', '06'),
+    line(4, '0100007F:4E22', '08'),
+    line(5, '0100007F:4E23', '0F'),
+])
+TCP6 = HEADER + line(0, '00000000000000000000000000000000:4E24', '0A', '00000000000000000000000000000000:0000')
+UDP = HEADER + line(0, '00000000:4E21', '07', '00000000:0000') + line(1, '00000000:4E25', '07', '00000000:0000')
+
+
+def test_parse_proc_net():
+    ports, totals = {}, {}
+    parse_proc_net(TCP, 'tcp', ports, totals)
+    parse_proc_net(TCP6, 'tcp', ports, totals)
+    parse_proc_net(UDP, 'udp', ports, totals)
+    parse_proc_net(HEADER + 'garbage\n   1: xyz:ZZZZ 0 0A\n', 'tcp', ports, totals)
+
+    assert ports[20001] == {'listen': True, 'udp': True, 'established': 2,
+                            'states': {'LISTEN': 1, 'ESTABLISHED': 2, 'TIME_WAIT': 1}}
+    assert ports[20002]['states'] == {'CLOSE_WAIT': 1} and not ports[20002]['listen']
+    # 未知状态码原样计数
+    assert ports[20003]['states'] == {'0F': 1}
+    assert ports[20004]['listen'] and ports[20005] == {'listen': False, 'udp': True, 'established': 0, 'states': {}}
+    assert totals == {'LISTEN': 2, 'ESTABLISHED': 2, 'TIME_WAIT': 1, 'CLOSE_WAIT': 1, '0F': 1}
+
+
+@pytest.fixture
+def proc(tmp_path):
+    net = tmp_path / 'net'
+    net.mkdir()
+    (net / 'tcp').write_text(TCP)
+    (net / 'tcp6').write_text(TCP6)
+    (net / 'udp').write_text(UDP)
+    return tmp_path
+
+
+def test_snapshot_queries(proc):
+    table = SocketTable(str(proc), interval=60)
+    snapshot = table.snapshot()
+    assert snapshot.is_listening('20001') and snapshot.is_listening(20004)
+    assert not snapshot.is_listening(20002) and not snapshot.is_listening(20005)
+    assert snapshot.is_bound(20005) and not snapshot.is_bound(20006)
+    assert snapshot.established(20001) == 2 and snapshot.established(20006) == 0
+    assert snapshot.total_established == 2
+    assert snapshot.to_dict()['listening_ports'] == [20001, 20004]
+
+    # interval内复用同一快照
+    assert table.snapshot() is snapshot and table.build_count == 1
+    assert table.snapshot(force=True) is not snapshot and table.build_count == 2
+
+
+def test_port_listening(proc, tmp_path):
+    assert port_listening(20001, str(proc)) is True
+    assert port_listening(20004, str(proc)) is True
+    # 只有已建立/关闭中的连接不算监听
+    assert port_listening(20002, str(proc)) is False
+    assert port_listening(20006, str(proc)) is False
+    assert port_listening(20001, str(tmp_path / 'missing')) is None
+
+
+def test_process_port_sockets():
+    if not os.path.isdir('/proc/self/fd'):
+        pytest.skip('需要/proc')
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    port = listener.getsockname()[1]
+    try:
+        assert process_port_sockets(os.getpid(), port) == {'listen': 1, 'established': 0}
+
+        client = socket.create_connection(('127.0.0.1', port))
+        conn, _ = listener.accept()
+        try:
+            # 客户端与服务端两端都在本进程中，本地端口为 port 的只有accept得到的连接
+            assert process_port_sockets(os.getpid(), port) == {'listen': 1, 'established': 1}
+            assert port_listening(port) is True
+        finally:
+            client.close()
+            conn.close()
+    finally:
+        listener.close()
+    assert process_port_sockets(os.getpid(), port)['listen'] == 0
+    assert process_port_sockets(2 ** 22 + 1, port) is None
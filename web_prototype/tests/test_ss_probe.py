@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+握手探测测试 - 本地回显服务器与SOCKS5替身作为上游，最小的AEAD服务端扮演SS服务
+"""
+
+import os
+import time
+import asyncio
+import contextlib
+
+import pytest
+
+import ss_probe
+from ss_probe import (probe_handshake, run_probes, AEAD_METHODS, AEADStream,
+                      evp_bytes_to_key, parse_dest, socks_address)
+
+needs_crypto = pytest.mark.skipif(not ss_probe.HANDSHAKE_SUPPORTED, reason='需要cryptography')
+
+PASSWORD = 'secret'
+
+
+async def serve(handler):
+    server = await asyncio.start_server(handler, '127.0.0.1', 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+async def pipe(reader, writer):
+    try:
+        while data := await reader.read(4096):
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def echo(reader, writer):
+    await pipe(reader, writer)
+
+
+def socks5():
+    """SOCKS5替身 (RFC1928，无认证，只支持CONNECT)"""
+    async def handle(reader, writer):
+        try:
+            _, count = await reader.readexactly(2)
+            if 0 not in await reader.readexactly(count):
+                writer.write(b'\x05\xff')
+                return
+            writer.write(b'\x05\x00')
+            _, cmd, _, atyp = await reader.readexactly(4)
+            if atyp == 3:
+                host = (await reader.readexactly((await reader.readexactly(1))[0])).decode()
+            else:
+                host = '.'.join(str(b) for b in await reader.readexactly(4))
+            port = int.from_bytes(await reader.readexactly(2), 'big')
+            try:
+                up_reader, up_writer = await asyncio.open_connection(host, port)
+            except OSError:
+                writer.write(b'\x05\x05\x00\x01' + bytes(6))
+                return
+            writer.write(b'\x05\x00\x00\x01' + bytes(6))
+            await asyncio.gather(pipe(reader, up_writer), pipe(up_reader, writer))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    return handle
+
+
+def parse_address(data):
+    """SS请求头部 (SOCKS5地址格式)，返回 (host, port, 剩余数据)"""
+    atyp = data[0]
+    if atyp == 1:
+        host, pos = '.'.join(str(b) for b in data[1:5]), 5
+    else:
+        host, pos = data[2:2 + data[1]].decode(), 2 + data[1]
+    return host, int.from_bytes(data[pos:pos + 2], 'big'), data[pos + 2:]
+
+
+def ss_server(method, password, backend):
+    """最小的Shadowsocks AEAD服务端：解密请求后经SOCKS5后端连接目标"""
+    key_len = AEAD_METHODS[method][0]
+    key = evp_bytes_to_key(password.encode(), key_len)
+
+    async def handle(reader, writer):
+        try:
+            decoder = AEADStream(method, key, await reader.readexactly(key_len))
+            first = await decoder.read_chunk(reader)
+            host, port, payload = parse_address(first)
+
+            up_reader, up_writer = await asyncio.open_connection(*backend)
+            up_writer.write(b'\x05\x01\x00')
+            up_writer.write(b'\x05\x01\x00' + socks_address(host, port))
+            reply = await up_reader.readexactly(2) + await up_reader.readexactly(10)
+            if reply[1] != 0 or reply[3] != 0:
+                return
+            up_writer.write(payload)
+
+            salt = os.urandom(key_len)
+            encoder = AEADStream(method, key, salt)
+            writer.write(salt)
+
+            async def upstream():
+                with contextlib.suppress(asyncio.IncompleteReadError, ConnectionError):
+                    while True:
+                        up_writer.write(await decoder.read_chunk(reader))
+
+            async def downstream():
+                while data := await up_reader.read(4096):
+                    writer.write(encoder.seal(data))
+                    await writer.drain()
+
+            await asyncio.gather(upstream(), downstream(), return_exceptions=True)
+        except (ss_probe.InvalidTag, asyncio.IncompleteReadError, ConnectionError, OSError):
+            # 与真实服务端一样，无法解密或上游不可达时直接关闭连接
+            pass
+        finally:
+            writer.close()
+    return handle
+
+
+async def closed_port():
+    server, port = await serve(echo)
+    server.close()
+    await server.wait_closed()
+    return port
+
+
+@contextlib.asynccontextmanager
+async def upstream(method='aes-256-gcm', backend_alive=True):
+    """echo <- SOCKS5替身 <- SS服务端，返回 (SS端口, 回显目标)"""
+    servers = []
+    echo_server, echo_port = await serve(echo)
+    servers.append(echo_server)
+    if backend_alive:
+        socks_server, socks_port = await serve(socks5())
+        servers.append(socks_server)
+    else:
+        socks_port = await closed_port()
+    ss, ss_port = await serve(ss_server(method, PASSWORD, ('127.0.0.1', socks_port)))
+    servers.append(ss)
+    try:
+        yield ss_port, ('127.0.0.1', echo_port)
+    finally:
+        for server in servers:
+            server.close()
+
+
+def target(port, method='aes-256-gcm', password=PASSWORD):
+    return {'server': '127.0.0.1', 'port': port, 'method': method, 'password': password}
+
+
+def handshake(method='aes-256-gcm', password=PASSWORD, backend_alive=True, timeout=2.0):
+    async def main():
+        async with upstream(method, backend_alive) as (ss_port, dest):
+            return await probe_handshake(target(ss_port, method, password), timeout, dest=dest,
+                                         payload=b'hello through the tunnel', sample_window=0.2)
+    return asyncio.run(main())
+
+
+@needs_crypto
+@pytest.mark.parametrize('method', sorted(AEAD_METHODS))
+def test_right_password(method):
+    result = handshake(method)
+    assert result['success'], result['message']
+    assert result['mode'] == 'handshake' and not result.get('degraded')
+    assert result['bytes'] == len(b'hello through the tunnel')
+    assert result['ttfb'] is not None and result['latency'] >= 0
+
+
+@needs_crypto
+def test_wrong_password():
+    result = handshake(password='wrong')
+    assert not result['success']
+    assert 'wrong password/method' in result['message']
+    assert result['latency'] == -1 and result['connect_latency'] >= 0
+
+
+@needs_crypto
+def test_dead_socks5_backend():
+    result = handshake(backend_alive=False)
+    assert not result['success']
+    assert 'SOCKS5 backend' in result['message']
+
+
+@needs_crypto
+def test_silent_server():
+    async def main():
+        async def silent(reader, writer):
+            await reader.read()
+            writer.close()
+        server, port = await serve(silent)
+        try:
+            return await probe_handshake(target(port), 0.5, dest=('127.0.0.1', 9))
+        finally:
+            server.close()
+
+    result = asyncio.run(main())
+    assert not result['success']
+    assert result['message'].startswith('Handshake timeout')
+
+
+@needs_crypto
+def test_unsupported_method_degrades_to_tcp():
+    async def main():
+        server, port = await serve(echo)
+        try:
+            return await probe_handshake(target(port, 'rc4-md5'), 1.0)
+        finally:
+            server.close()
+
+    result = asyncio.run(main())
+    assert result['success'] and result['mode'] == 'tcp' and result['degraded']
+    assert '不支持的加密方式 rc4-md5' in result['message']
+
+
+def test_missing_cryptography_degrades_to_tcp(monkeypatch):
+    monkeypatch.setattr(ss_probe, 'HANDSHAKE_SUPPORTED', False)
+
+    async def main():
+        server, port = await serve(echo)
+        try:
+            return await probe_handshake(target(port), 1.0)
+        finally:
+            server.close()
+
+    result = asyncio.run(main())
+    assert result['success'] and result['mode'] == 'tcp' and result['degraded']
+    assert '未安装cryptography' in result['message']
+
+
+def test_run_probes_deadline():
+    async def hang(target, timeout):
+        await asyncio.sleep(timeout + 10)
+
+    start = time.monotonic()
+    results = run_probes([{'server': '127.0.0.1', 'port': 9}] * 3, probe=hang, concurrency=1,
+                         timeout=5, deadline=0.3)
+    assert time.monotonic() - start < 0.3 + ss_probe.PROBE_GRACE + 0.5
+    assert sorted(probe['message'] for _, probe in results) == [
+        'Deadline exceeded', 'Deadline exceeded', 'Probe timeout']
+
+
+@pytest.mark.parametrize('spec, expected', [
+    ('www.gstatic.com:80', ('www.gstatic.com', 80)),
+    ('[::1]:443', ('::1', 443)),
+])
+def test_parse_dest(spec, expected):
+    assert parse_dest(spec) == expected
+
+
+@pytest.mark.parametrize('spec', ['', 'host', 'host:0', 'host:http', ':80'])
+def test_parse_dest_rejects(spec):
+    with pytest.raises(ValueError):
+        parse_dest(spec)
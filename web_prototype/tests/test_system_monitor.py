@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+系统监控测试 - 后台采样器的首次采样与采样间隔，分级TTL缓存的合并计算
+"""
+
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import system_monitor
+from system_monitor import MetricsSampler, TieredCache, _cacheable
+
+
+class CountingSampler(MetricsSampler):
+    """记录每次采样及同时进行的采样数"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = []
+        self.active = 0
+        self.peak = 0
+        self._count_lock = threading.Lock()
+
+    def sample(self):
+        with self._count_lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            self.calls.append(time.monotonic())
+        try:
+            return super().sample()
+        finally:
+            with self._count_lock:
+                self.active -= 1
+
+
+def test_first_latest_samples_once():
+    sampler = CountingSampler(interval=0.3)
+    try:
+        threads = [threading.Thread(target=sampler.latest) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        first = sampler.latest()
+        assert first is not None and first['elapsed'] == 0
+        # 并发的首次请求与采样线程只产生一次采样
+        assert len(sampler.calls) == 1 and sampler.peak == 1
+
+        time.sleep(0.45)
+        assert len(sampler.calls) == 2 and sampler.peak == 1
+        second = sampler.latest()
+        # 第二次采样相隔一个完整间隔，速率基于有效的差值
+        assert second['elapsed'] >= 0.25
+        assert sampler.calls[1] - sampler.calls[0] >= 0.25
+        assert len(sampler.history()) == 2
+    finally:
+        sampler.stop()
+
+
+def test_restart_keeps_interval():
+    sampler = CountingSampler(interval=0.2)
+    sampler.start()
+    sampler.stop()
+    sampler.start()
+    try:
+        # 已有采样时重新启动不立即采样
+        assert len(sampler.calls) == 1
+        time.sleep(0.3)
+        assert len(sampler.calls) == 2
+    finally:
+        sampler.stop()
+
+
+def test_cache_single_flight():
+    cache = TieredCache({'slow': 60})
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        release.wait(2)
+        return {'value': len(calls)}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get('slow', loader))) for _ in range(10)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    release.set()
+    for t in threads:
+        t.join()
+
+    # 并发的未命中只计算一次，全部请求共享结果
+    assert len(calls) == 1 and results == [{'value': 1}] * 10
+    stats = cache.stats()['slow']
+    assert stats['misses'] == 1 and stats['shared'] == 9 and stats['hits'] == 0
+    assert cache.get('slow', loader) == {'value': 1} and cache.stats()['slow']['hits'] == 1
+
+
+def test_cache_ttl_and_invalidate(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(system_monitor, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    cache = TieredCache({'static': None, 'fast': 2})
+    counter = iter(range(100))
+
+    def loader():
+        return next(counter)
+
+    assert cache.get('static', loader) == 0 and cache.get('fast', loader) == 1
+    now[0] += 1.9
+    assert cache.get('fast', loader) == 1
+    now[0] += 0.2
+    assert cache.get('fast', loader) == 2
+    # ttl为None的字段只计算一次
+    now[0] += 10_000
+    assert cache.get('static', loader) == 0
+
+    cache.invalidate('static')
+    assert cache.get('static', loader) == 3
+    cache.invalidate()
+    assert cache.get('fast', loader) == 4 and cache.get('static', loader) == 5
+
+
+def test_cache_errors_not_cached():
+    cache = TieredCache({'info': 60})
+    attempts = []
+
+    def failing():
+        attempts.append(1)
+        raise OSError('读取失败')
+
+    with pytest.raises(OSError):
+        cache.get('info', failing)
+    assert cache.stats()['info']['errors'] == 1
+
+    # 出错的结果字典不写入缓存
+    assert cache.get('info', lambda: {'error': 'x'}, _cacheable) == {'error': 'x'}
+    assert cache.get('info', lambda: {'ok': 1}, _cacheable) == {'ok': 1}
+    assert cache.get('info', lambda: {'ok': 2}, _cacheable) == {'ok': 1}
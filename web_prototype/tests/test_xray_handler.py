@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+在线配置测试 - HandlerClient 与 XraySupervisor.reload()，由假xray的 api 子命令驱动运行中的假xray
+"""
+
+import os
+import json
+import socket
+import tempfile
+import subprocess
+
+import pytest
+
+from conftest import make_config, FAKE_XRAY
+from readiness import is_listening
+from xray_handler import HandlerClient, HandlerError
+from xray_stats import INBOUND_TAG, read_api_port
+
+
+def load(supervisor, port):
+    with open(os.path.join(supervisor.service_dir, port, 'config.json')) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def running(supervisor):
+    """一个运行中的服务，返回 (端口, API端口, PID)"""
+    port = make_config(supervisor.service_dir)
+    result = supervisor.start(port)
+    assert result['success'], result['message']
+    api_port = read_api_port(os.path.join(supervisor.service_dir, port, 'config.json'))
+    return port, api_port, result['pid']
+
+
+def test_handler_replaces_inbound(running, supervisor, tmp_path, monkeypatch):
+    port, api_port, _ = running
+    # 临时配置文件在调用后删除
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    inbound = load(supervisor, port)['inbounds'][0]
+    client = HandlerClient(FAKE_XRAY)
+
+    client.remove_inbounds(api_port, [INBOUND_TAG])
+    assert not is_listening(port)
+    client.add_inbounds(api_port, [inbound])
+    assert is_listening(port)
+    assert client.call_count == 2 and client.error_count == 0
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('xray-')]
+
+    with pytest.raises(HandlerError, match='existing tag'):
+        client.add_inbounds(api_port, [inbound])
+    with pytest.raises(HandlerError, match='not found'):
+        client.remove_outbounds(api_port, ['missing'])
+    assert client.error_count == 2
+
+    # 空列表不调用xray
+    client.add_outbounds(api_port, [])
+    assert client.call_count == 4
+
+
+def test_bare_tags_are_read_as_files(running):
+    """与真实xray一样，rmi/rmo 没有 -tags 时把参数当作配置文件路径"""
+    port, api_port, _ = running
+    for command in ('rmi', 'rmo'):
+        result = subprocess.run([FAKE_XRAY, 'api', command, f'--server=127.0.0.1:{api_port}', INBOUND_TAG],
+                                capture_output=True, text=True)
+        assert result.returncode == 1 and 'No such file' in result.stderr
+    assert is_listening(port)
+
+
+def test_handler_errors():
+    with pytest.raises(HandlerError, match='未配置xray路径'):
+        HandlerClient().remove_inbounds(62999, [INBOUND_TAG])
+    with pytest.raises(HandlerError, match='调用失败'):
+        HandlerClient('/nonexistent/xray').remove_inbounds(62999, [INBOUND_TAG])
+    # API端口没有进程监听
+    with pytest.raises(HandlerError, match='rmi 失败'):
+        HandlerClient(FAKE_XRAY).remove_inbounds(1, [INBOUND_TAG])
+
+
+def test_reload_live_keeps_process_and_connections(running, supervisor):
+    port, api_port, pid = running
+    with socket.create_connection(('127.0.0.1', int(port))) as conn:
+        make_config(supervisor.service_dir, port, password='changed')
+        result = supervisor.reload(port)
+        assert result['success'], result['message']
+        assert '在线生效' in result['message']
+        assert result['pid'] == pid
+
+        # 已有连接不受影响，新连接由替换后的入站接收
+        conn.sendall(b'ping')
+        conn.settimeout(0.2)
+        with pytest.raises(socket.timeout):
+            conn.recv(1)
+        with socket.create_connection(('127.0.0.1', int(port)), timeout=1):
+            pass
+    assert supervisor.rolling_count == 0
+    assert read_api_port(os.path.join(supervisor.service_dir, port, 'config.json')) == api_port
+
+
+def test_reload_falls_back_to_rolling_restart(running, supervisor, monkeypatch):
+    port, _, pid = running
+
+    def fail(api_port, inbounds):
+        raise HandlerError('xray api adi 失败: fake')
+
+    monkeypatch.setattr(supervisor.handler, 'add_inbounds', fail)
+    make_config(supervisor.service_dir, port, password='changed')
+    result = supervisor.reload(port)
+    assert result['success'], result['message']
+    assert '平滑重启成功' in result['message']
+    assert result['pid'] != pid
+    assert supervisor.rolling_count == 1
+    assert is_listening(port)
+
+
+def test_reload_not_running(supervisor):
+    port = make_config(supervisor.service_dir)
+    result = supervisor.reload(port)
+    assert result['success'] and '未运行' in result['message']
+
+
+def test_replace_live_requires_api(running, supervisor):
+    port, _, pid = running
+    config = load(supervisor, port)
+    config['outbounds'][0]['tag'] = 'other'
+    with pytest.raises(HandlerError, match='未启用API'):
+        supervisor._replace_live(port, pid, config)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Xray流量统计测试 - StatsService编解码与计数器到速率的转换
+"""
+
+import json
+import stat
+
+import pytest
+
+import xray_stats
+from xray_stats import (StatsClient, TrafficPoller, counter_names, encode_query_request,
+                        decode_query_response, _encode_varint, _decode_varint)
+
+UPLINK, DOWNLINK = counter_names('ss-in')
+
+
+def stat_message(name, value=None):
+    """手工按wire格式拼出的 Stat 消息 (不经过被测的编码函数)"""
+    encoded = name.encode()
+    body = b'\x0a' + bytes([len(encoded)]) + encoded
+    if value is not None:
+        body += b'\x10' + value
+    return b'\x0a' + bytes([len(body)]) + body
+
+
+@pytest.mark.parametrize('value, encoded', [
+    (0, b'\x00'),
+    (1, b'\x01'),
+    (127, b'\x7f'),
+    (128, b'\x80\x01'),
+    (300, b'\xac\x02'),
+    (2 ** 32, b'\x80\x80\x80\x80\x10'),
+    (2 ** 63 - 1, b'\xff\xff\xff\xff\xff\xff\xff\xff\x7f'),
+])
+def test_varint_round_trip(value, encoded):
+    assert _encode_varint(value) == encoded
+    assert _decode_varint(b'\xff' + encoded, 1) == (value, 1 + len(encoded))
+
+
+def test_encode_query_request():
+    assert encode_query_request() == b''
+    assert encode_query_request('inbound>>>', reset=True) == b'\x0a\x0ainbound>>>\x10\x01'
+
+
+def test_decode_query_response():
+    data = (stat_message(UPLINK, b'\xac\x02')
+            + stat_message(DOWNLINK, b'\x80\x80\x80\x80\x10')
+            # 计数为0时value字段省略
+            + stat_message('outbound>>>socks-out>>>traffic>>>uplink')
+            # 未知字段 (fixed64) 跳过
+            + b'\x11' + bytes(8))
+    assert decode_query_response(data) == {
+        UPLINK: 300,
+        DOWNLINK: 2 ** 32,
+        'outbound>>>socks-out>>>traffic>>>uplink': 0,
+    }
+
+
+def test_decode_rejects_unknown_wire_type():
+    with pytest.raises(ValueError):
+        decode_query_response(b'\x0b')
+
+
+def test_cli_fallback_parses_statsquery(tmp_path):
+    # `xray api statsquery` 的输出：int64为字符串，计数为0时省略value
+    output = {'stat': [{'name': UPLINK, 'value': '12345678901'}, {'name': DOWNLINK}]}
+    xray = tmp_path / 'xray'
+    xray.write_text('#!/bin/sh\n'
+                    'test "$1 $2 $3" = "api statsquery --server=127.0.0.1:62001" || exit 2\n'
+                    f"echo '{json.dumps(output)}'\n")
+    xray.chmod(xray.stat().st_mode | stat.S_IEXEC)
+
+    client = StatsClient(xray_bin=str(xray))
+    assert client._query_cli(62001) == {UPLINK: 12345678901, DOWNLINK: 0}
+    with pytest.raises(RuntimeError):
+        client._query_cli(62002)
+
+
+class FakeClient:
+    """按API端口返回预设计数器"""
+
+    def __init__(self):
+        self.counters = {}
+        self.queries = []
+
+    def query(self, api_port):
+        self.queries.append(api_port)
+        if api_port not in self.counters:
+            raise ConnectionError('connection refused')
+        return self.counters[api_port]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def poller(tmp_path, monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(xray_stats, 'time', clock)
+    for port, api_port in (('20001', 62001), ('20002', 62002)):
+        (tmp_path / port).mkdir()
+        config = xray_stats.enable_stats({'inbounds': [{'tag': 'ss-in'}], 'outbounds': []}, api_port)
+        (tmp_path / port / 'config.json').write_text(json.dumps(config))
+
+    services = {'20001': {'status': 'running'}, '20002': {'status': 'running'}}
+    poller = TrafficPoller(client=FakeClient())
+    poller.configure(service_dir=str(tmp_path), services_fn=lambda: services)
+    poller.clock = clock
+    poller.services = services
+    yield poller
+    poller.stop()
+
+
+def poll(poller, counters, advance=10):
+    poller.clock.now += advance
+    poller.client.counters = counters
+    poller.poll()
+    with poller._lock:
+        return {port: dict(entry) for port, entry in poller._traffic.items()}
+
+
+def test_rates_from_counter_deltas(poller):
+    traffic = poll(poller, {62001: {UPLINK: 1000, DOWNLINK: 5000}, 62002: {UPLINK: 10, DOWNLINK: 20}})
+    # 首次采样只建立基线
+    assert traffic['20001']['rate_in'] == 0 and traffic['20001']['last_active'] is None
+
+    traffic = poll(poller, {62001: {UPLINK: 3000, DOWNLINK: 9000}, 62002: {UPLINK: 10, DOWNLINK: 20}})
+    assert (traffic['20001']['rate_in'], traffic['20001']['rate_out']) == (200, 400)
+    assert traffic['20001']['bytes_in'] == 3000
+    assert traffic['20001']['last_active'] == poller.clock.now
+    assert (traffic['20002']['rate_in'], traffic['20002']['rate_out']) == (0, 0)
+    assert traffic['20002']['last_active'] is None
+
+
+def test_counter_reset_rebaselines(poller):
+    poll(poller, {62001: {UPLINK: 1000, DOWNLINK: 5000}})
+    active = poll(poller, {62001: {UPLINK: 3000, DOWNLINK: 9000}})['20001']['last_active']
+
+    # Xray重启后计数归零：不产生负速率，以新计数为基线
+    traffic = poll(poller, {62001: {UPLINK: 100, DOWNLINK: 50}})['20001']
+    assert (traffic['rate_in'], traffic['rate_out']) == (0, 0)
+    assert (traffic['bytes_in'], traffic['bytes_out']) == (100, 50)
+    assert traffic['last_active'] == active
+
+    traffic = poll(poller, {62001: {UPLINK: 1100, DOWNLINK: 1050}}, advance=5)['20001']
+    assert (traffic['rate_in'], traffic['rate_out']) == (200, 200)
+
+
+def test_failed_query_keeps_previous_and_stopped_services_dropped(poller):
+    poll(poller, {62001: {UPLINK: 1000, DOWNLINK: 5000}, 62002: {UPLINK: 1, DOWNLINK: 1}})
+    traffic = poll(poller, {62002: {UPLINK: 2, DOWNLINK: 2}})
+    assert traffic['20001']['bytes_in'] == 1000
+    assert poller.error_count == 1
+
+    poller.services['20002']['status'] = 'stopped'
+    traffic = poll(poller, {62001: {UPLINK: 1000, DOWNLINK: 5000}})
+    assert set(traffic) == {'20001'}
+
+
+def test_shared_api_port_queried_once(poller):
+    poller.configure(targets_fn=lambda: {'20001': (62100, 'ss-20001'), '20002': (62100, 'ss-20002')})
+    poller.client.queries.clear()
+    traffic = poll(poller, {62100: {counter_names('ss-20001')[0]: 7, counter_names('ss-20002')[1]: 9}})
+    assert poller.client.queries == [62100]
+    assert traffic['20001']['bytes_in'] == 7 and traffic['20002']['bytes_out'] == 9
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Xray进程管理测试 - 用假xray (fake_xray.py) 启动、停止与重启服务
+"""
+
+import os
+import json
+import socket
+
+from conftest import make_config, free_port
+from readiness import is_listening
+from xray_handler import HandlerError
+from xray_stats import read_api_port
+from xray_supervisor import validate_config
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # 已退出但尚未回收的子进程
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            return f.read().split(') ', 1)[1][0] != 'Z'
+    except OSError:
+        return False
+
+
+def load(supervisor, port):
+    with open(os.path.join(supervisor.service_dir, port, 'config.json')) as f:
+        return json.load(f)
+
+
+def test_validate_config(supervisor):
+    port = make_config(supervisor.service_dir)
+    config = load(supervisor, port)
+    assert validate_config(config, port) is None
+
+    assert validate_config([], port) == '配置必须是JSON对象'
+    assert validate_config(dict(config, inbounds=[]), port) == '缺少inbounds'
+    assert '不一致' in validate_config(config, int(port) + 1)
+
+    bad = load(supervisor, port)
+    bad['inbounds'][0]['settings']['method'] = 'rc4-md5'
+    assert '不支持的加密方式' in validate_config(bad, port)
+
+    bad = load(supervisor, port)
+    bad['inbounds'][0]['settings']['password'] = ''
+    assert validate_config(bad, port) == '缺少Shadowsocks密码'
+
+    bad = load(supervisor, port)
+    bad['outbounds'][0]['settings']['servers'][0]['port'] = 70000
+    assert 'SOCKS5出站端口无效' in validate_config(bad, port)
+
+
+def test_start_stop_restart(supervisor):
+    port = make_config(supervisor.service_dir)
+    events = []
+    supervisor.listeners.append(lambda event, p, pid: events.append((event, p, pid)))
+
+    result = supervisor.start(port)
+    assert result['success'], result['message']
+    pid = result['pid']
+    assert result['elapsed'] < 1
+    assert is_listening(port)
+    with open(os.path.join(supervisor.service_dir, port, 'xray.pid')) as f:
+        assert int(f.read()) == pid
+
+    again = supervisor.start(port)
+    assert again['success'] and again['pid'] == pid and '已在运行' in again['message']
+
+    result = supervisor.restart(port)
+    assert result['success'], result['message']
+    assert result['pid'] != pid and not alive(pid)
+    assert result['elapsed'] < 1
+    pid = result['pid']
+
+    result = supervisor.stop(port)
+    assert result['success'] and result['pid'] == pid
+    assert result['elapsed'] < 1
+    assert not alive(pid) and not is_listening(port)
+    assert not os.path.exists(os.path.join(supervisor.service_dir, port, 'xray.pid'))
+    assert supervisor.stop(port)['message'] == f'服务端口 {port} 已经停止'
+
+    assert [e[0] for e in events] == ['started', 'stopping', 'started', 'stopping', 'stopping']
+
+
+def test_start_rejects_invalid_config(supervisor):
+    port = make_config(supervisor.service_dir)
+    config = load(supervisor, port)
+    config['inbounds'][0]['settings']['password'] = ''
+    with open(os.path.join(supervisor.service_dir, port, 'config.json'), 'w') as f:
+        json.dump(config, f)
+
+    result = supervisor.start(port)
+    assert not result['success'] and '缺少Shadowsocks密码' in result['message']
+    assert result['pid'] is None
+
+
+def test_start_reports_exit_with_log_tail(supervisor, monkeypatch):
+    port = make_config(supervisor.service_dir)
+    monkeypatch.setenv('FAKE_XRAY_EXIT', '1')
+
+    result = supervisor.start(port)
+    assert not result['success']
+    assert 'fake failure' in result['message']
+    assert not os.path.exists(os.path.join(supervisor.service_dir, port, 'xray.pid'))
+
+
+def test_start_refuses_occupied_port(supervisor):
+    port = free_port()
+    make_config(supervisor.service_dir, port)
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', port))
+        sock.listen(1)
+        result = supervisor.start(port)
+    assert not result['success'] and '已被其他进程占用' in result['message']
+
+
+def test_start_waits_for_listen(supervisor, monkeypatch):
+    port = make_config(supervisor.service_dir)
+    monkeypatch.setenv('FAKE_XRAY_DELAY', '0.3')
+
+    result = supervisor.start(port)
+    assert result['success'], result['message']
+    assert result['startup_ms'] >= 300
+    assert is_listening(port)
+
+
+def test_stop_escalates_to_sigkill(supervisor, monkeypatch):
+    port = make_config(supervisor.service_dir)
+    monkeypatch.setenv('FAKE_XRAY_IGNORE_TERM', '1')
+    supervisor.configure(stop_timeout=0.3)
+    pid = supervisor.start(port)['pid']
+
+    result = supervisor.stop(port)
+    assert result['success'], result['message']
+    assert result['shutdown_ms'] >= 300
+    assert not alive(pid) and not is_listening(port)
+
+
+def test_stop_takes_over_pid_file(supervisor):
+    """上一个Web进程启动的Xray通过PID文件接管"""
+    port = make_config(supervisor.service_dir)
+    pid = supervisor.start(port)['pid']
+    supervisor._children.clear()
+
+    result = supervisor.stop(port)
+    assert result['success'] and result['pid'] == pid
+    assert not is_listening(port)
+
+
+def test_rolling_restart_reports_failed_inbound_removal(supervisor, monkeypatch):
+    port = make_config(supervisor.service_dir)
+    old_pid = supervisor.start(port)['pid']
+    supervisor.configure(drain_timeout=0.2)
+
+    def fail(api_port, tags):
+        raise HandlerError('xray api rmi 失败: fake')
+
+    monkeypatch.setattr(supervisor.handler, 'remove_inbounds', fail)
+    result = supervisor.rolling_restart(port)
+    assert result['success'] and result['pid'] != old_pid
+    assert result['degraded'] and '未能停止接收新连接' in result['message']
+    assert '平滑重启成功' not in result['message']
+    stats = supervisor.get_reload_stats()
+    assert stats['rolling_degraded'] == 1 and stats['recent'][0]['degraded']
+
+
+def test_rolling_restart_drains_old_process(supervisor):
+    port = make_config(supervisor.service_dir)
+    old_pid = supervisor.start(port)['pid']
+    old_api = read_api_port(os.path.join(supervisor.service_dir, port, 'config.json'))
+    supervisor.configure(drain_timeout=0.3)
+
+    with socket.create_connection(('127.0.0.1', int(port))):
+        result = supervisor.rolling_restart(port)
+    assert result['success'], result['message']
+    assert result['pid'] != old_pid and not alive(old_pid)
+    # 排空超时仍未结束的连接计为中断；旧进程的入站已通过API删除
+    assert result['dropped'] == 1 and not result['degraded']
+    assert is_listening(port)
+
+    # 新进程使用新的API端口，config.json与运行中的进程一致
+    new_api = read_api_port(os.path.join(supervisor.service_dir, port, 'config.json'))
+    assert new_api != old_api
+    stats = supervisor.get_reload_stats()
+    assert stats['rolling_count'] == 1 and stats['dropped_total'] == 1 and stats['rolling_degraded'] == 0
+    assert stats['recent'][0]['old_pid'] == old_pid and stats['recent'][0]['pid'] == result['pid']
+
+
+def test_rolling_fallback_restores_rendered_config(supervisor, monkeypatch):
+    port = make_config(supervisor.service_dir)
+    old_pid = supervisor.start(port)['pid']
+    service_path = os.path.join(supervisor.service_dir, port)
+    rendered = {name: open(os.path.join(service_path, name), 'rb').read()
+                for name in ('config.json', 'api_port')}
+
+    # 只有平滑重启启动的新进程失败，退回的先停后启正常启动
+    spawn = supervisor._spawn
+    calls = []
+
+    def failing_spawn(port, log_file):
+        calls.append(port)
+        if len(calls) == 1:
+            monkeypatch.setenv('FAKE_XRAY_EXIT', '1')
+        try:
+            return spawn(port, log_file)
+        finally:
+            monkeypatch.delenv('FAKE_XRAY_EXIT', raising=False)
+
+    monkeypatch.setattr(supervisor, '_spawn', failing_spawn)
+    result = supervisor.rolling_restart(port)
+    assert result['success'], result['message']
+    assert len(calls) == 2 and result['pid'] != old_pid
+    assert supervisor.rolling_fallbacks == 1 and supervisor.rolling_count == 0
+    for name, data in rendered.items():
+        with open(os.path.join(service_path, name), 'rb') as f:
+            assert f.read() == data, name
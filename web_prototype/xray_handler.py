@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Xray在线配置模块 - 通过HandlerService/RoutingService增删运行中Xray的入站、出站与路由规则
+"""
+
+import os
+import json
+import tempfile
+import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class HandlerError(Exception):
+    """Xray API调用失败"""
+
+
+class HandlerClient:
+    """运行中Xray的入站/出站/路由规则管理
+
+    通过 `xray api adi/rmi/ado/rmo/adrules/rmrules` 调用：新增入站或出站时需要
+    把JSON配置转换为Xray内部的protobuf配置消息，由xray命令完成转换，无需在
+    这里维护这些消息定义。rmi/rmo 的参数默认是配置文件路径，按标签删除需要
+    -tags。失败时抛出 HandlerError，由调用方决定是否退回重启。
+    """
+
+    def __init__(self, xray_bin=None, timeout=5.0):
+        self.xray_bin = xray_bin
+        self.timeout = timeout
+
+        # 统计
+        self.call_count = 0
+        self.error_count = 0
+
+    def add_inbounds(self, api_port, inbounds):
+        """新增入站 (标签不能与已有入站重复)"""
+        if inbounds:
+            self._run(api_port, 'adi', config={'inbounds': inbounds})
+
+    def remove_inbounds(self, api_port, tags):
+        """按标签删除入站"""
+        if tags:
+            self._run(api_port, 'rmi', ['-tags'] + list(tags))
+
+    def add_outbounds(self, api_port, outbounds):
+        """新增出站"""
+        if outbounds:
+            self._run(api_port, 'ado', config={'outbounds': outbounds})
+
+    def remove_outbounds(self, api_port, tags):
+        """按标签删除出站"""
+        if tags:
+            self._run(api_port, 'rmo', ['-tags'] + list(tags))
+
+    def add_rules(self, api_port, rules):
+        """在已有路由规则之后追加规则 (规则需带ruleTag才能单独删除)"""
+        if rules:
+            self._run(api_port, 'adrules', ['-append'], config={'routing': {'rules': rules}})
+
+    def remove_rules(self, api_port, rule_tags):
+        """按ruleTag删除路由规则"""
+        if rule_tags:
+            self._run(api_port, 'rmrules', list(rule_tags))
+
+    def _run(self, api_port, command, args=(), config=None):
+        if not self.xray_bin:
+            raise HandlerError('未配置xray路径')
+
+        config_file = None
+        try:
+            if config is not None:
+                fd, config_file = tempfile.mkstemp(prefix=f'xray-{command}-', suffix='.json')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(config, f)
+                args = list(args) + [config_file]
+
+            self.call_count += 1
+            try:
+                result = subprocess.run(
+                    [self.xray_bin, 'api', command, f'--server=127.0.0.1:{api_port}'] + list(args),
+                    capture_output=True, text=True, timeout=self.timeout
+                )
+            except (OSError, subprocess.TimeoutExpired) as e:
+                self.error_count += 1
+                raise HandlerError(f'xray api {command} 调用失败: {e}')
+            if result.returncode != 0:
+                self.error_count += 1
+                detail = (result.stderr or result.stdout).strip() or f'退出码 {result.returncode}'
+                raise HandlerError(f'xray api {command} 失败: {detail}')
+        finally:
+            if config_file:
+                os.remove(config_file)
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Xray流量统计模块 - 通过Xray StatsService采集每个服务的流量计数
+"""
+
+import os
+import json
+import time
+import threading
+import subprocess
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import grpc
+except ImportError:
+    # 未安装grpcio时使用 `xray api statsquery` 命令查询
+    grpc = None
+
+logger = logging.getLogger(__name__)
+
+# 配置中的标签
+INBOUND_TAG = 'ss-in'
+OUTBOUND_TAG = 'socks-out'
+API_TAG = 'api'
+# API入站上启用的服务：流量统计，以及在线增删入站/出站/路由规则 (见 xray_handler)
+API_SERVICES = ['StatsService', 'HandlerService', 'RoutingService']
+
+# 每个服务的API端口只监听127.0.0.1，从该范围内分配 (与Shell脚本一致)
+API_PORT_BASE = 62000
+API_PORT_RANGE = 3000
+API_PORT_FILE = 'api_port'
+
+STATS_METHOD = '/xray.app.stats.command.StatsService/QueryStats'
+
+
+def counter_names(inbound_tag):
+    """入站的 (上行, 下行) 计数器名称"""
+    return (f'inbound>>>{inbound_tag}>>>traffic>>>uplink',
+            f'inbound>>>{inbound_tag}>>>traffic>>>downlink')
+
+
+def allocate_api_port(service_dir, port, exclude=()):
+    """为服务分配API端口，已分配时复用
+
+    exclude 中的端口不会被使用 (平滑重启时旧进程仍占用原API端口，需要换一个)。
+    """
+    port_file = os.path.join(service_dir, str(port), API_PORT_FILE)
+    existing = _read_int(port_file)
+    if existing and existing not in exclude:
+        return existing
+
+    used = set(exclude)
+    try:
+        for entry in os.listdir(service_dir):
+            # 服务端口本身也不能作为API端口
+            if entry.isdigit():
+                used.add(int(entry))
+            if entry != str(port):
+                value = _read_int(os.path.join(service_dir, entry, API_PORT_FILE))
+                if value:
+                    used.add(value)
+    except OSError:
+        pass
+
+    offset = int(port) % API_PORT_RANGE
+    for i in range(API_PORT_RANGE):
+        candidate = API_PORT_BASE + (offset + i) % API_PORT_RANGE
+        if candidate not in used:
+            os.makedirs(os.path.dirname(port_file), exist_ok=True)
+            with open(port_file, 'w') as f:
+                f.write(f'{candidate}\n')
+            return candidate
+    raise RuntimeError('没有可用的Xray API端口')
+
+
+def add_stats_config(config, api_port):
+    """为配置启用流量统计：stats/api/policy、API入站与路由规则"""
+    config['inbounds'][0]['tag'] = INBOUND_TAG
+    config['outbounds'][0]['tag'] = OUTBOUND_TAG
+    return enable_stats(config, api_port)
+
+
+def enable_stats(config, api_port):
+    """启用stats/api/policy，添加API入站与路由规则 (不修改已有入站/出站的标签)"""
+    config['stats'] = {}
+    config['api'] = {'tag': API_TAG, 'services': list(API_SERVICES)}
+    config['policy'] = {
+        'levels': {'0': {'statsUserUplink': False, 'statsUserDownlink': False}},
+        'system': {
+            'statsInboundUplink': True,
+            'statsInboundDownlink': True,
+            'statsOutboundUplink': True,
+            'statsOutboundDownlink': True
+        }
+    }
+    config['inbounds'].append({
+        'tag': API_TAG,
+        'listen': '127.0.0.1',
+        'port': api_port,
+        'protocol': 'dokodemo-door',
+        'settings': {'address': '127.0.0.1'}
+    })
+    rules = config.setdefault('routing', {}).setdefault('rules', [])
+    rules.insert(0, {'type': 'field', 'inboundTag': [API_TAG], 'outboundTag': API_TAG})
+    return config
+
+
+def read_api_port(config_file):
+    """从config.json读取API入站端口，未启用统计时返回None"""
+    try:
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+        for inbound in config.get('inbounds', []):
+            if inbound.get('tag') == API_TAG:
+                return int(inbound['port'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def _read_int(path):
+    try:
+        with open(path, 'r') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+# StatsService 的 protobuf 编解码 (消息结构简单，无需生成代码)
+def _encode_varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _decode_varint(data, pos):
+    result = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(data):
+    """遍历消息字段，产出 (字段号, 值)；长度分隔字段的值为bytes"""
+    pos = 0
+    while pos < len(data):
+        key, pos = _decode_varint(data, pos)
+        field, wire_type = key >> 3, key & 0x07
+        if wire_type == 0:
+            value, pos = _decode_varint(data, pos)
+        elif wire_type == 2:
+            length, pos = _decode_varint(data, pos)
+            value = data[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            value, pos = data[pos:pos + 8], pos + 8
+        elif wire_type == 5:
+            value, pos = data[pos:pos + 4], pos + 4
+        else:
+            raise ValueError(f'不支持的wire type: {wire_type}')
+        yield field, value
+
+
+def encode_query_request(pattern='', reset=False):
+    """QueryStatsRequest {string pattern = 1; bool reset = 2;}"""
+    body = b''
+    if pattern:
+        encoded = pattern.encode('utf-8')
+        body += b'\x0a' + _encode_varint(len(encoded)) + encoded
+    if reset:
+        body += b'\x10\x01'
+    return body
+
+
+def decode_query_response(data):
+    """QueryStatsResponse {repeated Stat stat = 1;}，Stat {string name = 1; int64 value = 2;}"""
+    counters = {}
+    for field, value in _iter_fields(data):
+        if field != 1:
+            continue
+        name, count = '', 0
+        for stat_field, stat_value in _iter_fields(value):
+            if stat_field == 1:
+                name = stat_value.decode('utf-8', 'replace')
+            elif stat_field == 2:
+                count = stat_value
+        counters[name] = count
+    return counters
+
+
+class StatsClient:
+    """StatsService客户端：优先gRPC，否则调用xray命令行"""
+
+    def __init__(self, xray_bin=None, timeout=2.0):
+        self.xray_bin = xray_bin
+        self.timeout = timeout
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def query(self, api_port):
+        """查询一个Xray进程的全部计数器 {名称: 字节数}"""
+        if grpc is not None:
+            return self._query_grpc(api_port)
+        return self._query_cli(api_port)
+
+    def _query_grpc(self, api_port):
+        with self._lock:
+            channel = self._channels.get(api_port)
+            if channel is None:
+                channel = self._channels[api_port] = grpc.insecure_channel(f'127.0.0.1:{api_port}')
+        # 序列化函数为None时直接收发bytes
+        call = channel.unary_unary(STATS_METHOD)
+        try:
+            return decode_query_response(call(encode_query_request(), timeout=self.timeout))
+        except grpc.RpcError:
+            with self._lock:
+                self._channels.pop(api_port, None)
+            channel.close()
+            raise
+
+    def _query_cli(self, api_port):
+        result = subprocess.run(
+            [self.xray_bin, 'api', 'statsquery', f'--server=127.0.0.1:{api_port}'],
+            capture_output=True, text=True, timeout=self.timeout
+        )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or f'statsquery 退出码 {result.returncode}')
+        data = json.loads(result.stdout or '{}')
+        # 计数为0时xray省略value字段，int64以字符串输出
+        return {stat['name']: int(stat.get('value', 0)) for stat in data.get('stat', [])}
+
+    def close(self, api_port):
+        with self._lock:
+            channel = self._channels.pop(api_port, None)
+        if channel is not None:
+            channel.close()
+
+
+class TrafficPoller:
+    """流量轮询器
+
+    每个interval并行查询所有运行中服务的StatsService，把累计计数转换为
+    字节/秒。uplink为客户端上传 (traffic_in)，downlink为下载 (traffic_out)。
+    Xray重启后计数归零，此时以新计数为基线重新计算。
+    多个服务共用一个Xray进程时 (见 consolidated_runtime)，由 targets_fn 给出
+    这些服务的 {端口: (API端口, 入站标签)}，同一API端口只查询一次。
+    """
+
+    def __init__(self, interval=10, max_workers=16, client=None):
+        self.interval = interval
+        self.max_workers = max_workers
+        self.client = client or StatsClient()
+        self.service_dir = None
+        # 返回 {端口: {'status', ...}}
+        self.services_fn = None
+        # 返回 {端口: (API端口, 入站标签)}，覆盖从config.json读取的API端口
+        self.targets_fn = None
+
+        self._lock = threading.Lock()
+        self._traffic = {}
+        self._api_ports = {}
+        self._executor = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+        # 统计
+        self.poll_count = 0
+        self.error_count = 0
+        self.last_poll_ms = 0
+
+    def configure(self, service_dir=None, services_fn=None, xray_bin=None, interval=None,
+                  targets_fn=None):
+        """设置服务目录、服务来源与xray路径"""
+        if service_dir is not None:
+            self.service_dir = service_dir
+        if services_fn is not None:
+            self.services_fn = services_fn
+        if targets_fn is not None:
+            self.targets_fn = targets_fn
+        if xray_bin is not None:
+            self.client.xray_bin = xray_bin
+        if interval is not None:
+            self.interval = interval
+
+    def start(self):
+        """启动轮询线程"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止轮询线程"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def get(self, port):
+        """单个服务的流量 {'bytes_in', 'bytes_out', 'rate_in', 'rate_out', 'last_active', 'updated_at'}"""
+        self.start()
+        with self._lock:
+            entry = self._traffic.get(str(port))
+            return dict(entry) if entry else None
+
+    def all(self):
+        """所有服务的流量 {端口: 流量}"""
+        self.start()
+        with self._lock:
+            return {port: dict(entry) for port, entry in self._traffic.items()}
+
+    def rates(self):
+        """{端口: (rate_in, rate_out)}，供监控数据采集使用"""
+        return {port: (entry['rate_in'], entry['rate_out']) for port, entry in self.all().items()}
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"轮询Xray流量统计失败: {e}")
+            self._stop_event.wait(self.interval)
+
+    def poll(self):
+        """查询一次所有运行中服务的计数器"""
+        if self.services_fn is None or self.service_dir is None:
+            return
+
+        start = time.time()
+        shared = self.targets_fn() if self.targets_fn else {}
+        targets = {}
+        for port, service in self.services_fn().items():
+            if service.get('status') != 'running':
+                continue
+            port = str(port)
+            if port in shared:
+                targets[port] = shared[port]
+                continue
+            api_port = self._api_port(port)
+            if api_port:
+                targets[port] = (api_port, INBOUND_TAG)
+
+        responses = {}
+        if targets:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            futures = {api_port: self._executor.submit(self.client.query, api_port)
+                       for api_port in {api_port for api_port, _ in targets.values()}}
+            for api_port, future in futures.items():
+                try:
+                    responses[api_port] = future.result()
+                except Exception as e:
+                    self.error_count += 1
+                    logger.debug(f"API端口 {api_port} 流量统计查询失败: {e}")
+
+        now = time.time()
+        with self._lock:
+            for port, (api_port, inbound_tag) in targets.items():
+                if api_port in responses:
+                    self._update(port, responses[api_port], inbound_tag, now)
+            # 清理已停止的服务
+            for port in list(self._traffic):
+                if port not in targets:
+                    del self._traffic[port]
+
+        self.poll_count += 1
+        self.last_poll_ms = round((time.time() - start) * 1000, 2)
+
+    def _update(self, port, counters, inbound_tag, now):
+        uplink, downlink = counter_names(inbound_tag)
+        bytes_in = counters.get(uplink, 0)
+        bytes_out = counters.get(downlink, 0)
+        previous = self._traffic.get(port)
+
+        rate_in = rate_out = 0
+        last_active = previous['last_active'] if previous else None
+        if previous and bytes_in >= previous['bytes_in'] and bytes_out >= previous['bytes_out']:
+            elapsed = now - previous['updated_at']
+            if elapsed > 0:
+                rate_in = round((bytes_in - previous['bytes_in']) / elapsed, 2)
+                rate_out = round((bytes_out - previous['bytes_out']) / elapsed, 2)
+            if rate_in or rate_out:
+                last_active = now
+
+        self._traffic[port] = {
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'rate_in': rate_in,
+            'rate_out': rate_out,
+            'last_active': last_active,
+            'updated_at': now
+        }
+
+    def _api_port(self, port):
+        """读取服务的API端口 (按config.json修改时间缓存)"""
+        config_file = os.path.join(self.service_dir, port, 'config.json')
+        try:
+            mtime = os.path.getmtime(config_file)
+        except OSError:
+            return None
+        cached = self._api_ports.get(port)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        api_port = read_api_port(config_file)
+        self._api_ports[port] = (mtime, api_port)
+        return api_port
+
+
+# 创建全局实例
+traffic_poller = TrafficPoller()
@@ -0,0 +1,630 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Xray进程管理模块 - 在Web进程内直接启动/停止Xray，替代调用Shell脚本
+"""
+
+import os
+import json
+import time
+import signal
+import threading
+import subprocess
+import logging
+from collections import deque
+
+from config_renderer import SS_METHODS, enable_reuseport, dumps, write_file
+from consolidated_runtime import ConsolidatedRuntime, RUNTIME_MODES, PROCESS_MODE, CONSOLIDATED_MODE
+from process_scanner import process_scanner
+from readiness import Backoff, ProcessHandle, is_listening, wait_for_listen, wait_for_exit
+from socket_table import process_port_sockets
+from xray_handler import HandlerClient, HandlerError
+from xray_stats import INBOUND_TAG, OUTBOUND_TAG, API_TAG, API_PORT_FILE, allocate_api_port, read_api_port
+
+logger = logging.getLogger(__name__)
+
+# 日志超过该大小时在启动前轮转 (与Shell脚本一致)
+MAX_LOG_SIZE = 10 * 1024 * 1024
+
+# 平滑重启的记录保留条数
+RELOAD_HISTORY_SIZE = 50
+
+
+def validate_config(config, port):
+    """校验服务配置，返回错误信息，通过时返回None"""
+    if not isinstance(config, dict):
+        return '配置必须是JSON对象'
+
+    inbounds = config.get('inbounds')
+    if not isinstance(inbounds, list) or not inbounds:
+        return '缺少inbounds'
+    ss_inbound = next((i for i in inbounds if isinstance(i, dict) and i.get('protocol') == 'shadowsocks'), None)
+    if ss_inbound is None:
+        return '缺少shadowsocks入站'
+    if ss_inbound.get('port') != int(port):
+        return f"入站端口 {ss_inbound.get('port')} 与服务端口 {port} 不一致"
+    settings = ss_inbound.get('settings') or {}
+    if settings.get('method') not in SS_METHODS:
+        return f"不支持的加密方式: {settings.get('method')}"
+    if not settings.get('password'):
+        return '缺少Shadowsocks密码'
+
+    outbounds = config.get('outbounds')
+    if not isinstance(outbounds, list) or not outbounds:
+        return '缺少outbounds'
+    for outbound in outbounds:
+        if not isinstance(outbound, dict) or outbound.get('protocol') != 'socks':
+            continue
+        servers = (outbound.get('settings') or {}).get('servers') or []
+        if not servers:
+            return 'SOCKS5出站缺少servers'
+        for server in servers:
+            if not server.get('address'):
+                return 'SOCKS5出站缺少地址'
+            server_port = server.get('port')
+            if not isinstance(server_port, int) or not 1 <= server_port <= 65535:
+                return f'SOCKS5出站端口无效: {server_port}'
+
+    for inbound in inbounds:
+        inbound_port = inbound.get('port') if isinstance(inbound, dict) else None
+        if not isinstance(inbound_port, int) or not 1 <= inbound_port <= 65535:
+            return f'入站端口无效: {inbound_port}'
+    return None
+
+
+class XraySupervisor:
+    """Xray进程管理器
+
+    - start(): 校验配置后用Popen直接启动xray，端口开始监听即返回 (见 readiness)
+    - stop(): SIGTERM整个进程组，进程退出即返回，超过截止时间后SIGKILL
+    - 自己启动的进程保留Popen句柄，由 reap() 回收；此前由Shell脚本或
+      上一个Web进程启动的Xray通过PID文件接管
+    所有操作返回 {'success', 'message', 'pid', 'elapsed'}，并附带实测的
+    startup_ms / shutdown_ms。
+    listeners 中的 listener(event, port, pid) 在启动就绪后 ('started') 与
+    停止服务前 ('stopping'，服务未运行时pid为None) 调用，如进程守护。
+
+    mode 为 'consolidated' 时新启动的服务加入共用的Xray进程 (见
+    consolidated_runtime)；已在共用进程中的服务无论当前模式都由它停止，
+    以独立进程运行的服务在下次重启时迁移。
+    reload() 在配置变化后通过Xray API在线替换服务的入站与出站，不重启进程。
+    rolling_restart() 让新进程与旧进程同时监听 (SO_REUSEPORT)，新进程就绪后
+    旧进程停止接收新连接并在 drain_timeout 内排空，代替先停后启的重启。
+    """
+
+    def __init__(self, service_dir=None, xray_bin=None, ready_timeout=5.0,
+                 stop_timeout=5.0, kill_timeout=2.0, backoff_initial=0.01, backoff_max=0.05,
+                 mode=PROCESS_MODE, drain_timeout=30.0):
+        self.service_dir = service_dir
+        self.xray_bin = xray_bin
+        self.ready_timeout = ready_timeout
+        self.stop_timeout = stop_timeout
+        self.kill_timeout = kill_timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.mode = mode
+        self.drain_timeout = drain_timeout
+        self.handler = HandlerClient(xray_bin)
+        self.consolidated = ConsolidatedRuntime(self)
+
+        self._children = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+        self.listeners = []
+
+        # 平滑重启统计
+        self._reloads = deque(maxlen=RELOAD_HISTORY_SIZE)
+        self.rolling_count = 0
+        self.rolling_fallbacks = 0
+        self.rolling_degraded = 0
+        self.dropped_total = 0
+
+    def configure(self, service_dir=None, xray_bin=None, ready_timeout=None, stop_timeout=None,
+                  kill_timeout=None, backoff_initial=None, backoff_max=None, mode=None,
+                  drain_timeout=None):
+        """设置服务目录、xray路径、截止时间、退避参数、运行模式与排空宽限时间"""
+        if mode is not None:
+            if mode not in RUNTIME_MODES:
+                raise ValueError(f"不支持的运行模式: {mode}，可选: {', '.join(RUNTIME_MODES)}")
+            self.mode = mode
+        if service_dir is not None:
+            self.service_dir = service_dir
+        if xray_bin is not None:
+            self.xray_bin = xray_bin
+            self.handler.xray_bin = xray_bin
+        if ready_timeout is not None:
+            self.ready_timeout = ready_timeout
+        if stop_timeout is not None:
+            self.stop_timeout = stop_timeout
+        if kill_timeout is not None:
+            self.kill_timeout = kill_timeout
+        if backoff_initial is not None:
+            self.backoff_initial = backoff_initial
+        if backoff_max is not None:
+            self.backoff_max = backoff_max
+        if drain_timeout is not None:
+            self.drain_timeout = drain_timeout
+
+    def start(self, port):
+        """启动服务"""
+        port = str(port)
+        if self.mode == CONSOLIDATED_MODE:
+            return self.consolidated.start(port)
+        return self._start_process(port)
+
+    def stop(self, port):
+        """停止服务"""
+        port = str(port)
+        if self.consolidated.is_member(port):
+            return self.consolidated.stop(port)
+        return self._stop_process(port)
+
+    def restart(self, port):
+        """重启服务"""
+        port = str(port)
+        if self.mode == CONSOLIDATED_MODE and self.consolidated.is_member(port):
+            # 只需重新加载一次共用进程
+            return self.consolidated.restart(port)
+
+        begin = time.time()
+        result = self.stop(port)
+        if not result['success']:
+            return result
+        shutdown_ms = result.get('shutdown_ms')
+        result = self.start(port)
+        result['elapsed'] = round(time.time() - begin, 3)
+        result['shutdown_ms'] = shutdown_ms
+        if result['success']:
+            result['message'] = f'服务端口 {port} 重启成功'
+        return result
+
+    def reload(self, port):
+        """配置变化后使其生效：服务运行中时通过Xray API在线替换入站与出站
+
+        服务未运行时新配置在下次启动时生效；进程未启用HandlerService
+        (旧版配置) 或API调用失败时退回为平滑重启。
+        """
+        port = str(port)
+        if self.consolidated.is_member(port):
+            return self.consolidated.restart(port)
+
+        begin = time.time()
+        with self._port_lock(port):
+            pid = self._running_pid(port)
+            if not pid:
+                return self._result(True, f'服务端口 {port} 未运行，新配置将在启动时生效', None, begin)
+            config, error = self.load_config(port)
+            if error:
+                return self._result(False, error, pid, begin)
+            try:
+                startup = self._replace_live(port, pid, config)
+                logger.info(f"端口 {port} 配置已在线生效 (PID: {pid})")
+                return self._result(True, f'服务端口 {port} 配置已在线生效', pid, begin,
+                                    startup_ms=round(startup * 1000, 1))
+            except HandlerError as e:
+                logger.warning(f"端口 {port} 配置在线生效失败，改为平滑重启: {e}")
+
+        result = self.rolling_restart(port)
+        result['elapsed'] = round(time.time() - begin, 3)
+        return result
+
+    def rolling_restart(self, port):
+        """平滑重启：先启动新进程，再排空并停止旧进程
+
+        1. 配置开启SO_REUSEPORT并换用新的API端口 (旧进程仍占用原API端口)
+        2. 新进程自己的套接字开始监听即视为就绪，此后新连接由两个进程分担
+        3. 通过旧进程的API删除其入站，旧进程不再接收新连接
+        4. 等待旧进程上的连接自然结束，超过 drain_timeout 后终止，
+           剩余连接数记为 dropped
+        旧进程未开启SO_REUSEPORT时新进程无法绑定端口，退回为先停后启。
+        第3步失败时旧进程在排空期间仍接收新连接，结果中 degraded 为True。
+        """
+        port = str(port)
+        if self.consolidated.is_member(port):
+            return self.restart(port)
+
+        begin = time.time()
+        with self._port_lock(port):
+            old_pid = self._running_pid(port)
+            if old_pid:
+                result = self._rolling_replace(port, old_pid, begin)
+                if result is not None:
+                    return result
+
+        if old_pid:
+            self.rolling_fallbacks += 1
+        result = self.restart(port) if old_pid else self.start(port)
+        result['elapsed'] = round(time.time() - begin, 3)
+        return result
+
+    def _rolling_replace(self, port, old_pid, begin):
+        """启动新进程并排空旧进程 (调用方持有端口锁)，新进程未就绪时返回None
+
+        新进程的配置 (新API端口) 需要写入config.json，进程扫描按该路径识别服务；
+        新进程未能接替时恢复原来的文件，退回的先停后启仍使用渲染的配置。
+        """
+        config, error = self.load_config(port)
+        if error:
+            return self._result(False, error, old_pid, begin)
+
+        config_file = self._path(port, 'config.json')
+        old_api = read_api_port(config_file)
+        saved = self._read_files(port, 'config.json', API_PORT_FILE)
+        api_inbound = next((i for i in config['inbounds'] if i.get('tag') == API_TAG), None)
+        try:
+            if api_inbound is not None:
+                api_inbound['port'] = allocate_api_port(self.service_dir, port, exclude={old_api})
+            enable_reuseport(config)
+            self._write_config(port, config)
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"端口 {port} 平滑重启准备配置失败: {e}")
+            self._restore_files(port, saved)
+            return None
+
+        log_file = self._path(port, 'xray.log')
+        try:
+            proc = self._spawn(port, log_file)
+        except OSError as e:
+            self._restore_files(port, saved)
+            return self._result(False, f'启动Xray失败: {e}', old_pid, begin)
+
+        def owns_listen(p):
+            counts = process_port_sockets(proc.pid, p)
+            return bool(counts and counts['listen'])
+
+        with ProcessHandle(proc.pid, proc) as handle:
+            ready, error, startup = wait_for_listen(port, handle, self.ready_timeout, self._backoff(),
+                                                    listening=owns_listen)
+            if not ready:
+                self._terminate(handle)
+        if not ready:
+            logger.warning(f"端口 {port} 新进程未就绪 ({error})，改为先停后启")
+            self._restore_files(port, saved)
+            return None
+
+        old_proc = self._children.get(port)
+        self._children[port] = proc
+        self._write_pid(port, proc.pid)
+        # 守护改为监视新进程，旧进程退出不再视为崩溃
+        self._notify('started', port, proc.pid)
+
+        # 旧进程不再接收新连接
+        degraded = None
+        if not old_api:
+            degraded = '旧进程未启用API'
+        else:
+            try:
+                self.handler.remove_inbounds(old_api, [INBOUND_TAG])
+            except HandlerError as e:
+                # 在线生效失败时入站可能已被删除，以旧进程是否仍在监听为准
+                counts = process_port_sockets(old_pid, port)
+                if counts is None or counts['listen']:
+                    degraded = str(e)
+        if degraded:
+            self.rolling_degraded += 1
+            logger.warning(f"端口 {port} 旧进程删除入站失败，排空期间仍会接收连接: {degraded}")
+
+        with ProcessHandle(old_pid, old_proc if old_proc and old_proc.pid == old_pid else None) as handle:
+            drained, remaining, drain = self._drain(port, handle)
+            exited, shutdown = self._terminate(handle)
+
+        record = {
+            'port': port,
+            'timestamp': begin,
+            'old_pid': old_pid,
+            'pid': proc.pid,
+            'startup_ms': round(startup * 1000, 1),
+            'drain_ms': round(drain * 1000, 1),
+            'shutdown_ms': round(shutdown * 1000, 1),
+            'elapsed_ms': round((time.time() - begin) * 1000, 1),
+            'drained': drained,
+            'dropped': remaining,
+            'degraded': bool(degraded)
+        }
+        self._reloads.append(record)
+        self.rolling_count += 1
+        self.dropped_total += remaining
+
+        logger.info(f"端口 {port} 平滑重启完成 (PID: {old_pid} -> {proc.pid}, 就绪 {record['startup_ms']}ms, "
+                    f"排空 {record['drain_ms']}ms, 中断连接 {remaining})")
+        message = f'服务端口 {port} 平滑重启成功'
+        if degraded:
+            message = f'服务端口 {port} 已重启，但旧进程未能停止接收新连接 ({degraded})'
+        if remaining:
+            message += f'，排空超时中断 {remaining} 个连接'
+        if not exited:
+            message += f'，旧进程 {old_pid} 未退出'
+        return self._result(True, message, proc.pid, begin, startup_ms=record['startup_ms'],
+                            drain_ms=record['drain_ms'], shutdown_ms=record['shutdown_ms'],
+                            dropped=remaining, degraded=bool(degraded))
+
+    def _drain(self, port, handle):
+        """等待旧进程在端口上的连接结束，返回 (是否排空, 剩余连接数, 耗时秒)"""
+        backoff = Backoff(initial=0.05, maximum=0.5)
+        start = time.monotonic()
+        deadline = start + self.drain_timeout
+        while True:
+            counts = process_port_sockets(handle.pid, port)
+            remaining = counts['established'] if counts else 0
+            if not remaining:
+                return True, 0, time.monotonic() - start
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return False, remaining, time.monotonic() - start
+            if handle.wait(min(backoff.next(), left)):
+                return True, 0, time.monotonic() - start
+
+    def get_reload_stats(self):
+        """平滑重启统计：次数、退回重启次数、未能删除旧入站的次数、中断连接总数与最近的记录"""
+        return {
+            'drain_timeout': self.drain_timeout,
+            'rolling_count': self.rolling_count,
+            'rolling_fallbacks': self.rolling_fallbacks,
+            'rolling_degraded': self.rolling_degraded,
+            'dropped_total': self.dropped_total,
+            'recent': list(self._reloads)
+        }
+
+    def _replace_live(self, port, pid, config):
+        """替换独立进程中服务的shadowsocks入站与第一个出站，返回就绪耗时秒
+
+        单独运行时没有指向出站的路由规则，重新添加的出站成为默认出站，
+        因此先替换出站，再替换入站。
+        """
+        api_port = read_api_port(self._path(port, 'config.json'))
+        inbound = next(i for i in config['inbounds'] if i.get('protocol') == 'shadowsocks')
+        outbound = config['outbounds'][0]
+        if not api_port or inbound.get('tag') != INBOUND_TAG or outbound.get('tag') != OUTBOUND_TAG:
+            raise HandlerError('配置未启用API或缺少标签')
+
+        self.handler.remove_outbounds(api_port, [OUTBOUND_TAG])
+        self.handler.add_outbounds(api_port, [outbound])
+        self.handler.remove_inbounds(api_port, [INBOUND_TAG])
+        self.handler.add_inbounds(api_port, [inbound])
+        with ProcessHandle(pid) as handle:
+            ready, error, startup = wait_for_listen(port, handle, self.ready_timeout, self._backoff())
+        if not ready:
+            raise HandlerError(error)
+        return startup
+
+    def _start_process(self, port):
+        """以独立的Xray进程启动服务"""
+        begin = time.time()
+        with self._port_lock(port):
+            pid = self._running_pid(port)
+            if pid:
+                return self._result(True, f'端口 {port} 已在运行', pid, begin)
+            # 共用进程未运行时，服务改为独立运行
+            self.consolidated.discard(port)
+
+            error = self.check_config(port)
+            if error:
+                return self._result(False, error, None, begin)
+
+            if is_listening(port):
+                return self._result(False, f'端口 {port} 已被其他进程占用', None, begin)
+
+            log_file = self._path(port, 'xray.log')
+            try:
+                proc = self._spawn(port, log_file)
+            except OSError as e:
+                return self._result(False, f'启动Xray失败: {e}', None, begin)
+
+            self._children[port] = proc
+            self._write_pid(port, proc.pid)
+
+            with ProcessHandle(proc.pid, proc) as handle:
+                ready, error, startup = wait_for_listen(port, handle, self.ready_timeout, self._backoff())
+                if not ready:
+                    self._terminate(handle)
+            if not ready:
+                self._children.pop(port, None)
+                self._remove_pid(port)
+                return self._result(False, f'{error}\n{self._log_tail(log_file)}'.strip(), None, begin,
+                                    startup_ms=round(startup * 1000, 1))
+
+            logger.info(f"端口 {port} 启动成功 (PID: {proc.pid}, 就绪耗时 {startup * 1000:.1f}ms)")
+            self._notify('started', port, proc.pid)
+            return self._result(True, f'服务端口 {port} 启动成功', proc.pid, begin,
+                                startup_ms=round(startup * 1000, 1))
+
+    def _spawn(self, port, log_file):
+        """轮转日志后启动xray进程 (不等待就绪)"""
+        self._rotate_log(log_file)
+        with open(log_file, 'ab') as log:
+            return subprocess.Popen(
+                [self.xray_bin, 'run', '-config', self._path(port, 'config.json')],
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                cwd=self._path(port),
+                # 独立进程组，Web进程退出不影响Xray
+                start_new_session=True
+            )
+
+    def _stop_process(self, port):
+        """停止独立运行的Xray进程"""
+        begin = time.time()
+        with self._port_lock(port):
+            pid = self._running_pid(port)
+            proc = self._children.pop(port, None)
+            self._notify('stopping', port, pid)
+            if not pid:
+                self._remove_pid(port)
+                return self._result(True, f'服务端口 {port} 已经停止', None, begin)
+
+            with ProcessHandle(pid, proc if proc and proc.pid == pid else None) as handle:
+                exited, shutdown = self._terminate(handle)
+            shutdown_ms = round(shutdown * 1000, 1)
+            if not exited:
+                return self._result(False, f'停止服务失败: 进程 {pid} 未退出', pid, begin,
+                                    shutdown_ms=shutdown_ms)
+
+            self._remove_pid(port)
+            logger.info(f"端口 {port} 已停止 (PID: {pid}, 退出耗时 {shutdown_ms}ms)")
+            return self._result(True, f'服务端口 {port} 停止成功', pid, begin, shutdown_ms=shutdown_ms)
+
+    def check_config(self, port):
+        """读取并校验服务的config.json，返回错误信息或None"""
+        return self.load_config(port)[1]
+
+    def load_config(self, port):
+        """读取并校验服务的config.json，返回 (配置, 错误信息)"""
+        config_file = self._path(str(port), 'config.json')
+        try:
+            with open(config_file, 'r') as f:
+                config = json.load(f)
+        except FileNotFoundError:
+            return None, f'端口 {port} 配置文件不存在: {config_file}'
+        except (OSError, ValueError) as e:
+            return None, f'端口 {port} 配置文件JSON格式错误: {e}'
+        error = validate_config(config, port)
+        return (None, f'端口 {port} 配置无效: {error}') if error else (config, None)
+
+    def reap(self):
+        """回收已退出的子进程，返回 {端口: 退出码}"""
+        exited = {}
+        for port, proc in list(self._children.items()):
+            code = proc.poll()
+            if code is not None:
+                self._children.pop(port, None)
+                exited[port] = code
+        exited.update(self.consolidated.reap())
+        return exited
+
+    def _running_pid(self, port):
+        """服务当前运行的PID (以进程扫描结果为准，避免PID复用误判)"""
+        self.reap()
+        state = process_scanner.states({port: self._read_pid(port)}, force=True).get(port)
+        if state and state['status'] == 'running':
+            return state['pid']
+        return None
+
+    def _notify(self, event, port, pid):
+        for listener in self.listeners:
+            try:
+                listener(event, port, pid)
+            except Exception as e:
+                logger.error(f"进程事件处理失败 ({event} {port}): {e}")
+
+    def _backoff(self):
+        return Backoff(initial=self.backoff_initial, maximum=self.backoff_max)
+
+    def _terminate(self, handle):
+        """SIGTERM进程组，超时后SIGKILL，返回 (是否已退出, 耗时秒)"""
+        start = time.monotonic()
+        for sig, timeout in ((signal.SIGTERM, self.stop_timeout), (signal.SIGKILL, self.kill_timeout)):
+            try:
+                self._signal(handle.pid, sig)
+            except ProcessLookupError:
+                handle.exited()
+                return True, time.monotonic() - start
+            exited, _ = wait_for_exit(handle, timeout)
+            if exited:
+                return True, time.monotonic() - start
+            if sig == signal.SIGTERM:
+                logger.warning(f"进程 {handle.pid} 在 {timeout} 秒内未退出，发送SIGKILL")
+        return False, time.monotonic() - start
+
+    def _signal(self, pid, sig):
+        try:
+            # 由本模块或Shell脚本(setsid)启动时，xray是进程组组长
+            if os.getpgid(pid) == pid:
+                os.killpg(pid, sig)
+                return
+        except ProcessLookupError:
+            raise
+        except OSError:
+            pass
+        os.kill(pid, sig)
+
+    def _port_lock(self, port):
+        with self._lock:
+            lock = self._locks.get(port)
+            if lock is None:
+                lock = self._locks[port] = threading.Lock()
+            return lock
+
+    def _path(self, port, *names):
+        return os.path.join(self.service_dir, port, *names)
+
+    def _read_pid(self, port):
+        try:
+            with open(self._path(port, 'xray.pid'), 'r') as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def _write_pid(self, port, pid):
+        pid_file = self._path(port, 'xray.pid')
+        tmp_file = f'{pid_file}.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(f'{pid}\n')
+        os.replace(tmp_file, pid_file)
+
+    def _write_config(self, port, config):
+        write_file(self._path(port, 'config.json'), dumps(config))
+
+    def _read_files(self, port, *names):
+        """读取服务目录中的文件 {文件名: 内容}，不存在的文件为None"""
+        saved = {}
+        for name in names:
+            try:
+                with open(self._path(port, name), 'rb') as f:
+                    saved[name] = f.read()
+            except FileNotFoundError:
+                saved[name] = None
+        return saved
+
+    def _restore_files(self, port, saved):
+        """恢复 _read_files 读取的文件"""
+        for name, data in saved.items():
+            try:
+                if data is None:
+                    os.remove(self._path(port, name))
+                else:
+                    write_file(self._path(port, name), data)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"恢复端口 {port} 的 {name} 失败: {e}")
+
+    def _remove_pid(self, port):
+        try:
+            os.remove(self._path(port, 'xray.pid'))
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _rotate_log(log_file):
+        try:
+            if os.path.getsize(log_file) > MAX_LOG_SIZE:
+                os.replace(log_file, f'{log_file}.old')
+        except OSError:
+            pass
+
+    @staticmethod
+    def _log_tail(log_file, lines=10):
+        try:
+            with open(log_file, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 4096))
+                return '\n'.join(f.read().decode('utf-8', 'replace').splitlines()[-lines:])
+        except OSError:
+            return ''
+
+    @staticmethod
+    def _result(success, message, pid, begin, **latency):
+        result = {
+            'success': success,
+            'message': message,
+            'pid': pid,
+            'elapsed': round(time.time() - begin, 3)
+        }
+        result.update(latency)
+        return result
+
+
+# 创建全局实例
+xray_supervisor = XraySupervisor()
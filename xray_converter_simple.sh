@@ -76,7 +76,11 @@ ensure_xray() {
     log_success "Xray下载完成"
 }
 
-# 生成配置文件 (改进版本，增加稳定性配置)
+# 配置生成模块 (与Web端共用，负责渲染、校验、原子写入与API端口分配)
+readonly CONFIG_RENDERER="$SCRIPT_DIR/web_prototype/config_renderer.py"
+
+# 生成配置文件 (启用 stats/api/policy 以便按服务统计流量；
+# SS入站开启SO_REUSEPORT，平滑重启时新旧进程可同时监听)
 generate_config() {
     local port="$1"
     local password="$2"
@@ -85,152 +89,92 @@ generate_config() {
     local socks_user="$5"
     local socks_pass="$6"
 
-    local config_file="$SERVICE_DIR/$port/config.json"
-    mkdir -p "$(dirname "$config_file")"
-
-    # 转义特殊字符
-    password=$(echo "$password" | sed 's/"/\\"/g')
-    socks_user=$(echo "$socks_user" | sed 's/"/\\"/g')
-    socks_pass=$(echo "$socks_pass" | sed 's/"/\\"/g')
-
-    # 生成更稳定的配置
-    if [ -n "$socks_user" ] && [ -n "$socks_pass" ]; then
-        # 有认证的SOCKS5
-        cat > "$config_file" << EOF
-{
-    "log": {
-        "loglevel": "warning",
-        "access": "",
-        "error": ""
-    },
-    "inbounds": [
-        {
-            "port": $port,
-            "protocol": "shadowsocks",
-            "settings": {
-                "method": "aes-256-gcm",
-                "password": "$password",
-                "network": "tcp,udp"
-            },
-            "streamSettings": {
-                "sockopt": {
-                    "tcpKeepAlive": true,
-                    "tcpNoDelay": true
-                }
-            }
-        }
-    ],
-    "outbounds": [
-        {
-            "protocol": "socks",
-            "settings": {
-                "servers": [
-                    {
-                        "address": "$socks_ip",
-                        "port": $socks_port,
-                        "users": [
-                            {
-                                "user": "$socks_user",
-                                "pass": "$socks_pass"
-                            }
-                        ]
-                    }
-                ]
-            },
-            "streamSettings": {
-                "sockopt": {
-                    "tcpKeepAlive": true,
-                    "tcpNoDelay": true
-                }
-            }
-        },
-        {
-            "protocol": "freedom",
-            "tag": "direct"
-        }
-    ],
-    "routing": {
-        "rules": [
-            {
-                "type": "field",
-                "outboundTag": "direct",
-                "domain": ["localhost", "127.0.0.1"]
-            }
-        ]
-    }
+    if ! python3 "$CONFIG_RENDERER" generate "$SERVICE_DIR" "$port" "$password" \
+            "$socks_ip" "$socks_port" "$socks_user" "$socks_pass"; then
+        log_error "生成配置文件失败"
+        return 1
+    fi
 }
-EOF
+
+# 启动就绪/停止退出的截止时间 (秒)，可通过环境变量调整
+readonly READY_TIMEOUT="${XRAY_READY_TIMEOUT:-5}"
+readonly STOP_TIMEOUT="${XRAY_STOP_TIMEOUT:-5}"
+# 轮询退避间隔 (秒)，逐次翻倍直到上限
+readonly BACKOFF_DELAYS=(0.01 0.02 0.04 0.05)
+
+# 当前毫秒时间戳
+now_ms() {
+    local ms=$(date +%s%3N 2>/dev/null)
+    if [[ "$ms" =~ ^[0-9]+$ ]]; then
+        echo "$ms"
     else
-        # 无认证的SOCKS5
-        cat > "$config_file" << EOF
-{
-    "log": {
-        "loglevel": "warning",
-        "access": "",
-        "error": ""
-    },
-    "inbounds": [
-        {
-            "port": $port,
-            "protocol": "shadowsocks",
-            "settings": {
-                "method": "aes-256-gcm",
-                "password": "$password",
-                "network": "tcp,udp"
-            },
-            "streamSettings": {
-                "sockopt": {
-                    "tcpKeepAlive": true,
-                    "tcpNoDelay": true
-                }
-            }
-        }
-    ],
-    "outbounds": [
-        {
-            "protocol": "socks",
-            "settings": {
-                "servers": [
-                    {
-                        "address": "$socks_ip",
-                        "port": $socks_port
-                    }
-                ]
-            },
-            "streamSettings": {
-                "sockopt": {
-                    "tcpKeepAlive": true,
-                    "tcpNoDelay": true
-                }
-            }
-        },
-        {
-            "protocol": "freedom",
-            "tag": "direct"
-        }
-    ],
-    "routing": {
-        "rules": [
-            {
-                "type": "field",
-                "outboundTag": "direct",
-                "domain": ["localhost", "127.0.0.1"]
-            }
-        ]
-    }
+        echo $(( $(date +%s) * 1000 ))
+    fi
 }
-EOF
+
+# 第n次轮询的等待间隔
+backoff_delay() {
+    local n="$1"
+    local last=$(( ${#BACKOFF_DELAYS[@]} - 1 ))
+    [ "$n" -gt "$last" ] && n=$last
+    echo "${BACKOFF_DELAYS[$n]}"
+}
+
+# 端口是否处于TCP监听状态
+port_is_listening() {
+    local port="$1"
+    if [ -r /proc/net/tcp ]; then
+        local files=(/proc/net/tcp)
+        [ -r /proc/net/tcp6 ] && files+=(/proc/net/tcp6)
+        awk -v p=":$(printf '%04X' "$port")" \
+            '$4 == "0A" && substr($2, length($2) - 4) == p { found = 1 } END { exit !found }' "${files[@]}"
+        return
+    fi
+    if command -v lsof >/dev/null 2>&1; then
+        lsof -nP -iTCP:"$port" -sTCP:LISTEN >/dev/null 2>&1
+        return
     fi
+    (exec 3<>"/dev/tcp/127.0.0.1/$port") 2>/dev/null
+}
 
-    # 验证生成的配置文件
-    if command -v jq >/dev/null 2>&1; then
-        if ! jq . "$config_file" >/dev/null 2>&1; then
-            log_error "生成的配置文件JSON格式错误"
+# 等待进程开始监听端口：0=就绪 1=进程已退出 2=超时
+wait_for_port() {
+    local port="$1"
+    local pid="$2"
+    local timeout="${3:-$READY_TIMEOUT}"
+    local deadline=$(( $(now_ms) + timeout * 1000 ))
+    local n=0
+
+    while true; do
+        if port_is_listening "$port"; then
+            return 0
+        fi
+        if ! kill -0 "$pid" 2>/dev/null; then
             return 1
         fi
-    fi
+        if [ "$(now_ms)" -ge "$deadline" ]; then
+            return 2
+        fi
+        sleep "$(backoff_delay $n)"
+        n=$((n + 1))
+    done
+}
 
-    log "配置文件生成成功: $config_file"
+# 等待进程退出：0=已退出 1=超时
+wait_for_exit() {
+    local pid="$1"
+    local timeout="${2:-$STOP_TIMEOUT}"
+    local deadline=$(( $(now_ms) + timeout * 1000 ))
+    local n=0
+
+    while kill -0 "$pid" 2>/dev/null; do
+        if [ "$(now_ms)" -ge "$deadline" ]; then
+            return 1
+        fi
+        sleep "$(backoff_delay $n)"
+        n=$((n + 1))
+    done
+    return 0
 }
 
 # 启动服务 (改进版本，增加重试和错误处理)
@@ -295,30 +239,35 @@ start_service() {
         local pid=$!
         echo "$pid" > "$pid_file"
 
-        # 等待进程稳定
-        sleep 2
+        # 等待端口开始监听 (进程提前退出时立即返回)
+        local started_at=$(now_ms)
+        local ready=0
+        wait_for_port "$port" "$pid" || ready=$?
+        local startup_ms=$(( $(now_ms) - started_at ))
 
-        # 检查进程是否还在运行
-        if kill -0 "$pid" 2>/dev/null; then
-            # 再次检查，确保进程真正稳定
-            sleep 1
-            if kill -0 "$pid" 2>/dev/null; then
-                log_success "端口 $port 启动成功 (PID: $pid)"
+        if [ $ready -eq 0 ]; then
+            log_success "端口 $port 启动成功 (PID: $pid, 就绪耗时 ${startup_ms}ms)"
 
-                # 记录启动时间
-                echo "LAST_START=$(date)" >> "$SERVICE_DIR/$port/info"
-                echo "LAST_START_AT=$(date +%s)" >> "$SERVICE_DIR/$port/info"
+            # 记录启动时间
+            echo "LAST_START=$(date)" >> "$SERVICE_DIR/$port/info"
+            echo "LAST_START_AT=$(date +%s)" >> "$SERVICE_DIR/$port/info"
 
-                return 0
-            fi
+            return 0
+        fi
+
+        if [ $ready -eq 2 ]; then
+            log_error "端口 $port 在 ${READY_TIMEOUT} 秒内未开始监听"
+            kill -KILL "$pid" 2>/dev/null || true
         fi
 
         # 启动失败，清理PID文件
         rm -f "$pid_file"
 
         if [ $attempt -lt $retry_count ]; then
-            log "端口 $port 启动失败，等待 2 秒后重试..."
-            sleep 2
+            # 重试间隔逐次翻倍: 0.5s, 1s, ...
+            local retry_delay=$(awk -v n="$attempt" 'BEGIN { print 0.5 * 2 ^ (n - 1) }')
+            log "端口 $port 启动失败，等待 ${retry_delay} 秒后重试..."
+            sleep "$retry_delay"
         fi
     done
 
@@ -339,35 +288,34 @@ stop_service() {
     local pid_file="$SERVICE_DIR/$port/xray.pid"
     local stopped=false
 
+    # 共用Xray进程中的服务 (Web合并运行模式) 不能单独终止进程，否则会停止所有服务
+    if [ -f "$pid_file" ] && [ -f "$CONFIG_DIR/runtime/xray.pid" ] && \
+       [ "$(cat "$pid_file")" = "$(cat "$CONFIG_DIR/runtime/xray.pid")" ] && \
+       kill -0 "$(cat "$pid_file")" 2>/dev/null; then
+        log_error "端口 $port 运行在共用Xray进程中，请通过Web界面停止"
+        return 1
+    fi
+
     # 通过PID文件停止
     if [ -f "$pid_file" ]; then
         local pid=$(cat "$pid_file")
         if kill -0 "$pid" 2>/dev/null; then
             log "正在停止端口 $port (PID: $pid)..."
 
-            # 尝试优雅停止
+            # 尝试优雅停止，进程退出即返回
+            local stop_started_at=$(now_ms)
             kill -TERM "$pid" 2>/dev/null || true
-
-            # 等待进程退出
-            for i in {1..10}; do
-                if ! kill -0 "$pid" 2>/dev/null; then
-                    stopped=true
-                    break
-                fi
-                sleep 0.5
-            done
-
-            # 如果优雅停止失败，强制终止
-            if ! $stopped; then
+            if wait_for_exit "$pid" "$STOP_TIMEOUT"; then
+                stopped=true
+            else
+                # 如果优雅停止失败，强制终止
                 log "优雅停止失败，强制终止进程..."
                 kill -KILL "$pid" 2>/dev/null || true
-                sleep 1
-
-                # 再次检查
-                if ! kill -0 "$pid" 2>/dev/null; then
+                if wait_for_exit "$pid" 2; then
                     stopped=true
                 fi
             fi
+            log "端口 $port 进程退出耗时 $(( $(now_ms) - stop_started_at ))ms"
         else
             stopped=true
         fi
@@ -381,8 +329,7 @@ stop_service() {
             log "通过端口查找到进程，正在终止..."
             for pid in $pids; do
                 kill -TERM "$pid" 2>/dev/null || true
-                sleep 1
-                kill -KILL "$pid" 2>/dev/null || true
+                wait_for_exit "$pid" "$STOP_TIMEOUT" || kill -KILL "$pid" 2>/dev/null || true
             done
             stopped=true
         fi
@@ -395,8 +342,7 @@ stop_service() {
             log "通过进程名查找到相关进程，正在终止..."
             for pid in $xray_pids; do
                 kill -TERM "$pid" 2>/dev/null || true
-                sleep 1
-                kill -KILL "$pid" 2>/dev/null || true
+                wait_for_exit "$pid" "$STOP_TIMEOUT" || kill -KILL "$pid" 2>/dev/null || true
             done
             stopped=true
         fi
@@ -433,9 +379,21 @@ check_status() {
     fi
 }
 
-# 生成随机端口
+# 生成随机端口 (10000-60000，避开Xray API端口范围)
+# 跳过已有服务、回收站中的服务与已被监听的端口；找不到时返回1
 random_port() {
-    echo $((10000 + RANDOM % 50001))
+    local port attempts
+    for ((attempts = 0; attempts < 200; attempts++)); do
+        # $RANDOM 只有15位，拼接两次才能覆盖整个范围
+        port=$((10000 + (RANDOM * 32768 + RANDOM) % 50001))
+        [ -d "$SERVICE_DIR/$port" ] && continue
+        [ -d "$CONFIG_DIR/.recycle/$port" ] && continue
+        compgen -G "$SERVICE_DIR/.recycle/${port}_*" >/dev/null && continue
+        port_is_listening "$port" && continue
+        echo "$port"
+        return 0
+    done
+    return 1
 }
 
 # 生成随机密码
@@ -449,8 +407,23 @@ random_password() {
 
 # 获取服务器IP
 get_server_ip() {
-    # 尝试多个服务获取外网IP
+    # 优先读取缓存文件 (与Web管理端共享)
     local ip
+    local cache_file="$CONFIG_DIR/.server_ip"
+    local cache_ttl="${SERVER_IP_CACHE_TTL:-3600}"
+
+    if [ -f "$cache_file" ]; then
+        local mtime=$(stat -c %Y "$cache_file" 2>/dev/null || stat -f %m "$cache_file" 2>/dev/null || echo 0)
+        if [ $(( $(date +%s) - mtime )) -lt "$cache_ttl" ]; then
+            ip=$(tr -d '\n\r\t ' < "$cache_file")
+            if [[ "$ip" =~ ^[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+$ ]]; then
+                echo "$ip"
+                return 0
+            fi
+        fi
+    fi
+
+    # 尝试多个服务获取外网IP
     local services=(
         "ifconfig.me"
         "ipinfo.io/ip"
@@ -465,6 +438,9 @@ get_server_ip() {
             # 清理返回的IP，去除空白字符
             ip=$(echo "$ip" | tr -d '\n\r\t ' | grep -oE '^[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+$')
             if [[ "$ip" =~ ^[0-9]+\.[0-9]+\.[0-9]+\.[0-9]+$ ]]; then
+                # 写入缓存文件
+                mkdir -p "$CONFIG_DIR"
+                echo "$ip" > "$cache_file.$$" && mv -f "$cache_file.$$" "$cache_file" || rm -f "$cache_file.$$"
                 echo "$ip"
                 return 0
             fi
@@ -663,14 +639,10 @@ add_service() {
     
     # 生成SS配置
     local ss_port
-    local attempts=0
-    while [ $attempts -lt 50 ]; do
-        ss_port=$(random_port)
-        if [ ! -d "$SERVICE_DIR/$ss_port" ]; then
-            break
-        fi
-        attempts=$((attempts + 1))
-    done
+    if ! ss_port=$(random_port); then
+        log_error "无法生成可用端口，请稍后重试"
+        return 1
+    fi
     
     local ss_password=$(random_password)
 
@@ -1268,7 +1240,6 @@ edit_service() {
                 # 重启服务
                 echo "正在重启服务以应用新配置..."
                 stop_service "$port"
-                sleep 2
                 if start_service "$port"; then
                     log_success "SOCKS5代理信息已更新并重启服务"
                 else
@@ -1298,7 +1269,6 @@ edit_service() {
             # 重启服务
             echo "正在重启服务以应用新密码..."
             stop_service "$port"
-            sleep 2
             if start_service "$port"; then
                 log_success "SS密码已更新并重启服务"
                 echo ""
@@ -1455,7 +1425,6 @@ EOF
             echo ""
             echo "正在重启服务以应用新配置..."
             stop_service "$port"
-            sleep 2
             if start_service "$port"; then
                 log_success "服务配置已全部更新并重启"
                 echo ""
@@ -1939,7 +1908,6 @@ start_monitor() {
             echo "服务监控已在运行 (PID: $monitor_pid)"
             echo ""
             echo "监控状态:"
-            echo "- 检查间隔: 30秒"
             echo "- 日志文件: $CONFIG_DIR/monitor.log"
             echo ""
             echo "要停止监控，请选择菜单中的 '停止服务监控' 选项"
@@ -1949,7 +1917,36 @@ start_monitor() {
         fi
     fi
 
-    # 创建监控脚本
+    # 优先使用Python服务守护：进程退出即时感知，指数退避重启，崩溃循环隔离
+    local watchdog_script="$SCRIPT_DIR/web_prototype/service_watchdog.py"
+    if command -v python3 >/dev/null 2>&1 && [ -f "$watchdog_script" ]; then
+        nohup python3 "$watchdog_script" \
+            --service-dir "$SERVICE_DIR" \
+            --xray-bin "$XRAY_BIN" \
+            --log-file "$CONFIG_DIR/monitor.log" > /dev/null 2>&1 &
+        local monitor_pid=$!
+        echo "$monitor_pid" > "$monitor_pid_file"
+
+        # 守护进程在1秒内退出说明启动失败 (如Web管理端已在守护服务)
+        if wait_for_exit "$monitor_pid" 1; then
+            log_error "服务守护启动失败，可能Web管理端已在守护服务，详见 $CONFIG_DIR/monitor.log"
+            rm -f "$monitor_pid_file"
+            return 1
+        fi
+
+        log_success "服务守护启动成功 (PID: $monitor_pid)"
+        echo ""
+        echo "监控配置:"
+        echo "- 服务进程退出后立即感知"
+        echo "- 按指数退避自动重启，反复崩溃的服务暂停重启 10 分钟"
+        echo "- 跳过已过期的服务"
+        echo "- 日志文件: $CONFIG_DIR/monitor.log"
+        echo ""
+        echo "要停止监控，请选择菜单中的 '停止服务监控' 选项"
+        return 0
+    fi
+
+    # 没有Python时生成轮询监控脚本
     cat > "$monitor_script" << 'EOF'
 #!/bin/bash
 
@@ -2255,19 +2252,38 @@ delete_service_api() {
     return 0
 }
 
+# 批量重启的并发数与滚动重启时同时停止的运行中服务数 (数量或百分比)
+readonly BULK_CONCURRENCY="${XRAY_BULK_CONCURRENCY:-8}"
+readonly BULK_MAX_UNAVAILABLE="${XRAY_BULK_MAX_UNAVAILABLE:-25%}"
+
 # 重启所有服务
 restart_all() {
     clear
     echo "=== 重启所有服务 ==="
     echo ""
 
+    # 优先使用Web管理端的批量引擎：并发重启，同时停止的运行中服务不超过 BULK_MAX_UNAVAILABLE
+    local bulk_script="$SCRIPT_DIR/web_prototype/bulk_ops.py"
+    if command -v python3 >/dev/null 2>&1 && [ -f "$bulk_script" ]; then
+        if python3 "$bulk_script" restart \
+            --concurrency "$BULK_CONCURRENCY" \
+            --max-unavailable "$BULK_MAX_UNAVAILABLE" \
+            --service-dir "$SERVICE_DIR" \
+            --xray-bin "$XRAY_BIN"; then
+            log_success "所有服务重启完成"
+        else
+            log_error "部分服务重启失败，请查看上方输出"
+        fi
+        return 0
+    fi
+
+    # 没有Python时逐个重启
     local count=0
     for port_dir in "$SERVICE_DIR"/*; do
         if [ -d "$port_dir" ]; then
             local port=$(basename "$port_dir")
             echo "重启端口 $port..."
             stop_service "$port"
-            sleep 1
             start_service "$port"
             count=$((count + 1))
         fi